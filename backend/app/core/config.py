@@ -14,11 +14,16 @@ JWT_EXPIRATION_HOURS = 24
 
 # External APIs
 DEEPGRAM_API_KEY = os.environ.get("DEEPGRAM_API_KEY")
+# Offline stand-in for Deepgram (load testing the job queue without the real API)
+DEEPGRAM_FAKE = os.environ.get("DEEPGRAM_FAKE", "").lower() in ("1", "true", "yes")
+DEEPGRAM_FAKE_LATENCY = float(os.environ.get("DEEPGRAM_FAKE_LATENCY", 2.0))
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 EMERGENT_LLM_KEY = os.environ.get("EMERGENT_LLM_KEY")
 
 # File storage
-UPLOAD_DIR = "/tmp/voice_workspace_uploads"
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "/tmp/voice_workspace_uploads")  # shared by API and worker
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB per read/write when streaming uploads
+MAX_RECORDING_SIZE = int(os.environ.get("MAX_RECORDING_SIZE", 2 * 1024 * 1024 * 1024))  # 2GB
 
 # S3 (Timeweb)
 S3_ACCESS_KEY = os.environ.get("S3_ACCESS_KEY")
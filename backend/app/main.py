@@ -1,7 +1,9 @@
 import logging
-from datetime import datetime, timezone, timedelta
-from fastapi import FastAPI
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 from app.routes import (
     auth_router,
@@ -25,6 +27,7 @@ from app.routes import (
     feedback_router,
 )
 from app.core.database import client
+from app.services.token_budget import PromptTooLarge
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
@@ -46,6 +49,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(PromptTooLarge)
+async def prompt_too_large_handler(request: Request, exc: PromptTooLarge):
+    """GPT requests rejected before dispatch (see app/services/token_budget.py)."""
+    return JSONResponse(status_code=413, content={"detail": str(exc)})
+
 # Include routers
 app.include_router(auth_router, prefix="/api")
 app.include_router(projects_router, prefix="/api")
@@ -75,9 +83,8 @@ async def health_check():
 
 @app.get("/api/model-info")
 async def model_info():
-    from app.core.database import db
-    settings = await db.settings.find_one({"key": "active_model"}, {"_id": 0})
-    model = settings["value"] if settings else "gpt-5.2"
+    from app.services.gpt import _get_active_model
+    model = await _get_active_model()
     return {"model": model}
 
 
@@ -136,156 +143,145 @@ async def startup_db_client():
             {"$set": {"name": "Bondarev Consulting"}},
         )
     
-    # Fetch exchange rate on startup
-    from app.routes.billing import update_exchange_rate
-    await update_exchange_rate()
-
     # Run data migration for public/private storage system
     await _migrate_storage_schema()
 
-    # Schedule daily exchange rate update at 3am MSK (00:00 UTC)
-    # and S3 storage cost calculation at 3:05am MSK (00:05 UTC)
-    # and trash cleanup at 3:10am MSK
+    # Build monthly usage rollups from existing usage_records on first start
+    from app.services.usage_rollups import ensure_rollup_indexes, rebuild_usage_rollups
+    await ensure_rollup_indexes()
+    if not await db.usage_rollups.find_one({}, {"_id": 1}):
+        from app.services.metering_ledger import ProjectorBusy
+        try:
+            await rebuild_usage_rollups()
+        except ProjectorBusy:
+            logger.info("Usage rollups are being rebuilt by another process")
+
+    from app.services.pipeline_jobs import ensure_pipeline_run_indexes
+    from app.services.attachment_text import ensure_attachment_text_indexes
+    from app.services.storage_cleanup import ensure_storage_cleanup_indexes
+    from app.services.storage_usage import ensure_storage_usage_indexes
+    await ensure_pipeline_run_indexes()
+    await ensure_attachment_text_indexes()
+    await ensure_storage_cleanup_indexes()
+    await ensure_storage_usage_indexes()
+
+    # Charges left pending by an interrupted run are applied by the next storage_costs run
+    from app.services.billing_batch import ensure_billing_batch_indexes
+    await ensure_billing_batch_indexes()
+
+    from app.services.conversation_context import ensure_conversation_context_indexes
+    await ensure_conversation_context_indexes()
+    from app.services.gpt_cache import ensure_gpt_cache_indexes
+    await ensure_gpt_cache_indexes()
+    from app.services.gpt_telemetry import ensure_gpt_telemetry_indexes
+    await ensure_gpt_telemetry_indexes()
+
+    # Load the tokenizer once, off the event loop, instead of on the first GPT request
     import asyncio
-    async def rate_updater():
-        while True:
-            now = datetime.now(timezone.utc)
-            # 3am MSK = 00:00 UTC (MSK = UTC+3)
-            target = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            if now >= target:
-                target += timedelta(days=1)
-            wait_secs = (target - now).total_seconds()
-            logger.info(f"Next exchange rate update in {wait_secs/3600:.1f}h")
-            await asyncio.sleep(wait_secs)
-            await update_exchange_rate()
-            # Run storage cost calculation 5 minutes after rate update
-            await asyncio.sleep(300)
-            await calculate_daily_storage_costs()
-            # Run trash cleanup 5 minutes after storage calc
-            await asyncio.sleep(300)
-            await _run_trash_cleanup()
-
-    asyncio.create_task(rate_updater())
+    from app.services.gpt import _get_active_model
+    from app.utils.tokens import get_encoding
+    await asyncio.to_thread(get_encoding, await _get_active_model())
+
+    # Daily maintenance jobs, run once cluster-wide (see app/services/scheduler.py)
+    from app.services.scheduler import run_scheduler
+    _register_scheduled_jobs()
+    asyncio.create_task(run_scheduler())
+
+    # Apply metering ledger entries to balances, transactions and usage records
+    from app.services.metering_ledger import run_ledger_projector
+    asyncio.create_task(run_ledger_projector())
 
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+    from app.services.pdf_parser import shutdown_ocr_pool
+    shutdown_ocr_pool()
 
 
-async def calculate_daily_storage_costs():
-    """Calculate and deduct S3 storage costs for all orgs. Runs daily after exchange rate update."""
+def _register_scheduled_jobs():
+    """Exchange rate at 3am MSK (00:00 UTC), storage costs at 3:05, trash cleanup at 3:10."""
+    from app.routes.billing import update_exchange_rate
+    from app.services.scheduler import ScheduledJob, register_job
+    from app.services.storage_usage import rebuild_storage_usage
+    register_job(ScheduledJob(
+        "exchange_rate", update_exchange_rate, hour=0, minute=0,
+        description="Курс USD/RUB", run_if_new=True,
+    ))
+    register_job(ScheduledJob(
+        "storage_usage_reconcile", rebuild_storage_usage, hour=0, minute=4, weekday=0,
+        description="Сверка объёма хранилища по организациям",
+        # First deploy: builds the counters once, cluster-wide, instead of on every API start
+        run_if_new=True,
+    ))
+    register_job(ScheduledJob(
+        "storage_costs", calculate_daily_storage_costs, hour=0, minute=5,
+        description="Списание за хранение S3",
+        after=("exchange_rate", "storage_usage_reconcile"), takes_slot=True,
+    ))
+    register_job(ScheduledJob(
+        "trash_cleanup", _run_trash_cleanup, hour=0, minute=10,
+        description="Очистка корзины",
+    ))
+
+
+async def calculate_daily_storage_costs(slot: Optional[datetime] = None):
+    """Calculate and deduct S3 storage costs for all orgs for the slot's day (default: today).
+
+    Runs daily after the exchange rate update; raises on failure so the
+    scheduler retries the same day.
+    """
     from app.core.database import db
-    from app.services.metering import get_cost_settings, usd_to_credits
-    import uuid as _uuid
+    from app.services.metering import get_cost_settings
+    from app.services.billing_batch import run_charges
+    from app.utils.pricing import price_storage_day
     import calendar
 
-    logger.info("Starting daily S3 storage cost calculation")
-
-    try:
-        settings = await get_cost_settings()
-        cost_per_gb_month = settings["s3_storage_cost_per_gb_month_usd"]
-        multiplier = settings["s3_storage_cost_multiplier"]
-
-        if cost_per_gb_month <= 0 or multiplier <= 0:
-            logger.info("Storage cost calculation skipped: cost or multiplier is 0")
-            return
-
-        now = datetime.now(timezone.utc)
-        days_in_month = calendar.monthrange(now.year, now.month)[1]
-        daily_cost_per_gb = cost_per_gb_month / days_in_month
-
-        # Get all orgs
-        orgs = await db.organizations.find({}, {"_id": 0, "id": 1, "name": 1}).to_list(10000)
-
-        for org in orgs:
-            org_id = org["id"]
-            # Find all users in this org
-            org_users = await db.users.find(
-                {"org_id": org_id}, {"_id": 0, "id": 1}
-            ).to_list(10000)
-            user_ids = [u["id"] for u in org_users]
-            if not user_ids:
-                continue
-
-            total_bytes = 0
-
-            # Sum S3 storage from meeting project attachments
-            att_pipeline = [
-                {"$match": {"s3_key": {"$exists": True, "$ne": None}}},
-                {"$lookup": {
-                    "from": "projects",
-                    "localField": "project_id",
-                    "foreignField": "id",
-                    "as": "project",
-                }},
-                {"$unwind": "$project"},
-                {"$match": {"project.user_id": {"$in": user_ids}}},
-                {"$group": {"_id": None, "total_size": {"$sum": {"$ifNull": ["$size", 0]}}}},
-            ]
-            att_result = await db.attachments.aggregate(att_pipeline).to_list(1)
-            if att_result:
-                total_bytes += att_result[0].get("total_size", 0)
-
-            # Sum S3 storage from document project attachments
-            doc_att_pipeline = [
-                {"$match": {"s3_key": {"$exists": True, "$ne": None}}},
-                {"$lookup": {
-                    "from": "doc_projects",
-                    "localField": "project_id",
-                    "foreignField": "id",
-                    "as": "project",
-                }},
-                {"$unwind": "$project"},
-                {"$match": {"project.user_id": {"$in": user_ids}}},
-                {"$group": {"_id": None, "total_size": {"$sum": {"$ifNull": ["$size", 0]}}}},
-            ]
-            doc_att_result = await db.doc_attachments.aggregate(doc_att_pipeline).to_list(1)
-            if doc_att_result:
-                total_bytes += doc_att_result[0].get("total_size", 0)
-
-            if total_bytes <= 0:
-                continue
-
-            total_gb = total_bytes / (1024 ** 3)
-            base_cost_usd = total_gb * daily_cost_per_gb
-            final_cost_usd = base_cost_usd * multiplier
-            credits_used = usd_to_credits(final_cost_usd)
-
-            if credits_used <= 0.0001:
-                continue
-
-            now_iso = now.isoformat()
-
-            await db.credit_balances.update_one(
-                {"org_id": org_id},
-                {"$inc": {"balance": -credits_used}, "$set": {"updated_at": now_iso}},
-            )
-
-            txn = {
-                "id": str(_uuid.uuid4()),
-                "org_id": org_id,
-                "user_id": "system",
-                "type": "deduction",
-                "amount": round(credits_used, 4),
-                "description": f"Хранение S3: {total_gb:.4f} ГБ (${base_cost_usd:.6f} x{multiplier})",
-                "created_at": now_iso,
-            }
-            await db.transactions.insert_one(txn)
-
-            logger.info(
-                f"Storage cost: org={org_id} ({org['name']}) "
-                f"size={total_gb:.4f}GB base=${base_cost_usd:.6f} "
-                f"multiplier={multiplier}x credits={credits_used:.4f}"
-            )
-
-        logger.info("Daily S3 storage cost calculation complete")
+    day = slot or datetime.now(timezone.utc)
+    logger.info(f"Starting daily S3 storage cost calculation for {day:%Y-%m-%d}")
+
+    settings = await get_cost_settings()
+    cost_per_gb_month = settings["s3_storage_cost_per_gb_month_usd"]
+    multiplier = settings["s3_storage_cost_multiplier"]
+
+    if cost_per_gb_month <= 0 or multiplier <= 0:
+        logger.info("Storage cost calculation skipped: cost or multiplier is 0")
+        return
+
+    days_in_month = calendar.monthrange(day.year, day.month)[1]
+
+    # One pass over the per-org counters (app/services/storage_usage.py)
+    usage = await db.storage_usage.find({"bytes": {"$gt": 0}}, {"_id": 0}).to_list(None)
+    orgs = {
+        o["id"]: o.get("name", "")
+        for o in await db.organizations.find(
+            {"id": {"$in": [u["org_id"] for u in usage]}}, {"_id": 0, "id": 1, "name": 1}
+        ).to_list(None)
+    }
+
+    # Compute all charges first, then apply them in bulk, once per org and day
+    charges = []
+    for u in usage:
+        org_id = u["org_id"]
+        if org_id not in orgs:
+            continue
+        charge = price_storage_day(u["bytes"], cost_per_gb_month, days_in_month, multiplier)
+        if not charge:
+            continue
+        charges.append({
+            "org_id": org_id,
+            "credits": charge.credits_used,
+            "description": f"Хранение S3: {charge.gb:.4f} ГБ (${charge.base_cost_usd:.6f} x{multiplier})",
+        })
+        logger.info(
+            f"Storage cost: org={org_id} ({orgs[org_id]}) "
+            f"size={charge.gb:.4f}GB base=${charge.base_cost_usd:.6f} "
+            f"multiplier={multiplier}x credits={charge.credits_used:.4f}"
+        )
 
-    except Exception as e:
-        logger.error(f"Storage cost calculation error: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+    await run_charges("storage", day.strftime("%Y-%m-%d"), charges)
 
+    logger.info("Daily S3 storage cost calculation complete")
 
 
 async def _migrate_storage_schema():
@@ -376,11 +372,10 @@ async def _migrate_storage_schema():
 
 
 async def _run_trash_cleanup():
-    """Run trash cleanup for both meeting and document collections."""
+    """Run trash cleanup for both meeting and document collections (raises so the scheduler retries)."""
     from app.services.access_control import cleanup_expired_trash
-    try:
-        await cleanup_expired_trash("meeting_folders", "projects")
-        await cleanup_expired_trash("doc_folders", "doc_projects")
-        logger.info("Trash cleanup complete")
-    except Exception as e:
-        logger.error(f"Trash cleanup error: {e}")
+    from app.services.storage_cleanup import retry_failed_deletes
+    await cleanup_expired_trash("meeting_folders", "projects")
+    await cleanup_expired_trash("doc_folders", "doc_projects")
+    await retry_failed_deletes()
+    logger.info("Trash cleanup complete")
@@ -12,9 +12,11 @@ class PipelineNodeConfig(BaseModel):
     inline_prompt: Optional[str] = None
     system_message: Optional[str] = None
     reasoning_effort: Optional[str] = "high"
+    max_output_tokens: Optional[int] = None  # answer limit sent to the provider; None = model default
     # For batch_loop nodes
     batch_size: Optional[int] = 3
     prompt_source_node: Optional[str] = None  # Explicit reference to template/ai_prompt node for batch loop
+    batch_concurrent: Optional[bool] = None  # None = concurrent unless the loop script reads context.results
     # For template nodes
     template_text: Optional[str] = None
     loop_vars: Optional[List[str]] = None  # Variables reserved for batch loop iteration (e.g. ["item"])
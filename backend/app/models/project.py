@@ -27,6 +27,8 @@ class ProjectResponse(BaseModel):
     reasoning_effort: Optional[str] = None
     recording_filename: Optional[str] = None
     recording_duration: Optional[float] = None
+    recording_size: Optional[int] = None
+    recording_sha256: Optional[str] = None
     fast_track: Optional[Dict[str, Any]] = None
     deleted_at: Optional[str] = None
     created_at: str
@@ -1,12 +1,14 @@
 import uuid
 import logging
 from datetime import datetime, timezone
-from typing import List
+from typing import List, Optional
 from fastapi import APIRouter, HTTPException, Depends
 from app.core.database import db
 from app.core.security import get_admin_user, get_superadmin_user, hash_password
 from app.models.user import UserResponse
 from app.core.config import OPENAI_API_KEY
+from app.services.settings_cache import settings_cache
+from app.services.scheduler import get_job, list_jobs, run_job_now, JobAlreadyRunning, JobFailed
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 logger = logging.getLogger(__name__)
@@ -15,9 +17,9 @@ DEFAULT_MODEL = "gpt-5.2"
 
 
 async def get_active_model() -> str:
-    """Get current active model from settings"""
-    settings = await db.settings.find_one({"key": "active_model"}, {"_id": 0})
-    return settings["value"] if settings else DEFAULT_MODEL
+    """Get current active model from settings (cached)"""
+    from app.services.gpt import _get_active_model
+    return await _get_active_model()
 
 
 @router.get("/users", response_model=List[UserResponse])
@@ -152,6 +154,7 @@ async def switch_model(model: str = None, admin=Depends(get_admin_user)):
         {"$set": {"key": "active_model", "value": model}},
         upsert=True,
     )
+    await settings_cache.invalidate("active_model")
 
     logger.info(f"Model switched: {old_model} -> {model}")
     return {"message": f"Модель переключена: {old_model} → {model}", "active_model": model}
@@ -175,3 +178,58 @@ async def update_trash_settings(data: dict, admin=Depends(get_superadmin_user)):
     from app.services.access_control import set_trash_retention_days
     await set_trash_retention_days(days)
     return {"retention_days": days, "message": f"Срок хранения корзины: {days} дней"}
+
+
+@router.get("/transcription/metrics")
+async def transcription_metrics(admin=Depends(get_superadmin_user)):
+    """Deepgram executor metrics: this API process plus live worker heartbeats."""
+    from datetime import timedelta
+    from app.services.transcription import get_transcription_service
+    cutoff = (datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat()
+    workers = await db.worker_status.find(
+        {"updated_at": {"$gte": cutoff}}, {"_id": 0}
+    ).sort("worker_id", 1).to_list(1000)
+    return {
+        "api": get_transcription_service().metrics(),
+        "workers": workers,
+    }
+
+
+@router.get("/scheduler/jobs")
+async def list_scheduled_jobs(admin=Depends(get_superadmin_user)):
+    """Scheduled maintenance jobs with their last and next run."""
+    return await list_jobs()
+
+
+@router.post("/scheduler/jobs/{name}/run")
+async def run_scheduled_job(name: str, admin=Depends(get_superadmin_user)):
+    """Run a scheduled job now, once cluster-wide (superadmin only)."""
+    if not get_job(name):
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    try:
+        state = await run_job_now(name)
+    except JobAlreadyRunning:
+        raise HTTPException(status_code=409, detail="Задача уже выполняется")
+    except JobFailed as e:
+        logger.warning(f"Scheduled job {name} run manually by {admin['email']} failed: {e.error}")
+        raise HTTPException(status_code=500, detail=f"Задача завершилась с ошибкой: {e.error}")
+    logger.info(f"Scheduled job {name} run manually by {admin['email']}")
+    return state
+
+
+@router.get("/gpt/telemetry")
+async def gpt_telemetry(
+    days: int = 7,
+    group: str = "model",
+    source: Optional[str] = None,
+    model: Optional[str] = None,
+    include_cache_hits: bool = False,
+    admin=Depends(get_superadmin_user),
+):
+    """GPT call latency / TTFT percentiles and mean tokens by model and reasoning effort (group=node: per pipeline node)."""
+    from app.services.gpt_telemetry import SUMMARY_GROUPS, gpt_call_summary
+    if group not in SUMMARY_GROUPS:
+        raise HTTPException(status_code=400, detail=f"Неизвестная группировка. Доступны: {', '.join(SUMMARY_GROUPS)}")
+    if days < 1:
+        raise HTTPException(status_code=400, detail="Период должен быть не меньше 1 дня")
+    return await gpt_call_summary(days, group, source, model, include_cache_hits)
@@ -1,4 +1,5 @@
 import uuid
+import asyncio
 import base64
 import json
 import logging
@@ -8,10 +9,15 @@ from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
 from pydantic import BaseModel
 from app.core.database import db
 from app.core.security import get_current_user
-from app.services.gpt import call_gpt_chat, call_gpt_chat_metered
+from app.services.gpt import GptResult, call_gpt_chat, call_gpt_chat_metered, stream_gpt_chat_metered
+from app.services.gpt_stream import gpt_sse_response
+from app.services.token_budget import PromptTooLarge
+from app.services.conversation_context import CONTEXT_HISTORY_TOKENS
 from app.services.metering import check_user_monthly_limit, check_org_balance, deduct_credits_and_record
-from app.services.s3 import s3_enabled, upload_bytes, presigned_url, download_bytes
+from app.services.s3 import s3_enabled, presigned_url
+from app.services.storage import get_storage
 from app.models.ai_chat import AiChatSessionResponse, AiChatSessionListItem, AiChatMessage
+from app.utils.context_window import group_turns, recent_start
 
 router = APIRouter(prefix="/ai-chat", tags=["ai-chat"])
 logger = logging.getLogger(__name__)
@@ -246,14 +252,10 @@ async def delete_session(session_id: str, user=Depends(get_current_user)):
     return {"message": "Session deleted"}
 
 
-@router.post("/sessions/{session_id}/message")
-async def send_message(
-    session_id: str,
-    content: str = Form(""),
-    pipeline_context: str = Form(""),
-    image: Optional[UploadFile] = File(None),
-    user=Depends(get_current_user),
-):
+async def _prepare_chat_message(
+    session_id: str, content: str, pipeline_context: str, image: Optional[UploadFile], user
+) -> tuple:
+    """Store the image, build the GPT conversation and check billing. Returns (user_msg, system, openai_messages)."""
     session = await db.ai_chat_sessions.find_one(
         {"id": session_id, "user_id": user["id"]}, {"_id": 0}
     )
@@ -277,7 +279,7 @@ async def send_message(
         mime = f"image/{ext}" if ext in ("png", "jpeg", "jpg", "webp", "gif") else "image/png"
         if s3_enabled():
             try:
-                upload_bytes(s3_key, image_data, image.content_type or "image/png")
+                await get_storage().put(s3_key, image_data, image.content_type or "image/png")
                 image_s3_key = s3_key
                 image_display_url = presigned_url(s3_key)
             except Exception as e:
@@ -295,9 +297,16 @@ async def send_message(
         "timestamp": now,
     }
 
-    # Build OpenAI messages from history
+    # Build OpenAI messages from the latest history within the token budget;
+    # historical images are fetched concurrently
+    turns = group_turns(session.get("messages", []))
+    history = [msg for turn in turns[recent_start(turns, CONTEXT_HISTORY_TOKENS):] for msg in turn]
+    image_keys = [m["image_s3_key"] for m in history if m["role"] == "user" and m.get("image_s3_key")]
+    history_images = dict(zip(image_keys, await asyncio.gather(
+        *(get_storage().get(key) for key in image_keys), return_exceptions=True
+    )))
     openai_messages = []
-    for msg in session.get("messages", []):
+    for msg in history:
         if msg["role"] == "user":
             parts = []
             if msg.get("content"):
@@ -305,7 +314,9 @@ async def send_message(
             if msg.get("image_s3_key"):
                 # For historical images, load from S3
                 try:
-                    hist_data = download_bytes(msg["image_s3_key"])
+                    hist_data = history_images[msg["image_s3_key"]]
+                    if isinstance(hist_data, Exception):
+                        raise hist_data
                     hist_b64 = base64.b64encode(hist_data).decode("utf-8")
                     ext = msg["image_s3_key"].rsplit(".", 1)[-1]
                     mime = f"image/{ext}" if ext in ("png", "jpeg", "jpg", "webp", "gif") else "image/png"
@@ -357,20 +368,14 @@ async def send_message(
         if not await check_org_balance(org_id, user):
             raise HTTPException(status_code=402, detail="Недостаточно кредитов. Пополните баланс.")
 
-    # Call GPT
-    try:
-        gpt_result = await call_gpt_chat_metered(
-            system_message=system,
-            messages=openai_messages,
-        )
-        ai_response = gpt_result.content
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"AI chat error: {e}")
-        raise HTTPException(status_code=500, detail=f"AI error: {str(e)}")
+    return user_msg, system, openai_messages
+
 
+async def _finish_chat_message(session_id: str, user_msg: dict, gpt_result: GptResult, user) -> dict:
+    """Meter the GPT call, save both messages and build the response payload."""
     # Deduct credits after successful AI call
+    ai_response = gpt_result.content
+    org_id = user.get("org_id")
     metering_info = None
     if org_id:
         try:
@@ -380,6 +385,8 @@ async def send_message(
                 model=gpt_result.model,
                 prompt_tokens=gpt_result.prompt_tokens,
                 completion_tokens=gpt_result.completion_tokens,
+                cached_tokens=gpt_result.cached_tokens,
+                cache_hit=gpt_result.cache_hit,
                 source="ai_chat",
             )
         except Exception as e:
@@ -406,8 +413,8 @@ async def send_message(
     pipeline_data = _extract_pipeline_json(ai_response)
 
     # Refresh image URL for the user message response
-    if image_s3_key:
-        user_msg["image_url"] = presigned_url(image_s3_key)
+    if user_msg.get("image_s3_key"):
+        user_msg["image_url"] = presigned_url(user_msg["image_s3_key"])
 
     return {
         "user_message": user_msg,
@@ -417,6 +424,56 @@ async def send_message(
     }
 
 
+@router.post("/sessions/{session_id}/message")
+async def send_message(
+    session_id: str,
+    content: str = Form(""),
+    pipeline_context: str = Form(""),
+    image: Optional[UploadFile] = File(None),
+    user=Depends(get_current_user),
+):
+    user_msg, system, openai_messages = await _prepare_chat_message(
+        session_id, content, pipeline_context, image, user
+    )
+
+    # Call GPT
+    try:
+        gpt_result = await call_gpt_chat_metered(
+            system_message=system,
+            messages=openai_messages,
+            source="ai_chat",
+        )
+    except (HTTPException, PromptTooLarge):
+        raise
+    except Exception as e:
+        logger.error(f"AI chat error: {e}")
+        raise HTTPException(status_code=500, detail=f"AI error: {str(e)}")
+
+    return await _finish_chat_message(session_id, user_msg, gpt_result, user)
+
+
+@router.post("/sessions/{session_id}/message/stream")
+async def send_message_stream(
+    session_id: str,
+    content: str = Form(""),
+    pipeline_context: str = Form(""),
+    image: Optional[UploadFile] = File(None),
+    user=Depends(get_current_user),
+):
+    """SSE variant of send_message: `token` events, then `done` with the same payload as send_message."""
+    user_msg, system, openai_messages = await _prepare_chat_message(
+        session_id, content, pipeline_context, image, user
+    )
+
+    async def on_complete(gpt_result: GptResult) -> dict:
+        return await _finish_chat_message(session_id, user_msg, gpt_result, user)
+
+    return gpt_sse_response(
+        stream_gpt_chat_metered(system_message=system, messages=openai_messages, source="ai_chat"),
+        on_complete,
+    )
+
+
 def _extract_pipeline_json(text: str) -> Optional[dict]:
     """Try to extract pipeline JSON from AI response text."""
     try:
@@ -1,20 +1,26 @@
 import uuid
 import os
+import asyncio
 import base64
 import zipfile
 import io
+import logging
 from datetime import datetime, timezone
 from typing import Optional, List
 from pydantic import BaseModel
 from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
-from fastapi.responses import RedirectResponse
 from app.core.database import db
 from app.routes.auth import get_current_user
-from app.services.s3 import s3_enabled, upload_bytes, download_bytes, delete_object, presigned_url
-from app.services.pdf_parser import extract_text_from_pdf
+from app.services.s3 import s3_enabled, upload_bytes
+from app.services.storage import get_storage, download_response
+from app.services.storage_cleanup import delete_local_files
+from app.services.storage_usage import project_storage_org, record_storage_change, record_attachments_removed
+from app.services.pdf_parser import extract_text_from_pdf_async
+from app.services.token_budget import CONTEXT_ATTACHMENTS_SHARE, fit_texts, section_budget
 from app.services.access_control import can_user_access_project, can_user_write_project
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 UPLOAD_DIR = "/app/backend/uploads/attachments"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -158,13 +164,15 @@ async def upload_attachment(
 
     now = datetime.now(timezone.utc).isoformat()
     created_attachments = []
+    storage_org_id = await project_storage_org(project)
 
     if ext in ARCHIVE_TYPES:
         # Save ZIP locally temporarily for extraction
         tmp_path = os.path.join(UPLOAD_DIR, safe_name)
         with open(tmp_path, "wb") as f:
             f.write(content)
-        inner_files = process_zip(tmp_path)
+        # Extraction and uploads block: keep them off the event loop
+        inner_files = await asyncio.to_thread(process_zip, tmp_path)
         # Remove temp ZIP
         if os.path.exists(tmp_path):
             os.remove(tmp_path)
@@ -181,9 +189,12 @@ async def upload_attachment(
                 "extracted_text": inner.get("extracted_text"),
                 "file_path": inner.get("file_path"),
                 "s3_key": inner.get("s3_key"),
+                "storage_org_id": storage_org_id,
                 "created_at": now,
             }
             await db.attachments.insert_one(doc)
+            if doc["s3_key"]:
+                await record_storage_change(storage_org_id, doc["size"] or 0)
             created_attachments.append(AttachmentResponse(**{k: v for k, v in doc.items() if k != "s3_key"}))
     else:
         # Single file
@@ -191,7 +202,7 @@ async def upload_attachment(
         file_path = None
         if s3_enabled():
             s3_key = f"attachments/{safe_name}"
-            upload_bytes(s3_key, content, file.content_type or "application/octet-stream")
+            await get_storage().put(s3_key, content, file.content_type or "application/octet-stream")
         else:
             file_path = os.path.join(UPLOAD_DIR, safe_name)
             with open(file_path, "wb") as f:
@@ -204,7 +215,7 @@ async def upload_attachment(
             else:
                 extracted = extract_text_from_file(file_path, ext)
         elif ext == ".pdf":
-            extracted = extract_text_from_pdf(content)
+            extracted = await extract_text_from_pdf_async(content)
 
         att_id = str(uuid.uuid4())
         doc = {
@@ -218,9 +229,12 @@ async def upload_attachment(
             "extracted_text": extracted,
             "file_path": file_path,
             "s3_key": s3_key,
+            "storage_org_id": storage_org_id,
             "created_at": now,
         }
         await db.attachments.insert_one(doc)
+        if s3_key:
+            await record_storage_change(storage_org_id, len(content))
         created_attachments.append(AttachmentResponse(**{k: v for k, v in doc.items() if k != "s3_key"}))
 
     return created_attachments
@@ -288,11 +302,15 @@ async def delete_attachment(
 
     # Delete file from storage
     if att.get("s3_key"):
-        delete_object(att["s3_key"])
-    elif att.get("file_path") and os.path.exists(att["file_path"]):
-        os.remove(att["file_path"])
+        try:
+            await get_storage().delete(att["s3_key"])
+        except Exception as e:
+            logger.warning(f"Storage delete failed for {att['s3_key']}: {e}")
+    elif att.get("file_path"):
+        await delete_local_files([att["file_path"]])
 
     await db.attachments.delete_one({"id": attachment_id})
+    await record_attachments_removed([att])
     return {"message": "Deleted"}
 
 
@@ -311,8 +329,7 @@ async def download_attachment(
         raise HTTPException(status_code=404, detail="Attachment not found")
 
     if att.get("s3_key"):
-        url = presigned_url(att["s3_key"], expires=3600)
-        return RedirectResponse(url=url)
+        return await download_response(att["s3_key"], att.get("name", "file"))
 
     if att.get("file_path") and os.path.exists(att["file_path"]):
         from fastapi.responses import FileResponse
@@ -351,7 +368,7 @@ async def build_attachment_context(attachment_ids: List[str], project_id: str):
         elif ft == "pdf":
             raw = None
             if att.get("s3_key"):
-                raw = download_bytes(att["s3_key"])
+                raw = await get_storage().get(att["s3_key"])
             elif att.get("file_path") and os.path.exists(att["file_path"]):
                 with open(att["file_path"], "rb") as f:
                     raw = f.read()
@@ -368,7 +385,7 @@ async def build_attachment_context(attachment_ids: List[str], project_id: str):
         elif ft == "image":
             raw = None
             if att.get("s3_key"):
-                raw = download_bytes(att["s3_key"])
+                raw = await get_storage().get(att["s3_key"])
             elif att.get("file_path") and os.path.exists(att["file_path"]):
                 with open(att["file_path"], "rb") as f:
                     raw = f.read()
@@ -382,4 +399,9 @@ async def build_attachment_context(attachment_ids: List[str], project_id: str):
                     }
                 })
 
+    # Attachment texts share CONTEXT_ATTACHMENTS_SHARE of the prompt budget
+    if text_parts:
+        model, budget = await section_budget(CONTEXT_ATTACHMENTS_SHARE)
+        text_parts = fit_texts(text_parts, budget, model)
+
     return text_parts, file_parts
@@ -1,3 +1,4 @@
+import re
 import uuid
 import logging
 import httpx
@@ -72,15 +73,15 @@ async def get_exchange_rate():
 
 
 async def update_exchange_rate():
-    """Fetch current USD/RUB rate and store in DB."""
+    """Fetch current USD/RUB rate and store in DB. Raises when the rate can't be fetched."""
     try:
         async with httpx.AsyncClient(timeout=10) as client:
             resp = await client.get("https://api.exchangerate-api.com/v4/latest/USD")
-            data = resp.json()
-            rate = data.get("rates", {}).get("RUB", 92.5)
+            resp.raise_for_status()
+            rate = float(resp.json()["rates"]["RUB"])
     except Exception as e:
         logger.warning(f"Failed to fetch exchange rate: {e}")
-        return
+        raise
 
     now = datetime.now(timezone.utc).isoformat()
     await db.exchange_rates.update_one(
@@ -316,7 +317,12 @@ async def admin_list_balances(admin=Depends(get_superadmin_user)):
 
 # ── Markup Tiers (Superadmin) ──
 
-from app.services.metering import get_markup_tiers as _get_tiers, get_cost_settings, update_cost_settings
+from app.services.metering import get_markup_tiers as _get_tiers, get_markup_table, get_cost_settings, update_cost_settings
+from app.services.settings_cache import settings_cache
+from app.services.usage_rollups import get_month_usage, rebuild_usage_rollups
+from app.services.metering_ledger import ProjectorBusy
+from app.services.storage_usage import rebuild_storage_usage
+from app.services.scheduler import run_job_now, JobAlreadyRunning, JobFailed
 
 
 class MarkupTierUpdate(BaseModel):
@@ -359,11 +365,34 @@ async def update_admin_cost_settings(data: CostSettingsUpdate, admin=Depends(get
 @router.post("/admin/run-storage-calc")
 async def admin_run_storage_calc(admin=Depends(get_superadmin_user)):
     """Manually trigger S3 storage cost calculation (superadmin only)."""
-    from app.main import calculate_daily_storage_costs
-    await calculate_daily_storage_costs()
+    try:
+        await run_job_now("storage_costs")
+    except JobAlreadyRunning:
+        raise HTTPException(status_code=409, detail="Расчёт стоимости хранения уже выполняется")
+    except JobFailed as e:
+        raise HTTPException(status_code=500, detail=f"Расчёт стоимости хранения завершился с ошибкой: {e.error}")
     return {"message": "Расчёт стоимости хранения выполнен"}
 
 
+@router.post("/admin/rebuild-usage-rollups")
+async def admin_rebuild_usage_rollups(month: Optional[str] = None, admin=Depends(get_superadmin_user)):
+    """Recompute monthly usage rollups from usage_records (superadmin only)."""
+    if month and not re.fullmatch(r"\d{4}-\d{2}", month):
+        raise HTTPException(status_code=400, detail="month должен быть в формате YYYY-MM")
+    try:
+        written = await rebuild_usage_rollups(month)
+    except ProjectorBusy:
+        raise HTTPException(status_code=409, detail="Пересчёт сводок уже выполняется")
+    return {"message": "Сводки использования пересчитаны", "documents": written}
+
+
+@router.post("/admin/rebuild-storage-usage")
+async def admin_rebuild_storage_usage(admin=Depends(get_superadmin_user)):
+    """Recompute per-org storage usage counters from attachments (superadmin only)."""
+    orgs = await rebuild_storage_usage()
+    return {"message": "Объём хранилища пересчитан", "orgs": orgs}
+
+
 @router.put("/admin/markup-tiers")
 async def update_markup_tiers(data: MarkupTierUpdate, admin=Depends(get_superadmin_user)):
     if not data.tiers:
@@ -388,6 +417,8 @@ async def update_markup_tiers(data: MarkupTierUpdate, admin=Depends(get_superadm
             "multiplier": t["multiplier"],
             "created_at": now,
         })
+    await settings_cache.invalidate("markup_tiers")
+    await get_markup_table()  # rebuild the in-process lookup table right away
 
     return {"message": "Markup tiers updated", "count": len(data.tiers)}
 
@@ -397,21 +428,7 @@ async def update_markup_tiers(data: MarkupTierUpdate, admin=Depends(get_superadm
 @router.get("/usage/my")
 async def get_my_usage(user=Depends(get_current_user)):
     """Get current user's usage stats for current month."""
-    now = datetime.now(timezone.utc)
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
-
-    pipeline = [
-        {"$match": {"user_id": user["id"], "created_at": {"$gte": month_start}}},
-        {"$group": {
-            "_id": None,
-            "total_tokens": {"$sum": "$total_tokens"},
-            "total_credits": {"$sum": "$credits_used"},
-            "total_requests": {"$sum": 1},
-        }},
-    ]
-    result = await db.usage_records.aggregate(pipeline).to_list(1)
-    stats = result[0] if result else {"total_tokens": 0, "total_credits": 0, "total_requests": 0}
-    stats.pop("_id", None)
+    stats = await get_month_usage("user", user["id"])
     stats["monthly_token_limit"] = user.get("monthly_token_limit", 0)
 
     return stats
@@ -7,10 +7,13 @@ from fastapi import APIRouter, HTTPException, Depends
 from app.core.database import db
 from app.core.security import get_current_user
 from app.models.chat import ChatRequestCreate, ChatRequestResponse, ChatResponseUpdate
-from app.services.gpt import call_gpt52, call_gpt52_metered
+from app.services.gpt import GptResult, call_gpt52, call_gpt52_metered, stream_gpt52_metered
+from app.services.gpt_stream import gpt_sse_response
 from app.services.metering import check_user_monthly_limit, check_org_balance, deduct_credits_and_record
 from app.routes.attachments import build_attachment_context
 from app.services.access_control import can_user_access_project, can_user_write_project
+from app.services.conversation_context import get_summary, bounded_history, refresh_summary_later, invalidate_summary
+from app.utils.prompt_layout import MEETING_SYSTEM_MESSAGE, transcript_prefix, layout_messages
 
 logger = logging.getLogger(__name__)
 
@@ -67,7 +70,7 @@ async def generate_script(data: GenerateScriptRequest, user=Depends(get_current_
         if not await check_org_balance(org_id, user):
             raise HTTPException(status_code=402, detail="Недостаточно кредитов. Пополните баланс.")
 
-    gpt_result = await call_gpt52_metered(system_message, user_message, reasoning_effort="medium")
+    gpt_result = await call_gpt52_metered(system_message, user_message, reasoning_effort="medium", source="generate_script")
 
     # Deduct credits
     if org_id:
@@ -78,6 +81,8 @@ async def generate_script(data: GenerateScriptRequest, user=Depends(get_current_
                 model=gpt_result.model,
                 prompt_tokens=gpt_result.prompt_tokens,
                 completion_tokens=gpt_result.completion_tokens,
+                cached_tokens=gpt_result.cached_tokens,
+                cache_hit=gpt_result.cache_hit,
                 source="generate_script",
             )
         except Exception as e:
@@ -133,15 +138,19 @@ async def analyze_raw(
 
     # If transcript text is already embedded in the prompt, skip context messages
     if data.skip_transcript_context:
+        system_message = data.system_message
         messages = [
             {"role": "user", "content": user_msg_content}
         ]
     else:
-        messages = [
-            {"role": "user", "content": f"Вот транскрипт встречи:\n\n{transcript['content']}"},
-            {"role": "assistant", "content": "Спасибо, я прочитал транскрипт. Готов помочь с анализом."},
-            {"role": "user", "content": user_msg_content}
-        ]
+        # Stable system + transcript prefix (cacheable across wizard steps),
+        # the step's own system message goes after it
+        system_message = MEETING_SYSTEM_MESSAGE
+        messages = layout_messages(
+            transcript_prefix(transcript["content"]),
+            user_msg_content,
+            instructions=data.system_message,
+        )
     
     # Check billing limits
     org_id = user.get("org_id")
@@ -152,9 +161,12 @@ async def analyze_raw(
             raise HTTPException(status_code=402, detail="Недостаточно кредитов. Пополните баланс.")
 
     gpt_result = await call_gpt52_metered(
-        system_message=data.system_message,
+        system_message=system_message,
         messages=messages,
-        reasoning_effort=data.reasoning_effort or "high"
+        reasoning_effort=data.reasoning_effort or "high",
+        cache_key=f"meeting:{project_id}",
+        use_cache=True,
+        source="analyze_raw",
     )
 
     # Deduct credits
@@ -166,6 +178,8 @@ async def analyze_raw(
                 model=gpt_result.model,
                 prompt_tokens=gpt_result.prompt_tokens,
                 completion_tokens=gpt_result.completion_tokens,
+                cached_tokens=gpt_result.cached_tokens,
+                cache_hit=gpt_result.cache_hit,
                 source="analyze_raw",
             )
         except Exception as e:
@@ -241,19 +255,33 @@ async def delete_chat_history(
     if not project or not await can_user_access_project(project, user, "meeting_folders"):
         raise HTTPException(status_code=404, detail="Project not found")
     
-    result = await db.chat_requests.delete_one({"id": chat_id, "project_id": project_id})
-    if result.deleted_count == 0:
+    deleted = await db.chat_requests.find_one_and_delete(
+        {"id": chat_id, "project_id": project_id}, {"_id": 0, "created_at": 1}
+    )
+    if not deleted:
         raise HTTPException(status_code=404, detail="Chat entry not found")
+    await invalidate_summary("meeting", project_id, deleted.get("created_at", ""))
     
     return {"message": "Deleted"}
 
 
-@router.post("/projects/{project_id}/analyze", response_model=ChatRequestResponse)
-async def analyze_with_prompt(
-    project_id: str,
-    data: ChatRequestCreate,
-    user=Depends(get_current_user)
-):
+def _chat_turn(ch: dict) -> list:
+    """A stored chat request as a (user, assistant) history turn."""
+    user_msg = ch.get("prompt_content", "")
+    if ch.get("additional_text"):
+        user_msg += f"\n\nДополнительно: {ch['additional_text']}"
+    return [
+        {"role": "user", "content": user_msg},
+        {"role": "assistant", "content": ch.get("response_text", "")},
+    ]
+
+
+async def _prepare_analysis(project_id: str, data: ChatRequestCreate, user) -> tuple:
+    """Validate access and billing, build the GPT conversation.
+
+    Returns (prompt, system_message, messages, context); context is
+    (summary, turns) of the history, for updating the summary afterwards.
+    """
     project = await db.projects.find_one({"id": project_id, "deleted_at": None}, {"_id": 0})
     if not project or not await can_user_access_project(project, user, "meeting_folders"):
         raise HTTPException(status_code=404, detail="Project not found")
@@ -275,26 +303,14 @@ async def analyze_with_prompt(
     if not transcript:
         raise HTTPException(status_code=400, detail="No transcript found")
     
-    # Build conversation history
-    chat_history = await db.chat_requests.find(
-        {"project_id": project_id},
-        {"_id": 0}
-    ).sort("created_at", 1).to_list(100)
-    
-    # Build messages list for multi-turn conversation
-    messages = []
-    
-    # Add transcript as first user message
-    messages.append({"role": "user", "content": f"Вот транскрипт встречи:\n\n{transcript['content']}"})
-    messages.append({"role": "assistant", "content": "Спасибо, я прочитал транскрипт. Готов помочь с анализом."})
-    
-    # Add previous conversation turns
-    for ch in chat_history:
-        user_msg = ch.get("prompt_content", "")
-        if ch.get("additional_text"):
-            user_msg += f"\n\nДополнительно: {ch['additional_text']}"
-        messages.append({"role": "user", "content": user_msg})
-        messages.append({"role": "assistant", "content": ch.get("response_text", "")})
+    # Conversation history: turns after the summary, newest within the token budget
+    summary = await get_summary("meeting", project_id)
+    query = {"project_id": project_id}
+    if summary.get("covered_until"):
+        query["created_at"] = {"$gt": summary["covered_until"]}
+    chat_history = await db.chat_requests.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
+    turns = [(ch.get("created_at", ""), _chat_turn(ch)) for ch in reversed(chat_history)]
+    history = bounded_history(summary, turns)
     
     # Add current request
     user_prompt = prompt["content"]
@@ -315,13 +331,9 @@ async def analyze_with_prompt(
     else:
         user_msg_content = user_prompt
 
-    messages.append({"role": "user", "content": user_msg_content})
-    
-    # System message
-    system_message = """Ты — профессиональный ассистент для анализа рабочих встреч.
-У тебя есть транскрипт встречи и история предыдущих запросов по этой встрече.
-Отвечай структурированно, используя markdown для форматирования.
-При ссылках на реплики участников указывай их имена."""
+    # Transcript and history form a stable prefix, so each request reuses the provider's prompt cache
+    system_message = MEETING_SYSTEM_MESSAGE
+    messages = layout_messages(transcript_prefix(transcript["content"]), user_msg_content, history=history)
     
     # Check billing limits
     org_id = user.get("org_id")
@@ -331,15 +343,12 @@ async def analyze_with_prompt(
         if not await check_org_balance(org_id, user):
             raise HTTPException(status_code=402, detail="Недостаточно кредитов. Пополните баланс.")
 
-    # Call GPT with full conversation
-    gpt_result = await call_gpt52_metered(
-        system_message=system_message,
-        messages=messages,
-        reasoning_effort=data.reasoning_effort or "high"
-    )
-    response_text = gpt_result.content
+    return prompt, system_message, messages, (summary, turns)
 
-    # Deduct credits
+
+async def _save_analysis(project_id: str, data: ChatRequestCreate, prompt: dict, gpt_result: GptResult, user, context: tuple) -> dict:
+    """Meter the GPT call, store the chat request and update the history summary if due."""
+    org_id = user.get("org_id")
     if org_id:
         try:
             await deduct_credits_and_record(
@@ -348,6 +357,8 @@ async def analyze_with_prompt(
                 model=gpt_result.model,
                 prompt_tokens=gpt_result.prompt_tokens,
                 completion_tokens=gpt_result.completion_tokens,
+                cached_tokens=gpt_result.cached_tokens,
+                cache_hit=gpt_result.cache_hit,
                 source="analyze_prompt",
             )
         except Exception as e:
@@ -364,14 +375,64 @@ async def analyze_with_prompt(
         "prompt_content": prompt["content"],
         "additional_text": data.additional_text,
         "reasoning_effort": data.reasoning_effort,
-        "response_text": response_text,
+        "response_text": gpt_result.content,
         "created_at": now
     }
     
     await db.chat_requests.insert_one(chat_doc)
+    chat_doc.pop("_id", None)
+
+    summary, turns = context
+    refresh_summary_later("meeting", project_id, project_id, turns + [(now, _chat_turn(chat_doc))], summary, user)
+    return chat_doc
+
+
+@router.post("/projects/{project_id}/analyze", response_model=ChatRequestResponse)
+async def analyze_with_prompt(
+    project_id: str,
+    data: ChatRequestCreate,
+    user=Depends(get_current_user)
+):
+    prompt, system_message, messages, context = await _prepare_analysis(project_id, data, user)
+
+    # Call GPT with full conversation
+    gpt_result = await call_gpt52_metered(
+        system_message=system_message,
+        messages=messages,
+        reasoning_effort=data.reasoning_effort or "high",
+        cache_key=f"meeting:{project_id}",
+        source="analyze_prompt",
+    )
+
+    chat_doc = await _save_analysis(project_id, data, prompt, gpt_result, user, context)
     return ChatRequestResponse(**chat_doc)
 
 
+@router.post("/projects/{project_id}/analyze/stream")
+async def analyze_with_prompt_stream(
+    project_id: str,
+    data: ChatRequestCreate,
+    user=Depends(get_current_user)
+):
+    """SSE variant of analyze_with_prompt: `token` events, then `done` with the saved chat request."""
+    prompt, system_message, messages, context = await _prepare_analysis(project_id, data, user)
+
+    async def on_complete(gpt_result: GptResult) -> dict:
+        chat_doc = await _save_analysis(project_id, data, prompt, gpt_result, user, context)
+        return ChatRequestResponse(**chat_doc).model_dump()
+
+    return gpt_sse_response(
+        stream_gpt52_metered(
+            system_message=system_message,
+            messages=messages,
+            reasoning_effort=data.reasoning_effort or "high",
+            cache_key=f"meeting:{project_id}",
+            source="analyze_prompt",
+        ),
+        on_complete,
+    )
+
+
 @router.get("/projects/{project_id}/chat-history", response_model=List[ChatRequestResponse])
 async def get_chat_history(project_id: str, user=Depends(get_current_user)):
     project = await db.projects.find_one({"id": project_id, "deleted_at": None}, {"_id": 0})
@@ -405,6 +466,7 @@ async def update_chat_response(
         {"id": chat_id},
         {"$set": {"response_text": data.response_text}}
     )
+    await invalidate_summary("meeting", project_id, chat.get("created_at", ""))
     
     updated = await db.chat_requests.find_one({"id": chat_id}, {"_id": 0})
     return ChatRequestResponse(**updated)
@@ -1,16 +1,21 @@
 import uuid
 import os
+import asyncio
 import logging
 from datetime import datetime, timezone
 from typing import Optional, List
 from pydantic import BaseModel
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from app.core.database import db
 from app.routes.auth import get_current_user
-from app.services.gpt import call_gpt52, call_gpt52_metered
+from app.services.gpt import GptResult, call_gpt52, call_gpt52_metered, stream_gpt52_metered
+from app.services.gpt_stream import gpt_sse_response
 from app.services.metering import check_user_monthly_limit, check_org_balance, deduct_credits_and_record
-from app.services.s3 import s3_enabled, upload_bytes, download_bytes, delete_object, presigned_url
+from app.services.s3 import s3_enabled
+from app.services.storage import get_storage, download_response
+from app.services.storage_cleanup import delete_attachment_files, delete_local_files
+from app.services.storage_usage import project_storage_org, record_storage_change, record_attachments_removed
 from app.services.access_control import (
     can_user_access_folder,
     can_user_write_folder,
@@ -20,12 +25,25 @@ from app.services.access_control import (
     get_accessible_public_folder_ids,
     cascade_visibility,
 )
-from app.services.pdf_parser import extract_text_from_pdf
+from app.services.attachment_text import build_source_context, extract_and_cache, content_hash, is_extractable
+from app.services.conversation_context import get_summary, bounded_history, refresh_summary_later, invalidate_summary
+from app.services.pipeline_jobs import (
+    RUN_PROJECTION,
+    TERMINAL_RUN_STATUSES,
+    start_pipeline_run,
+    resume_pipeline_run,
+    get_run_progress,
+)
+from app.utils.sse import sse_event, sse_comment
+from app.utils.prompt_layout import SOURCES_SYSTEM_MESSAGE, sources_system_message, layout_messages
+from app.utils.context_window import group_turns
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 UPLOAD_DIR = "/app/backend/uploads/doc_attachments"
+RUN_EVENTS_POLL_SECONDS = 1
+STREAM_HISTORY_MESSAGES = 200  # newest stream messages loaded for the context window
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 
@@ -317,22 +335,17 @@ async def permanent_delete_folder(folder_id: str, user=Depends(get_current_user)
     projects = await db.doc_projects.find(
         {"folder_id": folder_id, "owner_id": user["id"]}, {"_id": 0, "id": 1}
     ).to_list(10000)
-    from app.services.s3 import delete_object as s3_delete
-    for proj in projects:
-        atts = await db.doc_attachments.find(
-            {"project_id": proj["id"], "s3_key": {"$exists": True, "$ne": None}},
-            {"_id": 0, "s3_key": 1},
-        ).to_list(500)
-        for att in atts:
-            try:
-                s3_delete(att["s3_key"])
-            except Exception:
-                pass
-        await db.doc_attachments.delete_many({"project_id": proj["id"]})
-        await db.doc_streams.delete_many({"project_id": proj["id"]})
-        await db.doc_pins.delete_many({"project_id": proj["id"]})
-        await db.doc_runs.delete_many({"project_id": proj["id"]})
-        await db.doc_projects.delete_one({"id": proj["id"]})
+    project_ids = [p["id"] for p in projects]
+    await delete_attachment_files("doc_attachments", project_ids, "permanent_delete_doc_folder")
+    if project_ids:
+        scope = {"project_id": {"$in": project_ids}}
+        await db.doc_attachments.delete_many(scope)
+        await db.doc_streams.delete_many(scope)
+        await db.conversation_summaries.delete_many(scope)
+        await db.doc_pins.delete_many(scope)
+        await db.doc_runs.delete_many(scope)
+        await db.doc_run_nodes.delete_many(scope)
+        await db.doc_projects.delete_many({"id": {"$in": project_ids}})
     await db.doc_folders.delete_one({"id": folder_id})
     return {"message": "Папка удалена навсегда"}
 
@@ -481,19 +494,13 @@ async def permanent_delete_doc_project(project_id: str, user=Depends(get_current
     if not project:
         raise HTTPException(404, "Проект не найден в корзине")
 
-    attachments = await db.doc_attachments.find({"project_id": project_id}, {"_id": 0}).to_list(500)
-    for att in attachments:
-        if att.get("s3_key"):
-            try:
-                delete_object(att["s3_key"])
-            except Exception:
-                pass
-        elif att.get("file_path") and os.path.exists(att["file_path"]):
-            os.remove(att["file_path"])
+    await delete_attachment_files("doc_attachments", [project_id], "permanent_delete_doc_project")
     await db.doc_attachments.delete_many({"project_id": project_id})
     await db.doc_streams.delete_many({"project_id": project_id})
+    await db.conversation_summaries.delete_many({"project_id": project_id})
     await db.doc_pins.delete_many({"project_id": project_id})
     await db.doc_runs.delete_many({"project_id": project_id})
+    await db.doc_run_nodes.delete_many({"project_id": project_id})
     await db.doc_projects.delete_one({"id": project_id})
     return {"message": "Проект удалён навсегда"}
 
@@ -524,6 +531,7 @@ async def move_doc_project(project_id: str, data: DocProjectMove, user=Depends(g
 @router.post("/doc/projects/{project_id}/attachments")
 async def upload_doc_attachment(
     project_id: str,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     user=Depends(get_current_user)
 ):
@@ -544,7 +552,7 @@ async def upload_doc_attachment(
     file_path = None
     if s3_enabled():
         s3_key = f"doc_attachments/{safe_name}"
-        upload_bytes(s3_key, content, file.content_type or "application/octet-stream")
+        await get_storage().put(s3_key, content, file.content_type or "application/octet-stream")
     else:
         file_path = os.path.join(UPLOAD_DIR, safe_name)
         with open(file_path, "wb") as f:
@@ -554,6 +562,7 @@ async def upload_doc_attachment(
     file_type = "pdf" if ext == ".pdf" else "image" if ext in {".png", ".jpg", ".jpeg", ".webp", ".gif"} else "text" if ext in {".txt", ".csv", ".md", ".docx"} else "other"
 
     now = datetime.now(timezone.utc).isoformat()
+    storage_org_id = await project_storage_org(project)
     doc = {
         "id": str(uuid.uuid4()),
         "project_id": project_id,
@@ -561,11 +570,18 @@ async def upload_doc_attachment(
         "file_type": file_type,
         "content_type": file.content_type,
         "size": len(content),
+        "content_sha256": content_hash(content),
         "file_path": file_path,
         "s3_key": s3_key,
+        "storage_org_id": storage_org_id,
         "created_at": now,
     }
     await db.doc_attachments.insert_one(doc)
+    if s3_key:
+        await record_storage_change(storage_org_id, len(content))
+    if is_extractable(file.filename):
+        # Extract (and OCR) once now instead of on every run / stream message
+        background_tasks.add_task(extract_and_cache, file.filename, content, doc["content_sha256"])
     return {k: v for k, v in doc.items() if k != "_id"}
 
 @router.post("/doc/projects/{project_id}/attachments/url")
@@ -610,11 +626,15 @@ async def delete_doc_attachment(
         raise HTTPException(status_code=404, detail="Attachment not found")
 
     if att.get("s3_key"):
-        delete_object(att["s3_key"])
-    elif att.get("file_path") and os.path.exists(att["file_path"]):
-        os.remove(att["file_path"])
+        try:
+            await get_storage().delete(att["s3_key"])
+        except Exception as e:
+            logger.warning(f"Storage delete failed for {att['s3_key']}: {e}")
+    elif att.get("file_path"):
+        await delete_local_files([att["file_path"]])
 
     await db.doc_attachments.delete_one({"id": attachment_id})
+    await record_attachments_removed([att])
     return {"message": "Deleted"}
 
 
@@ -633,8 +653,7 @@ async def download_doc_attachment(
         raise HTTPException(status_code=404, detail="Attachment not found")
 
     if att.get("s3_key"):
-        url = presigned_url(att["s3_key"], expires=3600)
-        return RedirectResponse(url=url)
+        return await download_response(att["s3_key"], att.get("name", "file"))
 
     if att.get("file_path") and os.path.exists(att["file_path"]):
         from fastapi.responses import FileResponse
@@ -645,117 +664,9 @@ async def download_doc_attachment(
 
 # ==================== PIPELINE RUNNER ====================
 
-import re
-import json as json_module
-
-def _topo_sort(nodes, edges):
-    """Topological sort of pipeline nodes using flow edges."""
-    node_ids = {n["node_id"] for n in nodes}
-    in_deg = {n["node_id"]: 0 for n in nodes}
-    adj = {n["node_id"]: [] for n in nodes}
-    for e in edges:
-        if e["source"] in node_ids and e["target"] in node_ids:
-            adj[e["source"]].append(e["target"])
-            in_deg[e["target"]] = in_deg.get(e["target"], 0) + 1
-    queue = [nid for nid, d in in_deg.items() if d == 0]
-    result = []
-    while queue:
-        cur = queue.pop(0)
-        result.append(cur)
-        for nxt in adj.get(cur, []):
-            in_deg[nxt] -= 1
-            if in_deg[nxt] == 0:
-                queue.append(nxt)
-    return result
-
-
-def _build_data_deps(nodes, edges):
-    """Build data dependency map: node_id -> [source_node_ids]."""
-    from app.utils import build_input_from_map
-    deps = {}
-    for e in edges:
-        sh = e.get("source_handle", "") or ""
-        th = e.get("target_handle", "") or ""
-        is_data = "data" in sh or "data" in th
-        if is_data:
-            deps.setdefault(e["target"], []).append(e["source"])
-    # Merge input_from from nodes using shared utility for non-handle edges
-    edge_map = build_input_from_map(edges)
-    for n in nodes:
-        node_id = n.get("node_id")
-        input_from = n.get("input_from") or []
-        # Use edge-derived input_from as fallback if node has none
-        if not input_from and node_id in edge_map:
-            input_from = edge_map[node_id]
-        if input_from:
-            deps.setdefault(node_id, []).extend(
-                s for s in input_from if s not in deps.get(node_id, [])
-            )
-    return deps
-
-
-def _get_node_input(node_id, deps, outputs):
-    """Get input for a node from its data dependencies."""
-    sources = deps.get(node_id, [])
-    if not sources:
-        return None
-    if len(sources) == 1:
-        return outputs.get(sources[0])
-    return {sid: outputs.get(sid) for sid in sources}
-
-
-def _substitute_vars(text, outputs):
-    """Replace {{var}} placeholders with values from outputs."""
-    if not text:
-        return text
-    for match in re.findall(r'\{\{(\w+)\}\}', text):
-        val = outputs.get(match, "")
-        text = text.replace(f"{{{{{match}}}}}", str(val) if val else "")
-    return text
-
-
-def _execute_script(script_text, context):
-    """Execute a node script (parse_list, aggregate, template)."""
-    if not script_text:
-        return {"output": context.get("input")}
-    # We run simple Python-like JS scripts by extracting the function body
-    # For server-side, we use a safe subset
-    try:
-        # Try to find function run(context) { ... }
-        fn_match = re.search(r'function\s+run\s*\(\w*\)\s*\{([\s\S]*)\}\s*$', script_text)
-        if fn_match:
-            body = fn_match.group(1)
-        else:
-            body = script_text
-
-        # Simple JS->Python transpilation for common patterns
-        py_body = body
-        py_body = py_body.replace('const ', '')
-        py_body = py_body.replace('let ', '')
-        py_body = py_body.replace('var ', '')
-        py_body = py_body.replace('.join(', '.join(')
-        py_body = py_body.replace('===', '==')
-        py_body = py_body.replace('!==', '!=')
-        py_body = py_body.replace('||', ' or ')
-        py_body = py_body.replace('&&', ' and ')
-        py_body = py_body.replace('null', 'None')
-        py_body = py_body.replace('true', 'True')
-        py_body = py_body.replace('false', 'False')
-
-        local_vars = {"context": context, "result": {"output": context.get("input")}}
-        exec(py_body, {"__builtins__": {"len": len, "str": str, "int": int, "float": float, "list": list, "dict": dict, "range": range, "enumerate": enumerate, "isinstance": isinstance, "print": lambda *a: None, "json": json_module, "re": re}}, local_vars)
-
-        if "result" in local_vars and isinstance(local_vars["result"], dict):
-            return local_vars["result"]
-        return {"output": context.get("input")}
-    except Exception as e:
-        logger.warning(f"Script execution error: {e}")
-        return {"output": context.get("input"), "error": str(e)}
-
-
 @router.post("/doc/projects/{project_id}/run-pipeline")
 async def run_pipeline(project_id: str, data: RunPipelineRequest, user=Depends(get_current_user)):
-    """Run a pipeline on document project materials. Fully server-side execution."""
+    """Start a pipeline run on document project materials as a background job."""
     project = await db.doc_projects.find_one({"id": project_id, "deleted_at": None})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -767,280 +678,8 @@ async def run_pipeline(project_id: str, data: RunPipelineRequest, user=Depends(g
     if not pipeline:
         raise HTTPException(status_code=404, detail="Pipeline not found")
 
-    nodes = pipeline.get("nodes", [])
-    edges = pipeline.get("edges", [])
-    node_map = {n["node_id"]: n for n in nodes}
-
-    # Load source materials as context
-    attachments = await db.doc_attachments.find(
-        {"project_id": project_id}, {"_id": 0}
-    ).to_list(100)
-
-    source_texts = []
-    for att in attachments:
-        ext = os.path.splitext(att.get("name", ""))[1].lower()
-        raw_bytes = None
-
-        # Get file bytes
-        if att.get("s3_key"):
-            try:
-                raw_bytes = download_bytes(att["s3_key"])
-            except Exception as e:
-                logger.warning(f"Failed to download S3 attachment {att['name']}: {e}")
-        elif att.get("file_path") and os.path.exists(att["file_path"]):
-            try:
-                with open(att["file_path"], "rb") as f:
-                    raw_bytes = f.read()
-            except Exception as e:
-                logger.warning(f"Failed to read attachment {att['name']}: {e}")
-
-        if raw_bytes:
-            if ext == ".pdf":
-                text = extract_text_from_pdf(raw_bytes, max_chars=50000)
-                if text:
-                    source_texts.append(f"--- Документ: {att['name']} ---\n{text}")
-            elif ext in {".txt", ".md", ".csv"}:
-                text = raw_bytes.decode("utf-8", errors="replace")[:50000]
-                source_texts.append(f"--- Документ: {att['name']} ---\n{text}")
-        elif att.get("source_url"):
-            source_texts.append(f"--- Ссылка: {att['name']} ({att['source_url']}) ---")
-
-    source_context = "\n\n".join(source_texts) if source_texts else ""
-
-    # Topological sort
-    sorted_ids = _topo_sort(nodes, edges)
-    data_deps = _build_data_deps(nodes, edges)
-
-    # Execute nodes in order
-    outputs = {}
-    node_results = []  # ordered list of {node_id, label, type, output}
-    consumed_by_loop = set()
-
-    for node_id in sorted_ids:
-        node = node_map.get(node_id)
-        if not node or node_id in consumed_by_loop:
-            continue
-
-        node_type = node.get("node_type", "")
-        label = node.get("label", node_id)
-
-        # Skip interactive nodes (user_edit_list, user_review, template with vars)
-        if node_type in ("user_edit_list", "user_review"):
-            # Pass through input
-            inp = _get_node_input(node_id, data_deps, outputs)
-            outputs[node_id] = inp
-            if label:
-                outputs[label] = inp
-            continue
-
-        if node_type == "template":
-            # Template node: substitute variables from outputs
-            tmpl = node.get("template_text", "") or ""
-            result = _substitute_vars(tmpl, outputs)
-            # Also substitute {{input}}
-            inp = _get_node_input(node_id, data_deps, outputs)
-            if inp and isinstance(inp, str):
-                result = result.replace("{{input}}", inp)
-            outputs[node_id] = result
-            if label:
-                outputs[label] = result
-            node_results.append({"node_id": node_id, "label": label, "type": node_type, "output": result})
-            continue
-
-        if node_type == "ai_prompt":
-            inp = _get_node_input(node_id, data_deps, outputs)
-            prompt = node.get("inline_prompt", "") or ""
-            system_msg = node.get("system_message", "") or "Ты — AI-ассистент для анализа документов. Отвечай на русском языке."
-
-            # Run prep script if exists
-            if node.get("script"):
-                script_result = _execute_script(node["script"], {
-                    "input": inp, "prompt": prompt, "vars": outputs
-                })
-                if isinstance(script_result, dict) and script_result.get("promptVars"):
-                    for key, value in script_result["promptVars"].items():
-                        prompt = prompt.replace(f"{{{{{key}}}}}", str(value))
-
-            # Substitute variables
-            prompt = _substitute_vars(prompt, outputs)
-            if isinstance(inp, str):
-                prompt = prompt.replace("{{input}}", inp)
-
-            # Add source materials to system message
-            if source_context:
-                system_msg += f"\n\nИсходные материалы проекта:\n{source_context}"
-
-            try:
-                effort = node.get("reasoning_effort", "high")
-                gpt_result = await call_gpt52_metered(
-                    system_message=system_msg,
-                    user_message=prompt,
-                    reasoning_effort=effort
-                )
-                ai_result = gpt_result.content
-                # Meter the call
-                org_id = user.get("org_id")
-                if org_id:
-                    try:
-                        await deduct_credits_and_record(
-                            org_id=org_id, user_id=user["id"],
-                            model=gpt_result.model,
-                            prompt_tokens=gpt_result.prompt_tokens,
-                            completion_tokens=gpt_result.completion_tokens,
-                            source="pipeline_node",
-                        )
-                    except Exception as me:
-                        logger.error(f"Metering error: {me}")
-            except Exception as e:
-                ai_result = f"[Ошибка AI: {str(e)}]"
-
-            outputs[node_id] = ai_result
-            if label:
-                outputs[label] = ai_result
-            node_results.append({"node_id": node_id, "label": label, "type": node_type, "output": ai_result})
-            continue
-
-        if node_type == "parse_list":
-            inp = _get_node_input(node_id, data_deps, outputs)
-            if node.get("script"):
-                result = _execute_script(node["script"], {"input": inp, "vars": outputs})
-                out = result.get("output", inp)
-            else:
-                # Default: split by newlines
-                out = [line.strip() for line in str(inp or "").split("\n") if line.strip()] if inp else []
-            outputs[node_id] = out
-            if label:
-                outputs[label] = out
-            node_results.append({"node_id": node_id, "label": label, "type": node_type, "output": out})
-            continue
-
-        if node_type == "aggregate":
-            inp = _get_node_input(node_id, data_deps, outputs)
-            if node.get("script"):
-                result = _execute_script(node["script"], {"input": inp, "vars": outputs})
-                out = result.get("output", inp)
-            else:
-                # Default: join all inputs
-                if isinstance(inp, dict):
-                    parts = []
-                    for k, v in inp.items():
-                        node_label = node_map.get(k, {}).get("label", k)
-                        parts.append(f"## {node_label}\n\n{v}")
-                    out = "\n\n---\n\n".join(parts)
-                elif isinstance(inp, list):
-                    out = "\n\n".join(str(item) for item in inp)
-                else:
-                    out = str(inp) if inp else ""
-            outputs[node_id] = out
-            if label:
-                outputs[label] = out
-            node_results.append({"node_id": node_id, "label": label, "type": node_type, "output": out})
-            continue
-
-        if node_type == "batch_loop":
-            inp = _get_node_input(node_id, data_deps, outputs)
-            items = inp if isinstance(inp, list) else []
-            batch_size = node.get("batch_size", 3) or len(items) or 1
-
-            # Find AI node that follows this loop
-            loop_idx = sorted_ids.index(node_id)
-            ai_node = None
-            for next_id in sorted_ids[loop_idx + 1:]:
-                next_node = node_map.get(next_id)
-                if next_node and next_node.get("node_type") == "ai_prompt":
-                    ai_node = next_node
-                    consumed_by_loop.add(next_id)
-                    break
-
-            results = []
-            total_batches = max(1, (len(items) + batch_size - 1) // batch_size) if items else 0
-
-            for iteration in range(total_batches):
-                context = {
-                    "input": items,
-                    "iteration": iteration,
-                    "batchSize": batch_size,
-                    "results": results,
-                    "vars": outputs,
-                }
-                if node.get("script"):
-                    script_result = _execute_script(node["script"], context)
-                    if isinstance(script_result, dict) and script_result.get("done"):
-                        out = script_result.get("output", results)
-                        outputs[node_id] = out
-                        if label:
-                            outputs[label] = out
-                        break
-
-                    if ai_node and isinstance(script_result, dict) and script_result.get("promptVars"):
-                        prompt = ai_node.get("inline_prompt", "") or ""
-                        system_msg = ai_node.get("system_message", "") or "Ты — AI-ассистент для анализа."
-                        for key, val in script_result["promptVars"].items():
-                            prompt = prompt.replace(f"{{{{{key}}}}}", str(val))
-                        prompt = _substitute_vars(prompt, outputs)
-                        if source_context:
-                            system_msg += f"\n\nИсходные материалы проекта:\n{source_context}"
-                        try:
-                            gpt_result = await call_gpt52_metered(
-                                system_message=system_msg,
-                                user_message=prompt,
-                                reasoning_effort=ai_node.get("reasoning_effort", "high")
-                            )
-                            ai_result = gpt_result.content
-                            results.append(ai_result)
-                            org_id = user.get("org_id")
-                            if org_id:
-                                try:
-                                    await deduct_credits_and_record(
-                                        org_id=org_id, user_id=user["id"],
-                                        model=gpt_result.model,
-                                        prompt_tokens=gpt_result.prompt_tokens,
-                                        completion_tokens=gpt_result.completion_tokens,
-                                        source="pipeline_batch",
-                                    )
-                                except Exception as me:
-                                    logger.error(f"Metering error: {me}")
-                        except Exception as e:
-                            results.append(f"[Ошибка AI: {str(e)}]")
-                else:
-                    # No script — just pass items through
-                    outputs[node_id] = items
-                    if label:
-                        outputs[label] = items
-                    break
-            else:
-                outputs[node_id] = results
-                if label:
-                    outputs[label] = results
-
-            if ai_node:
-                ai_label = ai_node.get("label", ai_node["node_id"])
-                outputs[ai_node["node_id"]] = results
-                outputs[ai_label] = results
-
-            node_results.append({"node_id": node_id, "label": label, "type": "batch_loop", "output": outputs.get(node_id)})
-            continue
-
-    # Save run result
-    now = datetime.now(timezone.utc).isoformat()
-    run_record = {
-        "id": str(uuid.uuid4()),
-        "project_id": project_id,
-        "pipeline_id": data.pipeline_id,
-        "pipeline_name": pipeline.get("name", ""),
-        "node_results": node_results,
-        "status": "completed",
-        "created_at": now,
-    }
-    await db.doc_runs.insert_one(run_record)
-
-    # Update project status
-    await db.doc_projects.update_one(
-        {"id": project_id},
-        {"$set": {"status": "completed", "updated_at": now}}
-    )
-
-    return {k: v for k, v in run_record.items() if k != "_id"}
+    # Executed by the worker pool; progress via GET .../runs/{run_id} or .../events
+    return await start_pipeline_run(project_id, pipeline, user)
 
 
 @router.get("/doc/projects/{project_id}/runs")
@@ -1050,17 +689,86 @@ async def list_runs(project_id: str, user=Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="Project not found")
 
     runs = await db.doc_runs.find(
-        {"project_id": project_id}, {"_id": 0}
+        {"project_id": project_id}, RUN_PROJECTION
     ).sort("created_at", -1).to_list(50)
     return runs
 
 
+@router.get("/doc/projects/{project_id}/runs/{run_id}")
+async def get_run(project_id: str, run_id: str, user=Depends(get_current_user)):
+    """Run with per-node progress (status, output, tokens, duration)."""
+    project = await _get_doc_project_read(project_id, user)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    run = await get_run_progress(run_id)
+    if not run or run["project_id"] != project_id:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run
+
+
+@router.get("/doc/projects/{project_id}/runs/{run_id}/events")
+async def stream_run_events(project_id: str, run_id: str, user=Depends(get_current_user)):
+    """SSE progress of a run: `progress` on every node status change, then `done`."""
+    project = await _get_doc_project_read(project_id, user)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    run = await db.doc_runs.find_one({"id": run_id, "project_id": project_id}, {"_id": 0, "id": 1})
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+
+    async def events():
+        yield sse_comment("run")
+        last_state = None
+        while True:
+            progress = await get_run_progress(run_id, include_output=False)
+            if not progress:
+                yield sse_event("error", {"detail": "Run not found"})
+                return
+            if progress["status"] in TERMINAL_RUN_STATUSES:
+                yield sse_event("done", await get_run_progress(run_id))
+                return
+            state = (progress["status"], tuple((n["node_id"], n["status"]) for n in progress["nodes"]))
+            if state != last_state:
+                last_state = state
+                yield sse_event("progress", progress)
+            else:
+                yield sse_comment()
+            await asyncio.sleep(RUN_EVENTS_POLL_SECONDS)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/doc/projects/{project_id}/runs/{run_id}/resume")
+async def resume_run(project_id: str, run_id: str, user=Depends(get_current_user)):
+    """Re-run failed and unfinished nodes of a run, reusing completed node outputs."""
+    project = await db.doc_projects.find_one({"id": project_id, "deleted_at": None})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not await can_user_write_project(project, user, "doc_folders"):
+        raise HTTPException(403, "Нет прав на запуск пайплайна в этом проекте")
+    run = await db.doc_runs.find_one({"id": run_id, "project_id": project_id}, {"_id": 0})
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if run["status"] not in TERMINAL_RUN_STATUSES:
+        raise HTTPException(409, "Запуск ещё выполняется")
+    if "graph" not in run:
+        raise HTTPException(400, "Этот запуск нельзя продолжить")
+    if run["status"] == "completed" and not run.get("failed_nodes"):
+        raise HTTPException(400, "Все шаги запуска уже выполнены")
+    return await resume_pipeline_run(run)
+
+
 @router.delete("/doc/projects/{project_id}/runs/{run_id}")
 async def delete_run(project_id: str, run_id: str, user=Depends(get_current_user)):
     project = await _get_doc_project_read(project_id, user)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     await db.doc_runs.delete_one({"id": run_id, "project_id": project_id})
+    await db.doc_run_nodes.delete_many({"run_id": run_id})
     return {"message": "Deleted"}
 
 
@@ -1124,69 +832,90 @@ async def delete_stream(project_id: str, stream_id: str, user=Depends(get_curren
         raise HTTPException(status_code=404, detail="Stream not found")
 
     await db.doc_streams.delete_one({"id": stream_id})
+    await invalidate_summary("doc_stream", stream_id)
     return {"message": "Deleted"}
 
-@router.post("/doc/projects/{project_id}/streams/{stream_id}/messages")
-async def send_stream_message(
-    project_id: str, stream_id: str, data: StreamMessage, user=Depends(get_current_user)
-):
+async def _prepare_stream_message(project_id: str, stream_id: str, data: StreamMessage, user) -> tuple:
+    """Build the GPT request for a stream message.
+
+    Returns (system_message, openai_messages, context); context is
+    (summary, turns) of the history, for updating the summary afterwards.
+    """
     project = await _get_doc_project_read(project_id, user)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    stream = await db.doc_streams.find_one({"id": stream_id, "project_id": project_id})
+    stream = await db.doc_streams.find_one(
+        {"id": stream_id, "project_id": project_id},
+        {"messages": {"$slice": -STREAM_HISTORY_MESSAGES}},
+    )
     if not stream:
         raise HTTPException(status_code=404, detail="Stream not found")
 
-    # Build context from source materials
-    attachments = await db.doc_attachments.find(
-        {"project_id": project_id}, {"_id": 0}
-    ).to_list(100)
-
-    context_parts = []
-    for att in attachments:
-        ext = os.path.splitext(att.get("name", ""))[1].lower()
-        raw_bytes = None
-
-        if att.get("s3_key"):
-            try:
-                raw_bytes = download_bytes(att["s3_key"])
-            except Exception as e:
-                logger.warning(f"Failed to download S3 attachment {att['name']}: {e}")
-        elif att.get("file_path") and os.path.exists(att["file_path"]):
-            try:
-                with open(att["file_path"], "rb") as f:
-                    raw_bytes = f.read()
-            except Exception as e:
-                logger.warning(f"Failed to read attachment {att['name']}: {e}")
-
-        if raw_bytes:
-            if ext == ".pdf":
-                text = extract_text_from_pdf(raw_bytes, max_chars=50000)
-                if text:
-                    context_parts.append(f"--- Документ: {att['name']} ---\n{text}")
-            elif ext in {".txt", ".md", ".csv"}:
-                text = raw_bytes.decode("utf-8", errors="replace")[:50000]
-                context_parts.append(f"--- Документ: {att['name']} ---\n{text}")
-        elif att.get("source_url"):
-            context_parts.append(f"--- Ссылка: {att['name']} ({att['source_url']}) ---")
-
-    source_context = "\n\n".join(context_parts) if context_parts else ""
-
-    # Build system prompt
+    source_context = await build_source_context(project_id)
+
+    # Source materials first (shared by all streams of the project, cacheable),
+    # then the stream's instruction, the history and the new message
+    system_message = sources_system_message(
+        source_context, f"{SOURCES_SYSTEM_MESSAGE} Будь точен и структурирован."
+    )
     base_system = stream.get("system_prompt") or project.get("system_instruction") or ""
-    system_message = "Ты — AI-ассистент для анализа документов. Отвечай на русском языке. Будь точен и структурирован."
+    prefix = []
     if base_system:
-        system_message += f"\n\nИнструкция пользователя:\n{base_system}"
-    if source_context:
-        system_message += f"\n\nИсходные материалы проекта:\n{source_context}"
+        prefix.append({"role": "system", "content": f"Инструкция пользователя:\n{base_system}"})
+
+    # Multi-turn history: turns after the summary, newest within the token budget
+    summary = await get_summary("doc_stream", stream_id)
+    turns = [
+        (turn[0].get("timestamp", ""), [{"role": msg["role"], "content": msg["content"]} for msg in turn])
+        for turn in group_turns(stream.get("messages", []))
+    ]
+    history = bounded_history(summary, turns)
+    openai_messages = layout_messages(prefix, data.content, history=history)
+
+    return system_message, openai_messages, (summary, turns)
+
+
+async def _meter_stream_message(gpt_result: GptResult, user):
+    org_id = user.get("org_id")
+    if org_id:
+        try:
+            await deduct_credits_and_record(
+                org_id=org_id, user_id=user["id"],
+                model=gpt_result.model,
+                prompt_tokens=gpt_result.prompt_tokens,
+                completion_tokens=gpt_result.completion_tokens,
+                cached_tokens=gpt_result.cached_tokens,
+                cache_hit=gpt_result.cache_hit,
+                source="doc_stream",
+            )
+        except Exception as me:
+            logger.error(f"Metering error: {me}")
+
+
+async def _save_stream_exchange(project_id: str, stream_id: str, user_msg: dict, ai_response: str, context: tuple, user) -> dict:
+    assistant_msg = {"role": "assistant", "content": ai_response, "timestamp": datetime.now(timezone.utc).isoformat()}
+
+    # Save both messages
+    await db.doc_streams.update_one(
+        {"id": stream_id},
+        {
+            "$push": {"messages": {"$each": [user_msg, assistant_msg]}},
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+        }
+    )
 
-    # Build messages history for multi-turn
-    history = stream.get("messages", [])
-    openai_messages = []
-    for msg in history:
-        openai_messages.append({"role": msg["role"], "content": msg["content"]})
-    openai_messages.append({"role": "user", "content": data.content})
+    summary, turns = context
+    new_turn = [{"role": m["role"], "content": m["content"]} for m in (user_msg, assistant_msg)]
+    refresh_summary_later("doc_stream", stream_id, project_id, turns + [(user_msg["timestamp"], new_turn)], summary, user)
+    return {"user_message": user_msg, "assistant_message": assistant_msg}
+
+
+@router.post("/doc/projects/{project_id}/streams/{stream_id}/messages")
+async def send_stream_message(
+    project_id: str, stream_id: str, data: StreamMessage, user=Depends(get_current_user)
+):
+    system_message, openai_messages, context = await _prepare_stream_message(project_id, stream_id, data, user)
 
     # Add user message to DB first
     now = datetime.now(timezone.utc).isoformat()
@@ -1196,38 +925,46 @@ async def send_stream_message(
         gpt_result = await call_gpt52_metered(
             system_message=system_message,
             messages=openai_messages,
-            reasoning_effort="high"
+            reasoning_effort="high",
+            cache_key=f"doc:{project_id}",
+            source="doc_stream",
         )
         ai_response = gpt_result.content
         # Meter the call
-        org_id = user.get("org_id")
-        if org_id:
-            try:
-                await deduct_credits_and_record(
-                    org_id=org_id, user_id=user["id"],
-                    model=gpt_result.model,
-                    prompt_tokens=gpt_result.prompt_tokens,
-                    completion_tokens=gpt_result.completion_tokens,
-                    source="doc_stream",
-                )
-            except Exception as me:
-                logger.error(f"Metering error: {me}")
+        await _meter_stream_message(gpt_result, user)
     except Exception as e:
         logger.error(f"AI stream error: {e}")
         ai_response = f"Ошибка AI: {str(e)}"
 
-    assistant_msg = {"role": "assistant", "content": ai_response, "timestamp": datetime.now(timezone.utc).isoformat()}
+    return await _save_stream_exchange(project_id, stream_id, user_msg, ai_response, context, user)
 
-    # Save both messages
-    await db.doc_streams.update_one(
-        {"id": stream_id},
-        {
-            "$push": {"messages": {"$each": [user_msg, assistant_msg]}},
-            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
-        }
-    )
 
-    return {"user_message": user_msg, "assistant_message": assistant_msg}
+@router.post("/doc/projects/{project_id}/streams/{stream_id}/messages/stream")
+async def send_stream_message_sse(
+    project_id: str, stream_id: str, data: StreamMessage, user=Depends(get_current_user)
+):
+    """SSE variant of send_stream_message: `token` events, then `done` with both saved messages."""
+    system_message, openai_messages, context = await _prepare_stream_message(project_id, stream_id, data, user)
+    user_msg = {"role": "user", "content": data.content, "timestamp": datetime.now(timezone.utc).isoformat()}
+
+    async def on_complete(gpt_result: GptResult) -> dict:
+        await _meter_stream_message(gpt_result, user)
+        return await _save_stream_exchange(project_id, stream_id, user_msg, gpt_result.content, context, user)
+
+    async def on_error(e: Exception) -> dict:
+        return await _save_stream_exchange(project_id, stream_id, user_msg, f"Ошибка AI: {str(e)}", context, user)
+
+    return gpt_sse_response(
+        stream_gpt52_metered(
+            system_message=system_message,
+            messages=openai_messages,
+            reasoning_effort="high",
+            cache_key=f"doc:{project_id}",
+            source="doc_stream",
+        ),
+        on_complete,
+        on_error,
+    )
 
 
 # ==================== TEMPLATES ====================
@@ -239,23 +239,17 @@ async def permanent_delete_folder(folder_id: str, user=Depends(get_current_user)
     projects = await db.projects.find(
         {"folder_id": folder_id, "owner_id": user["id"]}, {"_id": 0, "id": 1}
     ).to_list(10000)
-    from app.services.s3 import s3_enabled, delete_object
-    for proj in projects:
-        atts = await db.attachments.find(
-            {"project_id": proj["id"], "s3_key": {"$exists": True, "$ne": None}},
-            {"_id": 0, "s3_key": 1},
-        ).to_list(500)
-        if s3_enabled():
-            for att in atts:
-                try:
-                    delete_object(att["s3_key"])
-                except Exception:
-                    pass
-        await db.attachments.delete_many({"project_id": proj["id"]})
-        await db.transcripts.delete_many({"project_id": proj["id"]})
-        await db.uncertain_fragments.delete_many({"project_id": proj["id"]})
-        await db.speaker_maps.delete_many({"project_id": proj["id"]})
-        await db.chat_requests.delete_many({"project_id": proj["id"]})
-        await db.projects.delete_one({"id": proj["id"]})
+    project_ids = [p["id"] for p in projects]
+    from app.services.storage_cleanup import delete_attachment_files
+    await delete_attachment_files("attachments", project_ids, "permanent_delete_folder")
+    if project_ids:
+        scope = {"project_id": {"$in": project_ids}}
+        await db.attachments.delete_many(scope)
+        await db.transcripts.delete_many(scope)
+        await db.uncertain_fragments.delete_many(scope)
+        await db.speaker_maps.delete_many(scope)
+        await db.chat_requests.delete_many(scope)
+        await db.conversation_summaries.delete_many(scope)
+        await db.projects.delete_many({"id": {"$in": project_ids}})
     await db.meeting_folders.delete_one({"id": folder_id})
     return {"message": "Папка удалена навсегда"}
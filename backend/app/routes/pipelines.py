@@ -11,6 +11,7 @@ from app.models.pipeline import (
     PipelineCreate, PipelineUpdate, PipelineResponse
 )
 from app.services.gpt import call_gpt52, call_gpt52_metered
+from app.services.token_budget import PromptTooLarge
 from app.services.metering import check_user_monthly_limit, check_org_balance, deduct_credits_and_record
 
 router = APIRouter(prefix="/pipelines", tags=["pipelines"])
@@ -196,7 +197,8 @@ async def generate_pipeline(data: GenerateRequest, user=Depends(get_current_user
         gpt_result = await call_gpt52_metered(
             system_message=system_prompt,
             user_message=data.prompt,
-            reasoning_effort="high"
+            reasoning_effort="high",
+            source="pipeline_generate",
         )
         result = gpt_result.content
 
@@ -209,6 +211,8 @@ async def generate_pipeline(data: GenerateRequest, user=Depends(get_current_user
                     model=gpt_result.model,
                     prompt_tokens=gpt_result.prompt_tokens,
                     completion_tokens=gpt_result.completion_tokens,
+                    cached_tokens=gpt_result.cached_tokens,
+                    cache_hit=gpt_result.cache_hit,
                     source="pipeline_generate",
                 )
             except Exception as e:
@@ -267,7 +271,7 @@ async def generate_pipeline(data: GenerateRequest, user=Depends(get_current_user
     except json.JSONDecodeError as e:
         logger.error(f"AI response parse error: {e}\nResponse: {result[:500]}")
         raise HTTPException(status_code=500, detail="AI вернул некорректный формат. Попробуйте переформулировать запрос.")
-    except HTTPException:
+    except (HTTPException, PromptTooLarge):
         raise
     except Exception as e:
         logger.error(f"Pipeline generation error: {e}")
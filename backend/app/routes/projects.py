@@ -1,6 +1,5 @@
 import uuid
 import shutil
-import asyncio
 import logging
 from pathlib import Path
 from datetime import datetime, timezone
@@ -9,11 +8,22 @@ from pydantic import BaseModel
 from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, BackgroundTasks, Query
 from app.core.database import db
 from app.core.security import get_current_user
-from app.core.config import UPLOAD_DIR, DEEPGRAM_API_KEY
+from app.core.config import UPLOAD_DIR, MAX_RECORDING_SIZE
 from app.models.project import ProjectCreate, ProjectUpdate, ProjectResponse
-from app.services.gpt import call_gpt52, call_gpt52_metered
+from app.services.gpt import call_gpt52
 from app.services.metering import check_user_monthly_limit, check_org_balance, deduct_credits_and_record
 from app.services.text_parser import parse_uncertain_fragments
+from app.services.transcript_processing import process_transcript
+from app.services.uploads import save_upload_to_disk
+from app.services.transcription import get_transcription_service
+from app.services.chunked_transcription import (
+    TRANSCRIPTION_CHUNKED_MIN_SECONDS,
+    probe_duration,
+    should_use_chunked,
+    transcribe_chunked,
+    clear_checkpoints,
+)
+from app.services.job_queue import enqueue_job
 from app.services.access_control import (
     can_user_access_project,
     can_user_write_project,
@@ -190,22 +200,14 @@ async def permanent_delete_project(project_id: str, user=Depends(get_current_use
     if not project:
         raise HTTPException(status_code=404, detail="Проект не найден в корзине")
 
-    from app.services.s3 import s3_enabled, delete_object
-    attachments = await db.attachments.find(
-        {"project_id": project_id, "s3_key": {"$exists": True, "$ne": None}},
-        {"_id": 0, "s3_key": 1},
-    ).to_list(500)
-    if s3_enabled():
-        for att in attachments:
-            try:
-                delete_object(att["s3_key"])
-            except Exception:
-                pass
+    from app.services.storage_cleanup import delete_attachment_files
+    await delete_attachment_files("attachments", [project_id], "permanent_delete_project")
     await db.projects.delete_one({"id": project_id})
     await db.transcripts.delete_many({"project_id": project_id})
     await db.uncertain_fragments.delete_many({"project_id": project_id})
     await db.speaker_maps.delete_many({"project_id": project_id})
     await db.chat_requests.delete_many({"project_id": project_id})
+    await db.conversation_summaries.delete_many({"project_id": project_id})
     await db.attachments.delete_many({"project_id": project_id})
     return {"message": "Проект удалён навсегда"}
 
@@ -264,14 +266,14 @@ async def upload_file(
     file_ext = Path(file.filename).suffix
     filename = f"{file_id}{file_ext}"
 
-    content = await file.read()
-    # Audio files: store locally only (no S3), will be deleted after transcription
-    file_path = Path(UPLOAD_DIR) / filename
-    with open(file_path, "wb") as f:
-        f.write(content)
+    # Audio files: store locally only (no S3), will be deleted after transcription.
+    # Streamed to disk chunk by chunk so long recordings never sit in memory.
+    stored = await save_upload_to_disk(file, Path(UPLOAD_DIR) / filename, MAX_RECORDING_SIZE)
     
     update_fields = {
             "recording_filename": filename,
+            "recording_size": stored.size,
+            "recording_sha256": stored.sha256,
             "language": language,
             "reasoning_effort": reasoning_effort,
             "status": "transcribing",
@@ -290,7 +292,19 @@ async def upload_file(
         {"$set": update_fields}
     )
     
-    asyncio.create_task(process_transcription(project_id, filename, language, reasoning_effort, user["id"], user.get("org_id")))
+    # Durable job: picked up by the worker pool (app/worker.py), survives restarts
+    await enqueue_job(
+        "transcription",
+        {
+            "project_id": project_id,
+            "filename": filename,
+            "language": language,
+            "reasoning_effort": reasoning_effort,
+            "user_id": user["id"],
+            "org_id": user.get("org_id"),
+        },
+        org_id=user.get("org_id"),
+    )
     
     return {"message": "File uploaded, transcription started", "filename": filename}
 
@@ -353,27 +367,33 @@ async def process_transcript_with_gpt(
 async def _run_gpt_processing(project_id: str, raw_content: str, master_prompt: dict, reasoning_effort: str, org_id: str = None, user_id: str = None):
     """Background task for GPT processing"""
     logger.info(f"[{project_id}] Starting manual GPT processing with master prompt: '{master_prompt.get('name')}'")
+
+    async def meter(chunk_result):
+        # Each chunk is charged as it completes, even if another chunk fails
+        if not (org_id and user_id):
+            return
+        try:
+            await deduct_credits_and_record(
+                org_id=org_id,
+                user_id=user_id,
+                model=chunk_result.model,
+                prompt_tokens=chunk_result.prompt_tokens,
+                completion_tokens=chunk_result.completion_tokens,
+                cached_tokens=chunk_result.cached_tokens,
+                cache_hit=chunk_result.cache_hit,
+                source="transcript_processing",
+            )
+        except Exception as e:
+            logger.error(f"Metering error: {e}")
+
     try:
-        gpt_result = await call_gpt52_metered(
+        gpt_result = await process_transcript(
             system_message=master_prompt["content"],
-            user_message=raw_content,
-            reasoning_effort=reasoning_effort
+            raw_content=raw_content,
+            reasoning_effort=reasoning_effort,
+            meter=meter,
         )
         processed_text = gpt_result.content
-
-        # Deduct credits
-        if org_id and user_id:
-            try:
-                await deduct_credits_and_record(
-                    org_id=org_id,
-                    user_id=user_id,
-                    model=gpt_result.model,
-                    prompt_tokens=gpt_result.prompt_tokens,
-                    completion_tokens=gpt_result.completion_tokens,
-                    source="transcript_processing",
-                )
-            except Exception as e:
-                logger.error(f"Metering error: {e}")
         
         logger.info(f"[{project_id}] GPT processing complete, result: {len(processed_text)} chars")
         
@@ -412,8 +432,42 @@ async def _run_gpt_processing(project_id: str, raw_content: str, master_prompt:
         )
 
 
-async def process_transcription(project_id: str, filename: str, language: str = "ru", reasoning_effort: str = "high", user_id: str = None, org_id: str = None):
-    """Transcription pipeline"""
+def _extract_transcript_lines(response) -> tuple:
+    """Extract "Speaker N: text" lines and the set of speakers from a Deepgram response."""
+    transcript_lines = []
+    unique_speakers = set()
+    
+    # Navigate new SDK response structure
+    if response.results and response.results.channels:
+        for channel in response.results.channels:
+            if channel.alternatives:
+                for alt in channel.alternatives:
+                    if alt.paragraphs and alt.paragraphs.paragraphs:
+                        for para in alt.paragraphs.paragraphs:
+                            speaker = para.speaker if para.speaker is not None else 0
+                            unique_speakers.add(speaker)
+                            if para.sentences:
+                                for sentence in para.sentences:
+                                    text = sentence.text if sentence.text else ""
+                                    if text:
+                                        transcript_lines.append(f"Speaker {speaker + 1}: {text}")
+                    # Fallback: use paragraphs.transcript if available
+                    elif alt.paragraphs and alt.paragraphs.transcript:
+                        transcript_lines.append(alt.paragraphs.transcript)
+                        unique_speakers.add(0)
+                    # Fallback: use alternative transcript directly
+                    elif alt.transcript:
+                        transcript_lines.append(alt.transcript)
+                        unique_speakers.add(0)
+    return transcript_lines, unique_speakers
+
+
+async def process_transcription(project_id: str, filename: str, language: str = "ru", reasoning_effort: str = "high", user_id: str = None, org_id: str = None, reraise: bool = False):
+    """Transcription pipeline.
+
+    With reraise=True (job queue) errors propagate so the job can be retried;
+    the queue marks the project as failed once retries are exhausted.
+    """
     now = datetime.now(timezone.utc).isoformat()
     file_path = Path(UPLOAD_DIR) / filename
     
@@ -425,70 +479,42 @@ async def process_transcription(project_id: str, filename: str, language: str =
         
         logger.info(f"[{project_id}] Starting transcription for {filename}")
         
-        # Read audio from local file
-        with open(file_path, "rb") as audio_file:
-            audio_data = audio_file.read()
+        deepgram_options = dict(
+            model="nova-3",
+            language=language,
+            smart_format=True,
+            diarize=True,
+            paragraphs=True,
+            punctuate=True,
+        )
         
-        # Deepgram transcription - run in executor to not block event loop
-        from deepgram import DeepgramClient
-        import concurrent.futures
+        probed_duration = None
+        if TRANSCRIPTION_CHUNKED_MIN_SECONDS > 0:
+            probed_duration = await probe_duration(file_path)
         
-        def run_deepgram():
-            client = DeepgramClient(api_key=DEEPGRAM_API_KEY)
+        if should_use_chunked(probed_duration):
+            # Long recording: overlapping segments transcribed in parallel, checkpointed per segment
+            stitched = await transcribe_chunked(project_id, file_path, probed_duration, deepgram_options)
+            duration = probed_duration
+            transcript_lines = [f"Speaker {speaker + 1}: {text}" for speaker, text in stitched]
+            unique_speakers = {speaker for speaker, _ in stitched}
+        else:
+            # Deepgram transcription on the shared, bounded executor (audio streamed from disk)
+            response = await get_transcription_service().transcribe_file(file_path, **deepgram_options)
+            logger.info(f"[{project_id}] Deepgram transcription received")
             
-            response = client.listen.v1.media.transcribe_file(
-                request=audio_data,
-                model="nova-3",
-                language=language,
-                smart_format=True,
-                diarize=True,
-                paragraphs=True,
-                punctuate=True,
-            )
-            return response
-        
-        loop = asyncio.get_event_loop()
-        with concurrent.futures.ThreadPoolExecutor() as pool:
-            response = await loop.run_in_executor(pool, run_deepgram)
-        
-        logger.info(f"[{project_id}] Deepgram transcription received")
-        
-        # Extract metadata
-        duration = response.metadata.duration if response.metadata else 0
-        
-        # Extract transcript with speaker labels
-        transcript_lines = []
-        unique_speakers = set()
-        
-        # Navigate new SDK response structure
-        if response.results and response.results.channels:
-            for channel in response.results.channels:
-                if channel.alternatives:
-                    for alt in channel.alternatives:
-                        if alt.paragraphs and alt.paragraphs.paragraphs:
-                            for para in alt.paragraphs.paragraphs:
-                                speaker = para.speaker if para.speaker is not None else 0
-                                unique_speakers.add(speaker)
-                                if para.sentences:
-                                    for sentence in para.sentences:
-                                        text = sentence.text if sentence.text else ""
-                                        if text:
-                                            transcript_lines.append(f"Speaker {speaker + 1}: {text}")
-                        # Fallback: use paragraphs.transcript if available
-                        elif alt.paragraphs and alt.paragraphs.transcript:
-                            transcript_lines.append(alt.paragraphs.transcript)
-                            unique_speakers.add(0)
-                        # Fallback: use alternative transcript directly
-                        elif alt.transcript:
-                            transcript_lines.append(alt.transcript)
-                            unique_speakers.add(0)
+            # Extract metadata
+            duration = response.metadata.duration if response.metadata else 0
+            transcript_lines, unique_speakers = _extract_transcript_lines(response)
         
         raw_transcript = "\n\n".join(transcript_lines)
         
         if not raw_transcript.strip():
             raise Exception("Empty transcript received from Deepgram")
         
-        # Save raw transcript
+        # Save raw transcript (replace any left over from an interrupted attempt)
+        await db.transcripts.delete_many({"project_id": project_id, "version_type": "raw"})
+        await db.speaker_maps.delete_many({"project_id": project_id})
         await db.transcripts.insert_one({
             "id": str(uuid.uuid4()),
             "project_id": project_id,
@@ -527,11 +553,15 @@ async def process_transcription(project_id: str, filename: str, language: str =
         if org_id and user_id and duration > 0:
             try:
                 from app.services.metering import deduct_transcription_cost
-                cost_result = await deduct_transcription_cost(org_id, user_id, duration)
+                cost_result = await deduct_transcription_cost(
+                    org_id, user_id, duration, request_key=f"transcription:{project_id}:{filename}"
+                )
                 logger.info(f"[{project_id}] Transcription cost deducted: {cost_result}")
             except Exception as cost_err:
                 logger.error(f"[{project_id}] Failed to deduct transcription cost: {cost_err}")
         
+        await clear_checkpoints(project_id)
+        
         # Delete local audio file after successful transcription
         try:
             if file_path.exists():
@@ -544,11 +574,17 @@ async def process_transcription(project_id: str, filename: str, language: str =
         import traceback
         logger.error(f"[{project_id}] Transcription error: {e}")
         logger.error(f"[{project_id}] Traceback: {traceback.format_exc()}")
-        await db.projects.update_one(
-            {"id": project_id},
-            {"$set": {
-                "status": "error",
-                "error_message": str(e),
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
+        if reraise:
+            raise
+        await mark_transcription_failed(project_id, str(e))
+
+
+async def mark_transcription_failed(project_id: str, error: str):
+    await db.projects.update_one(
+        {"id": project_id},
+        {"$set": {
+            "status": "error",
+            "error_message": error,
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }}
+    )
@@ -7,6 +7,7 @@ import uuid
 import logging
 from datetime import datetime, timezone
 from app.core.database import db
+from app.services.settings_cache import settings_cache
 
 logger = logging.getLogger(__name__)
 
@@ -65,15 +66,18 @@ def can_user_write_folder(folder: dict, user: dict) -> bool:
     return folder.get("access_type") == "readwrite"
 
 
-async def get_trash_retention_days() -> int:
-    """Get trash retention period from settings."""
-    from app.services.metering import get_cost_settings
+async def _load_trash_retention_days() -> int:
     doc = await db.settings.find_one({"key": "trash_settings"}, {"_id": 0})
     if doc and "value" in doc:
         return doc["value"].get("retention_days", 30)
     return 30
 
 
+async def get_trash_retention_days() -> int:
+    """Get trash retention period from settings (cached)."""
+    return await settings_cache.get("trash_settings", _load_trash_retention_days)
+
+
 async def set_trash_retention_days(days: int):
     now = datetime.now(timezone.utc).isoformat()
     await db.settings.update_one(
@@ -81,6 +85,7 @@ async def set_trash_retention_days(days: int):
         {"$set": {"key": "trash_settings", "value": {"retention_days": days}, "updated_at": now}},
         upsert=True,
     )
+    await settings_cache.invalidate("trash_settings")
 
 
 async def soft_delete_folder(
@@ -245,22 +250,14 @@ async def cleanup_expired_trash(folder_collection: str, project_collection: str)
         {"_id": 0, "id": 1},
     ).to_list(10000)
 
-    for proj in expired_projects:
-        # Clean up S3 attachments if needed
-        att_coll = "attachments" if project_collection == "projects" else "doc_attachments"
-        attachments = await db[att_coll].find(
-            {"project_id": proj["id"], "s3_key": {"$exists": True, "$ne": None}},
-            {"_id": 0, "s3_key": 1},
-        ).to_list(500)
-        from app.services.s3 import s3_enabled, delete_object
-        if s3_enabled():
-            for att in attachments:
-                try:
-                    delete_object(att["s3_key"])
-                except Exception:
-                    pass
-        await db[att_coll].delete_many({"project_id": proj["id"]})
-        await coll_projects.delete_one({"id": proj["id"]})
+    # Stored files of all expired projects go in bulk deletes
+    att_coll = "attachments" if project_collection == "projects" else "doc_attachments"
+    project_ids = [p["id"] for p in expired_projects]
+    from app.services.storage_cleanup import delete_attachment_files
+    await delete_attachment_files(att_coll, project_ids, f"trash_cleanup:{project_collection}")
+    if project_ids:
+        await db[att_coll].delete_many({"project_id": {"$in": project_ids}})
+        await coll_projects.delete_many({"id": {"$in": project_ids}})
 
     # Find expired folders
     expired_folders = await coll_folders.find(
@@ -0,0 +1,153 @@
+"""
+Extracted text of document attachments, cached in `attachment_texts`.
+
+Text is keyed by the SHA-256 of the file content and EXTRACTOR_VERSION, so
+identical files share one entry across projects and changing the extraction
+(parser, OCR settings, limits) only needs a version bump to re-extract.
+Uploads warm the cache in the background; anything missing is extracted on
+first use. Pipeline runs and doc stream messages read the cached text
+instead of downloading and re-parsing (often re-OCRing) every file per call.
+"""
+import os
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+from pymongo.errors import DuplicateKeyError
+from app.core.database import db
+from app.services.s3 import download_bytes
+from app.services.pdf_parser import extract_text_from_pdf
+from app.services.token_budget import CONTEXT_SOURCES_SHARE, fit_texts, section_budget
+
+logger = logging.getLogger(__name__)
+
+# Bump when extraction output changes; old entries are then ignored
+EXTRACTOR_VERSION = 2  # 2: per-page OCR of pages without a usable text layer
+ATTACHMENT_TEXT_MAX_CHARS = 50000
+TEXT_EXTENSIONS = {".txt", ".md", ".csv"}
+
+_extract_locks = {}
+
+
+def content_hash(raw_bytes: bytes) -> str:
+    return hashlib.sha256(raw_bytes).hexdigest()
+
+
+def is_extractable(name: str) -> bool:
+    ext = os.path.splitext(name or "")[1].lower()
+    return ext == ".pdf" or ext in TEXT_EXTENSIONS
+
+
+def _extract(name: str, raw_bytes: bytes) -> str:
+    ext = os.path.splitext(name or "")[1].lower()
+    if ext == ".pdf":
+        return extract_text_from_pdf(raw_bytes, max_chars=ATTACHMENT_TEXT_MAX_CHARS)
+    return raw_bytes.decode("utf-8", errors="replace")[:ATTACHMENT_TEXT_MAX_CHARS]
+
+
+async def ensure_attachment_text_indexes():
+    await db.attachment_texts.create_index([("content_hash", 1), ("extractor_version", 1)], unique=True)
+
+
+async def _cached_text(sha256: str) -> Optional[str]:
+    doc = await db.attachment_texts.find_one(
+        {"content_hash": sha256, "extractor_version": EXTRACTOR_VERSION},
+        {"_id": 0, "text": 1},
+    )
+    return doc["text"] if doc else None
+
+
+async def extract_and_cache(name: str, raw_bytes: bytes, sha256: Optional[str] = None) -> str:
+    """Text of a file, extracted at most once per content hash (per process, concurrently).
+
+    Empty results (e.g. OCR found nothing) are not cached, so a later
+    attempt or extractor fix can still produce text.
+    """
+    sha256 = sha256 or content_hash(raw_bytes)
+    lock = _extract_locks.setdefault(sha256, asyncio.Lock())
+    try:
+        async with lock:
+            text = await _cached_text(sha256)
+            if text is not None:
+                return text
+            # PDF parsing / OCR is CPU-bound: keep it off the event loop
+            text = await asyncio.to_thread(_extract, name, raw_bytes)
+            if not text.strip():
+                logger.info(f"No text extracted from {name} (sha256={sha256[:12]}), not caching")
+                return text
+            try:
+                await db.attachment_texts.insert_one({
+                    "content_hash": sha256,
+                    "extractor_version": EXTRACTOR_VERSION,
+                    "text": text,
+                    "chars": len(text),
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                })
+            except DuplicateKeyError:
+                pass  # another process extracted it first
+    finally:
+        if _extract_locks.get(sha256) is lock and not lock.locked():
+            del _extract_locks[sha256]
+    logger.info(f"Attachment text cached: {name} ({len(text)} chars, sha256={sha256[:12]})")
+    return text
+
+
+def _read_attachment_bytes(att: dict) -> Optional[bytes]:
+    if att.get("s3_key"):
+        try:
+            return download_bytes(att["s3_key"])
+        except Exception as e:
+            logger.warning(f"Failed to download S3 attachment {att['name']}: {e}")
+    elif att.get("file_path") and os.path.exists(att["file_path"]):
+        try:
+            with open(att["file_path"], "rb") as f:
+                return f.read()
+        except Exception as e:
+            logger.warning(f"Failed to read attachment {att['name']}: {e}")
+    return None
+
+
+async def get_attachment_text(att: dict) -> Optional[str]:
+    """Cached text of an attachment; downloads and extracts only on a cache miss."""
+    if not is_extractable(att.get("name", "")):
+        return None
+    sha256 = att.get("content_sha256")
+    if sha256:
+        text = await _cached_text(sha256)
+        if text is not None:
+            return text
+
+    raw_bytes = await asyncio.to_thread(_read_attachment_bytes, att)
+    if not raw_bytes:
+        return None
+    if not sha256:
+        # Attachments uploaded before hashing was introduced
+        sha256 = content_hash(raw_bytes)
+        await db.doc_attachments.update_one({"id": att["id"]}, {"$set": {"content_sha256": sha256}})
+    return await extract_and_cache(att["name"], raw_bytes, sha256)
+
+
+async def build_source_context(project_id: str) -> str:
+    """Source materials of a doc project as one text block for the system message.
+
+    Documents are truncated to share CONTEXT_SOURCES_SHARE of the active
+    model's prompt budget (see services/token_budget.py).
+    """
+    attachments = await db.doc_attachments.find(
+        {"project_id": project_id}, {"_id": 0}
+    ).to_list(100)
+
+    texts = await asyncio.gather(*(get_attachment_text(att) for att in attachments))
+    model, budget = await section_budget(CONTEXT_SOURCES_SHARE)
+    present = [t for t in texts if t]
+    fitted = iter(fit_texts(present, budget, model))
+    texts = [next(fitted) if t else t for t in texts]
+    source_texts = []
+    for att, text in zip(attachments, texts):
+        if text:
+            source_texts.append(f"--- Документ: {att['name']} ---\n{text}")
+        elif att.get("source_url"):
+            source_texts.append(f"--- Ссылка: {att['name']} ({att['source_url']}) ---")
+
+    return "\n\n".join(source_texts) if source_texts else ""
@@ -0,0 +1,208 @@
+"""
+Batch billing engine for scheduled org charges (daily storage).
+
+All charges of a run are computed first, then applied in a handful of bulk
+operations, exactly once per (kind, org, day) even when the job crashes
+half-way or is run again:
+
+  1. charges are inserted into `billing_charges` with a unique
+     `charge_key` = "<kind>:<org_id>:<day>" (insert_many, duplicates
+     ignored), so a re-run keeps the first computation
+  2. before touching balances, each charge's first apply attempt is
+     recorded in `billing_batch_charges` (unique `charge_key`) with the
+     org's `last_charges.<kind>` at that moment; a later attempt keeps
+     that first record
+  3. org balances are decremented with one bulk_write per chunk, each
+     update guarded by `last_charges.<kind>` < day, so a balance is charged
+     at most once per kind and day
+  4. the balances are read back: a charge went through when its org was
+     not yet charged for the day before the first attempt and is now. Only
+     those get a transaction (upserted by charge id) and are marked
+     "applied". The others (no balance document, or the day already
+     charged) are marked "skipped", so no deduction is shown that did not
+     happen
+
+A crash leaves charges "pending"; the next run (scheduled or manual)
+applies them again, and the guards make that a no-op for whatever already
+went through. Runs are serialised by the scheduler lease. MongoDB here
+runs without replica set transactions, hence the idempotency keys.
+"""
+import uuid
+import logging
+from datetime import datetime, timezone
+from typing import List
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from app.core.database import db
+
+logger = logging.getLogger(__name__)
+
+BILLING_BATCH_CHUNK = 500
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _chunks(items: list, size: int = BILLING_BATCH_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def charge_key(kind: str, org_id: str, day: str) -> str:
+    return f"{kind}:{org_id}:{day}"
+
+
+async def ensure_billing_batch_indexes():
+    await db.billing_charges.create_index("charge_key", unique=True)
+    await db.billing_charges.create_index([("state", 1), ("kind", 1), ("day", 1)])
+    await db.billing_batch_charges.create_index("charge_key", unique=True)
+
+
+async def record_charges(kind: str, day: str, charges: List[dict]) -> int:
+    """Store computed charges ({org_id, credits, description}) for a day.
+
+    Charges already stored for the same (kind, org, day) are kept as they
+    are. Returns the number of new charges.
+    """
+    now = _now_iso()
+    docs = [
+        {
+            "id": str(uuid.uuid4()),
+            "charge_key": charge_key(kind, c["org_id"], day),
+            "kind": kind,
+            "day": day,
+            "org_id": c["org_id"],
+            "credits": c["credits"],
+            "description": c["description"],
+            "state": "pending",
+            "created_at": now,
+        }
+        for c in charges
+    ]
+    inserted = 0
+    for chunk in _chunks(docs):
+        try:
+            result = await db.billing_charges.insert_many(chunk, ordered=False)
+            inserted += len(result.inserted_ids)
+        except BulkWriteError as e:
+            errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            if errors:
+                raise
+            inserted += e.details.get("nInserted", 0)
+    if inserted < len(docs):
+        logger.info(f"Billing {kind} {day}: {len(docs) - inserted} charges already recorded, kept")
+    return inserted
+
+
+async def _charged_days(kind: str, org_ids: set) -> dict:
+    """org_id -> last day charged for the kind (None if never); orgs without a balance are absent."""
+    balances = await db.credit_balances.find(
+        {"org_id": {"$in": list(org_ids)}},
+        {"_id": 0, "org_id": 1, "last_charges": 1},
+    ).to_list(None)
+    return {b["org_id"]: (b.get("last_charges") or {}).get(kind) for b in balances}
+
+
+async def _record_attempts(charges: List[dict], charged_before: dict) -> dict:
+    """Record the first apply attempt of each charge; returns charge_key -> record.
+
+    A charge retried after a crash keeps the record of its first attempt,
+    which holds the org's last charged day before any of its writes.
+    """
+    now = _now_iso()
+    docs = [
+        {
+            "charge_key": c["charge_key"],
+            "charge_id": c["id"],
+            "org_id": c["org_id"],
+            "day": c["day"],
+            "charged_before": charged_before.get(c["org_id"]),
+            "created_at": now,
+        }
+        for c in charges
+    ]
+    try:
+        await db.billing_batch_charges.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+    records = await db.billing_batch_charges.find(
+        {"charge_key": {"$in": [c["charge_key"] for c in charges]}}, {"_id": 0}
+    ).to_list(None)
+    return {r["charge_key"]: r for r in records}
+
+
+def _went_through(charge: dict, record: dict, charged_now: dict) -> bool:
+    before = record.get("charged_before")
+    now = charged_now.get(charge["org_id"])
+    return (before is None or before < charge["day"]) and now is not None and now >= charge["day"]
+
+
+async def _apply_chunk(kind: str, charges: List[dict]):
+    now = _now_iso()
+    guard = f"last_charges.{kind}"
+    org_ids = {c["org_id"] for c in charges}
+    records = await _record_attempts(charges, await _charged_days(kind, org_ids))
+
+    balance_ops = [
+        UpdateOne(
+            {"org_id": c["org_id"], "$or": [{guard: {"$exists": False}}, {guard: {"$lt": c["day"]}}]},
+            {"$inc": {"balance": -c["credits"]}, "$set": {guard: c["day"], "updated_at": now}},
+        )
+        for c in charges
+    ]
+    # Ordered: an org may have several pending days, the guard needs them oldest first
+    await db.credit_balances.bulk_write(balance_ops, ordered=True)
+
+    charged_now = await _charged_days(kind, org_ids)
+    applied = [c for c in charges if _went_through(c, records[c["charge_key"]], charged_now)]
+    skipped = [c for c in charges if not _went_through(c, records[c["charge_key"]], charged_now)]
+
+    if applied:
+        await db.transactions.bulk_write([
+            UpdateOne(
+                {"id": c["id"]},
+                {"$setOnInsert": {
+                    "id": c["id"],
+                    "org_id": c["org_id"],
+                    "user_id": "system",
+                    "type": "deduction",
+                    "amount": round(c["credits"], 4),
+                    "description": c["description"],
+                    "created_at": c["created_at"],
+                }},
+                upsert=True,
+            )
+            for c in applied
+        ], ordered=False)
+        await db.billing_charges.update_many(
+            {"id": {"$in": [c["id"] for c in applied]}},
+            {"$set": {"state": "applied", "applied_at": now}},
+        )
+    if skipped:
+        logger.warning(f"Billing {kind}: {len(skipped)} charges skipped (no balance or day already charged)")
+        await db.billing_charges.update_many(
+            {"id": {"$in": [c["id"] for c in skipped]}},
+            {"$set": {"state": "skipped", "applied_at": now}},
+        )
+    return len(applied)
+
+
+async def apply_pending_charges(kind: str) -> int:
+    """Apply every pending charge of a kind, oldest day first. Returns the number applied."""
+    pending = await db.billing_charges.find(
+        {"kind": kind, "state": "pending"}, {"_id": 0}
+    ).sort([("day", 1), ("org_id", 1)]).to_list(None)
+    applied = 0
+    for chunk in _chunks(pending):
+        applied += await _apply_chunk(kind, chunk)
+    if pending:
+        logger.info(f"Billing {kind}: applied {applied} of {len(pending)} charges")
+    return applied
+
+
+async def run_charges(kind: str, day: str, charges: List[dict]) -> int:
+    """Record and apply one day's charges. Safe to call again for the same day."""
+    await record_charges(kind, day, charges)
+    return await apply_pending_charges(kind)
@@ -0,0 +1,164 @@
+"""
+Chunked parallel transcription for long recordings.
+
+The recording is cut (ffmpeg) into overlapping segments that are sent to
+Deepgram concurrently through the shared TranscriptionService. Every
+finished segment is checkpointed in `transcription_segments`, so when the
+job is retried only the segments that failed are transcribed again.
+Segment results are stitched with speaker labels reconciled across the
+overlaps (see app/utils/transcript_segments.py).
+"""
+import os
+import asyncio
+import logging
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Optional
+from app.core.database import db
+from app.services.transcription import TranscriptionBusyError, get_transcription_service
+from app.utils.transcript_segments import plan_segments, stitch_segments
+
+logger = logging.getLogger(__name__)
+
+# Recordings at least this long use chunked mode (0 disables it)
+TRANSCRIPTION_CHUNKED_MIN_SECONDS = float(os.environ.get("TRANSCRIPTION_CHUNKED_MIN_SECONDS", 1800))
+TRANSCRIPTION_SEGMENT_SECONDS = float(os.environ.get("TRANSCRIPTION_SEGMENT_SECONDS", 600))
+TRANSCRIPTION_SEGMENT_OVERLAP_SECONDS = float(os.environ.get("TRANSCRIPTION_SEGMENT_OVERLAP_SECONDS", 8))
+TRANSCRIPTION_SEGMENT_CONCURRENCY = int(os.environ.get("TRANSCRIPTION_SEGMENT_CONCURRENCY", 4))
+
+
+async def _run(*args) -> tuple:
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    out, err = await proc.communicate()
+    return proc.returncode, out.decode(errors="replace"), err.decode(errors="replace")
+
+
+async def probe_duration(path: Path) -> Optional[float]:
+    """Audio duration in seconds via ffprobe, or None if it cannot be determined."""
+    try:
+        code, out, err = await _run(
+            "ffprobe", "-v", "error", "-show_entries", "format=duration",
+            "-of", "default=noprint_wrappers=1:nokey=1", str(path),
+        )
+    except FileNotFoundError:
+        logger.warning("ffprobe not installed, chunked transcription unavailable")
+        return None
+    if code != 0:
+        logger.warning(f"ffprobe failed for {path.name}: {err.strip()}")
+        return None
+    try:
+        return float(out.strip())
+    except ValueError:
+        return None
+
+
+def should_use_chunked(duration: Optional[float]) -> bool:
+    return bool(duration) and TRANSCRIPTION_CHUNKED_MIN_SECONDS > 0 and duration >= TRANSCRIPTION_CHUNKED_MIN_SECONDS
+
+
+async def _cut_segment(src: Path, start: float, end: float, dest: Path):
+    """Cut [start, end) out of src. Stream copy first, re-encode if the container refuses."""
+    base = ["ffmpeg", "-y", "-v", "error", "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}", "-i", str(src), "-vn"]
+    code, _, err = await _run(*base, "-c:a", "copy", str(dest))
+    if code != 0:
+        # Drop the partial output of the failed stream copy
+        dest.unlink(missing_ok=True)
+        dest = dest.with_suffix(".mp3")
+        code, _, err = await _run(*base, "-c:a", "libmp3lame", "-b:a", "96k", str(dest))
+        if code != 0:
+            dest.unlink(missing_ok=True)
+            raise RuntimeError(f"ffmpeg failed to cut segment at {start:.0f}s: {err.strip()}")
+    return dest
+
+
+def _timed_sentences(response, offset: float, seg_end: float) -> list:
+    """Extract diarized sentences with absolute timestamps from a Deepgram response."""
+    sentences = []
+    if not (response.results and response.results.channels):
+        return sentences
+    for channel in response.results.channels:
+        for alt in channel.alternatives or []:
+            if alt.paragraphs and alt.paragraphs.paragraphs:
+                for para in alt.paragraphs.paragraphs:
+                    speaker = para.speaker if para.speaker is not None else 0
+                    for sentence in para.sentences or []:
+                        if not sentence.text:
+                            continue
+                        start = getattr(sentence, "start", None)
+                        end = getattr(sentence, "end", None)
+                        if start is None:
+                            start = getattr(para, "start", None) or 0.0
+                        if end is None:
+                            end = getattr(para, "end", None) or start
+                        sentences.append({
+                            "speaker": speaker,
+                            "start": offset + start,
+                            "end": offset + end,
+                            "text": sentence.text,
+                        })
+            elif alt.transcript:
+                sentences.append({"speaker": 0, "start": offset, "end": seg_end, "text": alt.transcript})
+    return sentences
+
+
+async def transcribe_chunked(project_id: str, file_path: Path, duration: float, options: dict) -> list:
+    """Transcribe a long recording in overlapping segments. Returns [(speaker, text), ...]."""
+    recording = file_path.name
+    plan = plan_segments(duration, TRANSCRIPTION_SEGMENT_SECONDS, TRANSCRIPTION_SEGMENT_OVERLAP_SECONDS)
+
+    done = await db.transcription_segments.find(
+        {"project_id": project_id, "recording": recording}, {"_id": 0}
+    ).to_list(10000)
+    done_indexes = {d["index"] for d in done}
+    pending = [(i, start, end) for i, (start, end) in enumerate(plan) if i not in done_indexes]
+    logger.info(
+        f"[{project_id}] Chunked transcription: {len(plan)} segments, "
+        f"{len(done_indexes)} checkpointed, {len(pending)} to send"
+    )
+
+    service = get_transcription_service()
+    limit = asyncio.Semaphore(TRANSCRIPTION_SEGMENT_CONCURRENCY)
+
+    async def run_segment(index: int, start: float, end: float) -> dict:
+        async with limit:
+            seg_path = await _cut_segment(
+                file_path, start, end, file_path.with_name(f"{file_path.stem}_seg{index}{file_path.suffix}")
+            )
+            try:
+                response = await service.transcribe_file(seg_path, **options)
+            finally:
+                seg_path.unlink(missing_ok=True)
+        result = {
+            "project_id": project_id,
+            "recording": recording,
+            "index": index,
+            "start": start,
+            "end": end,
+            "sentences": _timed_sentences(response, start, end),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        await db.transcription_segments.update_one(
+            {"project_id": project_id, "recording": recording, "index": index},
+            {"$set": result},
+            upsert=True,
+        )
+        return result
+
+    outcomes = await asyncio.gather(*(run_segment(*p) for p in pending), return_exceptions=True)
+    failures = [o for o in outcomes if isinstance(o, BaseException)]
+    if failures and all(isinstance(f, TranscriptionBusyError) for f in failures):
+        # Only the pool was full; the finished segments are checkpointed
+        raise TranscriptionBusyError(f"{len(failures)} of {len(plan)} segments deferred: {failures[0]}")
+    if failures:
+        raise RuntimeError(
+            f"{len(failures)} of {len(plan)} segments failed (will retry only those): {failures[0]}"
+        )
+
+    segments = done + list(outcomes)
+    return stitch_segments(segments)
+
+
+async def clear_checkpoints(project_id: str):
+    await db.transcription_segments.delete_many({"project_id": project_id})
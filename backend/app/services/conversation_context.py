@@ -0,0 +1,172 @@
+"""
+Bounded conversation context for meeting chat (`chat_requests`) and
+document streams (`doc_streams.messages`).
+
+A request sends at most CONTEXT_HISTORY_TOKENS of history: the latest turns
+verbatim, everything older as a running summary stored in
+`conversation_summaries` (one document per conversation):
+
+    {kind, conversation_id, project_id, summary, covered_until, covered_turns, updated_at}
+
+`covered_until` is the key (ISO timestamp) of the last turn folded into the
+summary; later turns are sent verbatim. The summary is updated after a
+response has been saved, in the background, so the request itself never
+waits for it: once the verbatim part outgrows the budget, the older turns
+are folded into the summary (incrementally, at most
+CONTEXT_SUMMARY_BATCH_TOKENS per GPT call) until the verbatim part is down
+to CONTEXT_RECENT_SHARE of the budget. The summary therefore changes only
+every few messages, which also keeps the prompt prefix cacheable.
+
+Updates are guarded by the previous `covered_until`, so concurrent updates
+of the same conversation cannot overwrite each other. Deleting or editing a
+turn already covered by the summary drops the summary; it is rebuilt from
+the remaining history on the next update.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from pymongo.errors import DuplicateKeyError
+from app.core.database import db
+from app.utils.context_window import (
+    SUMMARIZER_SYSTEM_MESSAGE,
+    history_messages,
+    recent_start,
+    summary_request,
+    turn_tokens,
+)
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_HISTORY_TOKENS = int(os.environ.get("CONTEXT_HISTORY_TOKENS", 8000))
+CONTEXT_RECENT_SHARE = float(os.environ.get("CONTEXT_RECENT_SHARE", 0.5))
+CONTEXT_SUMMARY_BATCH_TOKENS = int(os.environ.get("CONTEXT_SUMMARY_BATCH_TOKENS", 24000))
+CONTEXT_SUMMARY_MAX_WORDS = int(os.environ.get("CONTEXT_SUMMARY_MAX_WORDS", 500))
+
+# (key, turn) pairs in chronological order; key is the turn's ISO timestamp
+KeyedTurns = List[Tuple[str, List[dict]]]
+
+_updating = set()   # (kind, conversation_id) being summarized by this process
+_tasks = set()      # keeps background update tasks referenced until they finish
+
+
+async def ensure_conversation_context_indexes():
+    await db.conversation_summaries.create_index([("kind", 1), ("conversation_id", 1)], unique=True)
+    await db.conversation_summaries.create_index("project_id")
+
+
+async def get_summary(kind: str, conversation_id: str) -> dict:
+    return await db.conversation_summaries.find_one(
+        {"kind": kind, "conversation_id": conversation_id}, {"_id": 0}
+    ) or {}
+
+
+def _uncovered(summary: dict, turns: KeyedTurns) -> KeyedTurns:
+    covered_until = summary.get("covered_until") or ""
+    return [(key, turn) for key, turn in turns if key > covered_until]
+
+
+def bounded_history(summary: dict, turns: KeyedTurns) -> List[dict]:
+    """History messages within CONTEXT_HISTORY_TOKENS: summary + latest turns.
+
+    Turns that are neither covered by the summary nor within the budget
+    (the summary is lagging behind) are left out until it catches up.
+    """
+    pending = [turn for _, turn in _uncovered(summary, turns)]
+    start = recent_start(pending, CONTEXT_HISTORY_TOKENS)
+    return history_messages(summary.get("summary"), pending[start:])
+
+
+def refresh_summary_later(kind: str, conversation_id: str, project_id: str, turns: KeyedTurns, summary: dict, user: dict):
+    """Fold older turns into the summary in the background once the verbatim part exceeds the budget."""
+    pending = _uncovered(summary, turns)
+    if sum(turn_tokens(turn) for _, turn in pending) <= CONTEXT_HISTORY_TOKENS:
+        return
+    if (kind, conversation_id) in _updating:
+        return
+    task = asyncio.create_task(_refresh_summary(kind, conversation_id, project_id, turns, user))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _summarize(previous: Optional[str], turns: List[List[dict]], user: dict) -> str:
+    from app.services.gpt import call_gpt52_metered
+    from app.services.metering import deduct_credits_and_record
+
+    gpt_result = await call_gpt52_metered(
+        system_message=SUMMARIZER_SYSTEM_MESSAGE.format(max_words=CONTEXT_SUMMARY_MAX_WORDS),
+        user_message=summary_request(previous, turns),
+        reasoning_effort="low",
+        source="context_summary",
+    )
+    org_id = user.get("org_id")
+    if org_id:
+        try:
+            await deduct_credits_and_record(
+                org_id=org_id, user_id=user["id"],
+                model=gpt_result.model,
+                prompt_tokens=gpt_result.prompt_tokens,
+                completion_tokens=gpt_result.completion_tokens,
+                cached_tokens=gpt_result.cached_tokens,
+                cache_hit=gpt_result.cache_hit,
+                source="context_summary",
+            )
+        except Exception as me:
+            logger.error(f"Metering error: {me}")
+    return gpt_result.content.strip()
+
+
+async def _store_summary(kind: str, conversation_id: str, project_id: str, previous: dict, summary: str, covered_until: str, covered_turns: int) -> bool:
+    """Save the new summary unless another update got there first."""
+    try:
+        await db.conversation_summaries.update_one(
+            {"kind": kind, "conversation_id": conversation_id, "covered_until": previous.get("covered_until")},
+            {"$set": {
+                "project_id": project_id,
+                "summary": summary,
+                "covered_until": covered_until,
+                "covered_turns": covered_turns,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def _refresh_summary(kind: str, conversation_id: str, project_id: str, turns: KeyedTurns, user: dict):
+    _updating.add((kind, conversation_id))
+    try:
+        summary = await get_summary(kind, conversation_id)
+        pending = _uncovered(summary, turns)
+        cut = recent_start([turn for _, turn in pending], int(CONTEXT_HISTORY_TOKENS * CONTEXT_RECENT_SHARE))
+        folded = 0
+        while folded < cut:
+            batch, size = [], 0
+            for key, turn in pending[folded:cut]:
+                if batch and size + turn_tokens(turn) > CONTEXT_SUMMARY_BATCH_TOKENS:
+                    break
+                batch.append((key, turn))
+                size += turn_tokens(turn)
+            text = await _summarize(summary.get("summary"), [turn for _, turn in batch], user)
+            covered_turns = (summary.get("covered_turns") or 0) + len(batch)
+            if not await _store_summary(kind, conversation_id, project_id, summary, text, batch[-1][0], covered_turns):
+                logger.info(f"Context summary {kind}:{conversation_id} updated elsewhere, skipping")
+                return
+            summary = {**summary, "summary": text, "covered_until": batch[-1][0], "covered_turns": covered_turns}
+            folded += len(batch)
+        logger.info(f"Context summary {kind}:{conversation_id}: folded {folded} turns")
+    except Exception as e:
+        logger.error(f"Context summary {kind}:{conversation_id} failed: {e}")
+    finally:
+        _updating.discard((kind, conversation_id))
+
+
+async def invalidate_summary(kind: str, conversation_id: str, key: Optional[str] = None):
+    """Drop the summary if it covers the turn with `key` (or unconditionally without a key)."""
+    query = {"kind": kind, "conversation_id": conversation_id}
+    if key is not None:
+        query["covered_until"] = {"$gte": key}
+    await db.conversation_summaries.delete_one(query)
@@ -0,0 +1,67 @@
+"""
+Deepgram client factory.
+
+With DEEPGRAM_FAKE=1 a local stand-in is returned instead of the real SDK
+client, so the transcription queue can be load-tested offline. The fake
+mirrors the SDK call signature and response shape used by
+process_transcription.
+"""
+import time
+import logging
+from types import SimpleNamespace
+from app.core.config import DEEPGRAM_API_KEY, DEEPGRAM_FAKE, DEEPGRAM_FAKE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Rough bitrate used by the fake to derive a duration from the upload size (128 kbps)
+FAKE_BYTES_PER_SECOND = 16000
+
+
+def create_deepgram_client():
+    if DEEPGRAM_FAKE:
+        return FakeDeepgramClient(latency=DEEPGRAM_FAKE_LATENCY)
+    from deepgram import DeepgramClient
+    return DeepgramClient(api_key=DEEPGRAM_API_KEY)
+
+
+class _FakeMedia:
+    def __init__(self, latency: float):
+        self._latency = latency
+
+    def transcribe_file(self, request, **options):
+        if isinstance(request, (bytes, bytearray)):
+            size = len(request)
+        else:
+            size = sum(len(chunk) for chunk in request)
+        time.sleep(self._latency)
+        return _fake_response(size, options.get("language", "ru"))
+
+
+class FakeDeepgramClient:
+    """Offline stand-in exposing `listen.v1.media.transcribe_file`."""
+
+    def __init__(self, latency: float = 2.0):
+        self.listen = SimpleNamespace(v1=SimpleNamespace(media=_FakeMedia(latency)))
+        logger.info(f"Using fake Deepgram client (latency={latency}s)")
+
+
+def _fake_response(size: int, language: str):
+    duration = max(size / FAKE_BYTES_PER_SECOND, 1.0)
+    # One paragraph per ~30s of audio, alternating between two speakers
+    paragraphs = []
+    for i in range(max(int(duration // 30), 1)):
+        start, end = i * 30.0, min((i + 1) * 30.0, duration)
+        paragraphs.append(SimpleNamespace(
+            speaker=i % 2,
+            start=start,
+            end=end,
+            sentences=[SimpleNamespace(text=f"Тестовая реплика {i + 1} ({language}).", start=start, end=end)],
+        ))
+    alternative = SimpleNamespace(
+        paragraphs=SimpleNamespace(paragraphs=paragraphs, transcript=None),
+        transcript=None,
+    )
+    return SimpleNamespace(
+        metadata=SimpleNamespace(duration=duration),
+        results=SimpleNamespace(channels=[SimpleNamespace(alternatives=[alternative])]),
+    )
@@ -1,15 +1,25 @@
+import re
+import time
 import logging
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, AsyncIterator, Tuple, Union
 from openai import AsyncOpenAI
 from app.core.config import OPENAI_API_KEY
 from app.core.database import db
+from app.services.settings_cache import settings_cache
+from app.services.token_budget import check_prompt
+from app.services.gpt_telemetry import record_gpt_call_later
 
 logger = logging.getLogger(__name__)
 
 client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 DEFAULT_MODEL = "gpt-5.2"
+GPT_TEMPERATURE = 0.3
+
+# reasoning_effort is only sent to reasoning models; "auto" / None keep the model default
+REASONING_MODEL_PREFIXES = ("gpt-5", "o1", "o3", "o4")
+REASONING_EFFORTS = {"minimal", "low", "medium", "high", "xhigh"}
 
 
 @dataclass
@@ -19,22 +29,70 @@ class GptResult:
     prompt_tokens: int
     completion_tokens: int
     total_tokens: int
+    cached_tokens: int = 0  # part of prompt_tokens served from the provider's prompt cache
+    cache_hit: bool = False  # answered from the response cache (services/gpt_cache.py), no provider call
 
 
-async def _get_active_model() -> str:
+async def _load_active_model() -> str:
     settings = await db.settings.find_one({"key": "active_model"}, {"_id": 0})
     return settings["value"] if settings else DEFAULT_MODEL
 
 
+async def _get_active_model() -> str:
+    return await settings_cache.get("active_model", _load_active_model)
+
+
 def _extract_usage(response) -> dict:
     usage = response.usage
     if usage:
+        details = getattr(usage, "prompt_tokens_details", None)
         return {
             "prompt_tokens": usage.prompt_tokens or 0,
             "completion_tokens": usage.completion_tokens or 0,
             "total_tokens": usage.total_tokens or 0,
+            "cached_tokens": (getattr(details, "cached_tokens", 0) or 0) if details else 0,
         }
-    return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0}
+
+
+def _cache_args(cache_key: Optional[str]) -> dict:
+    """Route calls sharing a prompt prefix (same meeting / project) to the same provider cache."""
+    return {"extra_body": {"prompt_cache_key": cache_key}} if cache_key else {}
+
+
+def _model_version(model: str) -> Optional[Tuple[int, int]]:
+    """(major, minor) of a gpt-N[.M] model name, e.g. gpt-5.10-mini -> (5, 10)."""
+    match = re.match(r"gpt-(\d+)(?:\.(\d+))?", model)
+    return (int(match.group(1)), int(match.group(2) or 0)) if match else None
+
+
+def _provider_effort(model: str, reasoning_effort: Optional[str]) -> Optional[str]:
+    """The effort value the model accepts, or None to leave the model default."""
+    if reasoning_effort not in REASONING_EFFORTS or not model.startswith(REASONING_MODEL_PREFIXES):
+        return None
+    version = _model_version(model) or (0, 0)
+    # "minimal" is gpt-5 only (o-series start at "low"); gpt-5.1+ replaced it with "none";
+    # "xhigh" exists from gpt-5.2
+    if reasoning_effort == "minimal" and version < (5, 0):
+        return "low"
+    if reasoning_effort == "minimal" and version >= (5, 1):
+        return "none"
+    if reasoning_effort == "xhigh" and version < (5, 2):
+        return "high"
+    return reasoning_effort
+
+
+def _request_args(model: str, reasoning_effort: Optional[str], max_output_tokens: Optional[int], cache_key: Optional[str]) -> dict:
+    args = {"model": model, **_cache_args(cache_key)}
+    effort = _provider_effort(model, reasoning_effort)
+    if effort:
+        args["reasoning_effort"] = effort
+    if not model.startswith(REASONING_MODEL_PREFIXES) or effort == "none":
+        # Reasoning models reject temperature while reasoning (also at their default effort)
+        args["temperature"] = GPT_TEMPERATURE
+    if max_output_tokens:
+        args["max_completion_tokens"] = max_output_tokens
+    return args
 
 
 async def call_gpt4o(system_message: str, user_message: str) -> str:
@@ -59,19 +117,74 @@ async def call_gpt52(
     user_message: str = None,
     reasoning_effort: str = "high",
     messages: list = None,
+    cache_key: Optional[str] = None,
 ) -> str:
     """Call active GPT model — returns content string (backward compatible)."""
-    result = await call_gpt52_metered(system_message, user_message, reasoning_effort, messages)
+    result = await call_gpt52_metered(system_message, user_message, reasoning_effort, messages, cache_key)
     return result.content
 
 
+async def _complete(msgs: list, args: dict) -> GptResult:
+    response = await client.chat.completions.create(messages=msgs, **args)
+    usage = _extract_usage(response)
+    return GptResult(
+        content=response.choices[0].message.content,
+        model=args["model"],
+        **usage,
+    )
+
+
+async def _dispatch(
+    model: str,
+    msgs: list,
+    reasoning_effort: Optional[str],
+    max_output_tokens: Optional[int],
+    cache_key: Optional[str],
+    use_cache: bool,
+    source: Optional[str],
+    node_id: Optional[str],
+) -> GptResult:
+    check_prompt(model, msgs, max_output_tokens)
+    args = _request_args(model, reasoning_effort, max_output_tokens, cache_key)
+    started = time.monotonic()
+    result, error = None, None
+    try:
+        if not use_cache:
+            result = await _complete(msgs, args)
+        else:
+            from app.services.gpt_cache import cached_call
+            result = await cached_call(
+                model, msgs, reasoning_effort, GPT_TEMPERATURE,
+                lambda: _complete(msgs, args), max_output_tokens,
+            )
+        return result
+    except BaseException as e:  # incl. cancellation (client gone)
+        error = e
+        raise
+    finally:
+        record_gpt_call_later(
+            model, reasoning_effort, int((time.monotonic() - started) * 1000),
+            source=source, node_id=node_id, max_output_tokens=max_output_tokens,
+            result=result, error=error,
+        )
+
+
 async def call_gpt52_metered(
     system_message: str,
     user_message: str = None,
     reasoning_effort: str = "high",
     messages: list = None,
+    cache_key: Optional[str] = None,
+    use_cache: bool = False,
+    max_output_tokens: Optional[int] = None,
+    source: Optional[str] = None,
+    node_id: Optional[str] = None,
 ) -> GptResult:
-    """Call active GPT model — returns GptResult with usage data."""
+    """Call active GPT model — returns GptResult with usage data.
+
+    use_cache: answer identical requests from the response cache (services/gpt_cache.py).
+    source / node_id: labels of the call in gpt_calls telemetry (services/gpt_telemetry.py).
+    """
     try:
         model = await _get_active_model()
         msgs = [{"role": "system", "content": system_message}]
@@ -79,18 +192,7 @@ async def call_gpt52_metered(
             msgs.extend(messages)
         elif user_message:
             msgs.append({"role": "user", "content": user_message})
-
-        response = await client.chat.completions.create(
-            model=model,
-            messages=msgs,
-            temperature=0.3,
-        )
-        usage = _extract_usage(response)
-        return GptResult(
-            content=response.choices[0].message.content,
-            model=model,
-            **usage,
-        )
+        return await _dispatch(model, msgs, reasoning_effort, max_output_tokens, cache_key, use_cache, source, node_id)
     except Exception as e:
         logger.error(f"GPT ({model if 'model' in dir() else 'unknown'}) error: {e}")
         raise e
@@ -99,33 +201,115 @@ async def call_gpt52_metered(
 async def call_gpt_chat(
     system_message: str,
     messages: list,
+    cache_key: Optional[str] = None,
 ) -> str:
     """Call GPT with full message history — returns content string (backward compatible)."""
-    result = await call_gpt_chat_metered(system_message, messages)
+    result = await call_gpt_chat_metered(system_message, messages, cache_key)
     return result.content
 
 
 async def call_gpt_chat_metered(
     system_message: str,
     messages: list,
+    cache_key: Optional[str] = None,
+    use_cache: bool = False,
+    reasoning_effort: Optional[str] = None,
+    max_output_tokens: Optional[int] = None,
+    source: Optional[str] = None,
 ) -> GptResult:
     """Call GPT with full message history — returns GptResult with usage data."""
     try:
         model = await _get_active_model()
         msgs = [{"role": "system", "content": system_message}]
         msgs.extend(messages)
+        return await _dispatch(model, msgs, reasoning_effort, max_output_tokens, cache_key, use_cache, source, None)
+    except Exception as e:
+        logger.error(f"GPT chat error: {e}")
+        raise e
 
-        response = await client.chat.completions.create(
-            model=model,
+
+async def _stream_completion(
+    model: str,
+    msgs: list,
+    reasoning_effort: Optional[str] = None,
+    max_output_tokens: Optional[int] = None,
+    cache_key: Optional[str] = None,
+    source: Optional[str] = None,
+) -> AsyncIterator[Union[str, GptResult]]:
+    check_prompt(model, msgs, max_output_tokens)
+    started = time.monotonic()
+    ttft_ms, result, error = None, None, None
+    try:
+        stream = await client.chat.completions.create(
             messages=msgs,
-            temperature=0.3,
+            stream=True,
+            stream_options={"include_usage": True},
+            **_request_args(model, reasoning_effort, max_output_tokens, cache_key),
         )
-        usage = _extract_usage(response)
-        return GptResult(
-            content=response.choices[0].message.content,
-            model=model,
-            **usage,
+        parts = []
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0}
+        async for chunk in stream:
+            if chunk.usage:
+                usage = _extract_usage(chunk)
+            if chunk.choices:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if ttft_ms is None:
+                        ttft_ms = int((time.monotonic() - started) * 1000)
+                    parts.append(delta)
+                    yield delta
+        result = GptResult(content="".join(parts), model=model, **usage)
+        yield result
+    except BaseException as e:  # incl. cancellation (client gone)
+        error = e
+        raise
+    finally:
+        record_gpt_call_later(
+            model, reasoning_effort, int((time.monotonic() - started) * 1000),
+            source=source, max_output_tokens=max_output_tokens, stream=True, ttft_ms=ttft_ms,
+            result=result, error=error,
         )
+
+
+async def stream_gpt52_metered(
+    system_message: str,
+    user_message: str = None,
+    reasoning_effort: str = "high",
+    messages: list = None,
+    cache_key: Optional[str] = None,
+    max_output_tokens: Optional[int] = None,
+    source: Optional[str] = None,
+) -> AsyncIterator[Union[str, GptResult]]:
+    """Streaming call_gpt52_metered — yields content deltas, then a final GptResult with usage."""
+    model = await _get_active_model()
+    msgs = [{"role": "system", "content": system_message}]
+    if messages:
+        msgs.extend(messages)
+    elif user_message:
+        msgs.append({"role": "user", "content": user_message})
+    try:
+        async for item in _stream_completion(model, msgs, reasoning_effort, max_output_tokens, cache_key, source):
+            yield item
     except Exception as e:
-        logger.error(f"GPT chat error: {e}")
+        logger.error(f"GPT stream ({model}) error: {e}")
+        raise e
+
+
+async def stream_gpt_chat_metered(
+    system_message: str,
+    messages: list,
+    cache_key: Optional[str] = None,
+    reasoning_effort: Optional[str] = None,
+    max_output_tokens: Optional[int] = None,
+    source: Optional[str] = None,
+) -> AsyncIterator[Union[str, GptResult]]:
+    """Streaming call_gpt_chat_metered — yields content deltas, then a final GptResult with usage."""
+    model = await _get_active_model()
+    msgs = [{"role": "system", "content": system_message}]
+    msgs.extend(messages)
+    try:
+        async for item in _stream_completion(model, msgs, reasoning_effort, max_output_tokens, cache_key, source):
+            yield item
+    except Exception as e:
+        logger.error(f"GPT chat stream error: {e}")
         raise e
@@ -0,0 +1,213 @@
+"""
+Opt-in response cache for identical GPT requests (`gpt_response_cache`).
+
+Callers pass `use_cache=True` to call_gpt52_metered / call_gpt_chat_metered
+where re-running the exact same request is common and a repeated answer is
+what the user expects: doc pipeline nodes and wizard steps on an unchanged
+transcript. Entries are keyed by a SHA-256 of (model, messages,
+reasoning_effort, temperature, max_output_tokens when set):
+
+    {key, state: "pending" | "ready", content, model, size, hits,
+     claimed_until, created_at, last_used_at, expires_at}
+
+- Identical concurrent requests make one provider call (single-flight):
+  within a process they await the same future; across processes the first
+  one claims the key with a "pending" entry (lease GPT_CACHE_PENDING_SECONDS)
+  and the others poll until it is ready.
+- Entries expire after GPT_CACHE_TTL_SECONDS (TTL index on expires_at) and
+  the least recently used ones are evicted once the stored responses
+  exceed GPT_CACHE_MAX_BYTES (checked every GPT_CACHE_EVICT_EVERY stores).
+- A hit is returned as a GptResult with `cache_hit=True` and zero tokens;
+  metering records it in usage_records at zero cost, without a transaction.
+
+Failed calls are not cached. Set GPT_RESPONSE_CACHE=0 to disable the cache
+everywhere.
+"""
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+from pymongo.errors import DuplicateKeyError
+from app.core.database import db
+from app.services.gpt import GptResult
+
+logger = logging.getLogger(__name__)
+
+GPT_CACHE_ENABLED = os.environ.get("GPT_RESPONSE_CACHE", "1") == "1"
+GPT_CACHE_TTL_SECONDS = int(os.environ.get("GPT_CACHE_TTL_SECONDS", 7 * 86400))
+GPT_CACHE_MAX_BYTES = int(os.environ.get("GPT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+GPT_CACHE_EVICT_EVERY = 100
+GPT_CACHE_PENDING_SECONDS = 600
+GPT_CACHE_POLL_SECONDS = 1
+
+_inflight: Dict[str, asyncio.Future] = {}
+_stores = 0
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def request_key(
+    model: str,
+    messages: List[dict],
+    reasoning_effort: Optional[str],
+    temperature: float,
+    max_output_tokens: Optional[int] = None,
+) -> str:
+    request = {"model": model, "messages": messages, "reasoning_effort": reasoning_effort, "temperature": temperature}
+    if max_output_tokens:
+        # A lower limit may cut the answer short; keys without a limit are unchanged
+        request["max_output_tokens"] = max_output_tokens
+    payload = json.dumps(request, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _hit(content: str, model: str) -> GptResult:
+    return GptResult(
+        content=content, model=model,
+        prompt_tokens=0, completion_tokens=0, total_tokens=0, cached_tokens=0,
+        cache_hit=True,
+    )
+
+
+async def ensure_gpt_cache_indexes():
+    await db.gpt_response_cache.create_index("key", unique=True)
+    await db.gpt_response_cache.create_index("expires_at", expireAfterSeconds=0)
+    await db.gpt_response_cache.create_index([("state", 1), ("last_used_at", 1)])
+
+
+async def _claim(key: str) -> Optional[dict]:
+    """The ready entry for key, or None once this process holds the pending claim."""
+    while True:
+        now = _now()
+        entry = await db.gpt_response_cache.find_one({"key": key}, {"_id": 0})
+        if entry and entry.get("state") == "ready":
+            await db.gpt_response_cache.update_one(
+                {"key": key}, {"$set": {"last_used_at": now}, "$inc": {"hits": 1}}
+            )
+            return entry
+        if entry and entry.get("claimed_until") and entry["claimed_until"].replace(tzinfo=timezone.utc) > now:
+            # Same request in flight in another process
+            await asyncio.sleep(GPT_CACHE_POLL_SECONDS)
+            continue
+        try:
+            await db.gpt_response_cache.update_one(
+                {"key": key, "state": "pending", "$or": [
+                    {"claimed_until": {"$exists": False}},
+                    {"claimed_until": {"$lt": now}},
+                ]},
+                {"$set": {
+                    "claimed_until": now + timedelta(seconds=GPT_CACHE_PENDING_SECONDS),
+                    "expires_at": now + timedelta(seconds=GPT_CACHE_PENDING_SECONDS),
+                }},
+                upsert=True,
+            )
+            return None
+        except DuplicateKeyError:
+            continue  # claimed or completed elsewhere in the meantime
+
+
+async def _store(key: str, result: GptResult):
+    global _stores
+    now = _now()
+    await db.gpt_response_cache.update_one(
+        {"key": key},
+        {"$set": {
+            "state": "ready",
+            "content": result.content,
+            "model": result.model,
+            "size": len(result.content.encode("utf-8")),
+            "hits": 0,
+            "created_at": now,
+            "last_used_at": now,
+            "expires_at": now + timedelta(seconds=GPT_CACHE_TTL_SECONDS),
+        }, "$unset": {"claimed_until": ""}},
+        # The pending entry may be gone already (TTL after a slow call)
+        upsert=True,
+    )
+    _stores += 1
+    if _stores % GPT_CACHE_EVICT_EVERY == 0:
+        await evict_gpt_cache()
+
+
+async def evict_gpt_cache() -> int:
+    """Delete least recently used entries until the cache fits GPT_CACHE_MAX_BYTES."""
+    totals = await db.gpt_response_cache.aggregate([
+        {"$match": {"state": "ready"}},
+        {"$group": {"_id": None, "bytes": {"$sum": "$size"}}},
+    ]).to_list(1)
+    excess = (totals[0]["bytes"] if totals else 0) - GPT_CACHE_MAX_BYTES
+    if excess <= 0:
+        return 0
+    keys, freed = [], 0
+    cursor = db.gpt_response_cache.find(
+        {"state": "ready"}, {"_id": 0, "key": 1, "size": 1}
+    ).sort("last_used_at", 1)
+    async for entry in cursor:
+        keys.append(entry["key"])
+        freed += entry.get("size", 0)
+        if freed >= excess:
+            break
+    await db.gpt_response_cache.delete_many({"key": {"$in": keys}, "state": "ready"})
+    logger.info(f"GPT cache: evicted {len(keys)} entries ({freed} bytes)")
+    return len(keys)
+
+
+async def _leader(key: str, call: Callable[[], Awaitable[GptResult]]) -> GptResult:
+    entry = await _claim(key)
+    if entry:
+        return _hit(entry["content"], entry["model"])
+    try:
+        result = await call()
+    except BaseException:
+        await db.gpt_response_cache.delete_one({"key": key, "state": "pending"})
+        raise
+    if result.content:
+        await _store(key, result)
+    else:
+        await db.gpt_response_cache.delete_one({"key": key, "state": "pending"})
+    return result
+
+
+async def cached_call(
+    model: str,
+    messages: List[dict],
+    reasoning_effort: Optional[str],
+    temperature: float,
+    call: Callable[[], Awaitable[GptResult]],
+    max_output_tokens: Optional[int] = None,
+) -> GptResult:
+    """Run `call` at most once for identical requests; later ones get the stored answer."""
+    if not GPT_CACHE_ENABLED:
+        return await call()
+    key = request_key(model, messages, reasoning_effort, temperature, max_output_tokens)
+    inflight = _inflight.get(key)
+    if inflight:
+        try:
+            result = await asyncio.shield(inflight)
+        except asyncio.CancelledError:
+            if not inflight.cancelled():
+                raise
+            # The leading request was cancelled (client gone): run it ourselves
+            return await cached_call(model, messages, reasoning_effort, temperature, call, max_output_tokens)
+        return _hit(result.content, result.model)
+
+    future = asyncio.get_running_loop().create_future()
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _inflight[key] = future
+    try:
+        result = await _leader(key, call)
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        _inflight.pop(key, None)
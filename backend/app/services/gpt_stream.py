@@ -0,0 +1,83 @@
+"""
+SSE delivery of streaming GPT calls.
+
+The GPT stream is consumed by a background task, not by the HTTP response,
+so metering and saving the result happen once generation completes even if
+the client disconnects halfway. The response relays the task's events:
+
+    event: token   data: {"text": "..."}
+    event: done    data: <same payload as the non-streaming endpoint>
+    event: error   data: {"detail": "..."}
+"""
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Optional
+from fastapi.responses import StreamingResponse
+from app.services.gpt import GptResult
+from app.utils.sse import sse_event, sse_comment
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_SECONDS = 15
+
+# Keep references to running producers so they are not garbage-collected mid-stream
+_producers = set()
+
+
+def gpt_sse_response(
+    gpt_stream: AsyncIterator,
+    on_complete: Callable[[GptResult], Awaitable[dict]],
+    on_error: Optional[Callable[[Exception], Awaitable[Optional[dict]]]] = None,
+) -> StreamingResponse:
+    """Relay a stream_gpt*_metered iterator as SSE.
+
+    `on_complete(result)` meters/saves and returns the `done` payload.
+    `on_error(exc)` may return a `done` payload instead of an `error` event.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            result = None
+            async for item in gpt_stream:
+                if isinstance(item, GptResult):
+                    result = item
+                else:
+                    queue.put_nowait(sse_event("token", {"text": item}))
+            queue.put_nowait(sse_event("done", await on_complete(result)))
+        except Exception as e:
+            logger.error(f"Streaming GPT error: {e}")
+            payload = None
+            if on_error:
+                try:
+                    payload = await on_error(e)
+                except Exception as he:
+                    logger.error(f"Stream error handler failed: {he}")
+            if payload is not None:
+                queue.put_nowait(sse_event("done", payload))
+            else:
+                queue.put_nowait(sse_event("error", {"detail": f"AI error: {str(e)}"}))
+        finally:
+            queue.put_nowait(None)
+
+    task = asyncio.create_task(produce())
+    _producers.add(task)
+    task.add_done_callback(_producers.discard)
+
+    async def events():
+        yield sse_comment("stream")
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield sse_comment("keepalive")
+                continue
+            if event is None:
+                return
+            yield event
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,117 @@
+"""
+Per-call GPT telemetry (`gpt_calls`) for tuning model / reasoning effort.
+
+services/gpt.py records every call (and response-cache hit) in a background
+task, off the request path:
+
+    {id, model, reasoning_effort, max_output_tokens, source, node_id, stream,
+     cache_hit, status, error, latency_ms, ttft_ms, prompt_tokens,
+     completion_tokens, cached_tokens, created_at, expires_at}
+
+`ttft_ms` (time to first token) is only known for streaming calls.
+Entries expire after GPT_TELEMETRY_RETENTION_DAYS (TTL index on
+expires_at). GET /api/admin/gpt/telemetry returns latency percentiles per
+model, effort and source (optionally per pipeline node), e.g. to pick the
+fastest effort that is still good enough for a pipeline node.
+"""
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+from app.core.database import db
+from app.utils.stats import summarize_calls
+
+logger = logging.getLogger(__name__)
+
+GPT_TELEMETRY_RETENTION_DAYS = int(os.environ.get("GPT_TELEMETRY_RETENTION_DAYS", 30))
+GPT_TELEMETRY_SUMMARY_LIMIT = 100000
+
+_tasks = set()  # keeps background writes referenced until they finish
+
+SUMMARY_GROUPS = {
+    "model": ("model", "reasoning_effort", "source"),
+    "node": ("source", "node_id", "model", "reasoning_effort"),
+}
+
+
+async def ensure_gpt_telemetry_indexes():
+    await db.gpt_calls.create_index("expires_at", expireAfterSeconds=0)
+    await db.gpt_calls.create_index("created_at")
+
+
+async def record_gpt_call(
+    model: str,
+    reasoning_effort: Optional[str],
+    latency_ms: int,
+    source: Optional[str] = None,
+    node_id: Optional[str] = None,
+    max_output_tokens: Optional[int] = None,
+    stream: bool = False,
+    ttft_ms: Optional[int] = None,
+    result=None,
+    error: Optional[Exception] = None,
+):
+    """Store one call; never raises (telemetry must not fail the request)."""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.gpt_calls.insert_one({
+            "id": str(uuid.uuid4()),
+            "model": model,
+            "reasoning_effort": reasoning_effort,
+            "max_output_tokens": max_output_tokens,
+            "source": source,
+            "node_id": node_id,
+            "stream": stream,
+            "cache_hit": bool(result and result.cache_hit),
+            "status": "error" if error else "ok",
+            "error": (str(error) or type(error).__name__)[:500] if error else None,
+            "latency_ms": latency_ms,
+            "ttft_ms": ttft_ms,
+            "prompt_tokens": result.prompt_tokens if result else 0,
+            "completion_tokens": result.completion_tokens if result else 0,
+            "cached_tokens": result.cached_tokens if result else 0,
+            "created_at": now.isoformat(),
+            "expires_at": now + timedelta(days=GPT_TELEMETRY_RETENTION_DAYS),
+        })
+    except Exception as e:
+        logger.warning(f"GPT telemetry write failed: {e}")
+
+
+def record_gpt_call_later(*args, **kwargs):
+    """record_gpt_call in the background, so the write adds no latency to the call."""
+    task = asyncio.create_task(record_gpt_call(*args, **kwargs))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def gpt_call_summary(
+    days: int = 7,
+    group: str = "model",
+    source: Optional[str] = None,
+    model: Optional[str] = None,
+    include_cache_hits: bool = False,
+) -> dict:
+    """Latency / TTFT percentiles and mean tokens of recent calls, grouped by SUMMARY_GROUPS[group]."""
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    query = {"created_at": {"$gte": since}}
+    if source:
+        query["source"] = source
+    if model:
+        query["model"] = model
+    if not include_cache_hits:
+        query["cache_hit"] = False
+    group_by = SUMMARY_GROUPS[group]
+    records = await db.gpt_calls.find(
+        query,
+        {"_id": 0, "status": 1, "latency_ms": 1, "ttft_ms": 1,
+         "prompt_tokens": 1, "completion_tokens": 1, "cached_tokens": 1,
+         **{k: 1 for k in group_by}},
+    ).sort("created_at", -1).to_list(GPT_TELEMETRY_SUMMARY_LIMIT)
+    return {
+        "since": since,
+        "calls": len(records),
+        "truncated": len(records) == GPT_TELEMETRY_SUMMARY_LIMIT,
+        "groups": summarize_calls(records, group_by),
+    }
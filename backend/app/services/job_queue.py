@@ -0,0 +1,252 @@
+"""
+Durable background job queue backed by MongoDB (`jobs` collection).
+
+The API only enqueues; workers (see app/worker.py) claim jobs with a lease.
+A worker that dies simply stops renewing its lease and the job is picked up
+again by another worker once the lease expires, as long as it has attempts
+left; a job that took its worker down on every attempt (OOM, a crashing
+ffmpeg) is marked `failed` by `fail_expired_jobs` instead. Failed jobs are
+retried with exponential backoff up to `max_attempts`, then marked `failed`.
+A handler that cannot run yet (e.g. a busy transcription pool) raises
+JobDeferred: the job is put back after a delay without using up an attempt.
+Per-org concurrency is capped by JOB_ORG_CONCURRENCY running jobs.
+"""
+import os
+import uuid
+import random
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+from pymongo import ReturnDocument
+from app.core.database import db
+
+logger = logging.getLogger(__name__)
+
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 120))
+JOB_ORG_CONCURRENCY = int(os.environ.get("JOB_ORG_CONCURRENCY", 2))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 5))
+JOB_BACKOFF_BASE_SECONDS = 15
+JOB_BACKOFF_MAX_SECONDS = 15 * 60
+
+
+# Attempts left: jobs queued before max_attempts existed use the default
+_HAS_ATTEMPTS_LEFT = {"$lt": ["$attempts", {"$ifNull": ["$max_attempts", JOB_MAX_ATTEMPTS]}]}
+_OUT_OF_ATTEMPTS = {"$gte": ["$attempts", {"$ifNull": ["$max_attempts", JOB_MAX_ATTEMPTS]}]}
+
+
+class JobDeferred(Exception):
+    """Raised by a job handler to retry later without counting a failed attempt."""
+
+    def __init__(self, delay: float, reason: str = ""):
+        super().__init__(reason or f"deferred for {delay:.0f}s")
+        self.delay = delay
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def backoff_delay(attempts: int) -> float:
+    """Exponential backoff with jitter: 15s, 30s, 60s ... capped at 15 min."""
+    delay = min(JOB_BACKOFF_BASE_SECONDS * (2 ** max(attempts - 1, 0)), JOB_BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+async def ensure_job_indexes():
+    await db.jobs.create_index([("status", 1), ("run_after", 1)])
+    await db.jobs.create_index([("org_id", 1), ("status", 1)])
+    await db.jobs.create_index("id", unique=True)
+
+
+async def enqueue_job(
+    job_type: str,
+    payload: dict,
+    org_id: Optional[str] = None,
+    max_attempts: int = JOB_MAX_ATTEMPTS,
+) -> str:
+    """Persist a job for the worker pool. Returns the job id."""
+    now = _now().isoformat()
+    job_id = str(uuid.uuid4())
+    await db.jobs.insert_one({
+        "id": job_id,
+        "type": job_type,
+        "payload": payload,
+        "org_id": org_id,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "run_after": now,
+        "lease_expires_at": None,
+        "worker_id": None,
+        "last_error": None,
+        "created_at": now,
+        "updated_at": now,
+    })
+    logger.info(f"Job enqueued: {job_type} id={job_id} org={org_id}")
+    return job_id
+
+
+async def _busy_org_ids(now_iso: str) -> list:
+    """Orgs that already have JOB_ORG_CONCURRENCY jobs running under a live lease."""
+    pipeline = [
+        {"$match": {"status": "running", "lease_expires_at": {"$gt": now_iso}, "org_id": {"$ne": None}}},
+        {"$group": {"_id": "$org_id", "running": {"$sum": 1}}},
+        {"$match": {"running": {"$gte": JOB_ORG_CONCURRENCY}}},
+    ]
+    rows = await db.jobs.aggregate(pipeline).to_list(10000)
+    return [r["_id"] for r in rows]
+
+
+async def claim_job(worker_id: str, job_types: list) -> Optional[dict]:
+    """Atomically lease the oldest runnable job, or return None."""
+    now = _now()
+    now_iso = now.isoformat()
+    busy = await _busy_org_ids(now_iso)
+    query = {
+        "type": {"$in": job_types},
+        "$or": [
+            {"status": "queued", "run_after": {"$lte": now_iso}},
+            # Lease expired: the previous worker died mid-job
+            {"status": "running", "lease_expires_at": {"$lte": now_iso}, "$expr": _HAS_ATTEMPTS_LEFT},
+        ],
+    }
+    if busy:
+        query["org_id"] = {"$nin": busy}
+
+    job = await db.jobs.find_one_and_update(
+        query,
+        {
+            "$set": {
+                "status": "running",
+                "worker_id": worker_id,
+                "lease_expires_at": (now + timedelta(seconds=JOB_LEASE_SECONDS)).isoformat(),
+                "updated_at": now_iso,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("run_after", 1)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not job or not job.get("org_id"):
+        return job
+
+    # Two workers may race past the busy-org check; the loser hands the job back.
+    running = await db.jobs.count_documents({
+        "org_id": job["org_id"], "status": "running", "lease_expires_at": {"$gt": now_iso},
+    })
+    if running > JOB_ORG_CONCURRENCY:
+        await db.jobs.update_one(
+            {"id": job["id"], "worker_id": worker_id},
+            {"$set": {"status": "queued", "worker_id": None, "lease_expires_at": None},
+             "$inc": {"attempts": -1}},
+        )
+        return None
+    return job
+
+
+async def renew_lease(job_id: str, worker_id: str) -> bool:
+    """Extend the lease of a running job. False if the job was taken over."""
+    now = _now()
+    result = await db.jobs.update_one(
+        {"id": job_id, "worker_id": worker_id, "status": "running"},
+        {"$set": {
+            "lease_expires_at": (now + timedelta(seconds=JOB_LEASE_SECONDS)).isoformat(),
+            "updated_at": now.isoformat(),
+        }},
+    )
+    return result.matched_count > 0
+
+
+async def complete_job(job_id: str, worker_id: str):
+    now_iso = _now().isoformat()
+    await db.jobs.update_one(
+        {"id": job_id, "worker_id": worker_id},
+        {"$set": {"status": "done", "lease_expires_at": None, "finished_at": now_iso, "updated_at": now_iso}},
+    )
+
+
+async def fail_job(job: dict, worker_id: str, error: str) -> bool:
+    """Record a failed attempt. Returns True if the job will be retried."""
+    now = _now()
+    if job["attempts"] < job.get("max_attempts", JOB_MAX_ATTEMPTS):
+        run_after = now + timedelta(seconds=backoff_delay(job["attempts"]))
+        await db.jobs.update_one(
+            {"id": job["id"], "worker_id": worker_id},
+            {"$set": {
+                "status": "queued",
+                "worker_id": None,
+                "lease_expires_at": None,
+                "run_after": run_after.isoformat(),
+                "last_error": error,
+                "updated_at": now.isoformat(),
+            }},
+        )
+        logger.warning(f"Job {job['id']} attempt {job['attempts']} failed, retry at {run_after.isoformat()}: {error}")
+        return True
+
+    await db.jobs.update_one(
+        {"id": job["id"], "worker_id": worker_id},
+        {"$set": {
+            "status": "failed",
+            "lease_expires_at": None,
+            "last_error": error,
+            "finished_at": now.isoformat(),
+            "updated_at": now.isoformat(),
+        }},
+    )
+    logger.error(f"Job {job['id']} failed permanently after {job['attempts']} attempts: {error}")
+    return False
+
+
+async def release_job(job: dict, worker_id: str, delay: float, reason: str):
+    """Put a claimed job back in the queue after `delay` seconds; the attempt is not counted."""
+    now = _now()
+    run_after = now + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+    await db.jobs.update_one(
+        {"id": job["id"], "worker_id": worker_id},
+        {"$set": {
+            "status": "queued",
+            "worker_id": None,
+            "lease_expires_at": None,
+            "run_after": run_after.isoformat(),
+            "last_error": reason,
+            "updated_at": now.isoformat(),
+        }, "$inc": {"attempts": -1}},
+    )
+    logger.info(f"Job {job['id']} deferred until {run_after.isoformat()}: {reason}")
+
+
+async def fail_expired_jobs() -> list:
+    """Mark running jobs whose lease expired on their last attempt as failed.
+
+    Their worker died mid-job on every attempt, so claim_job no longer picks
+    them up. Returns the failed jobs (for the failure handlers).
+    """
+    failed = []
+    while True:
+        now_iso = _now().isoformat()
+        job = await db.jobs.find_one_and_update(
+            {"status": "running", "lease_expires_at": {"$lte": now_iso}, "$expr": _OUT_OF_ATTEMPTS},
+            {"$set": {
+                "status": "failed",
+                "lease_expires_at": None,
+                "last_error": "Worker stopped responding on the last attempt (lease expired)",
+                "finished_at": now_iso,
+                "updated_at": now_iso,
+            }},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        if not job:
+            return failed
+        logger.error(f"Job {job['id']} failed permanently: lease expired after {job['attempts']} attempts")
+        failed.append(job)
+
+
+async def queue_depth(job_types: Optional[list] = None) -> int:
+    """Number of jobs that are runnable right now."""
+    query = {"status": "queued", "run_after": {"$lte": _now().isoformat()}}
+    if job_types:
+        query["type"] = {"$in": job_types}
+    return await db.jobs.count_documents(query)
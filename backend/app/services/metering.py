@@ -2,23 +2,19 @@ import uuid
 import logging
 from datetime import datetime, timezone
 from app.core.database import db
+from app.services.settings_cache import settings_cache
+from app.services.metering_ledger import record_charge
+from app.services.usage_rollups import get_month_usage
+from app.utils.pricing import (  # pricing constants/helpers re-exported for existing imports
+    MODEL_PRICING,
+    DEFAULT_PRICING,
+    MarkupTable,
+    calculate_base_cost,
+    usd_to_credits,
+)
 
 logger = logging.getLogger(__name__)
 
-# Model pricing (per 1M tokens) — updated for current models
-MODEL_PRICING = {
-    "gpt-4o": {"input": 2.50, "output": 10.00},
-    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
-    "gpt-4-turbo": {"input": 10.00, "output": 30.00},
-    "gpt-4": {"input": 30.00, "output": 60.00},
-    "gpt-3.5-turbo": {"input": 0.50, "output": 1.50},
-    "gpt-5.2": {"input": 2.50, "output": 10.00},
-    "o1": {"input": 15.00, "output": 60.00},
-    "o1-mini": {"input": 3.00, "output": 12.00},
-}
-
-DEFAULT_PRICING = {"input": 5.00, "output": 15.00}
-
 DEFAULT_MARKUP_TIERS = [
     {"min_cost": 0.0, "max_cost": 0.001, "multiplier": 10.0},
     {"min_cost": 0.001, "max_cost": 0.01, "multiplier": 7.0},
@@ -28,16 +24,14 @@ DEFAULT_MARKUP_TIERS = [
 ]
 
 
-def calculate_base_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
-    """Calculate base USD cost from token usage."""
-    pricing = MODEL_PRICING.get(model, DEFAULT_PRICING)
-    input_cost = (prompt_tokens / 1_000_000) * pricing["input"]
-    output_cost = (completion_tokens / 1_000_000) * pricing["output"]
-    return input_cost + output_cost
+async def get_markup_tiers() -> list:
+    """Get markup tiers (cached), seeding defaults on first use."""
+    table = await get_markup_table()
+    return [dict(t) for t in table.tiers]
 
 
-async def get_markup_tiers() -> list:
-    """Get markup tiers from DB, or seed defaults."""
+async def _load_markup_tiers() -> list:
+    """Load markup tiers from DB, or seed defaults."""
     tiers = await db.markup_tiers.find({}, {"_id": 0}).sort("min_cost", 1).to_list(100)
     if not tiers:
         now = datetime.now(timezone.utc).isoformat()
@@ -51,19 +45,19 @@ async def get_markup_tiers() -> list:
     return tiers
 
 
-async def apply_markup(base_cost: float) -> tuple:
-    """Apply tiered markup. Returns (final_cost_usd, multiplier_used)."""
-    tiers = await get_markup_tiers()
-    for tier in tiers:
-        if tier["min_cost"] <= base_cost < tier["max_cost"]:
-            return base_cost * tier["multiplier"], tier["multiplier"]
-    # Fallback: lowest multiplier
-    return base_cost * 2.0, 2.0
+async def get_markup_table() -> MarkupTable:
+    """Markup tiers compiled for bisect lookup, cached in-process."""
+    return await settings_cache.get("markup_tiers", _load_markup_table, copy_value=False)
+
 
+async def _load_markup_table() -> MarkupTable:
+    return MarkupTable(await _load_markup_tiers())
 
-def usd_to_credits(usd: float) -> float:
-    """Convert USD to credits. 1 credit = $0.02."""
-    return usd / 0.02
+
+async def apply_markup(base_cost: float) -> tuple:
+    """Apply tiered markup. Returns (final_cost_usd, multiplier_used)."""
+    table = await get_markup_table()
+    return table.apply(base_cost)
 
 
 # ── Cost Settings ──
@@ -77,7 +71,12 @@ DEFAULT_COST_SETTINGS = {
 
 
 async def get_cost_settings() -> dict:
-    """Get cost settings from DB or return defaults."""
+    """Get cost settings (cached) or defaults."""
+    return await settings_cache.get("cost_settings", _load_cost_settings)
+
+
+async def _load_cost_settings() -> dict:
+    """Load cost settings from DB or return defaults."""
     doc = await db.settings.find_one({"key": "cost_settings"}, {"_id": 0})
     if doc and "value" in doc:
         settings = {**DEFAULT_COST_SETTINGS, **doc["value"]}
@@ -95,11 +94,15 @@ async def update_cost_settings(updates: dict) -> dict:
         {"$set": {"key": "cost_settings", "value": current, "updated_at": now}},
         upsert=True,
     )
+    await settings_cache.invalidate("cost_settings")
     return current
 
 
-async def deduct_transcription_cost(org_id: str, user_id: str, duration_seconds: float) -> dict:
-    """Deduct transcription cost from org balance after successful Deepgram transcription."""
+async def deduct_transcription_cost(org_id: str, user_id: str, duration_seconds: float, request_key: str = None) -> dict:
+    """Deduct transcription cost from org balance after successful Deepgram transcription.
+
+    `request_key` makes the charge idempotent (e.g. a retried transcription job).
+    """
     settings = await get_cost_settings()
     duration_minutes = duration_seconds / 60.0
     base_cost_usd = duration_minutes * settings["transcription_cost_per_minute_usd"]
@@ -111,21 +114,22 @@ async def deduct_transcription_cost(org_id: str, user_id: str, duration_seconds:
 
     now = datetime.now(timezone.utc).isoformat()
 
-    await db.credit_balances.update_one(
-        {"org_id": org_id},
-        {"$inc": {"balance": -credits_used}, "$set": {"updated_at": now}},
+    duplicate = await record_charge(
+        org_id=org_id,
+        user_id=user_id,
+        credits=credits_used,
+        transaction={
+            "org_id": org_id,
+            "user_id": user_id,
+            "type": "deduction",
+            "amount": round(credits_used, 4),
+            "description": f"Транскрибация: {duration_minutes:.1f} мин (${base_cost_usd:.4f} x{settings['transcription_cost_multiplier']})",
+            "created_at": now,
+        },
+        request_key=request_key,
     )
-
-    txn_id = str(uuid.uuid4())
-    await db.transactions.insert_one({
-        "id": txn_id,
-        "org_id": org_id,
-        "user_id": user_id,
-        "type": "deduction",
-        "amount": round(credits_used, 4),
-        "description": f"Транскрибация: {duration_minutes:.1f} мин (${base_cost_usd:.4f} x{settings['transcription_cost_multiplier']})",
-        "created_at": now,
-    })
+    if duplicate:
+        return {"credits_used": 0, "duplicate": True}
 
     logger.info(
         f"Transcription cost: org={org_id} user={user_id} "
@@ -151,18 +155,8 @@ async def check_user_monthly_limit(user: dict) -> bool:
     if limit == 0:
         return True  # No limit
 
-    now = datetime.now(timezone.utc)
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
-
-    pipeline = [
-        {"$match": {
-            "user_id": user["id"],
-            "created_at": {"$gte": month_start},
-        }},
-        {"$group": {"_id": None, "total_tokens": {"$sum": "$total_tokens"}}},
-    ]
-    result = await db.usage_records.aggregate(pipeline).to_list(1)
-    used = result[0]["total_tokens"] if result else 0
+    usage = await get_month_usage("user", user["id"])
+    used = usage["total_tokens"]
 
     return used < limit
 
@@ -185,52 +179,74 @@ async def deduct_credits_and_record(
     prompt_tokens: int,
     completion_tokens: int,
     source: str,
+    request_key: str = None,
+    cached_tokens: int = 0,
+    cache_hit: bool = False,
 ) -> dict:
-    """Full metering pipeline: calculate cost, apply markup, deduct credits, record usage."""
-    total_tokens = prompt_tokens + completion_tokens
-    base_cost = calculate_base_cost(model, prompt_tokens, completion_tokens)
-    final_cost_usd, multiplier = await apply_markup(base_cost)
-    credits_used = usd_to_credits(final_cost_usd)
-
-    now = datetime.now(timezone.utc).isoformat()
+    """Full metering pipeline: calculate cost, apply markup, deduct credits, record usage.
 
-    # Deduct from balance
-    await db.credit_balances.update_one(
-        {"org_id": org_id},
-        {"$inc": {"balance": -credits_used}, "$set": {"updated_at": now}},
-    )
+    `cached_tokens` (the part of the prompt served from the provider's
+    prompt cache) is billed at the model's cached input rate. `cache_hit`
+    answers came from the response cache: they get a zero-cost usage record
+    and no transaction.
 
-    # Record transaction
-    txn_id = str(uuid.uuid4())
-    await db.transactions.insert_one({
-        "id": txn_id,
-        "org_id": org_id,
-        "user_id": user_id,
-        "type": "deduction",
-        "amount": round(credits_used, 4),
-        "description": f"AI: {source} ({model}, {total_tokens} токенов)",
-        "created_at": now,
-    })
+    The write is a single ledger insert (see services/metering_ledger.py);
+    pass `request_key` to make retries of the same call idempotent.
+    """
+    total_tokens = prompt_tokens + completion_tokens
+    if cache_hit:
+        base_cost, final_cost_usd, multiplier, credits_used = 0.0, 0.0, 1.0, 0.0
+    else:
+        base_cost = calculate_base_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+        final_cost_usd, multiplier = await apply_markup(base_cost)
+        credits_used = usd_to_credits(final_cost_usd)
 
-    # Record usage for monthly limits
-    await db.usage_records.insert_one({
-        "id": str(uuid.uuid4()),
+    now = datetime.now(timezone.utc).isoformat()
+    usage = {
         "org_id": org_id,
         "user_id": user_id,
         "model": model,
         "prompt_tokens": prompt_tokens,
         "completion_tokens": completion_tokens,
         "total_tokens": total_tokens,
+        "cached_tokens": cached_tokens,
+        "cache_hit": cache_hit,
         "base_cost_usd": round(base_cost, 8),
         "markup_multiplier": multiplier,
         "final_cost_usd": round(final_cost_usd, 8),
         "credits_used": round(credits_used, 4),
         "source": source,
         "created_at": now,
-    })
+    }
+
+    # Balance deduction, transaction and usage record in one ledger write
+    duplicate = await record_charge(
+        org_id=org_id,
+        user_id=user_id,
+        credits=credits_used,
+        transaction=None if cache_hit else {
+            "org_id": org_id,
+            "user_id": user_id,
+            "type": "deduction",
+            "amount": round(credits_used, 4),
+            "description": f"AI: {source} ({model}, {total_tokens} токенов)",
+            "created_at": now,
+        },
+        usage=usage,
+        request_key=request_key,
+    )
+    if duplicate and duplicate.get("usage"):
+        usage = duplicate["usage"]
+        result = {k: usage[k] for k in (
+            "prompt_tokens", "completion_tokens", "total_tokens", "base_cost_usd",
+            "markup_multiplier", "final_cost_usd", "credits_used",
+        )}
+        result["cached_tokens"] = usage.get("cached_tokens", 0)
+        result["cache_hit"] = usage.get("cache_hit", False)
+        return result
 
     logger.info(
-        f"Metering: user={user_id} model={model} tokens={total_tokens} "
+        f"Metering: user={user_id} model={model} tokens={total_tokens} cached={cached_tokens} "
         f"base=${base_cost:.6f} markup={multiplier}x final=${final_cost_usd:.6f} "
         f"credits={credits_used:.4f}"
     )
@@ -239,6 +255,8 @@ async def deduct_credits_and_record(
         "prompt_tokens": prompt_tokens,
         "completion_tokens": completion_tokens,
         "total_tokens": total_tokens,
+        "cached_tokens": cached_tokens,
+        "cache_hit": cache_hit,
         "base_cost_usd": round(base_cost, 8),
         "markup_multiplier": multiplier,
         "final_cost_usd": round(final_cost_usd, 8),
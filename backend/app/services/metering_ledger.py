@@ -0,0 +1,289 @@
+"""
+Metering ledger: one write per metered call, projected in batches.
+
+The request path records a charge with a single `insert_one` into
+`metering_ledger`. That document already holds the balance delta, the
+transaction and the usage record. A unique `request_key` makes a retried
+call a no-op. The projector applies pending entries to `credit_balances`,
+`transactions` and `usage_records`:
+
+  1. pending entries are grouped per org into a batch (state "applying")
+  2. the org balance gets one $inc for the whole batch, guarded by the
+     batch id (`applied_batches`, app/utils/ledger_batches.py) so
+     re-applying the same batch is a no-op
+  3. transactions / usage_records are upserted by ledger id (bulk_write)
+     and the monthly usage rollups are incremented (same batch guard)
+  4. the batch is marked "applied"
+
+A crash at any step leaves the batch "applying", and the next cycle
+resumes it before any new batch, so every entry is applied exactly once.
+Only one projector runs at a time (lease in `locks`); the others stand by.
+The lease is renewed before every batch and projection stops as soon as it
+is lost, so a projector that stalled past its lease cannot keep applying
+batches next to the one that took over. `projector_paused()` holds the
+lease for jobs that must not interleave with projection (the usage rollup
+rebuild).
+"""
+import os
+import uuid
+import socket
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from app.core.database import db
+from app.services.usage_rollups import apply_rollups, ensure_rollup_indexes
+from app.utils.ledger_batches import mark_applied, not_applied
+
+logger = logging.getLogger(__name__)
+
+METERING_FLUSH_INTERVAL = float(os.environ.get("METERING_FLUSH_INTERVAL", 0.5))
+METERING_BATCH_SIZE = int(os.environ.get("METERING_BATCH_SIZE", 1000))
+PROJECTOR_LEASE_SECONDS = 30
+PROJECTOR_PAUSE_SECONDS = 600
+PROJECTOR_LOCK_KEY = "metering_projector"
+
+_wake: Optional[asyncio.Event] = None
+
+
+class ProjectorLeaseLost(Exception):
+    pass
+
+
+class ProjectorBusy(Exception):
+    """Projection is already paused by another process."""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _wake_event() -> asyncio.Event:
+    global _wake
+    if _wake is None:
+        _wake = asyncio.Event()
+    return _wake
+
+
+async def ensure_ledger_indexes():
+    await db.metering_ledger.create_index("request_key", unique=True)
+    await db.metering_ledger.create_index([("state", 1), ("created_at", 1)])
+    await db.metering_ledger.create_index("batch_id")
+    await _ensure_unique_transaction_id()
+    await db.usage_records.create_index("id")
+    await ensure_rollup_indexes()
+
+
+async def _ensure_unique_transaction_id():
+    """Unique transactions.id, so concurrent upserts by id cannot insert duplicates.
+
+    Replaces the earlier non-unique index; if duplicates already exist the
+    non-unique index is kept and the error logged.
+    """
+    try:
+        await db.transactions.create_index("id", unique=True)
+        return
+    except OperationFailure as e:
+        if e.code not in (85, 86):  # IndexOptionsConflict / IndexKeySpecsConflict
+            raise
+    await db.transactions.drop_index("id_1")
+    try:
+        await db.transactions.create_index("id", unique=True)
+    except DuplicateKeyError as e:
+        logger.error(f"transactions.id has duplicates, keeping a non-unique index: {e}")
+        await db.transactions.create_index("id")
+
+
+async def record_charge(
+    org_id: str,
+    user_id: str,
+    credits: float,
+    transaction: Optional[dict],
+    usage: Optional[dict] = None,
+    request_key: Optional[str] = None,
+) -> Optional[dict]:
+    """Record a charge in one round-trip.
+
+    Returns None when recorded, or the existing ledger entry when
+    `request_key` was already charged. `transaction` may be None for
+    zero-cost usage that should not show up in the org's transactions.
+    """
+    entry_id = str(uuid.uuid4())
+    now = (transaction or usage or {}).get("created_at") or _now().isoformat()
+    entry = {
+        "id": entry_id,
+        "request_key": request_key or entry_id,
+        "org_id": org_id,
+        "user_id": user_id,
+        "credits": credits,
+        "transaction": {**transaction, "id": entry_id} if transaction else None,
+        "usage": {**usage, "id": entry_id} if usage else None,
+        "state": "pending",
+        "batch_id": None,
+        "created_at": now,
+    }
+    try:
+        await db.metering_ledger.insert_one(entry)
+    except DuplicateKeyError:
+        existing = await db.metering_ledger.find_one({"request_key": request_key}, {"_id": 0})
+        logger.info(f"Metering: request_key={request_key} already charged, skipping")
+        return existing
+    _wake_event().set()
+    return None
+
+
+async def _apply_batch(batch_id: str, org_id: str, entries: list):
+    now = _now().isoformat()
+    total = sum(e["credits"] for e in entries)
+    if total:
+        await db.credit_balances.update_one(
+            {"org_id": org_id, **not_applied(batch_id)},
+            {"$inc": {"balance": -total}, "$set": {"updated_at": now}, **mark_applied(batch_id)},
+        )
+    txn_ops = [UpdateOne({"id": e["id"]}, {"$setOnInsert": e["transaction"]}, upsert=True) for e in entries if e.get("transaction")]
+    usage_ops = [UpdateOne({"id": e["id"]}, {"$setOnInsert": e["usage"]}, upsert=True) for e in entries if e.get("usage")]
+    if txn_ops:
+        await db.transactions.bulk_write(txn_ops, ordered=False)
+    if usage_ops:
+        await db.usage_records.bulk_write(usage_ops, ordered=False)
+        await apply_rollups([e["usage"] for e in entries if e.get("usage")], batch_id)
+    await db.metering_ledger.update_many(
+        {"batch_id": batch_id},
+        {"$set": {"state": "applied", "applied_at": now}},
+    )
+
+
+async def _check_lease(owner: Optional[str]):
+    if owner and not await _acquire_lease(owner):
+        logger.warning(f"Metering projector {owner} lost its lease, stopping")
+        raise ProjectorLeaseLost()
+
+
+async def project_pending(owner: Optional[str] = None) -> int:
+    """Apply unfinished and pending ledger entries. Returns the number applied.
+
+    With `owner`, the projector lease is renewed before each batch and
+    ProjectorLeaseLost is raised once another process holds it.
+    """
+    applied = 0
+
+    # Resume batches interrupted mid-way first, whole (a batch is applied as one unit)
+    for batch_id in await db.metering_ledger.distinct("batch_id", {"state": "applying"}):
+        entries = await db.metering_ledger.find({"batch_id": batch_id}, {"_id": 0}).to_list(None)
+        await _check_lease(owner)
+        await _apply_batch(batch_id, entries[0]["org_id"], entries)
+        applied += len(entries)
+
+    pending = await db.metering_ledger.find(
+        {"state": "pending"}, {"_id": 0}
+    ).sort("created_at", 1).to_list(METERING_BATCH_SIZE)
+    by_org = defaultdict(list)
+    for e in pending:
+        by_org[e["org_id"]].append(e)
+    for org_id, entries in by_org.items():
+        batch_id = str(uuid.uuid4())
+        ids = [e["id"] for e in entries]
+        await db.metering_ledger.update_many(
+            {"id": {"$in": ids}, "state": "pending"},
+            {"$set": {"state": "applying", "batch_id": batch_id}},
+        )
+        claimed = await db.metering_ledger.find({"batch_id": batch_id}, {"_id": 0}).to_list(len(ids))
+        if claimed:
+            await _check_lease(owner)
+            await _apply_batch(batch_id, org_id, claimed)
+            applied += len(claimed)
+    return applied
+
+
+async def _acquire_lease(owner: str) -> bool:
+    now = _now()
+    try:
+        await db.locks.update_one(
+            {"key": PROJECTOR_LOCK_KEY, "$and": [
+                {"$or": [{"owner": owner}, {"owner": None}, {"lease_expires_at": {"$lt": now.isoformat()}}]},
+                # While paused, only the pausing process may hold the lease
+                {"$or": [{"paused_by": None}, {"paused_by": owner}, {"paused_until": {"$lt": now.isoformat()}}]},
+            ]},
+            {"$set": {
+                "owner": owner,
+                "lease_expires_at": (now + timedelta(seconds=PROJECTOR_LEASE_SECONDS)).isoformat(),
+            }},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def _release_lease(owner: str):
+    await db.locks.update_one(
+        {"key": PROJECTOR_LOCK_KEY, "owner": owner},
+        {"$set": {"lease_expires_at": _now().isoformat()}},
+    )
+
+
+@asynccontextmanager
+async def projector_paused():
+    """Stop projection for the duration of the block (at most PROJECTOR_PAUSE_SECONDS).
+
+    Waits for the running projector to finish its current batch, then
+    completes interrupted batches, so usage_records and everything derived
+    from them are consistent inside the block. Raises ProjectorBusy when
+    another process has already paused projection.
+    """
+    owner = f"pause:{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    now = _now()
+    await db.locks.create_index("key", unique=True)
+    try:
+        await db.locks.update_one(
+            {"key": PROJECTOR_LOCK_KEY, "$or": [{"paused_by": None}, {"paused_until": {"$lt": now.isoformat()}}]},
+            {"$set": {
+                "paused_by": owner,
+                "paused_until": (now + timedelta(seconds=PROJECTOR_PAUSE_SECONDS)).isoformat(),
+            }},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        raise ProjectorBusy()
+    try:
+        # The projector gives the lease up at its next batch; a stalled one loses it on expiry
+        while not await _acquire_lease(owner):
+            await asyncio.sleep(1)
+        await project_pending(owner)
+        yield
+    finally:
+        await db.locks.update_one(
+            {"key": PROJECTOR_LOCK_KEY, "paused_by": owner},
+            {"$set": {"paused_by": None, "owner": None, "lease_expires_at": _now().isoformat()}},
+        )
+
+
+async def run_ledger_projector(stop: Optional[asyncio.Event] = None):
+    """Background loop: project ledger entries while holding the projector lease."""
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    await db.locks.create_index("key", unique=True)
+    await ensure_ledger_indexes()
+    wake = _wake_event()
+    while not (stop and stop.is_set()):
+        try:
+            if not await _acquire_lease(owner):
+                raise ProjectorLeaseLost()
+            while await project_pending(owner) >= METERING_BATCH_SIZE:
+                pass
+        except ProjectorLeaseLost:
+            try:
+                # No-op unless still ours (projection paused): lets the pausing process in without waiting for expiry
+                await _release_lease(owner)
+            except Exception as e:
+                logger.error(f"Metering projector lease release failed: {e}")
+        except Exception as e:
+            logger.error(f"Metering projector error: {e}")
+        try:
+            await asyncio.wait_for(wake.wait(), timeout=METERING_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        wake.clear()
@@ -1,56 +1,148 @@
+"""
+PDF text extraction with OCR fallback.
+
+Pages whose text layer is good enough are used as is; only the others are
+rendered and OCRed. OCR runs in a process pool (OCR_PROCESSES, default: all
+cores), with at most twice as many pages in flight as there are processes.
+Pages are yielded in order as they become available, and extraction stops
+once `max_chars` is reached, so large scans are not OCRed beyond what is
+kept.
+
+extract_text_from_pdf() blocks; async code should call
+extract_text_from_pdf_async() (or run it in a thread).
+"""
+import io
+import os
+import re
+import asyncio
 import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
 import fitz  # PyMuPDF
 import pytesseract
 from PIL import Image
-import io
 
 logger = logging.getLogger(__name__)
 
+OCR_PROCESSES = int(os.environ.get("OCR_PROCESSES", 0)) or os.cpu_count() or 1
+OCR_DPI = 200
+OCR_LANG = "rus+eng"
+# A page's text layer is used when it has at least this many letters/digits
+TEXT_LAYER_MIN_CHARS = 30
+
+TRUNCATED_MARK = "\n...[обрезано]"
+
+_pool: Optional[ProcessPoolExecutor] = None
+# PyMuPDF is not thread-safe; extraction runs in worker threads, OCR in processes
+_fitz_lock = threading.Lock()
+
+
+def _ocr_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: children must not inherit the API's event loop and DB client
+        _pool = ProcessPoolExecutor(max_workers=OCR_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_ocr_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _ocr_png(png_bytes: bytes, lang: str) -> str:
+    """Runs in an OCR process."""
+    img = Image.open(io.BytesIO(png_bytes))
+    return pytesseract.image_to_string(img, lang=lang).strip()
+
+
+def text_layer_ok(text: str) -> bool:
+    return len(re.findall(r"\w", text or "")) >= TEXT_LAYER_MIN_CHARS
+
+
+def iter_pdf_text(pdf_bytes: bytes, max_chars: int = 100000) -> Iterator[tuple]:
+    """Yield (page_index, text, source) in page order, source being "text" or "ocr".
+
+    Stops after the page that reaches max_chars; OCR of later pages is
+    cancelled.
+    """
+    with _fitz_lock:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        layers = [page.get_text("text").strip() for page in doc]
+    try:
+        ocr_needed = [i for i, text in enumerate(layers) if not text_layer_ok(text)]
+        ocr_pages = set(ocr_needed)
+        if ocr_needed:
+            logger.info(f"PDF: OCR for {len(ocr_needed)}/{len(layers)} pages")
+
+        pool = _ocr_pool() if ocr_needed else None
+        in_flight = {}
+        to_submit = iter(ocr_needed)
+
+        def fill():
+            while len(in_flight) < OCR_PROCESSES * 2:
+                i = next(to_submit, None)
+                if i is None:
+                    return
+                with _fitz_lock:
+                    png = doc[i].get_pixmap(dpi=OCR_DPI).tobytes("png")
+                in_flight[i] = pool.submit(_ocr_png, png, OCR_LANG)
+
+        total = 0
+        try:
+            for i, layer in enumerate(layers):
+                source = "text"
+                text = layer
+                if i in ocr_pages:
+                    fill()
+                    try:
+                        ocr_text = in_flight.pop(i).result()
+                    except Exception as e:
+                        logger.warning(f"OCR failed for page {i}: {e}")
+                        ocr_text = ""
+                    if ocr_text:
+                        text, source = ocr_text, "ocr"
+                if not text:
+                    continue
+                yield i, text, source
+                total += len(text) + 2
+                if total >= max_chars:
+                    return
+        finally:
+            for future in in_flight.values():
+                future.cancel()
+    finally:
+        with _fitz_lock:
+            doc.close()
+
 
 def extract_text_from_pdf(pdf_bytes: bytes, max_chars: int = 100000) -> str:
-    """Extract text from PDF. Falls back to OCR if no text layer found."""
+    """Extract text from PDF, OCRing pages without a usable text layer."""
+    parts = []
+    sources = set()
     try:
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        for _, text, source in iter_pdf_text(pdf_bytes, max_chars):
+            parts.append(text)
+            sources.add(source)
     except Exception as e:
-        logger.warning(f"Failed to open PDF: {e}")
+        logger.warning(f"Failed to extract PDF text: {e}")
+        return "\n\n".join(parts)
+
+    if not parts:
+        logger.warning("No text extracted from PDF")
         return ""
 
-    # Step 1: Try direct text extraction
-    text_parts = []
-    for page in doc:
-        text = page.get_text("text")
-        if text.strip():
-            text_parts.append(text.strip())
-
-    if text_parts:
-        result = "\n\n".join(text_parts)
-        doc.close()
-        if len(result) > max_chars:
-            result = result[:max_chars] + "\n...[обрезано]"
-        logger.info(f"PDF text extracted: {len(result)} chars (text layer)")
-        return result
-
-    # Step 2: OCR fallback
-    logger.info("No text layer found, running OCR...")
-    ocr_parts = []
-    for i, page in enumerate(doc):
-        try:
-            pix = page.get_pixmap(dpi=200)
-            img = Image.open(io.BytesIO(pix.tobytes("png")))
-            ocr_text = pytesseract.image_to_string(img, lang="rus+eng")
-            if ocr_text.strip():
-                ocr_parts.append(ocr_text.strip())
-        except Exception as e:
-            logger.warning(f"OCR failed for page {i}: {e}")
-
-    doc.close()
-
-    if ocr_parts:
-        result = "\n\n".join(ocr_parts)
-        if len(result) > max_chars:
-            result = result[:max_chars] + "\n...[обрезано]"
-        logger.info(f"PDF text extracted: {len(result)} chars (OCR)")
-        return result
-
-    logger.warning("No text extracted from PDF")
-    return ""
+    result = "\n\n".join(parts)
+    if len(result) > max_chars:
+        result = result[:max_chars] + TRUNCATED_MARK
+    logger.info(f"PDF text extracted: {len(result)} chars ({'+'.join(sorted(sources))})")
+    return result
+
+
+async def extract_text_from_pdf_async(pdf_bytes: bytes, max_chars: int = 100000) -> str:
+    """extract_text_from_pdf without blocking the event loop."""
+    return await asyncio.to_thread(extract_text_from_pdf, pdf_bytes, max_chars)
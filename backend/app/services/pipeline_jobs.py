@@ -0,0 +1,201 @@
+"""
+Pipeline runs as background jobs.
+
+POST run-pipeline stores a `doc_runs` document (status "queued") with a
+snapshot of the pipeline graph and enqueues a "pipeline_run" job for the
+worker pool (app/worker.py). Each node's status, output, token usage and
+duration go to `doc_run_nodes` as soon as it finishes, so:
+
+- clients follow progress by polling the run or via SSE,
+- a job interrupted by a crash or deploy is retried by the queue and
+  continues from the finished nodes instead of starting over,
+- a run with failed nodes can be resumed; only failed and unfinished nodes
+  (and the nodes that consumed their output) run again.
+"""
+import uuid
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+from app.core.database import db
+from app.services.job_queue import enqueue_job
+from app.services.pipeline_runner import PipelineRun
+from app.services.attachment_text import build_source_context
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_RUN_JOB = "pipeline_run"
+PIPELINE_JOB_MAX_ATTEMPTS = 3
+TERMINAL_RUN_STATUSES = ("completed", "failed")
+
+# doc_runs documents without the graph snapshot
+RUN_PROJECTION = {"_id": 0, "graph": 0}
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+async def ensure_pipeline_run_indexes():
+    await db.doc_run_nodes.create_index([("run_id", 1), ("node_id", 1)], unique=True)
+    await db.doc_run_nodes.create_index("project_id")
+
+
+async def start_pipeline_run(project_id: str, pipeline: dict, user: dict) -> dict:
+    """Create a queued run and hand it to the worker pool."""
+    now = _now_iso()
+    run = {
+        "id": str(uuid.uuid4()),
+        "project_id": project_id,
+        "pipeline_id": pipeline["id"],
+        "pipeline_name": pipeline.get("name", ""),
+        "node_results": [],
+        "status": "queued",
+        "user_id": user["id"],
+        "org_id": user.get("org_id"),
+        "graph": {"nodes": pipeline.get("nodes", []), "edges": pipeline.get("edges", [])},
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    await db.doc_runs.insert_one(run)
+    await _enqueue(run)
+    return await db.doc_runs.find_one({"id": run["id"]}, RUN_PROJECTION)
+
+
+async def _enqueue(run: dict):
+    job_id = await enqueue_job(
+        PIPELINE_RUN_JOB,
+        {"run_id": run["id"]},
+        org_id=run.get("org_id"),
+        max_attempts=PIPELINE_JOB_MAX_ATTEMPTS,
+    )
+    await db.doc_runs.update_one({"id": run["id"]}, {"$set": {"job_id": job_id}})
+
+
+async def resume_pipeline_run(run: dict) -> dict:
+    """Queue a finished or failed run again, keeping the outputs of its completed nodes."""
+    await db.doc_run_nodes.delete_many({"run_id": run["id"], "status": {"$ne": "completed"}})
+    await db.doc_runs.update_one(
+        {"id": run["id"]},
+        {"$set": {"status": "queued", "error": None, "updated_at": _now_iso()}},
+    )
+    await _enqueue(run)
+    return await db.doc_runs.find_one({"id": run["id"]}, RUN_PROJECTION)
+
+
+async def get_run_progress(run_id: str, include_output: bool = True) -> Optional[dict]:
+    run = await db.doc_runs.find_one({"id": run_id}, RUN_PROJECTION)
+    if not run:
+        return None
+    projection = {"_id": 0, "writes": 0, "result": 0}
+    if not include_output:
+        projection["output"] = 0
+    nodes = await db.doc_run_nodes.find({"run_id": run_id}, projection).sort("started_at", 1).to_list(1000)
+    run["nodes"] = nodes
+    run["nodes_finished"] = sum(1 for n in nodes if n["status"] in ("completed", "failed"))
+    return run
+
+
+async def run_pipeline_job(run_id: str):
+    """Worker handler: execute (or continue) a queued pipeline run."""
+    run = await db.doc_runs.find_one({"id": run_id}, {"_id": 0})
+    if not run:
+        logger.warning(f"Pipeline run {run_id} not found, skipping")
+        return
+    if run["status"] == "completed":
+        return
+
+    nodes = run["graph"]["nodes"]
+    edges = run["graph"]["edges"]
+    node_map = {n["node_id"]: n for n in nodes}
+
+    finished = await db.doc_run_nodes.find(
+        {"run_id": run_id, "status": "completed"}, {"_id": 0}
+    ).to_list(None)
+    completed = {
+        d["node_id"]: {"writes": {w["name"]: w["value"] for w in d.get("writes", [])}, "result": d.get("result")}
+        for d in finished
+    }
+
+    async def on_node_start(node_id: str):
+        node = node_map[node_id]
+        await db.doc_run_nodes.update_one(
+            {"run_id": run_id, "node_id": node_id},
+            {"$set": {
+                "project_id": run["project_id"],
+                "label": node.get("label", node_id),
+                "type": node.get("node_type", ""),
+                "status": "running",
+                "started_at": _now_iso(),
+            }},
+            upsert=True,
+        )
+
+    async def on_node_done(node_id: str, info: dict):
+        usage = info["usage"] or {}
+        result = info["result"]
+        await db.doc_run_nodes.update_one(
+            {"run_id": run_id, "node_id": node_id},
+            {"$set": {
+                "status": info["status"],
+                "output": result["output"] if result else info["writes"].get(node_id),
+                "result": result,
+                # Stored as a list: output names are labels and may contain dots
+                "writes": [{"name": k, "value": v} for k, v in info["writes"].items()],
+                "prompt_tokens": usage.get("prompt_tokens", 0),
+                "completion_tokens": usage.get("completion_tokens", 0),
+                "total_tokens": usage.get("total_tokens", 0),
+                "gpt_calls": usage.get("gpt_calls", 0),
+                "duration_ms": info["duration_ms"],
+                "finished_at": _now_iso(),
+            }},
+        )
+        await db.doc_runs.update_one({"id": run_id}, {"$set": {"updated_at": _now_iso()}})
+
+    source_context = await build_source_context(run["project_id"])
+    user = {"id": run["user_id"], "org_id": run.get("org_id")}
+    pipeline_run = PipelineRun(
+        nodes, edges, source_context, user,
+        completed=completed, on_node_start=on_node_start, on_node_done=on_node_done,
+        cache_key=f"doc:{run['project_id']}", run_id=run_id,
+    )
+
+    now = _now_iso()
+    await db.doc_runs.update_one(
+        {"id": run_id},
+        {"$set": {
+            "status": "running",
+            "started_at": run.get("started_at") or now,
+            "nodes_total": len(pipeline_run.plan.order),
+            "nodes_reused": len(pipeline_run.completed),
+            "updated_at": now,
+        }},
+    )
+    if pipeline_run.completed:
+        logger.info(f"Pipeline run {run_id}: reusing {len(pipeline_run.completed)} completed nodes")
+
+    node_results = await pipeline_run.execute()
+
+    now = _now_iso()
+    await db.doc_runs.update_one(
+        {"id": run_id},
+        {"$set": {
+            "status": "completed",
+            "node_results": node_results,
+            "failed_nodes": [nid for nid in pipeline_run.plan.order if nid in pipeline_run.failed],
+            "finished_at": now,
+            "updated_at": now,
+        }},
+    )
+    await db.doc_projects.update_one(
+        {"id": run["project_id"]},
+        {"$set": {"status": "completed", "updated_at": now}}
+    )
+
+
+async def mark_pipeline_run_failed(run_id: str, error: str):
+    now = _now_iso()
+    await db.doc_runs.update_one(
+        {"id": run_id},
+        {"$set": {"status": "failed", "error": error, "finished_at": now, "updated_at": now}},
+    )
@@ -0,0 +1,547 @@
+"""
+Server-side pipeline execution for document projects.
+
+Nodes run as soon as the nodes they depend on have finished
+(see app.utils.pipeline_schedule), so independent ai_prompt branches of a
+fan-out graph call GPT concurrently. GPT calls are capped per run
+(PIPELINE_RUN_CONCURRENCY) and per organization across the runs of one
+process (PIPELINE_ORG_CONCURRENCY). The org cap is not shared between
+processes: with N worker containers an organization can have up to
+N × PIPELINE_ORG_CONCURRENCY calls in flight, so size it for the deployment.
+
+A batch_loop whose script does not read context.results sends all of its
+batches at once (node option `batch_concurrent` forces either mode); results
+keep iteration order, each batch is metered on its own and only failed
+batches are retried (PIPELINE_BATCH_ATTEMPTS).
+
+Every node sees the outputs of the already finished nodes that precede it in
+topological order, merged in that order, so results and `node_results`
+ordering are the same as with the former one-node-at-a-time loop.
+"""
+import os
+import re
+import hashlib
+import json as json_module
+import time
+import asyncio
+import logging
+import weakref
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+from app.services.gpt import GptResult, call_gpt52_metered
+from app.services.metering import deduct_credits_and_record
+from app.utils import build_input_from_map
+from app.utils.pipeline_schedule import plan_pipeline, script_reads_results
+from app.utils.prompt_layout import layout_messages, sources_system_message
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_RUN_CONCURRENCY = int(os.environ.get("PIPELINE_RUN_CONCURRENCY", 6))
+# Per process, not cluster-wide: set it to the org budget divided by the number of worker processes
+PIPELINE_ORG_CONCURRENCY = int(os.environ.get("PIPELINE_ORG_CONCURRENCY", 12))
+PIPELINE_BATCH_ATTEMPTS = int(os.environ.get("PIPELINE_BATCH_ATTEMPTS", 2))
+
+DEFAULT_NODE_SYSTEM_MESSAGE = "Ты — AI-ассистент для анализа документов. Отвечай на русском языке."
+DEFAULT_BATCH_SYSTEM_MESSAGE = "Ты — AI-ассистент для анализа."
+
+# Per-process org caps, dropped once no run holds or waits on them (an idle semaphore has nothing to remember)
+_org_semaphores = weakref.WeakValueDictionary()
+
+
+def _topo_sort(nodes, edges):
+    """Topological sort of pipeline nodes using flow edges."""
+    node_ids = {n["node_id"] for n in nodes}
+    in_deg = {n["node_id"]: 0 for n in nodes}
+    adj = {n["node_id"]: [] for n in nodes}
+    for e in edges:
+        if e["source"] in node_ids and e["target"] in node_ids:
+            adj[e["source"]].append(e["target"])
+            in_deg[e["target"]] = in_deg.get(e["target"], 0) + 1
+    queue = [nid for nid, d in in_deg.items() if d == 0]
+    result = []
+    while queue:
+        cur = queue.pop(0)
+        result.append(cur)
+        for nxt in adj.get(cur, []):
+            in_deg[nxt] -= 1
+            if in_deg[nxt] == 0:
+                queue.append(nxt)
+    return result
+
+
+def _build_data_deps(nodes, edges):
+    """Build data dependency map: node_id -> [source_node_ids]."""
+    deps = {}
+    for e in edges:
+        sh = e.get("source_handle", "") or ""
+        th = e.get("target_handle", "") or ""
+        is_data = "data" in sh or "data" in th
+        if is_data:
+            deps.setdefault(e["target"], []).append(e["source"])
+    # Merge input_from from nodes using shared utility for non-handle edges
+    edge_map = build_input_from_map(edges)
+    for n in nodes:
+        node_id = n.get("node_id")
+        input_from = n.get("input_from") or []
+        # Use edge-derived input_from as fallback if node has none
+        if not input_from and node_id in edge_map:
+            input_from = edge_map[node_id]
+        if input_from:
+            deps.setdefault(node_id, []).extend(
+                s for s in input_from if s not in deps.get(node_id, [])
+            )
+    return deps
+
+
+def _get_node_input(node_id, deps, outputs):
+    """Get input for a node from its data dependencies."""
+    sources = deps.get(node_id, [])
+    if not sources:
+        return None
+    if len(sources) == 1:
+        return outputs.get(sources[0])
+    return {sid: outputs.get(sid) for sid in sources}
+
+
+def _substitute_vars(text, outputs):
+    """Replace {{var}} placeholders with values from outputs."""
+    if not text:
+        return text
+    for match in re.findall(r'\{\{(\w+)\}\}', text):
+        val = outputs.get(match, "")
+        text = text.replace(f"{{{{{match}}}}}", str(val) if val else "")
+    return text
+
+
+def _execute_script(script_text, context):
+    """Execute a node script (parse_list, aggregate, template)."""
+    if not script_text:
+        return {"output": context.get("input")}
+    # We run simple Python-like JS scripts by extracting the function body
+    # For server-side, we use a safe subset
+    try:
+        # Try to find function run(context) { ... }
+        fn_match = re.search(r'function\s+run\s*\(\w*\)\s*\{([\s\S]*)\}\s*$', script_text)
+        if fn_match:
+            body = fn_match.group(1)
+        else:
+            body = script_text
+
+        # Simple JS->Python transpilation for common patterns
+        py_body = body
+        py_body = py_body.replace('const ', '')
+        py_body = py_body.replace('let ', '')
+        py_body = py_body.replace('var ', '')
+        py_body = py_body.replace('.join(', '.join(')
+        py_body = py_body.replace('===', '==')
+        py_body = py_body.replace('!==', '!=')
+        py_body = py_body.replace('||', ' or ')
+        py_body = py_body.replace('&&', ' and ')
+        py_body = py_body.replace('null', 'None')
+        py_body = py_body.replace('true', 'True')
+        py_body = py_body.replace('false', 'False')
+
+        local_vars = {"context": context, "result": {"output": context.get("input")}}
+        exec(py_body, {"__builtins__": {"len": len, "str": str, "int": int, "float": float, "list": list, "dict": dict, "range": range, "enumerate": enumerate, "isinstance": isinstance, "print": lambda *a: None, "json": json_module, "re": re}}, local_vars)
+
+        if "result" in local_vars and isinstance(local_vars["result"], dict):
+            return local_vars["result"]
+        return {"output": context.get("input")}
+    except Exception as e:
+        logger.warning(f"Script execution error: {e}")
+        return {"output": context.get("input"), "error": str(e)}
+
+
+def _org_semaphore(org_id: str) -> asyncio.Semaphore:
+    sem = _org_semaphores.get(org_id)
+    if sem is None:
+        sem = asyncio.Semaphore(PIPELINE_ORG_CONCURRENCY)
+        _org_semaphores[org_id] = sem
+    return sem
+
+
+class PipelineRun:
+    """One execution of a pipeline graph for a user."""
+
+    def __init__(
+        self,
+        nodes: list,
+        edges: list,
+        source_context: str,
+        user: dict,
+        completed: Optional[dict] = None,
+        on_node_start: Optional[Callable[[str], Awaitable[None]]] = None,
+        on_node_done: Optional[Callable[[str, dict], Awaitable[None]]] = None,
+        cache_key: Optional[str] = None,
+        run_id: Optional[str] = None,
+    ):
+        """completed: node_id -> {"writes", "result"} of nodes finished by an earlier
+        attempt of this run; they are not executed again (resume).
+        cache_key: provider prompt cache key shared by the run's GPT calls.
+        run_id: stored run this execution belongs to; makes its charges idempotent
+        when a node or batch is executed again (retried job, resume)."""
+        self.nodes = nodes
+        self.node_map = {n["node_id"]: n for n in nodes}
+        self.source_context = source_context
+        self.cache_key = cache_key
+        self.run_id = run_id
+        self.user = user
+        self.sorted_ids = _topo_sort(nodes, edges)
+        self.data_deps = _build_data_deps(nodes, edges)
+        self.plan = plan_pipeline(nodes, edges, self.sorted_ids, self.data_deps)
+        self.writes = {}    # node_id -> {output name: value} written by that node
+        self.results = {}   # node_id -> node_results entry
+        self.usage = {}     # node_id -> token counters of its GPT calls
+        self.failed = set() # nodes with at least one failed GPT call
+        self.completed = self._reusable(completed or {})
+        self.on_node_start = on_node_start
+        self.on_node_done = on_node_done
+        self._done = {nid: asyncio.Event() for nid in self.plan.order}
+        self._run_slots = asyncio.Semaphore(PIPELINE_RUN_CONCURRENCY)
+
+    def _reusable(self, completed: dict) -> dict:
+        """Keep completed nodes whose dependencies were all kept as well, so a
+        node re-run on resume also re-runs everything that consumed its output."""
+        kept = {}
+        for nid in self.plan.order:
+            if nid in completed and all(dep in kept for dep in self.plan.deps[nid]):
+                kept[nid] = completed[nid]
+        return kept
+
+    def _outputs_for(self, node_id: str) -> dict:
+        """Outputs visible to a node: writes of finished earlier nodes, in topological order."""
+        outputs = {}
+        for nid in self.sorted_ids:
+            if nid == node_id:
+                break
+            w = self.writes.get(nid)
+            if w:
+                outputs.update(w)
+        return outputs
+
+    @asynccontextmanager
+    async def _gpt_slot(self):
+        org_id = self.user.get("org_id")
+        async with self._run_slots:
+            if org_id:
+                async with _org_semaphore(org_id):
+                    yield
+            else:
+                yield
+
+    async def _request_gpt(self, system_msg: str, prompt: str, ai_node: dict, source: str, node_id: str) -> GptResult:
+        messages = None
+        if self.source_context:
+            # Source materials go in a stable system message shared by every call of the run,
+            # the node's own system message after it
+            messages = layout_messages([], prompt, instructions=system_msg)
+            system_msg = sources_system_message(self.source_context)
+        async with self._gpt_slot():
+            return await call_gpt52_metered(
+                system_message=system_msg,
+                user_message=prompt,
+                messages=messages,
+                reasoning_effort=ai_node.get("reasoning_effort", "high"),
+                max_output_tokens=ai_node.get("max_output_tokens"),
+                cache_key=self.cache_key,
+                use_cache=True,
+                source=source,
+                node_id=node_id,
+            )
+
+    def _charge_key(self, node_id: str, batch_index: int, system_msg: str, prompt: str) -> Optional[str]:
+        """Idempotency key of one GPT call of a stored run.
+
+        The prompt digest keeps a call whose input changed on resume (an
+        upstream node ran again) billable, while the same call repeated
+        after a crash is charged once.
+        """
+        if not self.run_id:
+            return None
+        digest = hashlib.sha256(f"{system_msg}\n{prompt}".encode("utf-8")).hexdigest()[:16]
+        return f"pipeline:{self.run_id}:{node_id}:{batch_index}:{digest}"
+
+    async def _meter(self, gpt_result: GptResult, source: str, node_id: str, request_key: Optional[str] = None):
+        usage = self.usage.setdefault(node_id, {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0, "gpt_calls": 0})
+        usage["prompt_tokens"] += gpt_result.prompt_tokens
+        usage["cached_tokens"] += gpt_result.cached_tokens
+        usage["completion_tokens"] += gpt_result.completion_tokens
+        usage["total_tokens"] += gpt_result.total_tokens
+        usage["gpt_calls"] += 1
+        org_id = self.user.get("org_id")
+        if org_id:
+            try:
+                await deduct_credits_and_record(
+                    org_id=org_id, user_id=self.user["id"],
+                    model=gpt_result.model,
+                    prompt_tokens=gpt_result.prompt_tokens,
+                    completion_tokens=gpt_result.completion_tokens,
+                    cached_tokens=gpt_result.cached_tokens,
+                    cache_hit=gpt_result.cache_hit,
+                    source=source,
+                    request_key=request_key,
+                )
+            except Exception as me:
+                logger.error(f"Metering error: {me}")
+
+    async def _call_gpt(self, system_msg: str, prompt: str, ai_node: dict, source: str, node_id: str, batch_index: int = 0) -> str:
+        try:
+            gpt_result = await self._request_gpt(system_msg, prompt, ai_node, source, node_id)
+        except Exception as e:
+            self.failed.add(node_id)
+            return f"[Ошибка AI: {str(e)}]"
+        await self._meter(gpt_result, source, node_id, self._charge_key(node_id, batch_index, system_msg, prompt))
+        return gpt_result.content
+
+    def _emit(self, node_id: str, node: dict, out, writes: dict, node_type: str = None):
+        label = node.get("label", node_id)
+        writes[node_id] = out
+        if label:
+            writes[label] = out
+        self.results[node_id] = {"node_id": node_id, "label": label, "type": node_type or node.get("node_type", ""), "output": out}
+
+    async def _execute_node(self, node_id: str):
+        node = self.node_map[node_id]
+        node_type = node.get("node_type", "")
+        label = node.get("label", node_id)
+        outputs = self._outputs_for(node_id)
+        inp = _get_node_input(node_id, self.data_deps, outputs)
+        writes = {}
+
+        # Interactive nodes (user_edit_list, user_review) pass their input through
+        if node_type in ("user_edit_list", "user_review"):
+            writes[node_id] = inp
+            if label:
+                writes[label] = inp
+
+        elif node_type == "template":
+            # Template node: substitute variables from outputs
+            tmpl = node.get("template_text", "") or ""
+            result = _substitute_vars(tmpl, outputs)
+            # Also substitute {{input}}
+            if inp and isinstance(inp, str):
+                result = result.replace("{{input}}", inp)
+            self._emit(node_id, node, result, writes)
+
+        elif node_type == "ai_prompt":
+            prompt = node.get("inline_prompt", "") or ""
+            system_msg = node.get("system_message", "") or DEFAULT_NODE_SYSTEM_MESSAGE
+
+            # Run prep script if exists
+            if node.get("script"):
+                script_result = _execute_script(node["script"], {
+                    "input": inp, "prompt": prompt, "vars": outputs
+                })
+                if isinstance(script_result, dict) and script_result.get("promptVars"):
+                    for key, value in script_result["promptVars"].items():
+                        prompt = prompt.replace(f"{{{{{key}}}}}", str(value))
+
+            # Substitute variables
+            prompt = _substitute_vars(prompt, outputs)
+            if isinstance(inp, str):
+                prompt = prompt.replace("{{input}}", inp)
+
+            ai_result = await self._call_gpt(system_msg, prompt, node, "pipeline_node", node_id)
+            self._emit(node_id, node, ai_result, writes)
+
+        elif node_type == "parse_list":
+            if node.get("script"):
+                result = _execute_script(node["script"], {"input": inp, "vars": outputs})
+                out = result.get("output", inp)
+            else:
+                # Default: split by newlines
+                out = [line.strip() for line in str(inp or "").split("\n") if line.strip()] if inp else []
+            self._emit(node_id, node, out, writes)
+
+        elif node_type == "aggregate":
+            if node.get("script"):
+                result = _execute_script(node["script"], {"input": inp, "vars": outputs})
+                out = result.get("output", inp)
+            else:
+                # Default: join all inputs
+                if isinstance(inp, dict):
+                    parts = []
+                    for k, v in inp.items():
+                        node_label = self.node_map.get(k, {}).get("label", k)
+                        parts.append(f"## {node_label}\n\n{v}")
+                    out = "\n\n---\n\n".join(parts)
+                elif isinstance(inp, list):
+                    out = "\n\n".join(str(item) for item in inp)
+                else:
+                    out = str(inp) if inp else ""
+            self._emit(node_id, node, out, writes)
+
+        elif node_type == "batch_loop":
+            await self._execute_batch_loop(node_id, node, inp, outputs, writes)
+
+        self.writes[node_id] = writes
+
+    async def _execute_batch_loop(self, node_id: str, node: dict, inp, outputs: dict, writes: dict):
+        label = node.get("label", node_id)
+        items = inp if isinstance(inp, list) else []
+        batch_size = node.get("batch_size", 3) or len(items) or 1
+        ai_id = self.plan.loop_targets.get(node_id)
+        ai_node = self.node_map.get(ai_id) if ai_id else None
+
+        results = []
+        total_batches = max(1, (len(items) + batch_size - 1) // batch_size) if items else 0
+
+        if ai_node and node.get("script") and self._batches_concurrent(node):
+            await self._execute_batches_concurrently(node_id, node, ai_node, items, batch_size, total_batches, outputs, writes, results)
+        else:
+            await self._execute_batches_sequentially(node_id, node, ai_node, items, batch_size, total_batches, outputs, writes, results)
+
+        if ai_node:
+            writes[ai_id] = results
+            writes[ai_node.get("label", ai_id)] = results
+
+        self.results[node_id] = {"node_id": node_id, "label": label, "type": "batch_loop", "output": writes.get(node_id)}
+
+    async def _execute_batches_sequentially(self, node_id, node, ai_node, items, batch_size, total_batches, outputs, writes, results):
+        label = node.get("label", node_id)
+        for iteration in range(total_batches):
+            context = {
+                "input": items,
+                "iteration": iteration,
+                "batchSize": batch_size,
+                "results": results,
+                "vars": outputs,
+            }
+            if node.get("script"):
+                script_result = _execute_script(node["script"], context)
+                if isinstance(script_result, dict) and script_result.get("done"):
+                    out = script_result.get("output", results)
+                    writes[node_id] = out
+                    if label:
+                        writes[label] = out
+                    break
+
+                if ai_node and isinstance(script_result, dict) and script_result.get("promptVars"):
+                    system_msg, prompt = self._batch_prompt(ai_node, script_result["promptVars"], outputs)
+                    results.append(await self._call_gpt(system_msg, prompt, ai_node, "pipeline_batch", node_id, iteration))
+            else:
+                # No script — just pass items through
+                writes[node_id] = items
+                if label:
+                    writes[label] = items
+                break
+        else:
+            writes[node_id] = results
+            if label:
+                writes[label] = results
+
+    async def _execute_batches_concurrently(self, node_id, node, ai_node, items, batch_size, total_batches, outputs, writes, results):
+        """Run the (cheap) loop script for every iteration first, then send all batch prompts at once.
+
+        Only used when the script does not read context.results, so its
+        output cannot depend on earlier GPT answers.
+        """
+        label = node.get("label", node_id)
+        prompts = []
+        done_result = None
+        for iteration in range(total_batches):
+            context = {
+                "input": items,
+                "iteration": iteration,
+                "batchSize": batch_size,
+                "results": [],
+                "vars": outputs,
+            }
+            script_result = _execute_script(node["script"], context)
+            if isinstance(script_result, dict) and script_result.get("done"):
+                done_result = script_result
+                break
+            if isinstance(script_result, dict) and script_result.get("promptVars"):
+                prompts.append(self._batch_prompt(ai_node, script_result["promptVars"], outputs))
+
+        results.extend(await self._run_batches(node_id, prompts, ai_node))
+
+        out = done_result.get("output", results) if done_result else results
+        writes[node_id] = out
+        if label:
+            writes[label] = out
+
+    async def _run_batches(self, node_id: str, prompts: list, ai_node: dict) -> list:
+        """Send batch prompts concurrently; results in batch order. Failed batches are retried alone."""
+        results = [None] * len(prompts)
+        errors = {}
+        pending = list(range(len(prompts)))
+        for attempt in range(1, PIPELINE_BATCH_ATTEMPTS + 1):
+            outcomes = await asyncio.gather(
+                *(self._request_gpt(prompts[i][0], prompts[i][1], ai_node, "pipeline_batch", node_id) for i in pending),
+                return_exceptions=True,
+            )
+            failed = []
+            for i, outcome in zip(pending, outcomes):
+                if isinstance(outcome, asyncio.CancelledError):
+                    raise outcome
+                if isinstance(outcome, Exception):
+                    errors[i] = outcome
+                    failed.append(i)
+                    continue
+                await self._meter(outcome, "pipeline_batch", node_id, self._charge_key(node_id, i, *prompts[i]))
+                results[i] = outcome.content
+            pending = failed
+            if not pending:
+                break
+            logger.warning(f"Pipeline batch loop: {len(pending)}/{len(prompts)} batches failed (attempt {attempt}), retrying")
+        for i in pending:
+            results[i] = f"[Ошибка AI: {str(errors[i])}]"
+        if pending:
+            self.failed.add(node_id)
+        return results
+
+    def _batch_prompt(self, ai_node: dict, prompt_vars: dict, outputs: dict) -> tuple:
+        """Returns (system_message, prompt) for one batch of a loop's ai_prompt node."""
+        prompt = ai_node.get("inline_prompt", "") or ""
+        system_msg = ai_node.get("system_message", "") or DEFAULT_BATCH_SYSTEM_MESSAGE
+        for key, val in prompt_vars.items():
+            prompt = prompt.replace(f"{{{{{key}}}}}", str(val))
+        prompt = _substitute_vars(prompt, outputs)
+        return system_msg, prompt
+
+    @staticmethod
+    def _batches_concurrent(node: dict) -> bool:
+        mode = node.get("batch_concurrent")
+        if mode is not None:
+            return bool(mode)
+        return not script_reads_results(node.get("script"))
+
+    async def _run_when_ready(self, node_id: str):
+        for dep in self.plan.deps[node_id]:
+            await self._done[dep].wait()
+        previous = self.completed.get(node_id)
+        if previous:
+            self.writes[node_id] = previous["writes"]
+            if previous.get("result"):
+                self.results[node_id] = previous["result"]
+        else:
+            if self.on_node_start:
+                await self.on_node_start(node_id)
+            started = time.monotonic()
+            await self._execute_node(node_id)
+            if self.on_node_done:
+                await self.on_node_done(node_id, {
+                    "status": "failed" if node_id in self.failed else "completed",
+                    "writes": self.writes[node_id],
+                    "result": self.results.get(node_id),
+                    "usage": self.usage.get(node_id),
+                    "duration_ms": int((time.monotonic() - started) * 1000),
+                })
+        self._done[node_id].set()
+
+    async def execute(self) -> list:
+        """Run all nodes; returns node_results in topological order."""
+        tasks = [asyncio.create_task(self._run_when_ready(nid)) for nid in self.plan.order]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            raise
+        return [self.results[nid] for nid in self.plan.order if nid in self.results]
+
+
+async def execute_pipeline(nodes: list, edges: list, source_context: str, user: dict) -> list:
+    """Execute a pipeline graph and return its node_results."""
+    return await PipelineRun(nodes, edges, source_context, user).execute()
@@ -1,71 +1,43 @@
-import io
+"""
+Sync helpers for object storage, kept for blocking code paths (worker
+threads, zip processing). They go through the pooled backend of
+app.services.storage; async code should use get_storage() directly.
+"""
 import logging
-import boto3
-from botocore.exceptions import ClientError
-from app.core.config import S3_ACCESS_KEY, S3_SECRET_KEY, S3_ENDPOINT, S3_BUCKET, S3_REGION
+from app.services.storage import get_storage, storage_enabled
 
 logger = logging.getLogger(__name__)
 
-_client = None
-
-
-def _get_client():
-    global _client
-    if _client is None:
-        _client = boto3.client(
-            "s3",
-            endpoint_url=S3_ENDPOINT,
-            aws_access_key_id=S3_ACCESS_KEY,
-            aws_secret_access_key=S3_SECRET_KEY,
-            region_name=S3_REGION,
-        )
-    return _client
-
 
 def s3_enabled() -> bool:
-    return all([S3_ACCESS_KEY, S3_SECRET_KEY, S3_ENDPOINT, S3_BUCKET])
+    return storage_enabled()
 
 
 def upload_bytes(key: str, data: bytes, content_type: str = "application/octet-stream") -> str:
-    """Upload bytes to S3. Returns the S3 key."""
-    client = _get_client()
+    """Upload bytes to S3 (multipart for large objects). Returns the S3 key."""
     try:
-        client.put_object(
-            Bucket=S3_BUCKET,
-            Key=key,
-            Body=data,
-            ContentType=content_type,
-        )
+        get_storage().backend.put(key, data, content_type)
         logger.info(f"S3 upload: {key} ({len(data)} bytes)")
         return key
-    except ClientError as e:
+    except Exception as e:
         logger.error(f"S3 upload failed for {key}: {e}")
         raise
 
 
 def download_bytes(key: str) -> bytes:
     """Download file from S3, returns bytes."""
-    client = _get_client()
-    resp = client.get_object(Bucket=S3_BUCKET, Key=key)
-    return resp["Body"].read()
+    return get_storage().backend.get(key)
 
 
 def delete_object(key: str):
     """Delete object from S3."""
     try:
-        client = _get_client()
-        client.delete_object(Bucket=S3_BUCKET, Key=key)
+        get_storage().backend.delete(key)
         logger.info(f"S3 delete: {key}")
-    except ClientError as e:
+    except Exception as e:
         logger.warning(f"S3 delete failed for {key}: {e}")
 
 
 def presigned_url(key: str, expires: int = 3600) -> str:
     """Generate a presigned download URL."""
-    client = _get_client()
-    url = client.generate_presigned_url(
-        "get_object",
-        Params={"Bucket": S3_BUCKET, "Key": key},
-        ExpiresIn=expires,
-    )
-    return url
+    return get_storage().presigned_url(key, expires)
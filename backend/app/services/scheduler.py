@@ -0,0 +1,313 @@
+"""
+Cluster-wide scheduler for periodic maintenance jobs (exchange rate,
+storage billing, trash cleanup, ...).
+
+Every API process runs `run_scheduler()`, but a job only runs in the
+process holding its lease in `locks` ("scheduler:<name>", renewed while the
+job runs), so each run happens once no matter how many workers serve the
+API. State per job lives in `scheduled_jobs`:
+
+- `last_slot`: the scheduled time the last successful run covered. A job
+  is due when the latest slot (app/utils/cron.py) is newer, so after
+  downtime a missed run is caught up once on startup rather than skipped
+  or repeated.
+- `failures`, `retry_at`: a failed run (the job raised, or lost its lease)
+  leaves `last_slot` as it was and is retried after
+  SCHEDULER_RETRY_BASE_SECONDS, doubling per consecutive failure up to
+  SCHEDULER_RETRY_MAX_SECONDS.
+- `last_run_at`, `last_status`, `last_error`, `last_duration_ms`,
+  `next_run_at`: shown by GET /api/admin/scheduler/jobs.
+
+A job registered with `after` waits until those jobs have run (or at least
+been attempted) for their latest slot at or before its own and are not
+running anywhere, so a chain like exchange rate -> storage billing keeps
+its order even when processes catch up different jobs at once. Jobs with
+`takes_slot` get the slot (datetime) they run for, e.g. to bill the right
+day when catching up after midnight.
+
+The lease is renewed while a job runs; if that fails for longer than the
+lease could still be valid, the job is cancelled, since another process
+may already have started it.
+
+POST /api/admin/scheduler/jobs/{name}/run runs a job right away under the
+same lease (409 while it is running elsewhere).
+
+Jobs seen for the first time start from the current slot (nothing to catch
+up), unless registered with `run_if_new`.
+"""
+import os
+import socket
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from pymongo.errors import DuplicateKeyError
+from app.core.database import db
+from app.utils.cron import last_slot, next_slot
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_POLL_SECONDS = 30
+SCHEDULER_LEASE_SECONDS = 600
+SCHEDULER_RETRY_BASE_SECONDS = 300
+SCHEDULER_RETRY_MAX_SECONDS = 6 * 3600
+
+
+@dataclass
+class ScheduledJob:
+    name: str
+    func: Callable[[], Awaitable]
+    hour: int
+    minute: int = 0
+    weekday: Optional[int] = None  # weekly on this day (0 = Monday) instead of daily
+    description: str = ""
+    run_if_new: bool = False
+    after: Tuple[str, ...] = ()  # names of jobs that must run first for the same slot
+    takes_slot: bool = False  # call func(slot) with the slot datetime being run
+
+    def last_slot(self, now: datetime) -> datetime:
+        return last_slot(now, self.hour, self.minute, self.weekday)
+
+    def next_slot(self, now: datetime) -> datetime:
+        return next_slot(now, self.hour, self.minute, self.weekday)
+
+
+_jobs: Dict[str, ScheduledJob] = {}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def register_job(job: ScheduledJob):
+    """Add a job; jobs due at the same poll run in registration order."""
+    _jobs[job.name] = job
+
+
+def get_job(name: str) -> Optional[ScheduledJob]:
+    return _jobs.get(name)
+
+
+async def ensure_scheduler_indexes():
+    await db.locks.create_index("key", unique=True)
+    await db.scheduled_jobs.create_index("name", unique=True)
+
+
+async def _acquire_lease(name: str, owner: str) -> bool:
+    now = _now()
+    try:
+        await db.locks.update_one(
+            {"key": f"scheduler:{name}", "$or": [
+                {"owner": owner},
+                {"lease_expires_at": {"$lt": now.isoformat()}},
+            ]},
+            {"$set": {
+                "owner": owner,
+                "lease_expires_at": (now + timedelta(seconds=SCHEDULER_LEASE_SECONDS)).isoformat(),
+            }},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def _release_lease(name: str, owner: str):
+    await db.locks.delete_one({"key": f"scheduler:{name}", "owner": owner})
+
+
+async def _keep_lease(name: str, owner: str, work: asyncio.Task):
+    """Renew the job lease while it runs; cancel the job once the lease may be gone."""
+    loop = asyncio.get_running_loop()
+    renewed_at = loop.time()
+    while True:
+        await asyncio.sleep(SCHEDULER_LEASE_SECONDS / 3)
+        try:
+            if await _acquire_lease(name, owner):
+                renewed_at = loop.time()
+                continue
+            logger.error(f"Scheduler: lost lease on {name}, cancelling the run")
+        except Exception as e:
+            if loop.time() - renewed_at < SCHEDULER_LEASE_SECONDS * 2 / 3:
+                logger.warning(f"Scheduler: lease renewal for {name} failed: {e}")
+                continue
+            logger.error(f"Scheduler: could not renew lease on {name}, cancelling the run: {e}")
+        work.cancel()
+        return
+
+
+async def _seed_new_jobs(now: datetime):
+    for job in _jobs.values():
+        seed = {"name": job.name, "created_at": now.isoformat(), "next_run_at": job.next_slot(now).isoformat()}
+        if not job.run_if_new:
+            seed["last_slot"] = job.last_slot(now).isoformat()
+        await db.scheduled_jobs.update_one({"name": job.name}, {"$setOnInsert": seed}, upsert=True)
+
+
+def _due_slot(job: ScheduledJob, state: dict, now: datetime) -> Optional[str]:
+    """Slot the job should run for now, or None when it is not due (or waiting to retry)."""
+    if state.get("retry_at") and state["retry_at"] > now.isoformat():
+        return None
+    slot = job.last_slot(now).isoformat()
+    return slot if (state.get("last_slot") or "") < slot else None
+
+
+def _retry_delay(failures: int) -> timedelta:
+    return timedelta(seconds=min(SCHEDULER_RETRY_BASE_SECONDS * 2 ** (failures - 1), SCHEDULER_RETRY_MAX_SECONDS))
+
+
+def _waiting_for(job: ScheduledJob, slot: str, states: Dict[str, dict]) -> Optional[str]:
+    """Name of a job in `after` that has not run for this slot yet, or is running."""
+    slot_time = datetime.fromisoformat(slot)
+    for name in job.after:
+        dep = _jobs.get(name)
+        if not dep:
+            continue
+        state = states.get(name, {})
+        dep_slot = dep.last_slot(slot_time).isoformat()
+        attempted = max(state.get("last_slot") or "", state.get("last_run_at") or "") >= dep_slot
+        if state.get("running_by") or not attempted:
+            return name
+    return None
+
+
+async def _run_job(job: ScheduledJob, slot: str, state: dict, owner: str) -> Optional[str]:
+    """Run the job for a slot and record the outcome. Returns the error of a failed run."""
+    started = _now()
+    if state.get("last_slot") and not state.get("manual"):
+        missed = job.last_slot(started) - datetime.fromisoformat(state["last_slot"])
+        if missed > timedelta(days=1 if job.weekday is None else 7):
+            logger.info(f"Scheduler: catching up {job.name} (last run for {state['last_slot']})")
+    await db.scheduled_jobs.update_one(
+        {"name": job.name},
+        {"$set": {"running_by": owner, "started_at": started.isoformat()}},
+    )
+    work = asyncio.create_task(job.func(datetime.fromisoformat(slot)) if job.takes_slot else job.func())
+    keeper = asyncio.create_task(_keep_lease(job.name, owner, work))
+    status, error = "completed", None
+    try:
+        await work
+    except asyncio.CancelledError:
+        if not keeper.done():
+            raise
+        status, error = "failed", "lease lost"
+    except Exception as e:
+        status, error = "failed", str(e)
+        logger.error(f"Scheduled job {job.name} failed: {e}")
+    finally:
+        keeper.cancel()
+        work.cancel()
+    finished = _now()
+    update = {
+        "last_run_at": started.isoformat(),
+        "last_status": status,
+        "last_error": error,
+        "last_duration_ms": int((finished - started).total_seconds() * 1000),
+        "running_by": None,
+    }
+    if status == "completed":
+        update.update({"last_slot": slot, "failures": 0, "retry_at": None, "next_run_at": job.next_slot(finished).isoformat()})
+    else:
+        failures = (state.get("failures") or 0) + 1
+        retry_at = (finished + _retry_delay(failures)).isoformat()
+        update.update({"failures": failures, "retry_at": retry_at, "next_run_at": retry_at})
+        logger.warning(f"Scheduled job {job.name}: failure {failures}, retrying at {retry_at}")
+    # Guarded by the owner: after a lost lease the job's state belongs to the new runner
+    await db.scheduled_jobs.update_one({"name": job.name, "running_by": owner}, {"$set": update})
+    logger.info(f"Scheduled job {job.name}: {status} in {(finished - started).total_seconds():.1f}s")
+    return error
+
+
+async def run_due_jobs(owner: str) -> int:
+    """Run every due job this process can lease. Returns the number run."""
+    ran = 0
+    now = _now()
+    states = {s["name"]: s for s in await db.scheduled_jobs.find({}, {"_id": 0}).to_list(None)}
+    for job in _jobs.values():
+        if not _due_slot(job, states.get(job.name, {}), now):
+            continue
+        if not await _acquire_lease(job.name, owner):
+            continue
+        try:
+            # Another process may have run it between the read and the lease
+            states = {s["name"]: s for s in await db.scheduled_jobs.find({}, {"_id": 0}).to_list(None)}
+            state = states.get(job.name, {})
+            slot = _due_slot(job, state, _now())
+            if not slot:
+                continue
+            waiting = _waiting_for(job, slot, states)
+            if waiting:
+                logger.info(f"Scheduler: {job.name} waits for {waiting}")
+                continue
+            await _run_job(job, slot, state, owner)
+            ran += 1
+        finally:
+            await _release_lease(job.name, owner)
+    return ran
+
+
+class JobAlreadyRunning(Exception):
+    pass
+
+
+class JobFailed(Exception):
+    """A manually triggered run failed; the failure is recorded in the job state as well."""
+
+    def __init__(self, name: str, error: str):
+        super().__init__(error)
+        self.name = name
+        self.error = error
+
+
+async def run_job_now(name: str, owner: Optional[str] = None) -> dict:
+    """Run a job immediately (manual trigger), under its lease. Returns its state.
+
+    Raises JobFailed if the run failed.
+    """
+    job = _jobs[name]
+    owner = owner or f"{socket.gethostname()}:{os.getpid()}:manual"
+    if not await _acquire_lease(name, owner):
+        raise JobAlreadyRunning(name)
+    try:
+        state = await db.scheduled_jobs.find_one({"name": name}, {"_id": 0}) or {}
+        slot = max(job.last_slot(_now()).isoformat(), state.get("last_slot") or "")
+        error = await _run_job(job, slot, {**state, "manual": True}, owner)
+    finally:
+        await _release_lease(name, owner)
+    if error:
+        raise JobFailed(name, error)
+    return await db.scheduled_jobs.find_one({"name": name}, {"_id": 0})
+
+
+async def list_jobs() -> List[dict]:
+    states = {s["name"]: s for s in await db.scheduled_jobs.find({}, {"_id": 0}).to_list(None)}
+    result = []
+    for job in _jobs.values():
+        state = states.get(job.name, {})
+        result.append({
+            "name": job.name,
+            "description": job.description,
+            "schedule": f"{'weekly day ' + str(job.weekday) + ' ' if job.weekday is not None else 'daily '}{job.hour:02d}:{job.minute:02d} UTC",
+            "last_run_at": state.get("last_run_at"),
+            "last_status": state.get("last_status"),
+            "last_error": state.get("last_error"),
+            "failures": state.get("failures") or 0,
+            "last_duration_ms": state.get("last_duration_ms"),
+            "next_run_at": state.get("next_run_at"),
+            "running": bool(state.get("running_by")),
+        })
+    return result
+
+
+async def run_scheduler(stop: Optional[asyncio.Event] = None):
+    """Background loop of an API process: run due jobs it wins the lease for."""
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    await ensure_scheduler_indexes()
+    await _seed_new_jobs(_now())
+    while not (stop and stop.is_set()):
+        try:
+            await run_due_jobs(owner)
+        except Exception as e:
+            logger.error(f"Scheduler error: {e}")
+        await asyncio.sleep(SCHEDULER_POLL_SECONDS)
@@ -0,0 +1,96 @@
+"""
+In-process cache for rarely changing settings (active model, cost settings,
+trash settings, markup tiers).
+
+Entries live for SETTINGS_CACHE_TTL seconds. Writers call `invalidate(key)`,
+which drops the local entry and bumps a per-key version counter in
+`settings_versions`; other processes (API replicas, workers) poll those
+counters at most every SETTINGS_VERSION_CHECK_SECONDS with a single query
+and reload any key whose version moved, so a change is visible everywhere
+within a couple of seconds instead of after the TTL.
+"""
+import os
+import copy
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+from pymongo import ReturnDocument
+from app.core.database import db
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_CACHE_TTL = float(os.environ.get("SETTINGS_CACHE_TTL", 300))
+SETTINGS_VERSION_CHECK_SECONDS = float(os.environ.get("SETTINGS_VERSION_CHECK_SECONDS", 2))
+
+
+@dataclass
+class _Entry:
+    value: Any
+    version: int
+    loaded_at: float
+
+
+class SettingsCache:
+    def __init__(self, ttl: float, version_check_seconds: float):
+        self.ttl = ttl
+        self.version_check_seconds = version_check_seconds
+        self._entries = {}
+        self._locks = {}
+        self._versions = {}
+        self._versions_checked_at = float("-inf")
+
+    async def _refresh_versions(self):
+        now = time.monotonic()
+        if now - self._versions_checked_at < self.version_check_seconds:
+            return
+        self._versions_checked_at = now
+        try:
+            docs = await db.settings_versions.find({}, {"_id": 0}).to_list(1000)
+        except Exception as e:
+            logger.warning(f"Settings version check failed: {e}")
+            return
+        self._versions = {d["key"]: d.get("version", 0) for d in docs}
+
+    def _fresh(self, entry, version: int) -> bool:
+        return (
+            entry is not None
+            and entry.version == version
+            and time.monotonic() - entry.loaded_at < self.ttl
+        )
+
+    async def get(self, key: str, loader: Callable[[], Awaitable[Any]], copy_value: bool = True) -> Any:
+        """Return the cached value for key, calling loader() on miss, expiry or remote invalidation.
+
+        Returns a copy, so callers may mutate the result freely; pass
+        copy_value=False for immutable values.
+        """
+        await self._refresh_versions()
+        version = self._versions.get(key, 0)
+        entry = self._entries.get(key)
+        if not self._fresh(entry, version):
+            lock = self._locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                entry = self._entries.get(key)
+                if not self._fresh(entry, version):
+                    entry = _Entry(await loader(), version, time.monotonic())
+                    self._entries[key] = entry
+        return copy.deepcopy(entry.value) if copy_value else entry.value
+
+    async def invalidate(self, key: str):
+        """Drop key here and signal other processes to reload it."""
+        self._entries.pop(key, None)
+        try:
+            doc = await db.settings_versions.find_one_and_update(
+                {"key": key},
+                {"$inc": {"version": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            self._versions[key] = doc["version"]
+        except Exception as e:
+            logger.error(f"Failed to publish settings invalidation for {key}: {e}")
+
+
+settings_cache = SettingsCache(SETTINGS_CACHE_TTL, SETTINGS_VERSION_CHECK_SECONDS)
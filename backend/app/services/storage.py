@@ -0,0 +1,309 @@
+"""
+Object storage for attachments, documents and chat images.
+
+`get_storage()` returns an async facade over a blocking backend:
+
+- S3Backend: one boto3 client with a connection pool of
+  STORAGE_CONCURRENCY connections; objects of STORAGE_MULTIPART_THRESHOLD
+  bytes and more are uploaded as multipart, parts in parallel.
+- LocalBackend: a directory (STORAGE_LOCAL_ROOT) with the same interface,
+  selected with STORAGE_BACKEND=local for tests and S3-less setups.
+
+Backend calls run in a dedicated thread pool of STORAGE_CONCURRENCY
+threads, so transfers never block the event loop and concurrency is
+bounded. Downloads can be ranged or streamed in chunks instead of
+materialising whole objects. The sync helpers in app.services.s3 use the
+same backend.
+"""
+import io
+import os
+import shutil
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "s3")
+STORAGE_LOCAL_ROOT = os.environ.get("STORAGE_LOCAL_ROOT", "/app/backend/uploads/storage")
+STORAGE_CONCURRENCY = int(os.environ.get("STORAGE_CONCURRENCY", 16))
+STORAGE_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+STORAGE_MULTIPART_CHUNK = 8 * 1024 * 1024
+STORAGE_MULTIPART_CONCURRENCY = 4
+STORAGE_STREAM_CHUNK = 1024 * 1024
+# S3 multi-object delete accepts at most 1000 keys per request
+STORAGE_DELETE_BATCH = 1000
+
+
+class StorageError(Exception):
+    pass
+
+
+class S3Backend:
+    """Blocking S3 operations; the client is thread-safe and pooled."""
+
+    supports_presigned = True
+
+    def __init__(self, endpoint: str, access_key: str, secret_key: str, bucket: str, region: Optional[str], max_connections: int):
+        import boto3
+        from botocore.config import Config
+        from boto3.s3.transfer import TransferConfig
+        self.bucket = bucket
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region,
+            config=Config(max_pool_connections=max_connections, retries={"max_attempts": 5, "mode": "standard"}),
+        )
+        self.transfer = TransferConfig(
+            multipart_threshold=STORAGE_MULTIPART_THRESHOLD,
+            multipart_chunksize=STORAGE_MULTIPART_CHUNK,
+            max_concurrency=STORAGE_MULTIPART_CONCURRENCY,
+        )
+
+    def put(self, key: str, data: bytes, content_type: str):
+        if len(data) >= STORAGE_MULTIPART_THRESHOLD:
+            self.client.upload_fileobj(
+                io.BytesIO(data), self.bucket, key,
+                ExtraArgs={"ContentType": content_type}, Config=self.transfer,
+            )
+        else:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type)
+
+    def put_file(self, key: str, path: str, content_type: str):
+        self.client.upload_file(path, self.bucket, key, ExtraArgs={"ContentType": content_type}, Config=self.transfer)
+
+    def _get_object(self, key: str, start: Optional[int], end: Optional[int]):
+        kwargs = {"Bucket": self.bucket, "Key": key}
+        if start is not None or end is not None:
+            kwargs["Range"] = f"bytes={start or 0}-{'' if end is None else end}"
+        return self.client.get_object(**kwargs)["Body"]
+
+    def get(self, key: str, start: Optional[int] = None, end: Optional[int] = None) -> bytes:
+        return self._get_object(key, start, end).read()
+
+    def iter_chunks(self, key: str, chunk_size: int, start: Optional[int] = None, end: Optional[int] = None) -> Iterator[bytes]:
+        return self._get_object(key, start, end).iter_chunks(chunk_size)
+
+    def size(self, key: str) -> int:
+        return self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def delete_batch(self, keys: List[str]) -> Dict[str, str]:
+        """Multi-object delete of up to STORAGE_DELETE_BATCH keys; returns {key: error} of failures."""
+        resp = self.client.delete_objects(
+            Bucket=self.bucket,
+            Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True},
+        )
+        return {e["Key"]: f"{e.get('Code')}: {e.get('Message')}" for e in resp.get("Errors", [])}
+
+    def presigned_url(self, key: str, expires: int) -> str:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=expires,
+        )
+
+
+class LocalBackend:
+    """Stores objects as files under `root`; keys map to relative paths."""
+
+    supports_presigned = False
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise StorageError(f"Invalid key: {key}")
+        return path
+
+    def put(self, key: str, data: bytes, content_type: str):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.part"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def put_file(self, key: str, src: str, content_type: str):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(src, f"{path}.part")
+        os.replace(f"{path}.part", path)
+
+    def get(self, key: str, start: Optional[int] = None, end: Optional[int] = None) -> bytes:
+        with open(self.path(key), "rb") as f:
+            f.seek(start or 0)
+            return f.read() if end is None else f.read(end - (start or 0) + 1)
+
+    def iter_chunks(self, key: str, chunk_size: int, start: Optional[int] = None, end: Optional[int] = None) -> Iterator[bytes]:
+        f = open(self.path(key), "rb")
+        f.seek(start or 0)
+        remaining = None if end is None else end - (start or 0) + 1
+
+        def chunks():
+            nonlocal remaining
+            with f:
+                while remaining is None or remaining > 0:
+                    chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                    if not chunk:
+                        return
+                    if remaining is not None:
+                        remaining -= len(chunk)
+                    yield chunk
+        return chunks()
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self.path(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_batch(self, keys: List[str]) -> Dict[str, str]:
+        failed = {}
+        for key in keys:
+            try:
+                self.delete(key)
+            except Exception as e:
+                failed[key] = str(e)
+        return failed
+
+    def presigned_url(self, key: str, expires: int) -> str:
+        return f"file://{self.path(key)}"
+
+
+class Storage:
+    """Async facade: backend calls run in a bounded thread pool."""
+
+    def __init__(self, backend, concurrency: int = STORAGE_CONCURRENCY):
+        self.backend = backend
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="storage")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    @property
+    def supports_presigned(self) -> bool:
+        return self.backend.supports_presigned
+
+    async def put(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> str:
+        await self._run(self.backend.put, key, data, content_type)
+        logger.info(f"Storage upload: {key} ({len(data)} bytes)")
+        return key
+
+    async def put_file(self, key: str, path: str, content_type: str = "application/octet-stream") -> str:
+        """Upload a file from disk without reading it into memory (multipart when large)."""
+        await self._run(self.backend.put_file, key, path, content_type)
+        logger.info(f"Storage upload: {key} (from {path})")
+        return key
+
+    async def get(self, key: str) -> bytes:
+        return await self._run(self.backend.get, key, None, None)
+
+    async def get_range(self, key: str, start: int, end: Optional[int] = None) -> bytes:
+        """Bytes start..end inclusive (end=None: to the end of the object)."""
+        return await self._run(self.backend.get, key, start, end)
+
+    async def stream(
+        self, key: str, chunk_size: int = STORAGE_STREAM_CHUNK,
+        start: Optional[int] = None, end: Optional[int] = None,
+    ) -> AsyncIterator[bytes]:
+        chunks = await self._run(self.backend.iter_chunks, key, chunk_size, start, end)
+        while True:
+            chunk = await self._run(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    async def size(self, key: str) -> int:
+        return await self._run(self.backend.size, key)
+
+    async def delete(self, key: str):
+        await self._run(self.backend.delete, key)
+        logger.info(f"Storage delete: {key}")
+
+    async def delete_many(self, keys: List[str]) -> Dict[str, str]:
+        """Delete keys in batches of STORAGE_DELETE_BATCH, concurrently.
+
+        Returns {key: error} for keys that could not be deleted; a batch
+        whose request fails as a whole reports all of its keys.
+        """
+        keys = list(dict.fromkeys(keys))
+        batches = [keys[i:i + STORAGE_DELETE_BATCH] for i in range(0, len(keys), STORAGE_DELETE_BATCH)]
+        results = await asyncio.gather(
+            *(self._run(self.backend.delete_batch, batch) for batch in batches),
+            return_exceptions=True,
+        )
+        failed = {}
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                failed.update({k: str(result) for k in batch})
+            else:
+                failed.update(result)
+        logger.info(f"Storage bulk delete: {len(keys) - len(failed)}/{len(keys)} keys in {len(batches)} requests")
+        return failed
+
+    def presigned_url(self, key: str, expires: int = 3600) -> str:
+        # Signing is local computation, no request is made
+        return self.backend.presigned_url(key, expires)
+
+
+async def download_response(key: str, filename: str, expires: int = 3600):
+    """Redirect to a presigned URL, or stream the object through the API when the backend has none."""
+    from urllib.parse import quote
+    from fastapi.responses import RedirectResponse, StreamingResponse
+    storage = get_storage()
+    if storage.supports_presigned:
+        return RedirectResponse(url=storage.presigned_url(key, expires))
+    size = await storage.size(key)
+    return StreamingResponse(
+        storage.stream(key),
+        media_type="application/octet-stream",
+        headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}",
+            "Content-Length": str(size),
+        },
+    )
+
+
+_storage: Optional[Storage] = None
+
+
+def _s3_settings() -> dict:
+    from app.core.config import S3_ACCESS_KEY, S3_SECRET_KEY, S3_ENDPOINT, S3_BUCKET, S3_REGION
+    return {
+        "endpoint": S3_ENDPOINT,
+        "access_key": S3_ACCESS_KEY,
+        "secret_key": S3_SECRET_KEY,
+        "bucket": S3_BUCKET,
+        "region": S3_REGION,
+    }
+
+
+def storage_enabled() -> bool:
+    """Whether object storage is configured (otherwise uploads stay on local paths)."""
+    if STORAGE_BACKEND == "local":
+        return True
+    s = _s3_settings()
+    return all([s["access_key"], s["secret_key"], s["endpoint"], s["bucket"]])
+
+
+def get_storage() -> Storage:
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "local":
+            backend = LocalBackend(STORAGE_LOCAL_ROOT)
+        else:
+            backend = S3Backend(max_connections=STORAGE_CONCURRENCY, **_s3_settings())
+        _storage = Storage(backend)
+    return _storage
@@ -0,0 +1,138 @@
+"""
+Bulk deletion of stored attachment files, used by permanent deletes and
+trash cleanup.
+
+Keys are deleted with multi-object requests (1000 keys each) in the storage
+thread pool, so a folder with thousands of attachments takes a few requests
+and the event loop stays free. Keys that could not be deleted go to
+`storage_delete_queue` and are retried by `retry_failed_deletes()` (run with
+the daily trash cleanup) with growing delays, instead of being forgotten.
+"""
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List
+from pymongo import UpdateOne
+from app.core.database import db
+from app.services.storage import get_storage, storage_enabled
+from app.services.storage_usage import record_attachments_removed
+
+logger = logging.getLogger(__name__)
+
+DELETE_RETRY_MAX_ATTEMPTS = 10
+DELETE_RETRY_BASE_DELAY = timedelta(minutes=30)
+DELETE_RETRY_BATCH = 5000
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def ensure_storage_cleanup_indexes():
+    await db.storage_delete_queue.create_index("key", unique=True)
+    await db.storage_delete_queue.create_index([("status", 1), ("next_attempt_at", 1)])
+
+
+async def _record_failures(failed: Dict[str, str], source: str):
+    now = _now()
+    first_key, first_error = next(iter(failed.items()))
+    logger.warning(f"Storage delete failed for {len(failed)} keys ({source}), e.g. {first_key}: {first_error}")
+    await db.storage_delete_queue.bulk_write([
+        UpdateOne(
+            {"key": key},
+            {
+                "$set": {"error": error, "source": source, "status": "pending", "updated_at": now.isoformat()},
+                "$setOnInsert": {
+                    "id": str(uuid.uuid4()),
+                    "attempts": 0,
+                    "next_attempt_at": (now + DELETE_RETRY_BASE_DELAY).isoformat(),
+                    "created_at": now.isoformat(),
+                },
+            },
+            upsert=True,
+        )
+        for key, error in failed.items()
+    ], ordered=False)
+
+
+async def delete_stored_objects(keys: List[str], source: str) -> int:
+    """Delete keys from object storage in bulk; failures are queued for retry.
+
+    Returns the number of keys deleted.
+    """
+    keys = [k for k in dict.fromkeys(keys) if k]
+    if not keys or not storage_enabled():
+        return 0
+    failed = await get_storage().delete_many(keys)
+    if failed:
+        await _record_failures(failed, source)
+    return len(keys) - len(failed)
+
+
+async def delete_local_files(paths: List[str]):
+    """Remove attachment files stored on local disk (no object storage)."""
+    def remove_all():
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Failed to remove {path}: {e}")
+    if paths:
+        await asyncio.to_thread(remove_all)
+
+
+async def delete_attachment_files(att_collection: str, project_ids: List[str], source: str) -> int:
+    """Delete the stored files of all attachments of the given projects (not the documents).
+
+    Storage usage counters are decremented; callers delete the attachment
+    documents right after.
+    """
+    if not project_ids:
+        return 0
+    attachments = await db[att_collection].find(
+        {"project_id": {"$in": project_ids}},
+        {"_id": 0, "s3_key": 1, "file_path": 1, "size": 1, "storage_org_id": 1},
+    ).to_list(None)
+    keys = [a["s3_key"] for a in attachments if a.get("s3_key")]
+    paths = [a["file_path"] for a in attachments if not a.get("s3_key") and a.get("file_path")]
+    await delete_local_files(paths)
+    deleted = await delete_stored_objects(keys, source)
+    await record_attachments_removed(attachments)
+    return deleted
+
+
+async def retry_failed_deletes() -> int:
+    """Retry queued deletes that are due. Returns the number of keys deleted."""
+    if not storage_enabled():
+        return 0
+    now = _now()
+    due = await db.storage_delete_queue.find(
+        {"status": "pending", "next_attempt_at": {"$lte": now.isoformat()}},
+        {"_id": 0, "key": 1, "attempts": 1},
+    ).to_list(DELETE_RETRY_BATCH)
+    if not due:
+        return 0
+
+    failed = await get_storage().delete_many([d["key"] for d in due])
+    deleted = [d["key"] for d in due if d["key"] not in failed]
+    if deleted:
+        await db.storage_delete_queue.delete_many({"key": {"$in": deleted}})
+
+    for d in due:
+        if d["key"] not in failed:
+            continue
+        attempts = d.get("attempts", 0) + 1
+        update = {"attempts": attempts, "error": failed[d["key"]], "updated_at": now.isoformat()}
+        if attempts >= DELETE_RETRY_MAX_ATTEMPTS:
+            update["status"] = "failed"
+            logger.error(f"Storage delete of {d['key']} failed {attempts} times, giving up")
+        else:
+            update["next_attempt_at"] = (now + DELETE_RETRY_BASE_DELAY * 2 ** attempts).isoformat()
+        await db.storage_delete_queue.update_one({"key": d["key"]}, {"$set": update})
+
+    logger.info(f"Storage delete retry: {len(deleted)}/{len(due)} keys deleted")
+    return len(deleted)
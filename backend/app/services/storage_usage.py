@@ -0,0 +1,141 @@
+"""
+Per-org object storage usage (`storage_usage`).
+
+One document per org with `bytes` and `objects` of attachments kept in
+object storage. Counters are incremented on upload and decremented on
+attachment delete and permanent delete / trash purge, so the daily storage
+charge is a single pass over these documents instead of joining every
+attachment with its project for every org.
+
+Usage is attributed to the org of the project's owner, as before; the org
+is stored on the attachment (`storage_org_id`) at upload so the decrement
+hits the same counter. Drift (legacy attachments, crashes between the
+write and the counter update) is corrected by the reconciliation, which
+runs weekly (and once right after the first deploy) under the scheduler
+lease and can be started by hand:
+    python -m app.services.storage_usage
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+from pymongo import UpdateOne
+from app.core.database import db
+
+logger = logging.getLogger(__name__)
+
+# Attachment collection -> project collection
+ATTACHMENT_COLLECTIONS = {"attachments": "projects", "doc_attachments": "doc_projects"}
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+async def ensure_storage_usage_indexes():
+    await db.storage_usage.create_index("org_id", unique=True)
+
+
+async def project_storage_org(project: dict) -> Optional[str]:
+    """Org that pays for a project's stored files: the org of its owner."""
+    owner = await db.users.find_one({"id": project.get("user_id")}, {"_id": 0, "org_id": 1})
+    return (owner or {}).get("org_id")
+
+
+async def record_storage_change(org_id: Optional[str], delta_bytes: int, delta_objects: int = 1):
+    if not org_id or (not delta_bytes and not delta_objects):
+        return
+    await db.storage_usage.update_one(
+        {"org_id": org_id},
+        {"$inc": {"bytes": delta_bytes, "objects": delta_objects}, "$set": {"updated_at": _now_iso()}},
+        upsert=True,
+    )
+
+
+async def record_attachments_removed(attachments: Iterable[dict]):
+    """Decrement counters for deleted attachments (those stored in object storage)."""
+    deltas = defaultdict(lambda: [0, 0])
+    for att in attachments:
+        if att.get("s3_key") and att.get("storage_org_id"):
+            d = deltas[att["storage_org_id"]]
+            d[0] -= att.get("size") or 0
+            d[1] -= 1
+    if not deltas:
+        return
+    now = _now_iso()
+    await db.storage_usage.bulk_write([
+        UpdateOne(
+            {"org_id": org_id},
+            {"$inc": {"bytes": b, "objects": n}, "$set": {"updated_at": now}},
+            upsert=True,
+        )
+        for org_id, (b, n) in deltas.items()
+    ], ordered=False)
+
+
+async def rebuild_storage_usage() -> int:
+    """Recompute all counters from the attachments. Returns the number of orgs with usage.
+
+    Each collection is read once, so the cost is linear in the number of
+    attachments, not orgs x attachments. Attachments missing
+    `storage_org_id` get it set on the way.
+    """
+    user_orgs = {
+        u["id"]: u.get("org_id")
+        for u in await db.users.find({}, {"_id": 0, "id": 1, "org_id": 1}).to_list(None)
+    }
+    totals = defaultdict(lambda: [0, 0])
+    for att_coll, project_coll in ATTACHMENT_COLLECTIONS.items():
+        project_orgs = {
+            p["id"]: user_orgs.get(p.get("user_id"))
+            for p in await db[project_coll].find({}, {"_id": 0, "id": 1, "user_id": 1}).to_list(None)
+        }
+        backfill = defaultdict(list)
+        cursor = db[att_coll].find(
+            {"s3_key": {"$exists": True, "$ne": None}},
+            {"_id": 0, "id": 1, "project_id": 1, "size": 1, "storage_org_id": 1},
+        )
+        async for att in cursor:
+            org_id = project_orgs.get(att["project_id"])
+            if not org_id:
+                continue
+            totals[org_id][0] += att.get("size") or 0
+            totals[org_id][1] += 1
+            if att.get("storage_org_id") != org_id:
+                backfill[org_id].append(att["id"])
+        for org_id, ids in backfill.items():
+            await db[att_coll].update_many({"id": {"$in": ids}}, {"$set": {"storage_org_id": org_id}})
+
+    now = _now_iso()
+    ops = [
+        UpdateOne(
+            {"org_id": org_id},
+            {"$set": {"bytes": b, "objects": n, "updated_at": now, "reconciled_at": now}},
+            upsert=True,
+        )
+        for org_id, (b, n) in totals.items()
+    ]
+    # Orgs with nothing stored any more are reset
+    existing = await db.storage_usage.find({}, {"_id": 0, "org_id": 1}).to_list(None)
+    ops += [
+        UpdateOne(
+            {"org_id": d["org_id"]},
+            {"$set": {"bytes": 0, "objects": 0, "updated_at": now, "reconciled_at": now}},
+        )
+        for d in existing if d["org_id"] not in totals
+    ]
+    if ops:
+        await db.storage_usage.bulk_write(ops, ordered=False)
+    logger.info(f"Storage usage rebuilt: {len(totals)} orgs with stored files")
+    return len(totals)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    async def _main():
+        await ensure_storage_usage_indexes()
+        await rebuild_storage_usage()
+
+    asyncio.run(_main())
@@ -3,6 +3,7 @@ import uuid
 import logging
 from datetime import datetime, timezone
 from app.core.database import db
+from app.utils.transcript_chunks import split_uncertain_section
 
 logger = logging.getLogger(__name__)
 
@@ -16,35 +17,7 @@ async def parse_uncertain_fragments(project_id: str, text: str):
     - Auto-corrected words (GPT already replaced them)
     """
     # Find and separate the "Uncertain places" section
-    section_markers = [
-        r'^---+\s*$\n+\s*(?:Сомнительные места|Uncertain places|Сомнения)',
-        r'\n\n(?:Сомнительные места|Uncertain places|Сомнения)\s*:?\s*\n',
-        r'\n(?:Сомнительные места|Uncertain places|Сомнения)\s*:\s*\n',
-    ]
-    
-    main_text = text
-    uncertain_section = None
-    
-    for marker in section_markers:
-        match = re.search(marker, text, re.MULTILINE | re.IGNORECASE)
-        if match:
-            main_text = text[:match.start()].strip()
-            uncertain_section = text[match.end():].strip()
-            break
-    
-    # Check for "no uncertain places" indicators
-    if uncertain_section:
-        no_issues_indicators = [
-            r'нет сомнительных',
-            r'сомнительных мест нет',
-            r'no uncertain',
-            r'отсутствуют',
-            r'не обнаружен',
-        ]
-        for indicator in no_issues_indicators:
-            if re.search(indicator, uncertain_section, re.IGNORECASE):
-                uncertain_section = None
-                break
+    main_text, uncertain_section = split_uncertain_section(text)
     
     # Remove the "Сомнительные места" section from stored transcript
     if uncertain_section or main_text != text:
@@ -0,0 +1,97 @@
+"""
+Prompt budgeting before GPT calls.
+
+Every call in services/gpt.py counts its prompt first and is rejected with
+PromptTooLarge (HTTP 413 via the handler in main.py) when it would not fit
+the active model's context window minus GPT_OUTPUT_RESERVE_TOKENS, instead
+of failing at the provider after the upload and, for some errors, still
+being billed.
+
+Sections that can give way are fitted before the request is built:
+source materials (CONTEXT_SOURCES_SHARE of the budget) and chat attachments
+(CONTEXT_ATTACHMENTS_SHARE) are truncated with `fit_texts`; history is
+already bounded by services/conversation_context.py.
+
+Token counts of large texts (transcripts, extracted attachment text) are
+cached by content hash, so an unchanged transcript is tokenized once per
+process however many analysis calls it feeds.
+"""
+import os
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import List, Optional
+from app.utils.tokens import allocate, context_window, count_tokens, get_encoding, messages_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+GPT_OUTPUT_RESERVE_TOKENS = int(os.environ.get("GPT_OUTPUT_RESERVE_TOKENS", 16000))
+CONTEXT_SOURCES_SHARE = float(os.environ.get("CONTEXT_SOURCES_SHARE", 0.6))
+CONTEXT_ATTACHMENTS_SHARE = float(os.environ.get("CONTEXT_ATTACHMENTS_SHARE", 0.4))
+TOKEN_CACHE_SIZE = 2048
+TOKEN_CACHE_MIN_CHARS = 4000  # shorter texts are cheaper to count than to hash
+
+_token_cache = OrderedDict()
+
+
+class PromptTooLarge(Exception):
+    def __init__(self, tokens: int, limit: int):
+        self.tokens = tokens
+        self.limit = limit
+        super().__init__(
+            f"Запрос слишком большой для модели: ~{tokens} токенов при лимите {limit}. "
+            f"Сократите текст или уберите часть вложений."
+        )
+
+
+def prompt_budget(model: str, reserve: Optional[int] = None) -> int:
+    """Prompt tokens available for a model, after the reserve for the answer.
+
+    `reserve` is the call's output limit when it sets one (max_output_tokens),
+    GPT_OUTPUT_RESERVE_TOKENS otherwise.
+    """
+    return context_window(model) - (reserve or GPT_OUTPUT_RESERVE_TOKENS)
+
+
+def cached_count(text: Optional[str], model: Optional[str] = None) -> int:
+    """count_tokens, cached by content hash for large texts."""
+    if not text or len(text) < TOKEN_CACHE_MIN_CHARS:
+        return count_tokens(text, model)
+    encoding = get_encoding(model)
+    key = (encoding.name if encoding else None, hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest())
+    tokens = _token_cache.get(key)
+    if tokens is None:
+        tokens = count_tokens(text, model)
+        _token_cache[key] = tokens
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    else:
+        _token_cache.move_to_end(key)
+    return tokens
+
+
+def check_prompt(model: str, messages: List[dict], reserve: Optional[int] = None) -> int:
+    """Prompt tokens of a request; raises PromptTooLarge when it does not fit the model."""
+    tokens = messages_tokens(messages, model, cached_count)
+    limit = prompt_budget(model, reserve)
+    if tokens > limit:
+        logger.warning(f"Prompt rejected before dispatch: ~{tokens} tokens, {model} limit {limit}")
+        raise PromptTooLarge(tokens, limit)
+    return tokens
+
+
+def fit_texts(texts: List[str], budget: int, model: Optional[str] = None) -> List[str]:
+    """Truncate texts to share `budget` tokens; texts that fit are left as they are."""
+    sizes = [cached_count(t, model) for t in texts]
+    if sum(sizes) <= budget:
+        return texts
+    limits = allocate(sizes, budget)
+    logger.info(f"Fitting {len(texts)} sections of {sum(sizes)} tokens into {budget}")
+    return [t if size <= limit else truncate_tokens(t, limit, model) for t, size, limit in zip(texts, sizes, limits)]
+
+
+async def section_budget(share: float) -> tuple:
+    """(model, token budget) for a section taking `share` of the active model's prompt budget."""
+    from app.services.gpt import _get_active_model
+    model = await _get_active_model()
+    return model, int(prompt_budget(model) * share)
@@ -0,0 +1,94 @@
+"""
+Map-reduce GPT processing of transcripts with the master prompt.
+
+Long transcripts are split on speaker-paragraph boundaries and the master
+prompt runs on every chunk concurrently (bounded by GPT_CHUNK_CONCURRENCY),
+so processing time is bounded by chunk latency rather than transcript
+length. Chunk outputs and their "Сомнительные места" sections are merged
+into a single text for parse_uncertain_fragments.
+
+Every chunk is metered as soon as it completes (the `meter` callback), so
+chunks the provider has already billed are charged even when another chunk
+fails for good.
+"""
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+from app.services.gpt import GptResult, call_gpt52_metered
+from app.utils.transcript_chunks import split_transcript, merge_chunk_outputs
+
+logger = logging.getLogger(__name__)
+
+GPT_CHUNK_MAX_CHARS = int(os.environ.get("GPT_CHUNK_MAX_CHARS", 30000))
+GPT_CHUNK_CONCURRENCY = int(os.environ.get("GPT_CHUNK_CONCURRENCY", 4))
+GPT_CHUNK_ATTEMPTS = int(os.environ.get("GPT_CHUNK_ATTEMPTS", 2))
+
+CHUNK_NOTE = (
+    "\n\nВНИМАНИЕ: это фрагмент {index} из {total} длинной стенограммы. "
+    "Обработай только этот фрагмент целиком, ничего не пропуская и не добавляя "
+    "вступлений или выводов. Секцию «Сомнительные места» приведи только для этого фрагмента."
+)
+
+
+async def process_transcript(
+    system_message: str,
+    raw_content: str,
+    reasoning_effort: str = "high",
+    meter: Optional[Callable[[GptResult], Awaitable[None]]] = None,
+) -> GptResult:
+    """Run the master prompt over a transcript, chunked when it exceeds GPT_CHUNK_MAX_CHARS.
+
+    Returns a GptResult with the merged text and usage summed over all chunks.
+    `meter` is awaited with the result of every GPT call as it completes.
+    """
+    chunks = split_transcript(raw_content, GPT_CHUNK_MAX_CHARS)
+    if len(chunks) <= 1:
+        result = await call_gpt52_metered(
+            system_message=system_message,
+            user_message=raw_content,
+            reasoning_effort=reasoning_effort,
+            source="transcript_processing",
+        )
+        if meter:
+            await meter(result)
+        return result
+
+    logger.info(f"Processing transcript in {len(chunks)} chunks (concurrency {GPT_CHUNK_CONCURRENCY})")
+    limit = asyncio.Semaphore(GPT_CHUNK_CONCURRENCY)
+
+    async def run_chunk(index: int, chunk: str) -> GptResult:
+        note = CHUNK_NOTE.format(index=index + 1, total=len(chunks))
+        async with limit:
+            for attempt in range(1, GPT_CHUNK_ATTEMPTS + 1):
+                try:
+                    result = await call_gpt52_metered(
+                        system_message=system_message + note,
+                        user_message=chunk,
+                        reasoning_effort=reasoning_effort,
+                        source="transcript_processing",
+                    )
+                    break
+                except Exception as e:
+                    if attempt == GPT_CHUNK_ATTEMPTS:
+                        raise
+                    logger.warning(f"Chunk {index + 1}/{len(chunks)} failed (attempt {attempt}): {e}")
+        if meter:
+            await meter(result)
+        return result
+
+    # Let every chunk finish (and be metered) before reporting a failure
+    results = await asyncio.gather(*(run_chunk(i, c) for i, c in enumerate(chunks)), return_exceptions=True)
+    failures = [r for r in results if isinstance(r, BaseException)]
+    if failures:
+        logger.error(f"{len(failures)} of {len(chunks)} transcript chunks failed")
+        raise failures[0]
+    return GptResult(
+        content=merge_chunk_outputs([r.content for r in results]),
+        model=results[0].model,
+        prompt_tokens=sum(r.prompt_tokens for r in results),
+        completion_tokens=sum(r.completion_tokens for r in results),
+        total_tokens=sum(r.total_tokens for r in results),
+        cached_tokens=sum(r.cached_tokens for r in results),
+        cache_hit=all(r.cache_hit for r in results),
+    )
@@ -0,0 +1,115 @@
+"""
+Process-wide Deepgram transcription service.
+
+One SDK client (and its HTTP connection pool) and one bounded thread pool
+are shared by every transcription in the process, so thread count and
+connection churn stay constant under bursts of uploads. Calls beyond
+DEEPGRAM_MAX_CONCURRENCY wait for a slot; once DEEPGRAM_MAX_PENDING calls
+are already waiting, new ones are rejected with TranscriptionBusyError
+(the worker puts the job back in the queue after a short delay, without
+counting a failed attempt).
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from app.services.deepgram_client import create_deepgram_client
+from app.services.uploads import iter_file_chunks
+from app.utils.stats import percentile
+
+logger = logging.getLogger(__name__)
+
+DEEPGRAM_MAX_CONCURRENCY = int(os.environ.get("DEEPGRAM_MAX_CONCURRENCY", 4))
+DEEPGRAM_MAX_PENDING = int(os.environ.get("DEEPGRAM_MAX_PENDING", 32))
+LATENCY_WINDOW = 500
+
+
+class TranscriptionBusyError(Exception):
+    """Raised when too many transcription calls are already waiting."""
+
+
+class TranscriptionService:
+    def __init__(self, max_concurrency: int, max_pending: int):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="deepgram")
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._slots = None
+        self._waiting = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def _get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                self._client = create_deepgram_client()
+            return self._client
+
+    def _transcribe_sync(self, path: Path, options: dict):
+        return self._get_client().listen.v1.media.transcribe_file(
+            request=iter_file_chunks(path),
+            **options,
+        )
+
+    async def transcribe_file(self, path: Path, **options):
+        """Transcribe a file from disk (streamed) on the shared executor."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        if self._waiting >= self.max_pending:
+            self._rejected += 1
+            raise TranscriptionBusyError(
+                f"Deepgram busy: {self._waiting} calls waiting, {self._in_flight} in flight"
+            )
+
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._in_flight += 1
+        started = time.monotonic()
+        try:
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(self._executor, self._transcribe_sync, path, options)
+            self._completed += 1
+            return response
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._latencies.append(time.monotonic() - started)
+            self._in_flight -= 1
+            self._slots.release()
+
+    def metrics(self) -> dict:
+        latencies = list(self._latencies)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_pending": self.max_pending,
+            "queue_depth": self._waiting,
+            "in_flight": self._in_flight,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "latency_p50_s": round(percentile(latencies, 50), 3) if latencies else None,
+            "latency_p95_s": round(percentile(latencies, 95), 3) if latencies else None,
+        }
+
+
+_service = None
+
+
+def get_transcription_service() -> TranscriptionService:
+    global _service
+    if _service is None:
+        _service = TranscriptionService(DEEPGRAM_MAX_CONCURRENCY, DEEPGRAM_MAX_PENDING)
+    return _service
@@ -0,0 +1,65 @@
+"""
+Streaming file uploads: copy an incoming UploadFile to disk chunk by chunk,
+enforcing a size cap and computing a SHA-256 checksum on the fly.
+Memory use stays at one chunk regardless of the file size.
+"""
+import hashlib
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+import aiofiles
+from fastapi import HTTPException, UploadFile
+
+from app.core.config import UPLOAD_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StoredUpload:
+    path: Path
+    size: int
+    sha256: str
+
+
+async def save_upload_to_disk(
+    file: UploadFile,
+    dest: Path,
+    max_bytes: int,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> StoredUpload:
+    """Stream an upload to `dest`. Raises 413 and removes the partial file if over `max_bytes`."""
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(dest, "wb") as out:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Файл превышает {max_bytes // (1024 * 1024)}MB",
+                    )
+                digest.update(chunk)
+                await out.write(chunk)
+    except BaseException:
+        dest.unlink(missing_ok=True)
+        raise
+
+    logger.info(f"Upload stored: {dest.name} ({size} bytes)")
+    return StoredUpload(path=dest, size=size, sha256=digest.hexdigest())
+
+
+def iter_file_chunks(path: Path, chunk_size: int = UPLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield a file's contents in chunks — suitable as a streaming request body."""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
@@ -0,0 +1,149 @@
+"""
+Monthly usage rollups per user and per org (`usage_rollups`).
+
+One document per (scope, scope_id, month) with total_tokens,
+total_credits and total_requests. They are updated by the metering ledger
+projector in the same batch that writes usage_records, guarded by the
+batch id like the balance update (`applied_batches`), so monthly limit
+checks and /billing/usage/my are single-document reads.
+
+A rebuild overwrites the totals, so it runs with projection paused
+(metering_ledger.projector_paused); raises ProjectorBusy when another
+rebuild is running. Rebuild from raw usage_records:
+    python -m app.services.usage_rollups [--month YYYY-MM]
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Optional
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from app.core.database import db
+from app.utils.ledger_batches import mark_applied, not_applied
+
+logger = logging.getLogger(__name__)
+
+EMPTY_USAGE = {"total_tokens": 0, "total_credits": 0, "total_requests": 0}
+
+
+def month_key(iso_ts: str) -> str:
+    """'2026-10-16T18:33:43+00:00' -> '2026-10' (timestamps are stored in UTC)."""
+    return iso_ts[:7]
+
+
+def current_month() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m")
+
+
+async def ensure_rollup_indexes():
+    await db.usage_rollups.create_index([("scope", 1), ("scope_id", 1), ("month", 1)], unique=True)
+
+
+async def apply_rollups(usage_records: list, batch_id: str):
+    """Add a projector batch's usage records to the rollups, at most once per batch."""
+    totals = defaultdict(lambda: dict(EMPTY_USAGE))
+    for u in usage_records:
+        month = month_key(u["created_at"])
+        for scope, scope_id in (("user", u.get("user_id")), ("org", u.get("org_id"))):
+            if not scope_id:
+                continue
+            t = totals[(scope, scope_id, month)]
+            t["total_tokens"] += u.get("total_tokens", 0)
+            t["total_credits"] += u.get("credits_used", 0)
+            t["total_requests"] += 1
+    if not totals:
+        return
+
+    now = datetime.now(timezone.utc).isoformat()
+    ops = [
+        UpdateOne(
+            {"scope": scope, "scope_id": scope_id, "month": month, **not_applied(batch_id)},
+            {"$inc": t, "$set": {"updated_at": now}, **mark_applied(batch_id)},
+            upsert=True,
+        )
+        for (scope, scope_id, month), t in totals.items()
+    ]
+    try:
+        await db.usage_rollups.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # A duplicate key means the rollup already holds this batch (resumed batch)
+        errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+        if errors:
+            raise
+
+
+async def get_month_usage(scope: str, scope_id: str, month: Optional[str] = None) -> dict:
+    doc = await db.usage_rollups.find_one(
+        {"scope": scope, "scope_id": scope_id, "month": month or current_month()},
+        {"_id": 0, "total_tokens": 1, "total_credits": 1, "total_requests": 1},
+    )
+    return {**EMPTY_USAGE, **(doc or {})}
+
+
+async def rebuild_usage_rollups(month: Optional[str] = None) -> int:
+    """Recompute rollups from usage_records (one month, or all). Returns documents written."""
+    from app.services.metering_ledger import projector_paused
+    async with projector_paused():
+        return await _rebuild(month)
+
+
+async def _rebuild(month: Optional[str]) -> int:
+    match = {"created_at": {"$regex": f"^{month}"}} if month else {}
+    written = 0
+    for scope, field in (("user", "$user_id"), ("org", "$org_id")):
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": {"scope_id": field, "month": {"$substrCP": ["$created_at", 0, 7]}},
+                "total_tokens": {"$sum": "$total_tokens"},
+                "total_credits": {"$sum": "$credits_used"},
+                "total_requests": {"$sum": 1},
+            }},
+        ]
+        rows = [r for r in await db.usage_records.aggregate(pipeline).to_list(None) if r["_id"]["scope_id"]]
+        now = datetime.now(timezone.utc).isoformat()
+        ops = [
+            UpdateOne(
+                {"scope": scope, "scope_id": r["_id"]["scope_id"], "month": r["_id"]["month"]},
+                {"$set": {
+                    "total_tokens": r["total_tokens"],
+                    "total_credits": r["total_credits"],
+                    "total_requests": r["total_requests"],
+                    "updated_at": now,
+                }},
+                upsert=True,
+            )
+            for r in rows
+        ]
+        # Rollups with no records left in range are reset
+        stale = {"scope": scope}
+        if month:
+            stale["month"] = month
+        keep = {(r["_id"]["scope_id"], r["_id"]["month"]) for r in rows}
+        existing = await db.usage_rollups.find(stale, {"_id": 0, "scope_id": 1, "month": 1}).to_list(None)
+        for doc in existing:
+            if (doc["scope_id"], doc["month"]) not in keep:
+                ops.append(UpdateOne(
+                    {"scope": scope, "scope_id": doc["scope_id"], "month": doc["month"]},
+                    {"$set": {**EMPTY_USAGE, "updated_at": now}},
+                ))
+        if ops:
+            await db.usage_rollups.bulk_write(ops, ordered=False)
+            written += len(ops)
+    logger.info(f"Usage rollups rebuilt ({month or 'all months'}): {written} documents")
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Rebuild monthly usage rollups from usage_records")
+    parser.add_argument("--month", help="YYYY-MM (default: all months)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    async def _main():
+        await ensure_rollup_indexes()
+        await rebuild_usage_rollups(args.month)
+
+    asyncio.run(_main())
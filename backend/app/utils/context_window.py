@@ -0,0 +1,78 @@
+"""
+Token budgeting for conversation history (meeting chat, document streams).
+
+History is a list of turns: a user message plus the replies to it. The
+most recent turns that fit the budget are sent verbatim; everything older
+is replaced by a running summary (services/conversation_context.py keeps
+it up to date in the background). Tokens are counted with the model
+tokenizer (app/utils/tokens.py).
+"""
+from typing import List, Optional, Union
+from app.utils.tokens import content_tokens
+
+SUMMARY_HEADER = "Краткое содержание предыдущей части диалога:\n\n"
+
+SUMMARIZER_SYSTEM_MESSAGE = """Ты ведёшь краткое содержание длинного диалога пользователя с AI-ассистентом.
+Обнови краткое содержание с учётом новых реплик: сохрани запросы пользователя,
+ключевые выводы, решения, цифры, имена и договорённости, на которые могут сослаться дальше.
+Не добавляй ничего от себя. Пиши на русском языке, не длиннее {max_words} слов.
+Верни только обновлённое краткое содержание."""
+
+
+def estimate_tokens(content: Union[str, list, None]) -> int:
+    """Token count of a message content (text or multimodal parts)."""
+    return content_tokens(content)
+
+
+def turn_tokens(turn: List[dict]) -> int:
+    return sum(estimate_tokens(m.get("content")) for m in turn)
+
+
+def group_turns(messages: List[dict]) -> List[List[dict]]:
+    """Split a flat message list into turns, each starting at a user message."""
+    turns = []
+    for msg in messages:
+        if msg.get("role") == "user" or not turns:
+            turns.append([])
+        turns[-1].append(msg)
+    return turns
+
+
+def recent_start(turns: List[List[dict]], budget: int) -> int:
+    """Index of the oldest turn such that turns[index:] fit the budget.
+
+    The latest turn is always kept, even when it alone exceeds the budget.
+    """
+    used = 0
+    for i in range(len(turns) - 1, -1, -1):
+        used += turn_tokens(turns[i])
+        if used > budget and i < len(turns) - 1:
+            return i + 1
+    return 0
+
+
+def history_messages(summary: Optional[str], turns: List[List[dict]]) -> List[dict]:
+    """Summary of the older part (if any) followed by the recent turns verbatim."""
+    messages = []
+    if summary:
+        messages.append({"role": "system", "content": f"{SUMMARY_HEADER}{summary}"})
+    for turn in turns:
+        messages.extend(turn)
+    return messages
+
+
+def summary_request(previous: Optional[str], turns: List[List[dict]]) -> str:
+    """User message asking the summarizer to fold `turns` into the previous summary."""
+    lines = []
+    for turn in turns:
+        for msg in turn:
+            content = msg.get("content")
+            if isinstance(content, list):
+                content = "\n".join(p.get("text", "") for p in content if p.get("type") == "text")
+            speaker = "Пользователь" if msg.get("role") == "user" else "Ассистент"
+            lines.append(f"{speaker}: {content or ''}")
+    dialogue = "\n\n".join(lines)
+    return (
+        f"Текущее краткое содержание:\n{previous or '(пусто)'}\n\n"
+        f"Новые реплики:\n{dialogue}"
+    )
@@ -0,0 +1,21 @@
+"""Schedule arithmetic for daily / weekly jobs (UTC)."""
+from datetime import datetime, timedelta
+from typing import Optional
+
+
+def last_slot(now: datetime, hour: int, minute: int = 0, weekday: Optional[int] = None) -> datetime:
+    """Most recent scheduled time at or before `now`.
+
+    Daily at hour:minute, or weekly when `weekday` is given (0 = Monday).
+    """
+    slot = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if slot > now:
+        slot -= timedelta(days=1)
+    if weekday is not None:
+        slot -= timedelta(days=(slot.weekday() - weekday) % 7)
+    return slot
+
+
+def next_slot(now: datetime, hour: int, minute: int = 0, weekday: Optional[int] = None) -> datetime:
+    """First scheduled time strictly after `now`."""
+    return last_slot(now, hour, minute, weekday) + timedelta(days=1 if weekday is None else 7)
@@ -0,0 +1,27 @@
+"""
+Exactly-once guard for documents updated by metering ledger batches
+(`credit_balances`, `usage_rollups`).
+
+Each guarded document keeps the ids of the last LEDGER_BATCH_HISTORY
+batches applied to it in `applied_batches`; an update is filtered on the
+batch id not being there and pushes it in the same write. A batch resumed
+after later batches of the same org were applied is still recognised,
+which a single "last batch" value could not do. `last_ledger_batch` (the
+previous single-value guard) is still honoured for batches applied before
+the switch.
+"""
+
+LEDGER_BATCH_HISTORY = 1000
+
+
+def not_applied(batch_id: str) -> dict:
+    """Filter matching documents the batch has not been applied to yet."""
+    return {
+        "applied_batches": {"$ne": batch_id},
+        "last_ledger_batch": {"$ne": batch_id},
+    }
+
+
+def mark_applied(batch_id: str) -> dict:
+    """Update operator recording the batch on the document (capped history)."""
+    return {"$push": {"applied_batches": {"$each": [batch_id], "$slice": -LEDGER_BATCH_HISTORY}}}
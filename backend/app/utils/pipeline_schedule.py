@@ -0,0 +1,104 @@
+"""Dependency planning for the parallel pipeline runner.
+
+The runner used to execute `_topo_sort` order one node at a time, so every
+node implicitly saw the outputs of all nodes before it. To run nodes
+concurrently without changing results, a node waits for every earlier node
+it can observe:
+
+- flow / data edge sources and `input_from` (data deps),
+- nodes whose id or label it references as `{{name}}` in its prompt or
+  template, or as a quoted name in its script (`context.vars["name"]`).
+
+A batch_loop claims the first ai_prompt after it in topological order, as
+before; that node is not scheduled on its own, and the loop also waits for
+whatever the claimed node's prompt references.
+"""
+import re
+from typing import NamedTuple
+
+_VAR_RE = re.compile(r'\{\{(\w+)\}\}')
+_QUOTED_RE = re.compile(r'["\']([^"\'\n]+)["\']')
+_RESULTS_RE = re.compile(r'\bresults\b')
+
+
+class PipelinePlan(NamedTuple):
+    order: list          # node ids to execute, in topological order
+    deps: dict           # node_id -> [node ids it must wait for], in topological order
+    loop_targets: dict   # batch_loop node_id -> claimed ai_prompt node_id
+
+
+def template_refs(text: str) -> set:
+    """Names used as {{name}} placeholders."""
+    return set(_VAR_RE.findall(text or ""))
+
+
+def script_refs(script: str) -> set:
+    """Quoted strings in a node script; a superset of the vars it can read by name."""
+    return set(_QUOTED_RE.findall(script or ""))
+
+
+def script_reads_results(script: str) -> bool:
+    """Whether a batch_loop script may read context.results (earlier GPT answers).
+
+    Any mention of `results` counts, so iterations only run concurrently when
+    the script certainly cannot depend on previous batches.
+    """
+    return bool(_RESULTS_RE.search(script or ""))
+
+
+def plan_pipeline(nodes: list, edges: list, sorted_ids: list, data_deps: dict) -> PipelinePlan:
+    node_map = {n["node_id"]: n for n in nodes}
+    pos = {nid: i for i, nid in enumerate(sorted_ids)}
+
+    loop_targets = {}
+    consumed = set()
+    for i, nid in enumerate(sorted_ids):
+        node = node_map.get(nid)
+        if not node or nid in consumed or node.get("node_type") != "batch_loop":
+            continue
+        for next_id in sorted_ids[i + 1:]:
+            next_node = node_map.get(next_id)
+            if next_node and next_node.get("node_type") == "ai_prompt":
+                loop_targets[nid] = next_id
+                consumed.add(next_id)
+                break
+    owner = {ai_id: loop_id for loop_id, ai_id in loop_targets.items()}
+    order = [nid for nid in sorted_ids if nid in node_map and nid not in consumed]
+
+    # name -> nodes that write outputs[name]
+    writers = {}
+    for nid in order:
+        node = node_map[nid]
+        names = {nid, node.get("label", nid)}
+        ai_id = loop_targets.get(nid)
+        if ai_id:
+            names |= {ai_id, node_map[ai_id].get("label", ai_id)}
+        for name in names:
+            if name:
+                writers.setdefault(name, []).append(nid)
+
+    preds = {}
+    for e in edges:
+        if e.get("source") in node_map and e.get("target") in node_map:
+            preds.setdefault(e["target"], []).append(e["source"])
+
+    deps = {}
+    for nid in order:
+        node = node_map[nid]
+        candidates = list(preds.get(nid, [])) + list(data_deps.get(nid, []))
+        names = template_refs(node.get("inline_prompt")) | template_refs(node.get("template_text"))
+        names |= script_refs(node.get("script"))
+        ai_id = loop_targets.get(nid)
+        if ai_id:
+            names |= template_refs(node_map[ai_id].get("inline_prompt"))
+        for name in names:
+            candidates.extend(writers.get(name, []))
+
+        wait_for = set()
+        for dep in candidates:
+            dep = owner.get(dep, dep)
+            if dep != nid and dep in pos and pos[dep] < pos[nid] and dep not in consumed:
+                wait_for.add(dep)
+        deps[nid] = sorted(wait_for, key=pos.get)
+
+    return PipelinePlan(order, deps, loop_targets)
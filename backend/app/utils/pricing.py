@@ -0,0 +1,140 @@
+"""
+Pure pricing engine for AI usage: base cost from token counts, tiered
+markup and credit conversion. No I/O, so it serves both the metering hot
+path and bulk backfills over usage_records.
+"""
+from bisect import bisect_right
+from typing import Iterable, NamedTuple, Optional
+
+# Model pricing (per 1M tokens) — updated for current models.
+# "cached_input" is the rate for prompt tokens served from the provider's
+# prompt cache; models without it bill cached tokens as regular input.
+MODEL_PRICING = {
+    "gpt-4o": {"input": 2.50, "output": 10.00, "cached_input": 1.25},
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60, "cached_input": 0.075},
+    "gpt-4-turbo": {"input": 10.00, "output": 30.00},
+    "gpt-4": {"input": 30.00, "output": 60.00},
+    "gpt-3.5-turbo": {"input": 0.50, "output": 1.50},
+    "gpt-5.2": {"input": 2.50, "output": 10.00, "cached_input": 0.25},
+    "o1": {"input": 15.00, "output": 60.00, "cached_input": 7.50},
+    "o1-mini": {"input": 3.00, "output": 12.00, "cached_input": 1.50},
+}
+
+DEFAULT_PRICING = {"input": 5.00, "output": 15.00}
+
+# Used when no tier covers the cost
+FALLBACK_MULTIPLIER = 2.0
+
+# 1 credit = $0.02
+CREDIT_USD = 0.02
+
+
+def calculate_base_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """Calculate base USD cost from token usage (cached_tokens is part of prompt_tokens)."""
+    pricing = MODEL_PRICING.get(model, DEFAULT_PRICING)
+    cached = min(cached_tokens or 0, prompt_tokens)
+    input_cost = ((prompt_tokens - cached) / 1_000_000) * pricing["input"]
+    cached_cost = (cached / 1_000_000) * pricing.get("cached_input", pricing["input"])
+    output_cost = (completion_tokens / 1_000_000) * pricing["output"]
+    return input_cost + cached_cost + output_cost
+
+
+def usd_to_credits(usd: float) -> float:
+    """Convert USD to credits. 1 credit = $0.02."""
+    return usd / CREDIT_USD
+
+
+class MarkupTable:
+    """Markup tiers compiled for O(log n) lookup.
+
+    Matches the original linear scan exactly: a cost gets the multiplier of
+    the first tier (by min_cost) with min_cost <= cost < max_cost, even when
+    tiers overlap or leave gaps. All tier boundaries split the cost axis into
+    elementary intervals, each pre-resolved to its multiplier.
+    """
+
+    def __init__(self, tiers: Iterable[dict], fallback: float = FALLBACK_MULTIPLIER):
+        self.tiers = tuple(sorted(tiers, key=lambda t: t["min_cost"]))
+        self.fallback = fallback
+        self._bounds = sorted({t["min_cost"] for t in self.tiers} | {t["max_cost"] for t in self.tiers})
+        self._multipliers = []
+        for lo in self._bounds:
+            match = next((t["multiplier"] for t in self.tiers if t["min_cost"] <= lo < t["max_cost"]), None)
+            self._multipliers.append(match)
+
+    def multiplier_for(self, base_cost: float) -> float:
+        i = bisect_right(self._bounds, base_cost) - 1
+        if i < 0:
+            return self.fallback
+        m = self._multipliers[i]
+        return self.fallback if m is None else m
+
+    def apply(self, base_cost: float) -> tuple:
+        """Returns (final_cost_usd, multiplier_used)."""
+        multiplier = self.multiplier_for(base_cost)
+        return base_cost * multiplier, multiplier
+
+
+class PricedUsage(NamedTuple):
+    base_cost_usd: float
+    markup_multiplier: float
+    final_cost_usd: float
+    credits_used: float
+
+
+def price_usage(table: MarkupTable, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> PricedUsage:
+    base_cost = calculate_base_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+    final_cost, multiplier = table.apply(base_cost)
+    return PricedUsage(base_cost, multiplier, final_cost, usd_to_credits(final_cost))
+
+
+def price_usage_batch(table: MarkupTable, records: Iterable[dict], model_pricing: Optional[dict] = None) -> list:
+    """Price many usage records ({model, prompt_tokens, completion_tokens, cached_tokens}) for backfills.
+
+    Same results as price_usage, with per-model rates and lookups hoisted
+    out of the loop.
+    """
+    model_pricing = model_pricing or MODEL_PRICING
+    rates = {}
+    bounds, multipliers, fallback = table._bounds, table._multipliers, table.fallback
+    bisect = bisect_right
+    result = []
+    append = result.append
+    for r in records:
+        model = r.get("model")
+        rate = rates.get(model)
+        if rate is None:
+            p = model_pricing.get(model, DEFAULT_PRICING)
+            rate = rates[model] = (p["input"], p["output"], p.get("cached_input", p["input"]))
+        prompt = r.get("prompt_tokens") or 0
+        cached = min(r.get("cached_tokens") or 0, prompt)
+        base = ((prompt - cached) / 1_000_000) * rate[0] + ((r.get("completion_tokens") or 0) / 1_000_000) * rate[1] + (cached / 1_000_000) * rate[2]
+        i = bisect(bounds, base) - 1
+        m = multipliers[i] if i >= 0 else None
+        if m is None:
+            m = fallback
+        final = base * m
+        append(PricedUsage(base, m, final, final / CREDIT_USD))
+    return result
+
+
+class StorageCharge(NamedTuple):
+    gb: float
+    base_cost_usd: float
+    final_cost_usd: float
+    credits_used: float
+
+
+# Daily storage charges at or below this many credits are not billed
+MIN_STORAGE_CHARGE_CREDITS = 0.0001
+
+
+def price_storage_day(total_bytes: int, cost_per_gb_month: float, days_in_month: int, multiplier: float) -> Optional[StorageCharge]:
+    """One day of object storage for `total_bytes`; None when too small to bill."""
+    gb = total_bytes / (1024 ** 3)
+    base = gb * cost_per_gb_month / days_in_month
+    final = base * multiplier
+    credits = usd_to_credits(final)
+    if credits <= MIN_STORAGE_CHARGE_CREDITS:
+        return None
+    return StorageCharge(gb, base, final, credits)
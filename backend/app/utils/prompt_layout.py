@@ -0,0 +1,59 @@
+"""
+Prompt assembly with a stable, cacheable prefix.
+
+Provider prompt caching matches requests on their longest common prefix,
+so everything that repeats across calls on the same meeting or document
+project goes first, byte-identical every time:
+
+  1. stable system message (never depends on the request)
+  2. the transcript or the project's source materials
+  3. previous turns (append-only, so each call extends the last prefix)
+  4. request-specific instructions, as a separate system message
+  5. the request itself
+
+Anything that varies per call (wizard step instructions, node system
+messages, the prompt) must stay below the prefix.
+"""
+from typing import List, Optional, Union
+
+MEETING_SYSTEM_MESSAGE = """Ты — профессиональный ассистент для анализа рабочих встреч.
+У тебя есть транскрипт встречи и история предыдущих запросов по этой встрече.
+Отвечай структурированно, используя markdown для форматирования.
+При ссылках на реплики участников указывай их имена."""
+
+TRANSCRIPT_INTRO = "Вот транскрипт встречи:\n\n"
+TRANSCRIPT_ACK = "Спасибо, я прочитал транскрипт. Готов помочь с анализом."
+
+SOURCES_SYSTEM_MESSAGE = "Ты — AI-ассистент для анализа документов. Отвечай на русском языке."
+SOURCES_HEADER = "Исходные материалы проекта:\n"
+
+
+def transcript_prefix(transcript_text: str) -> List[dict]:
+    """The transcript as a fixed user/assistant exchange."""
+    return [
+        {"role": "user", "content": f"{TRANSCRIPT_INTRO}{transcript_text}"},
+        {"role": "assistant", "content": TRANSCRIPT_ACK},
+    ]
+
+
+def sources_system_message(source_context: str, base: str = SOURCES_SYSTEM_MESSAGE) -> str:
+    """Stable system message carrying a document project's source materials."""
+    if not source_context:
+        return base
+    return f"{base}\n\n{SOURCES_HEADER}{source_context}"
+
+
+def layout_messages(
+    prefix: List[dict],
+    request: Union[str, list],
+    history: Optional[List[dict]] = None,
+    instructions: Optional[str] = None,
+) -> List[dict]:
+    """Messages after the stable system message: prefix, history, instructions, request."""
+    messages = list(prefix)
+    if history:
+        messages.extend(history)
+    if instructions:
+        messages.append({"role": "system", "content": instructions})
+    messages.append({"role": "user", "content": request})
+    return messages
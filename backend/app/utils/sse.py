@@ -0,0 +1,14 @@
+"""Server-Sent Events formatting."""
+import json
+
+
+def sse_event(event: str, data) -> str:
+    """Format one SSE frame. `data` is JSON-encoded; multi-line payloads are split per the spec."""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    lines = "\n".join(f"data: {line}" for line in payload.split("\n"))
+    return f"event: {event}\n{lines}\n\n"
+
+
+def sse_comment(text: str = "") -> str:
+    """SSE comment frame — ignored by clients, used to flush headers and keep proxies alive."""
+    return f": {text}\n\n"
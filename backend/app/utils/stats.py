@@ -0,0 +1,40 @@
+"""Small statistics helpers for latency metrics."""
+
+
+def percentile(values: list, pct: float) -> float:
+    """Linear-interpolated percentile (pct in 0..100) of a list of numbers."""
+    if not values:
+        raise ValueError("percentile of empty list")
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return float(ordered[0])
+    rank = (len(ordered) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    fraction = rank - lower
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * fraction
+
+
+def summarize_calls(records: list, group_by: tuple, pcts: tuple = (50, 90, 95, 99)) -> list:
+    """Per-group call count, latency / time-to-first-token percentiles and mean tokens.
+
+    records: dicts with `latency_ms`, optional `ttft_ms` and token counts;
+    groups are sorted by call count, largest first.
+    """
+    groups = {}
+    for r in records:
+        groups.setdefault(tuple(r.get(k) for k in group_by), []).append(r)
+    summary = []
+    for key, rows in groups.items():
+        entry = dict(zip(group_by, key))
+        entry["calls"] = len(rows)
+        entry["errors"] = sum(1 for r in rows if r.get("status") == "error")
+        for field in ("latency_ms", "ttft_ms"):
+            values = [r[field] for r in rows if r.get(field) is not None]
+            for pct in pcts:
+                entry[f"{field}_p{pct}"] = round(percentile(values, pct), 1) if values else None
+        for field in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+            entry[f"avg_{field}"] = round(sum(r.get(field) or 0 for r in rows) / len(rows), 1)
+        summary.append(entry)
+    summary.sort(key=lambda e: -e["calls"])
+    return summary
@@ -0,0 +1,127 @@
+"""
+Prompt token counting with the model's tokenizer (tiktoken).
+
+When tiktoken or its encoding files are unavailable, counts fall back to a
+length-based estimate (CHARS_PER_TOKEN), which over-counts Russian text
+slightly and is good enough for budgeting.
+"""
+from functools import lru_cache
+from typing import List, Optional, Union
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4     # role and separators of every chat message
+REPLY_PRIMING_TOKENS = 3
+IMAGE_PART_TOKENS = 1000        # a high-detail image tile set, roughly
+FILE_PART_BYTES_PER_TOKEN = 40  # PDFs sent as files: text plus page images
+
+DEFAULT_ENCODING = "o200k_base"
+DEFAULT_CONTEXT_WINDOW = 128_000
+
+# Prompt (input) tokens a model accepts: the whole context window where
+# prompt and completion share it, the separate input limit where the model
+# has one (gpt-5.2: 400k total, of which at most 272k input)
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128_000,
+    "gpt-4o-mini": 128_000,
+    "gpt-4-turbo": 128_000,
+    "gpt-4": 8_192,
+    "gpt-3.5-turbo": 16_385,
+    "gpt-5.2": 272_000,
+    "o1": 200_000,
+    "o1-mini": 128_000,
+}
+
+TRUNCATION_MARK = "\n[…текст сокращён]"
+
+
+def context_window(model: Optional[str]) -> int:
+    return MODEL_CONTEXT_WINDOWS.get(model or "", DEFAULT_CONTEXT_WINDOW)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: Optional[str] = None):
+    """tiktoken encoding for a model, or None when tiktoken is not usable."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(DEFAULT_ENCODING)
+    except KeyError:
+        return get_encoding(None) if model else None
+    except Exception:
+        # Encoding files could not be loaded (e.g. no network on first use)
+        return None
+
+
+def count_tokens(text: Optional[str], model: Optional[str] = None) -> int:
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _file_part_tokens(part: dict) -> int:
+    data = (part.get("file") or {}).get("file_data", "")
+    payload = data.split(",", 1)[-1]
+    return max(len(payload) * 3 // 4 // FILE_PART_BYTES_PER_TOKEN, IMAGE_PART_TOKENS)
+
+
+def content_tokens(content: Union[str, list, None], model: Optional[str] = None, count=count_tokens) -> int:
+    """Tokens of a message content: text or multimodal parts (text, image_url, file)."""
+    if not content:
+        return 0
+    if isinstance(content, str):
+        return count(content, model)
+    total = 0
+    for part in content:
+        kind = part.get("type")
+        if kind == "text":
+            total += count(part.get("text"), model)
+        elif kind == "file":
+            total += _file_part_tokens(part)
+        else:
+            total += IMAGE_PART_TOKENS
+    return total
+
+
+def messages_tokens(messages: List[dict], model: Optional[str] = None, count=count_tokens) -> int:
+    """Prompt tokens of a chat completion request."""
+    return REPLY_PRIMING_TOKENS + sum(
+        MESSAGE_OVERHEAD_TOKENS + content_tokens(m.get("content"), model, count) for m in messages
+    )
+
+
+def truncate_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Cut text to at most max_tokens (marker included); unchanged when it fits."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    keep = max(max_tokens - count_tokens(TRUNCATION_MARK, model), 0)
+    encoding = get_encoding(model)
+    if encoding is None:
+        head = text[:max(keep - 1, 0) * CHARS_PER_TOKEN]
+    else:
+        head = encoding.decode(encoding.encode(text, disallowed_special=())[:keep])
+    return head + TRUNCATION_MARK
+
+
+def allocate(sizes: List[int], budget: int) -> List[int]:
+    """Share a token budget between sections: small ones keep their size,
+    the rest split what is left equally (water-filling)."""
+    limits = [0] * len(sizes)
+    remaining = max(budget, 0)
+    pending = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    while pending:
+        share = remaining // len(pending)
+        i = pending[0]
+        if sizes[i] <= share:
+            limits[i] = sizes[i]
+            remaining -= sizes[i]
+            pending.pop(0)
+        else:
+            for j in pending:
+                limits[j] = share
+            break
+    return limits
@@ -0,0 +1,118 @@
+"""
+Helpers for map-reduce GPT processing of long transcripts: splitting the
+raw transcript into chunks on speaker-paragraph boundaries and merging the
+per-chunk outputs (text + "Сомнительные места" sections) back into one.
+"""
+import re
+
+UNCERTAIN_SECTION_MARKERS = [
+    r'^---+\s*$\n+\s*(?:Сомнительные места|Uncertain places|Сомнения)',
+    r'\n\n(?:Сомнительные места|Uncertain places|Сомнения)\s*:?\s*\n',
+    r'\n(?:Сомнительные места|Uncertain places|Сомнения)\s*:\s*\n',
+]
+
+NO_UNCERTAIN_INDICATORS = [
+    r'нет сомнительных',
+    r'сомнительных мест нет',
+    r'no uncertain',
+    r'отсутствуют',
+    r'не обнаружен',
+]
+
+_SPEAKER_PREFIX = re.compile(r'^([^:\n]{1,80}):\s')
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+
+def split_uncertain_section(text: str) -> tuple:
+    """Split GPT output into (main_text, uncertain_section).
+
+    uncertain_section is None when there is no section or it only says
+    that there are no uncertain places.
+    """
+    main_text = text
+    uncertain_section = None
+    for marker in UNCERTAIN_SECTION_MARKERS:
+        match = re.search(marker, text, re.MULTILINE | re.IGNORECASE)
+        if match:
+            main_text = text[:match.start()].strip()
+            uncertain_section = text[match.end():].strip()
+            break
+
+    if uncertain_section:
+        for indicator in NO_UNCERTAIN_INDICATORS:
+            if re.search(indicator, uncertain_section, re.IGNORECASE):
+                uncertain_section = None
+                break
+    return main_text, uncertain_section
+
+
+def _split_paragraph(paragraph: str, max_chars: int) -> list:
+    """Split an oversized speaker paragraph at sentence ends, repeating the speaker label."""
+    match = _SPEAKER_PREFIX.match(paragraph)
+    prefix = match.group(0) if match else ""
+    body = paragraph[len(prefix):]
+    limit = max(max_chars - len(prefix), 1)
+
+    pieces, current = [], ""
+    for sentence in _SENTENCE_END.split(body):
+        while len(sentence) > limit:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:limit])
+            sentence = sentence[limit:]
+        if current and len(current) + 1 + len(sentence) > limit:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return [prefix + p for p in pieces]
+
+
+def split_transcript(text: str, max_chars: int) -> list:
+    """Pack speaker paragraphs (separated by blank lines) into chunks of at most max_chars."""
+    paragraphs = []
+    for p in re.split(r'\n\s*\n', text):
+        p = p.strip()
+        if not p:
+            continue
+        paragraphs.extend(_split_paragraph(p, max_chars) if len(p) > max_chars else [p])
+
+    chunks, current = [], []
+    size = 0
+    for p in paragraphs:
+        added = len(p) + (2 if current else 0)
+        if current and size + added > max_chars:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+            added = len(p)
+        current.append(p)
+        size += added
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def merge_chunk_outputs(outputs: list) -> str:
+    """Join per-chunk GPT outputs, combining their "Сомнительные места" sections into one."""
+    texts, items, seen = [], [], set()
+    for output in outputs:
+        main_text, section = split_uncertain_section(output or "")
+        if main_text:
+            texts.append(main_text)
+        if not section:
+            continue
+        # The "---" marker leaves the heading's colon in the section (text_parser relies on it as is)
+        for line in section.lstrip(":").split("\n"):
+            item = re.sub(r'^(?:\d+[\.\)]\s*|[-•]\s*)', '', line.strip()).strip()
+            if item and item.lower() not in seen:
+                seen.add(item.lower())
+                items.append(item)
+
+    merged = "\n\n".join(texts)
+    if items:
+        numbered = "\n".join(f"{i}. {item}" for i, item in enumerate(items, 1))
+        merged += f"\n\n---\nСомнительные места:\n{numbered}"
+    return merged
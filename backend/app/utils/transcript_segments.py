@@ -0,0 +1,110 @@
+"""
+Helpers for chunked transcription: planning overlapping audio segments and
+stitching per-segment diarized sentences back into one transcript.
+
+A segment result is a dict:
+    {"index": 0, "start": 0.0, "end": 600.0,
+     "sentences": [{"speaker": 0, "start": 1.2, "end": 3.4, "text": "..."}]}
+with sentence times already absolute (segment offset applied). Speaker
+numbers are local to each segment until reconciled by `stitch_segments`.
+"""
+from collections import defaultdict
+
+
+def plan_segments(duration: float, segment_seconds: float, overlap_seconds: float) -> list:
+    """Split [0, duration] into segments of `segment_seconds` overlapping by `overlap_seconds`."""
+    if duration <= 0:
+        return []
+    if overlap_seconds >= segment_seconds:
+        raise ValueError("overlap must be shorter than the segment length")
+    segments = []
+    start = 0.0
+    while True:
+        end = min(start + segment_seconds, duration)
+        segments.append((round(start, 3), round(end, 3)))
+        if end >= duration:
+            break
+        start = end - overlap_seconds
+    return segments
+
+
+def _midpoint(sentence: dict) -> float:
+    return (sentence["start"] + sentence["end"]) / 2
+
+
+def _intersection(a: dict, b: dict) -> float:
+    return max(0.0, min(a["end"], b["end"]) - max(a["start"], b["start"]))
+
+
+def reconcile_speakers(prev_sentences: list, cur_sentences: list, next_global: int) -> tuple:
+    """Map the current segment's local speakers onto global speakers.
+
+    `prev_sentences` carry global speaker ids; both lists should be limited to
+    the overlap window. Speakers are matched one-to-one by total overlapping
+    speech time; unmatched local speakers get fresh global ids.
+    Returns (mapping, next_global).
+    """
+    votes = defaultdict(float)
+    for cur in cur_sentences:
+        for prev in prev_sentences:
+            weight = _intersection(cur, prev)
+            if weight > 0:
+                votes[(cur["speaker"], prev["speaker"])] += weight
+
+    mapping = {}
+    used_global = set()
+    for (local, glob), _ in sorted(votes.items(), key=lambda kv: kv[1], reverse=True):
+        if local in mapping or glob in used_global:
+            continue
+        mapping[local] = glob
+        used_global.add(glob)
+
+    for cur in sorted(cur_sentences, key=lambda s: s["start"]):
+        if cur["speaker"] not in mapping:
+            mapping[cur["speaker"]] = next_global
+            next_global += 1
+    return mapping, next_global
+
+
+def stitch_segments(segments: list) -> list:
+    """Merge overlapping segment results into [(global_speaker, text), ...] in time order.
+
+    Each sentence is kept by exactly one segment: the cut between two
+    neighbours is the middle of their overlap.
+    """
+    segments = sorted(segments, key=lambda s: s["index"])
+    if not segments:
+        return []
+
+    cuts = [float("-inf")]
+    for prev, cur in zip(segments, segments[1:]):
+        cuts.append((cur["start"] + prev["end"]) / 2)
+    cuts.append(float("inf"))
+
+    result = []
+    prev_global = []  # previous segment's sentences with global speaker ids
+    next_global = 0
+    for i, seg in enumerate(segments):
+        sentences = seg.get("sentences", [])
+        if i == 0:
+            mapping = {}
+            for s in sorted(sentences, key=lambda s: s["start"]):
+                if s["speaker"] not in mapping:
+                    mapping[s["speaker"]] = s["speaker"]
+            next_global = max(mapping.values(), default=-1) + 1
+        else:
+            overlap_start, overlap_end = seg["start"], segments[i - 1]["end"]
+            prev_window = [s for s in prev_global if s["end"] > overlap_start]
+            cur_window = [s for s in sentences if s["start"] < overlap_end]
+            mapping, next_global = reconcile_speakers(prev_window, cur_window, next_global)
+            for s in sentences:
+                if s["speaker"] not in mapping:
+                    mapping[s["speaker"]] = next_global
+                    next_global += 1
+
+        globalized = [{**s, "speaker": mapping[s["speaker"]]} for s in sentences]
+        for s in sorted(globalized, key=lambda s: s["start"]):
+            if cuts[i] <= _midpoint(s) < cuts[i + 1]:
+                result.append((s["speaker"], s["text"]))
+        prev_global = globalized
+    return result
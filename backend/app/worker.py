@@ -0,0 +1,229 @@
+"""
+Background job worker.
+
+Run with:  python -m app.worker
+
+Claims jobs from the Mongo-backed queue (app/services/job_queue.py) and runs
+them. Each process keeps between WORKER_MIN_CONCURRENCY and
+WORKER_MAX_CONCURRENCY job slots, growing with queue depth and shrinking
+when idle; more capacity comes from running more worker containers, which
+coordinate only through job leases.
+"""
+import os
+import signal
+import socket
+import asyncio
+import logging
+from app.services.job_queue import (
+    JOB_LEASE_SECONDS,
+    JobDeferred,
+    ensure_job_indexes,
+    claim_job,
+    renew_lease,
+    complete_job,
+    fail_job,
+    fail_expired_jobs,
+    release_job,
+    queue_depth,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("app.worker")
+
+WORKER_MIN_CONCURRENCY = int(os.environ.get("WORKER_MIN_CONCURRENCY", 1))
+WORKER_MAX_CONCURRENCY = int(os.environ.get("WORKER_MAX_CONCURRENCY", 8))
+POLL_INTERVAL_SECONDS = 2
+SCALE_INTERVAL_SECONDS = 5
+TRANSCRIPTION_BUSY_RETRY_SECONDS = 30
+
+
+# ── Job handlers ──
+
+async def _run_transcription(payload: dict):
+    from app.routes.projects import process_transcription
+    from app.services.transcription import TranscriptionBusyError
+    try:
+        await process_transcription(**payload, reraise=True)
+    except TranscriptionBusyError as e:
+        # The pool is full, not a failure of this job: try again shortly
+        raise JobDeferred(TRANSCRIPTION_BUSY_RETRY_SECONDS, str(e))
+
+
+async def _transcription_failed(payload: dict, error: str):
+    from app.routes.projects import mark_transcription_failed
+    await mark_transcription_failed(payload["project_id"], error)
+
+
+async def _run_pipeline(payload: dict):
+    from app.services.pipeline_jobs import run_pipeline_job
+    await run_pipeline_job(payload["run_id"])
+
+
+async def _pipeline_failed(payload: dict, error: str):
+    from app.services.pipeline_jobs import mark_pipeline_run_failed
+    await mark_pipeline_run_failed(payload["run_id"], error)
+
+
+JOB_HANDLERS = {
+    "transcription": _run_transcription,
+    "pipeline_run": _run_pipeline,
+}
+
+FAILURE_HANDLERS = {
+    "transcription": _transcription_failed,
+    "pipeline_run": _pipeline_failed,
+}
+
+
+# ── Worker loop ──
+
+async def _keep_lease(job_id: str, slot_id: str, handler: asyncio.Task):
+    """Renew the job lease; cancel the handler once the lease is lost.
+
+    A renewal that fails on a DB error is retried until the lease would
+    have expired, since by then claim_job may hand the job to another slot.
+    """
+    loop = asyncio.get_running_loop()
+    renewed_at = loop.time()
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            if await renew_lease(job_id, slot_id):
+                renewed_at = loop.time()
+                continue
+            logger.warning(f"[{slot_id}] Lost lease on job {job_id}, cancelling")
+        except Exception as e:
+            if loop.time() - renewed_at < JOB_LEASE_SECONDS * 2 / 3:
+                logger.warning(f"[{slot_id}] Lease renewal error for job {job_id}: {e}")
+                continue
+            logger.error(f"[{slot_id}] Could not renew lease on job {job_id}, cancelling: {e}")
+        handler.cancel()
+        return
+
+
+async def _on_failed(job: dict, error: str):
+    """Run the failure handler of a job that will not be retried."""
+    if job["type"] not in FAILURE_HANDLERS:
+        return
+    try:
+        await FAILURE_HANDLERS[job["type"]](job["payload"], error)
+    except Exception as fe:
+        logger.error(f"Failure handler error for job {job['id']}: {fe}")
+
+
+async def _fail_expired():
+    """Jobs whose worker died on their last attempt: fail them and run their handlers."""
+    try:
+        for job in await fail_expired_jobs():
+            await _on_failed(job, job["last_error"])
+    except Exception as e:
+        logger.error(f"Expired job check failed: {e}")
+
+
+async def _run_job(job: dict, slot_id: str):
+    logger.info(f"[{slot_id}] Running job {job['type']} id={job['id']} attempt={job['attempts']}")
+    handler = asyncio.create_task(JOB_HANDLERS[job["type"]](job["payload"]))
+    heartbeat = asyncio.create_task(_keep_lease(job["id"], slot_id, handler))
+    try:
+        await handler
+    except asyncio.CancelledError:
+        if not heartbeat.done():
+            raise  # the slot itself is being cancelled
+        # Lease lost: the job belongs to another slot now, leave its state alone
+        logger.warning(f"[{slot_id}] Job {job['id']} abandoned after losing its lease")
+    except JobDeferred as d:
+        await release_job(job, slot_id, d.delay, str(d))
+    except Exception as e:
+        will_retry = await fail_job(job, slot_id, str(e))
+        if not will_retry:
+            await _on_failed(job, str(e))
+    else:
+        await complete_job(job["id"], slot_id)
+        logger.info(f"[{slot_id}] Job {job['id']} done")
+    finally:
+        heartbeat.cancel()
+        handler.cancel()
+
+
+async def _wait(stop: asyncio.Event, seconds: float):
+    try:
+        await asyncio.wait_for(stop.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def _slot(slot_id: str, stop: asyncio.Event, exit_when_idle: bool):
+    while not stop.is_set():
+        try:
+            job = await claim_job(slot_id, list(JOB_HANDLERS))
+        except Exception as e:
+            logger.error(f"[{slot_id}] Claim error: {e}")
+            job = None
+        if job is None:
+            if exit_when_idle:
+                return
+            await _wait(stop, POLL_INTERVAL_SECONDS)
+            continue
+        await _run_job(job, slot_id)
+
+
+async def _publish_status(worker_id: str, active_slots: int, depth: int):
+    """Heartbeat with transcription metrics, read by /api/admin/transcription/metrics."""
+    from datetime import datetime, timezone
+    from app.core.database import db
+    from app.services.transcription import get_transcription_service
+    try:
+        await db.worker_status.update_one(
+            {"worker_id": worker_id},
+            {"$set": {
+                "worker_id": worker_id,
+                "active_slots": active_slots,
+                "job_queue_depth": depth,
+                "transcription": get_transcription_service().metrics(),
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }},
+            upsert=True,
+        )
+    except Exception as e:
+        logger.warning(f"Failed to publish worker status: {e}")
+
+
+async def run_worker():
+    base_id = f"{socket.gethostname()}:{os.getpid()}"
+    await ensure_job_indexes()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    from app.services.metering_ledger import run_ledger_projector
+    projector = asyncio.create_task(run_ledger_projector(stop))
+
+    logger.info(f"Worker {base_id} started (slots {WORKER_MIN_CONCURRENCY}..{WORKER_MAX_CONCURRENCY})")
+    slots = set()
+    counter = 0
+    while not stop.is_set():
+        slots = {t for t in slots if not t.done()}
+        try:
+            depth = await queue_depth(list(JOB_HANDLERS))
+        except Exception as e:
+            logger.error(f"Queue depth check failed: {e}")
+            depth = 0
+        await _publish_status(base_id, len(slots), depth)
+        await _fail_expired()
+        target = max(WORKER_MIN_CONCURRENCY, min(WORKER_MAX_CONCURRENCY, len(slots) + depth))
+        while len(slots) < target:
+            counter += 1
+            # Slots above the minimum are burst capacity and exit once the queue is drained
+            burst = len(slots) >= WORKER_MIN_CONCURRENCY
+            slots.add(asyncio.create_task(_slot(f"{base_id}/{counter}", stop, burst)))
+        await _wait(stop, SCALE_INTERVAL_SECONDS)
+
+    logger.info(f"Worker {base_id} stopping, waiting for {len(slots)} running slots")
+    await asyncio.gather(*slots, return_exceptions=True)
+    projector.cancel()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())
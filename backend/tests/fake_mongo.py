@@ -0,0 +1,343 @@
+"""
+Minimal in-memory stand-in for the motor collections used by unit tests.
+
+Supports the subset of queries and update operators the services use:
+equality (with array membership; None matches a missing field), $ne,
+$lt/$lte/$gt/$gte, $in, $nin, $exists, $or, $and, $expr (comparisons of
+fields and $ifNull); $set, $unset, $inc,
+$setOnInsert, $push ($each/$slice), $addToSet; unique indexes
+(DuplicateKeyError on insert or upsert) and bulk_write of UpdateOne. Not a
+general MongoDB emulator.
+"""
+import copy
+from types import SimpleNamespace
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_MISSING = object()
+
+
+def _get(doc, path):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _eq(value, expected):
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def _cmp(value, op, arg):
+    if value is _MISSING or value is None:
+        return False
+    try:
+        return {"$lt": value < arg, "$lte": value <= arg, "$gt": value > arg, "$gte": value >= arg}[op]
+    except TypeError:
+        return False
+
+
+def _match_field(value, cond):
+    if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+        for op, arg in cond.items():
+            if op == "$ne":
+                if value is not _MISSING and _eq(value, arg):
+                    return False
+            elif op == "$in":
+                if not any(value is not _MISSING and _eq(value, a) for a in arg):
+                    return False
+            elif op == "$nin":
+                if any(value is not _MISSING and _eq(value, a) for a in arg):
+                    return False
+            elif op == "$exists":
+                if (value is not _MISSING) != bool(arg):
+                    return False
+            elif op in ("$lt", "$lte", "$gt", "$gte"):
+                if not _cmp(value, op, arg):
+                    return False
+            else:
+                raise NotImplementedError(op)
+        return True
+    if value is _MISSING:
+        return cond is None
+    return _eq(value, cond)
+
+
+def _expr(doc, expr):
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = _get(doc, expr[1:])
+        return None if value is _MISSING else value
+    if not isinstance(expr, dict):
+        return expr
+    (op, args), = expr.items()
+    values = [_expr(doc, a) for a in args]
+    if op == "$ifNull":
+        return next((v for v in values if v is not None), None)
+    if op in ("$lt", "$lte", "$gt", "$gte"):
+        return _cmp(values[0], op, values[1])
+    if op == "$eq":
+        return values[0] == values[1]
+    raise NotImplementedError(op)
+
+
+def matches(doc, query):
+    for key, cond in query.items():
+        if key == "$expr":
+            if not _expr(doc, cond):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in cond):
+                return False
+        elif not _match_field(_get(doc, key), cond):
+            return False
+    return True
+
+
+def _set(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset(doc, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part, {})
+    doc.pop(parts[-1], None)
+
+
+def apply_update(doc, update, inserting=False):
+    for op, fields in update.items():
+        for path, arg in fields.items():
+            current = _get(doc, path)
+            if op == "$set":
+                _set(doc, path, copy.deepcopy(arg))
+            elif op == "$setOnInsert":
+                if inserting:
+                    _set(doc, path, copy.deepcopy(arg))
+            elif op == "$unset":
+                _unset(doc, path)
+            elif op == "$inc":
+                _set(doc, path, (0 if current is _MISSING else current) + arg)
+            elif op == "$push":
+                items = list(arg["$each"]) if isinstance(arg, dict) and "$each" in arg else [arg]
+                values = ([] if current is _MISSING else list(current)) + items
+                if isinstance(arg, dict) and "$slice" in arg:
+                    n = arg["$slice"]
+                    values = values[n:] if n < 0 else values[:n]
+                _set(doc, path, values)
+            elif op == "$addToSet":
+                values = [] if current is _MISSING else list(current)
+                if arg not in values:
+                    values.append(arg)
+                _set(doc, path, values)
+            else:
+                raise NotImplementedError(op)
+
+
+def _project(doc, projection):
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    included = [k for k, v in projection.items() if v and k != "_id"]
+    if included:
+        doc = {k: doc[k] for k in included if k in doc}
+    return doc
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, key, direction=1):
+        keys = [(key, direction)] if isinstance(key, str) else list(key)
+        for field, order in reversed(keys):  # stable sorts, least significant key first
+            self._docs.sort(key=lambda d: (d.get(field) is None, d.get(field)), reverse=order < 0)
+        return self
+
+    def limit(self, n):
+        if n:
+            self._docs = self._docs[:n]
+        return self
+
+    async def to_list(self, length=None):
+        return self._docs[:length] if length else list(self._docs)
+
+    def __aiter__(self):
+        self._iter = iter(self._docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+        self.unique = []  # tuples of unique-indexed field names
+
+    async def create_index(self, keys, unique=False, **kwargs):
+        if unique:
+            fields = (keys,) if isinstance(keys, str) else tuple(k for k, _ in keys)
+            if fields not in self.unique:
+                self.unique.append(fields)
+
+    def _check_unique(self, doc, skip=None):
+        for fields in self.unique:
+            key = tuple(_get(doc, f) for f in fields)
+            if _MISSING in key:
+                continue
+            for other in self.docs:
+                if other is not skip and tuple(_get(other, f) for f in fields) == key:
+                    raise DuplicateKeyError(f"duplicate key {dict(zip(fields, key))}")
+
+    async def insert_one(self, doc):
+        doc = copy.deepcopy(doc)
+        self._check_unique(doc)
+        self.docs.append(doc)
+        return SimpleNamespace(inserted_id=id(doc))
+
+    async def insert_many(self, docs, ordered=True):
+        inserted, errors = [], []
+        for i, doc in enumerate(docs):
+            try:
+                inserted.append((await self.insert_one(doc)).inserted_id)
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted)})
+        return SimpleNamespace(inserted_ids=inserted)
+
+    async def find_one(self, query=None, projection=None):
+        for doc in self.docs:
+            if matches(doc, query or {}):
+                return _project(doc, projection)
+        return None
+
+    def find(self, query=None, projection=None):
+        return FakeCursor([_project(d, projection) for d in self.docs if matches(d, query or {})])
+
+    async def count_documents(self, query):
+        return sum(1 for d in self.docs if matches(d, query))
+
+    async def distinct(self, field, query=None):
+        values = []
+        for d in self.docs:
+            value = _get(d, field)
+            if matches(d, query or {}) and value is not _MISSING and value not in values:
+                values.append(value)
+        return values
+
+    def _update(self, query, update, upsert, many):
+        matched = [d for d in self.docs if matches(d, query)]
+        if not many:
+            matched = matched[:1]
+        for doc in matched:
+            before = copy.deepcopy(doc)
+            apply_update(doc, update)
+            try:
+                self._check_unique(doc, skip=doc)
+            except DuplicateKeyError:
+                doc.clear()
+                doc.update(before)
+                raise
+        if matched or not upsert:
+            return SimpleNamespace(matched_count=len(matched), modified_count=len(matched), upserted_id=None)
+        doc = {}
+        for key, cond in query.items():
+            if not key.startswith("$") and not (isinstance(cond, dict) and any(k.startswith("$") for k in cond)):
+                _set(doc, key, copy.deepcopy(cond))
+        apply_update(doc, update, inserting=True)
+        self._check_unique(doc)
+        self.docs.append(doc)
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=id(doc))
+
+    async def update_one(self, query, update, upsert=False):
+        return self._update(query, update, upsert, many=False)
+
+    async def update_many(self, query, update, upsert=False):
+        return self._update(query, update, upsert, many=True)
+
+    async def find_one_and_update(self, query, update, sort=None, projection=None, return_document=False, upsert=False):
+        candidates = FakeCursor([d for d in self.docs if matches(d, query)])
+        if sort:
+            candidates.sort(sort)
+        if not candidates._docs:
+            return None
+        doc = candidates._docs[0]
+        before = copy.deepcopy(doc)
+        apply_update(doc, update)
+        return _project(doc if return_document else before, projection)
+
+    async def bulk_write(self, ops, ordered=True):
+        errors = []
+        for i, op in enumerate(ops):
+            try:
+                self._update(op._filter, op._doc, op._upsert, many=False)
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+        return SimpleNamespace(bulk_api_result={})
+
+    async def delete_one(self, query):
+        for i, doc in enumerate(self.docs):
+            if matches(doc, query):
+                del self.docs[i]
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    async def delete_many(self, query):
+        before = len(self.docs)
+        self.docs = [d for d in self.docs if not matches(d, query)]
+        return SimpleNamespace(deleted_count=before - len(self.docs))
+
+    def aggregate(self, pipeline):
+        """$match and a single-key $group with $sum are supported."""
+        docs = list(self.docs)
+        for stage in pipeline:
+            if "$match" in stage:
+                docs = [d for d in docs if matches(d, stage["$match"])]
+            elif "$group" in stage:
+                spec = stage["$group"]
+                groups = {}
+                for d in docs:
+                    key = _get(d, spec["_id"][1:]) if isinstance(spec["_id"], str) else spec["_id"]
+                    row = groups.setdefault(key, {"_id": key})
+                    for name, acc in spec.items():
+                        if name == "_id":
+                            continue
+                        arg = acc["$sum"]
+                        value = _get(d, arg[1:]) if isinstance(arg, str) else arg
+                        row[name] = row.get(name, 0) + (0 if value is _MISSING else value)
+                docs = list(groups.values())
+            else:
+                raise NotImplementedError(stage)
+        return FakeCursor(docs)
+
+
+class FakeDB:
+    def __init__(self):
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._collections.setdefault(name, FakeCollection())
+
+    def __getitem__(self, name):
+        return getattr(self, name)
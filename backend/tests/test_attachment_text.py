@@ -0,0 +1,40 @@
+"""Unit tests for the attachment text cache (app.services.attachment_text) on an in-memory DB."""
+import asyncio
+import pytest
+from fake_mongo import FakeDB
+from app.services import attachment_text
+from app.services.attachment_text import extract_and_cache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(attachment_text, "db", fake)
+    return fake
+
+
+class TestExtractAndCache:
+    def test_text_cached_once(self, db):
+        assert run(extract_and_cache("a.txt", "привет".encode())) == "привет"
+        assert run(extract_and_cache("a.txt", "привет".encode())) == "привет"
+        assert len(db.attachment_texts.docs) == 1
+        assert not attachment_text._extract_locks
+
+    def test_empty_text_not_cached(self, db):
+        assert run(extract_and_cache("empty.txt", b"  \n")) == "  \n"
+        assert db.attachment_texts.docs == []
+        assert not attachment_text._extract_locks
+
+    def test_failed_extraction_releases_lock(self, db, monkeypatch):
+        def broken(name, raw_bytes):
+            raise ValueError("corrupt file")
+
+        monkeypatch.setattr(attachment_text, "_extract", broken)
+        with pytest.raises(ValueError):
+            run(extract_and_cache("a.pdf", b"%PDF"))
+        assert not attachment_text._extract_locks
+        assert db.attachment_texts.docs == []
@@ -0,0 +1,82 @@
+"""Unit tests for the batch billing engine (app.services.billing_batch) on an in-memory DB."""
+import asyncio
+import pytest
+from fake_mongo import FakeDB
+from app.services import billing_batch
+from app.services.billing_batch import apply_pending_charges, ensure_billing_batch_indexes, run_charges
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(billing_batch, "db", fake)
+    run(ensure_billing_batch_indexes())
+    run(fake.transactions.create_index("id", unique=True))
+    run(fake.credit_balances.insert_one({"org_id": "org1", "balance": 100.0}))
+    return fake
+
+
+def charge(org_id, credits=5.0):
+    return {"org_id": org_id, "credits": credits, "description": "Хранение"}
+
+
+def balance(db, org_id="org1"):
+    return run(db.credit_balances.find_one({"org_id": org_id}))["balance"]
+
+
+def states(db):
+    return {c["org_id"]: c["state"] for c in db.billing_charges.docs}
+
+
+class TestRunCharges:
+    def test_applied_once(self, db):
+        assert run(run_charges("storage", "2026-10-16", [charge("org1")])) == 1
+        assert run(run_charges("storage", "2026-10-16", [charge("org1", 7.0)])) == 0
+        assert balance(db) == 95
+        assert len(db.transactions.docs) == 1
+        assert states(db) == {"org1": "applied"}
+
+    def test_no_transaction_without_deduction(self, db):
+        # No balance document for org2; org1 already charged for the day by an earlier run
+        run(db.credit_balances.update_one({"org_id": "org1"}, {"$set": {"last_charges.storage": "2026-10-16"}}))
+        assert run(run_charges("storage", "2026-10-16", [charge("org1"), charge("org2")])) == 0
+        assert balance(db) == 100
+        assert db.transactions.docs == []
+        assert states(db) == {"org1": "skipped", "org2": "skipped"}
+        assert run(apply_pending_charges("storage")) == 0
+
+    def test_resumed_after_crash_before_transactions(self, db, monkeypatch):
+        real = db.transactions.bulk_write
+
+        async def crash(*args, **kwargs):
+            raise RuntimeError("connection reset")
+
+        monkeypatch.setattr(db.transactions, "bulk_write", crash)
+        with pytest.raises(RuntimeError):
+            run(run_charges("storage", "2026-10-16", [charge("org1")]))
+        monkeypatch.setattr(db.transactions, "bulk_write", real)
+        assert run(apply_pending_charges("storage")) == 1
+        assert balance(db) == 95
+        assert len(db.transactions.docs) == 1
+        assert states(db) == {"org1": "applied"}
+
+    def test_crashed_charge_recognised_after_later_day(self, db, monkeypatch):
+        real = db.transactions.bulk_write
+
+        async def crash(*args, **kwargs):
+            raise RuntimeError("connection reset")
+
+        monkeypatch.setattr(db.transactions, "bulk_write", crash)
+        with pytest.raises(RuntimeError):
+            run(run_charges("storage", "2026-10-15", [charge("org1")]))
+        monkeypatch.setattr(db.transactions, "bulk_write", real)
+        # The balance no longer says which charge set the day, only the attempt record does
+        assert run(run_charges("storage", "2026-10-16", [charge("org1")])) == 2
+        assert balance(db) == 90
+        assert len(db.transactions.docs) == 2
+        assert {c["state"] for c in db.billing_charges.docs} == {"applied"}
+        assert len(db.billing_batch_charges.docs) == 2
@@ -0,0 +1,67 @@
+"""Unit tests for app.utils.context_window (conversation history budgeting)."""
+from app.utils.context_window import (
+    estimate_tokens, group_turns, recent_start, history_messages, summary_request, turn_tokens,
+)
+
+
+def turn(n, size=400):
+    return [
+        {"role": "user", "content": f"q{n} " + "x" * size},
+        {"role": "assistant", "content": f"a{n} " + "y" * size},
+    ]
+
+
+class TestEstimate:
+    def test_text_and_parts(self):
+        assert estimate_tokens("") == 0
+        text = estimate_tokens("x" * 400)
+        assert text > 0
+        parts = [{"type": "text", "text": "x" * 400}, {"type": "image_url", "image_url": {"url": "data:"}}]
+        assert estimate_tokens(parts) == text + 1000
+
+
+class TestTurns:
+    def test_group_turns(self):
+        messages = turn(1) + turn(2) + [{"role": "user", "content": "q3"}]
+        turns = group_turns(messages)
+        assert [len(t) for t in turns] == [2, 2, 1]
+        assert turns[1][0]["content"].startswith("q2")
+
+    def test_leading_assistant_message(self):
+        assert len(group_turns([{"role": "assistant", "content": "hi"}] + turn(1))) == 2
+
+
+class TestRecentStart:
+    def test_fits_everything(self):
+        turns = [turn(i) for i in range(3)]
+        assert recent_start(turns, 10_000) == 0
+
+    def test_keeps_newest_within_budget(self):
+        turns = [turn(i) for i in range(10)]
+        per_turn = turn_tokens(turns[0])
+        start = recent_start(turns, per_turn * 3 + 1)
+        assert start == 7
+        assert sum(turn_tokens(t) for t in turns[start:]) <= per_turn * 3 + 1
+
+    def test_latest_turn_always_kept(self):
+        turns = [turn(0), turn(1, size=10_000)]
+        assert recent_start(turns, 100) == 1
+
+    def test_flat_for_growing_history(self):
+        budget = turn_tokens(turn(100)) * 5
+        kept = {n - recent_start([turn(i) for i in range(n)], budget) for n in range(10, 200, 37)}
+        assert kept == {5}
+
+
+class TestHistoryMessages:
+    def test_summary_first(self):
+        messages = history_messages("S", [turn(1)])
+        assert messages[0]["role"] == "system" and messages[0]["content"].endswith("S")
+        assert messages[1:] == turn(1)
+
+    def test_no_summary(self):
+        assert history_messages(None, [turn(1)]) == turn(1)
+
+    def test_summary_request(self):
+        text = summary_request("old", [[{"role": "user", "content": [{"type": "text", "text": "look"}]}]])
+        assert "old" in text and "Пользователь: look" in text
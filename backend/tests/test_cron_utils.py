@@ -0,0 +1,32 @@
+"""Unit tests for app.utils.cron (scheduler slot arithmetic)."""
+from datetime import datetime, timezone
+from app.utils.cron import last_slot, next_slot
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+class TestDailySlots:
+    def test_after_todays_slot(self):
+        assert last_slot(utc(2026, 10, 16, 0, 7), 0, 5) == utc(2026, 10, 16, 0, 5)
+        assert next_slot(utc(2026, 10, 16, 0, 7), 0, 5) == utc(2026, 10, 17, 0, 5)
+
+    def test_before_todays_slot(self):
+        assert last_slot(utc(2026, 10, 16, 0, 2), 0, 5) == utc(2026, 10, 15, 0, 5)
+        assert next_slot(utc(2026, 10, 16, 0, 2), 0, 5) == utc(2026, 10, 16, 0, 5)
+
+    def test_exactly_on_slot(self):
+        assert last_slot(utc(2026, 10, 16, 0, 5), 0, 5) == utc(2026, 10, 16, 0, 5)
+        assert next_slot(utc(2026, 10, 16, 0, 5), 0, 5) == utc(2026, 10, 17, 0, 5)
+
+
+class TestWeeklySlots:
+    # 2026-10-16 is a Friday, 2026-10-12 a Monday
+    def test_last_monday(self):
+        assert last_slot(utc(2026, 10, 16, 12, 0), 0, 4, weekday=0) == utc(2026, 10, 12, 0, 4)
+        assert next_slot(utc(2026, 10, 16, 12, 0), 0, 4, weekday=0) == utc(2026, 10, 19, 0, 4)
+
+    def test_monday_before_slot(self):
+        assert last_slot(utc(2026, 10, 12, 0, 1), 0, 4, weekday=0) == utc(2026, 10, 5, 0, 4)
+        assert last_slot(utc(2026, 10, 12, 0, 4), 0, 4, weekday=0) == utc(2026, 10, 12, 0, 4)
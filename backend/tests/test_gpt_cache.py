@@ -0,0 +1,212 @@
+"""Unit tests for the GPT response cache (app.services.gpt_cache), partly on an in-memory DB."""
+import asyncio
+from datetime import datetime, timezone, timedelta
+import pytest
+from fake_mongo import FakeDB
+from app.services import gpt_cache, metering, metering_ledger, usage_rollups
+from app.services.gpt import GptResult
+from app.services.gpt_cache import cached_call, evict_gpt_cache, request_key
+
+MESSAGES = [{"role": "system", "content": "Ты — ассистент"}, {"role": "user", "content": "Вопрос"}]
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestRequestKey:
+    def test_stable(self):
+        assert request_key("gpt-5.2", MESSAGES, "high", 0.3) == request_key("gpt-5.2", [dict(m) for m in MESSAGES], "high", 0.3)
+
+    def test_dict_order_does_not_matter(self):
+        reordered = [{"content": m["content"], "role": m["role"]} for m in MESSAGES]
+        assert request_key("gpt-5.2", MESSAGES, "high", 0.3) == request_key("gpt-5.2", reordered, "high", 0.3)
+
+    def test_every_component_counts(self):
+        base = request_key("gpt-5.2", MESSAGES, "high", 0.3)
+        assert base != request_key("gpt-4o", MESSAGES, "high", 0.3)
+        assert base != request_key("gpt-5.2", MESSAGES, "low", 0.3)
+        assert base != request_key("gpt-5.2", MESSAGES, "high", 0.7)
+        assert base != request_key("gpt-5.2", MESSAGES[::-1], "high", 0.3)
+        assert base != request_key("gpt-5.2", MESSAGES[:1] + [{"role": "user", "content": "Вопрос "}], "high", 0.3)
+        assert base == request_key("gpt-5.2", MESSAGES, "high", 0.3, None)
+        assert base != request_key("gpt-5.2", MESSAGES, "high", 0.3, 2000)
+
+
+KEY = request_key("gpt-5.2", MESSAGES, "high", 0.3)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(gpt_cache, "db", fake)
+    monkeypatch.setattr(gpt_cache, "GPT_CACHE_ENABLED", True)
+    monkeypatch.setattr(gpt_cache, "GPT_CACHE_POLL_SECONDS", 0.01)
+    run(gpt_cache.ensure_gpt_cache_indexes())
+    return fake
+
+
+def answer(content="Ответ"):
+    return GptResult(content=content, model="gpt-5.2", prompt_tokens=100, completion_tokens=20, total_tokens=120)
+
+
+def counting(calls, content="Ответ"):
+    async def call():
+        calls.append(content)
+        return answer(content)
+    return call
+
+
+def cached(call):
+    return cached_call("gpt-5.2", MESSAGES, "high", 0.3, call)
+
+
+def ready(db, key=KEY, content="Готово", size=10, last_used_at=None):
+    now = datetime.now(timezone.utc)
+    run(db.gpt_response_cache.insert_one({
+        "key": key, "state": "ready", "content": content, "model": "gpt-5.2", "size": size, "hits": 0,
+        "created_at": now, "last_used_at": last_used_at or now, "expires_at": now + timedelta(days=1),
+    }))
+
+
+class TestCachedCall:
+    def test_second_call_is_hit(self, db):
+        calls = []
+        first = run(cached(counting(calls)))
+        second = run(cached(counting(calls)))
+        assert calls == ["Ответ"]
+        assert not first.cache_hit and first.total_tokens == 120
+        assert second.cache_hit and second.content == "Ответ" and second.total_tokens == 0
+        entry = db.gpt_response_cache.docs[0]
+        assert entry["state"] == "ready" and entry["hits"] == 1 and "claimed_until" not in entry
+
+    def test_claim_race_returns_entry_stored_elsewhere(self, db, monkeypatch):
+        ready(db)
+        find_one = db.gpt_response_cache.find_one
+        reads = []
+
+        async def stale_first_read(query=None, projection=None):
+            # The other process stores its answer between our read and our claim
+            reads.append(query)
+            return None if len(reads) == 1 else await find_one(query, projection)
+
+        monkeypatch.setattr(db.gpt_response_cache, "find_one", stale_first_read)
+        calls = []
+        result = run(cached(counting(calls)))
+        assert calls == [] and result.cache_hit and result.content == "Готово"
+        assert len(db.gpt_response_cache.docs) == 1
+
+    def test_waits_for_pending_claim_of_other_process(self, db):
+        now = datetime.now(timezone.utc)
+        run(db.gpt_response_cache.insert_one({
+            "key": KEY, "state": "pending", "claimed_until": now + timedelta(minutes=5), "expires_at": now + timedelta(minutes=5),
+        }))
+
+        async def scenario():
+            calls = []
+            waiting = asyncio.create_task(cached(counting(calls)))
+            await asyncio.sleep(0.05)
+            assert not waiting.done()
+            await db.gpt_response_cache.update_one(
+                {"key": KEY}, {"$set": {"state": "ready", "content": "Готово", "model": "gpt-5.2"}, "$unset": {"claimed_until": ""}}
+            )
+            result = await waiting
+            assert calls == [] and result.content == "Готово" and result.cache_hit
+
+        run(scenario())
+
+    def test_expired_claim_taken_over(self, db):
+        past = datetime.now(timezone.utc) - timedelta(minutes=1)
+        run(db.gpt_response_cache.insert_one({"key": KEY, "state": "pending", "claimed_until": past, "expires_at": past}))
+        calls = []
+        result = run(cached(counting(calls)))
+        assert calls == ["Ответ"] and not result.cache_hit
+        assert db.gpt_response_cache.docs[0]["state"] == "ready"
+
+    def test_follower_runs_call_when_leader_cancelled(self, db):
+        async def scenario():
+            started = asyncio.Event()
+
+            async def slow():
+                started.set()
+                await asyncio.sleep(10)
+
+            calls = []
+            leader = asyncio.create_task(cached(slow))
+            await started.wait()
+            follower = asyncio.create_task(cached(counting(calls)))
+            await asyncio.sleep(0)
+            leader.cancel()
+            result = await follower
+            assert calls == ["Ответ"] and not result.cache_hit
+            with pytest.raises(asyncio.CancelledError):
+                await leader
+
+        run(scenario())
+        assert [e["state"] for e in db.gpt_response_cache.docs] == ["ready"]
+        assert not gpt_cache._inflight
+
+    def test_follower_gets_leader_error_and_nothing_is_cached(self, db):
+        async def scenario():
+            started = asyncio.Event()
+            release = asyncio.Event()
+
+            async def failing():
+                started.set()
+                await release.wait()
+                raise RuntimeError("provider error")
+
+            calls = []
+            leader = asyncio.create_task(cached(failing))
+            await started.wait()
+            follower = asyncio.create_task(cached(counting(calls)))
+            await asyncio.sleep(0)
+            release.set()
+            for task in (leader, follower):
+                with pytest.raises(RuntimeError):
+                    await task
+            assert calls == []
+
+        run(scenario())
+        assert db.gpt_response_cache.docs == []
+        assert not gpt_cache._inflight
+
+    def test_empty_answer_not_cached(self, db):
+        calls = []
+        run(cached(counting(calls, content="")))
+        run(cached(counting(calls, content="")))
+        assert len(calls) == 2 and db.gpt_response_cache.docs == []
+
+    def test_store_survives_expired_pending_entry(self, db):
+        # The pending entry was removed by the TTL index while the call ran
+        run(gpt_cache._store(KEY, answer()))
+        entry = run(db.gpt_response_cache.find_one({"key": KEY}))
+        assert entry["state"] == "ready" and entry["content"] == "Ответ"
+
+
+class TestEvict:
+    def test_least_recently_used_evicted_until_under_limit(self, db, monkeypatch):
+        monkeypatch.setattr(gpt_cache, "GPT_CACHE_MAX_BYTES", 25)
+        base = datetime(2026, 10, 1, tzinfo=timezone.utc)
+        for i, key in enumerate(["old", "mid", "new"]):
+            ready(db, key=key, size=10, last_used_at=base + timedelta(hours=i))
+        assert run(evict_gpt_cache()) == 1
+        assert sorted(e["key"] for e in db.gpt_response_cache.docs) == ["mid", "new"]
+        assert run(evict_gpt_cache()) == 0
+
+
+class TestCacheHitMetering:
+    def test_hit_recorded_at_zero_cost_without_transaction(self, db, monkeypatch):
+        for module in (metering, metering_ledger, usage_rollups):
+            monkeypatch.setattr(module, "db", db)
+        run(db.credit_balances.insert_one({"org_id": "org1", "balance": 50.0}))
+        result = run(metering.deduct_credits_and_record(
+            org_id="org1", user_id="u1", model="gpt-5.2",
+            prompt_tokens=0, completion_tokens=0, source="wizard", cache_hit=True,
+        ))
+        assert result["credits_used"] == 0 and result["cache_hit"]
+        run(metering_ledger.project_pending())
+        assert run(db.credit_balances.find_one({"org_id": "org1"}))["balance"] == 50.0
+        assert db.transactions.docs == []
+        usage = db.usage_records.docs
+        assert len(usage) == 1 and usage[0]["cache_hit"] and usage[0]["credits_used"] == 0
@@ -0,0 +1,37 @@
+"""Unit tests for the reasoning-effort mapping of GPT requests (app.services.gpt)."""
+import pytest
+from app.services.gpt import GPT_TEMPERATURE, _provider_effort, _request_args
+
+
+class TestProviderEffort:
+    @pytest.mark.parametrize("model, effort, expected", [
+        ("gpt-5", "minimal", "minimal"),
+        ("gpt-5-mini", "minimal", "minimal"),
+        ("gpt-5.1", "minimal", "none"),
+        ("gpt-5.2", "minimal", "none"),
+        ("gpt-5.1", "xhigh", "high"),
+        ("gpt-5.2", "xhigh", "xhigh"),
+        ("gpt-5.10-mini", "xhigh", "xhigh"),
+        ("gpt-5.2", "medium", "medium"),
+    ])
+    def test_gpt5_versions(self, model, effort, expected):
+        assert _provider_effort(model, effort) == expected
+
+    @pytest.mark.parametrize("model", ["o1", "o3-mini", "o4-mini"])
+    def test_o_series_minimal_becomes_low(self, model):
+        assert _provider_effort(model, "minimal") == "low"
+        assert _provider_effort(model, "xhigh") == "high"
+        assert _provider_effort(model, "medium") == "medium"
+
+    def test_not_sent_to_other_models_or_unknown_values(self):
+        assert _provider_effort("gpt-4o", "high") is None
+        assert _provider_effort("gpt-5.2", "auto") is None
+        assert _provider_effort("gpt-5.2", None) is None
+
+
+class TestRequestArgs:
+    def test_temperature_only_without_reasoning(self):
+        assert _request_args("gpt-4o", "high", None, None)["temperature"] == GPT_TEMPERATURE
+        assert _request_args("gpt-5.2", "minimal", None, None)["temperature"] == GPT_TEMPERATURE
+        args = _request_args("o3-mini", "minimal", None, None)
+        assert args["reasoning_effort"] == "low" and "temperature" not in args
@@ -0,0 +1,66 @@
+"""Unit tests for the Mongo-backed job queue (app.services.job_queue) on an in-memory DB."""
+import asyncio
+from datetime import datetime, timezone, timedelta
+import pytest
+from fake_mongo import FakeDB
+from app.services import job_queue
+from app.services.job_queue import claim_job, enqueue_job, fail_expired_jobs
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(job_queue, "db", fake)
+    run(job_queue.ensure_job_indexes())
+    return fake
+
+
+def expire_lease(db, job_id):
+    past = (datetime.now(timezone.utc) - timedelta(seconds=1)).isoformat()
+    run(db.jobs.update_one({"id": job_id}, {"$set": {"lease_expires_at": past}}))
+
+
+def job(db, job_id):
+    return run(db.jobs.find_one({"id": job_id}))
+
+
+class TestExpiredLease:
+    def test_reclaimed_while_attempts_left(self, db):
+        job_id = run(enqueue_job("transcription", {}, max_attempts=2))
+        assert run(claim_job("w1", ["transcription"]))["attempts"] == 1
+        expire_lease(db, job_id)
+        reclaimed = run(claim_job("w2", ["transcription"]))
+        assert reclaimed["id"] == job_id and reclaimed["attempts"] == 2
+        assert run(fail_expired_jobs()) == []
+
+    def test_exhausted_job_failed_not_reclaimed(self, db):
+        job_id = run(enqueue_job("transcription", {"project_id": "p1"}, max_attempts=1))
+        run(claim_job("w1", ["transcription"]))
+        expire_lease(db, job_id)
+        assert run(claim_job("w2", ["transcription"])) is None
+        failed = run(fail_expired_jobs())
+        assert [j["id"] for j in failed] == [job_id]
+        assert job(db, job_id)["status"] == "failed"
+        assert run(fail_expired_jobs()) == []
+
+    def test_live_lease_left_alone(self, db):
+        job_id = run(enqueue_job("transcription", {}, max_attempts=1))
+        run(claim_job("w1", ["transcription"]))
+        assert run(fail_expired_jobs()) == []
+        assert job(db, job_id)["status"] == "running"
+
+
+class TestRelease:
+    def test_deferred_job_keeps_its_attempts(self, db):
+        job_id = run(enqueue_job("transcription", {}, max_attempts=1))
+        claimed = run(claim_job("w1", ["transcription"]))
+        run(job_queue.release_job(claimed, "w1", 30, "Deepgram busy"))
+        released = job(db, job_id)
+        assert released["status"] == "queued" and released["attempts"] == 0
+        assert released["run_after"] > datetime.now(timezone.utc).isoformat()
+        # Not runnable before the delay
+        assert run(claim_job("w1", ["transcription"])) is None
@@ -0,0 +1,99 @@
+"""Unit tests for the metering ledger projector (app.services.metering_ledger) on an in-memory DB."""
+import asyncio
+from datetime import datetime, timezone, timedelta
+import pytest
+from fake_mongo import FakeDB
+from app.services import metering_ledger, usage_rollups
+from app.services.metering_ledger import ProjectorBusy, ProjectorLeaseLost, project_pending, projector_paused
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(metering_ledger, "db", fake)
+    monkeypatch.setattr(usage_rollups, "db", fake)
+    run(fake.credit_balances.insert_one({"org_id": "org1", "balance": 100.0}))
+    run(usage_rollups.ensure_rollup_indexes())
+    return fake
+
+
+def entry(db, entry_id, credits, state="pending", batch_id=None):
+    now = "2026-10-16T10:00:00+00:00"
+    run(db.metering_ledger.insert_one({
+        "id": entry_id,
+        "request_key": entry_id,
+        "org_id": "org1",
+        "user_id": "u1",
+        "credits": credits,
+        "transaction": {"id": entry_id, "org_id": "org1", "type": "deduction", "amount": credits, "created_at": now},
+        "usage": {"id": entry_id, "org_id": "org1", "user_id": "u1", "total_tokens": 10, "credits_used": credits, "created_at": now},
+        "state": state,
+        "batch_id": batch_id,
+        "created_at": now,
+    }))
+
+
+def balance(db):
+    return run(db.credit_balances.find_one({"org_id": "org1"}))["balance"]
+
+
+class TestProjector:
+    def test_pending_applied_once(self, db):
+        entry(db, "e1", 3)
+        entry(db, "e2", 2)
+        assert run(project_pending()) == 2
+        assert balance(db) == 95
+        assert run(project_pending()) == 0
+        assert balance(db) == 95
+        assert len(db.transactions.docs) == 2
+        assert run(usage_rollups.get_month_usage("org", "org1", "2026-10"))["total_requests"] == 2
+
+    def test_late_resume_after_later_batch_is_noop(self, db):
+        entry(db, "x1", 10)
+        run(project_pending())
+        entry(db, "y1", 5)
+        run(project_pending())
+        assert balance(db) == 85
+        # A stalled projector resumes batch X after batch Y was applied
+        run(db.metering_ledger.update_many({"id": "x1"}, {"$set": {"state": "applying"}}))
+        run(project_pending())
+        assert balance(db) == 85
+        assert run(usage_rollups.get_month_usage("org", "org1", "2026-10"))["total_requests"] == 2
+
+    def test_stuck_batch_resumed_whole(self, db, monkeypatch):
+        monkeypatch.setattr(metering_ledger, "METERING_BATCH_SIZE", 2)
+        for i in range(3):
+            entry(db, f"s{i}", 1, state="applying", batch_id="b1")
+        assert run(project_pending()) == 3
+        assert balance(db) == 97
+        assert all(e["state"] == "applied" for e in db.metering_ledger.docs)
+
+    def test_stops_when_lease_lost(self, db):
+        expires = (datetime.now(timezone.utc) + timedelta(seconds=30)).isoformat()
+        run(db.locks.create_index("key", unique=True))
+        run(db.locks.insert_one({"key": "metering_projector", "owner": "other", "lease_expires_at": expires}))
+        entry(db, "e1", 3)
+        with pytest.raises(ProjectorLeaseLost):
+            run(project_pending("me"))
+        assert balance(db) == 100
+
+
+class TestProjectorPause:
+    def test_pause_blocks_projection_and_finishes_stuck_batches(self, db):
+        entry(db, "s1", 4, state="applying", batch_id="b1")
+
+        async def scenario():
+            async with projector_paused():
+                # Interrupted batch completed before the block runs
+                assert (await db.credit_balances.find_one({"org_id": "org1"}))["balance"] == 96
+                assert not await metering_ledger._acquire_lease("projector")
+                with pytest.raises(ProjectorBusy):
+                    async with projector_paused():
+                        pass
+            assert await metering_ledger._acquire_lease("projector")
+
+        run(scenario())
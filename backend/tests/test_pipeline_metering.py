@@ -0,0 +1,68 @@
+"""Unit tests for idempotent metering of pipeline runs (app.services.pipeline_runner) with fake GPT and metering."""
+import asyncio
+import pytest
+from app.services import pipeline_runner
+from app.services.gpt import GptResult
+from app.services.pipeline_runner import PipelineRun
+
+USER = {"id": "u1", "org_id": "org1"}
+NODES = [
+    {"node_id": "list", "node_type": "template", "label": "list", "template_text": "a"},
+    {"node_id": "ask", "node_type": "ai_prompt", "label": "ask", "inline_prompt": "Вопрос про {{list}}"},
+]
+EDGES = [{"source": "list", "target": "ask"}]
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def charges(monkeypatch):
+    keys = []
+
+    async def call(**kwargs):
+        return GptResult(content="Ответ", model="gpt-5.2", prompt_tokens=10, completion_tokens=5, total_tokens=15)
+
+    async def deduct(**kwargs):
+        keys.append(kwargs["request_key"])
+
+    monkeypatch.setattr(pipeline_runner, "call_gpt52_metered", call)
+    monkeypatch.setattr(pipeline_runner, "deduct_credits_and_record", deduct)
+    return keys
+
+
+def execute(nodes=NODES, run_id="run1"):
+    return run(PipelineRun(nodes, EDGES, "", USER, run_id=run_id).execute())
+
+
+class TestChargeKeys:
+    def test_same_call_of_a_run_has_same_key(self, charges):
+        execute()
+        execute()
+        assert len(charges) == 2 and charges[0] == charges[1]
+        assert charges[0].startswith("pipeline:run1:ask:0:")
+
+    def test_changed_prompt_or_other_run_billed_again(self, charges):
+        execute()
+        changed = [NODES[0] | {"template_text": "b"}, NODES[1]]
+        execute(changed)
+        execute(run_id="run2")
+        assert len(set(charges)) == 3
+
+    @pytest.mark.parametrize("concurrent", [True, False])
+    def test_batches_keyed_by_index(self, charges, concurrent):
+        nodes = [
+            {"node_id": "src", "node_type": "template", "label": "src", "template_text": "x\ny"},
+            {"node_id": "items", "node_type": "parse_list", "label": "items"},
+            {"node_id": "loop", "node_type": "batch_loop", "label": "loop", "batch_size": 1, "batch_concurrent": concurrent,
+             "script": 'result = {"promptVars": {"item": context["input"][context["iteration"]]}}'},
+            {"node_id": "ask", "node_type": "ai_prompt", "label": "ask", "inline_prompt": "{{item}}"},
+        ]
+        edges = [{"source": "src", "target": "items"}, {"source": "items", "target": "loop"}, {"source": "loop", "target": "ask"}]
+        run(PipelineRun(nodes, edges, "", USER, run_id="run1").execute())
+        assert [k.split(":")[2:4] for k in charges] == [["loop", "0"], ["loop", "1"]]
+
+    def test_no_key_without_run(self, charges):
+        execute(run_id=None)
+        assert charges == [None]
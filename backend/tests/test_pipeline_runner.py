@@ -8,6 +8,7 @@ import pytest
 import requests
 import os
 import uuid
+import time
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
 TEST_EMAIL = "test@example.com"
@@ -250,6 +251,19 @@ class TestPipelineRunner:
             
             assert run_resp.status_code == 200, f"Run pipeline failed: {run_resp.text}"
             run_result = run_resp.json()
+            assert run_result["status"] == "queued"
+            
+            # Runs execute in the worker; poll the run until it finishes
+            deadline = time.time() + 120
+            while run_result["status"] not in ("completed", "failed") and time.time() < deadline:
+                time.sleep(2)
+                poll_resp = requests.get(
+                    f"{BASE_URL}/api/doc/projects/{project_id}/runs/{run_result['id']}",
+                    headers=self.headers,
+                )
+                assert poll_resp.status_code == 200, f"Get run failed: {poll_resp.text}"
+                run_result = poll_resp.json()
+            assert "nodes" in run_result, "Run progress should list nodes"
             
             # Validate response structure
             assert "id" in run_result, "Result should have id"
@@ -260,6 +274,7 @@ class TestPipelineRunner:
             assert "node_results" in run_result, "Result should have node_results"
             assert "status" in run_result, "Result should have status"
             assert run_result["status"] == "completed"
+            assert all(n["status"] in ("completed", "failed") for n in run_result["nodes"])
             
             print(f"PASS: Pipeline '{pipeline_name}' executed successfully with {len(run_result['node_results'])} node results")
             
@@ -0,0 +1,83 @@
+"""Unit tests for app.utils.pipeline_schedule (parallel pipeline planning)."""
+from app.utils.pipeline_schedule import plan_pipeline, template_refs, script_refs, script_reads_results
+
+
+def node(node_id, node_type="ai_prompt", **kw):
+    return {"node_id": node_id, "node_type": node_type, "label": kw.pop("label", node_id), **kw}
+
+
+def edge(source, target):
+    return {"source": source, "target": target}
+
+
+def data_deps_from(edges):
+    deps = {}
+    for e in edges:
+        deps.setdefault(e["target"], []).append(e["source"])
+    return deps
+
+
+class TestRefs:
+    def test_template_refs(self):
+        assert template_refs("{{a}} and {{b_2}} {{ not }}") == {"a", "b_2"}
+        assert template_refs(None) == set()
+
+    def test_script_refs(self):
+        assert script_refs('x = context["vars"]["summary"]; y = "a b"') == {"vars", "summary", "a b"}
+
+    def test_script_reads_results(self):
+        assert script_reads_results('done = len(context["results"]) > 3')
+        assert script_reads_results("return context.results.join('')")
+        assert not script_reads_results('result = {"promptVars": {"item": context["input"][context["iteration"]]}}')
+        assert not script_reads_results(None)
+
+
+class TestPlanPipeline:
+    def test_fan_out_branches_are_independent(self):
+        nodes = [node("src", "template")] + [node(f"b{i}") for i in range(5)] + [node("agg", "aggregate")]
+        edges = [edge("src", f"b{i}") for i in range(5)] + [edge(f"b{i}", "agg") for i in range(5)]
+        sorted_ids = ["src", "b0", "b1", "b2", "b3", "b4", "agg"]
+        plan = plan_pipeline(nodes, edges, sorted_ids, data_deps_from(edges))
+        assert plan.order == sorted_ids
+        for i in range(5):
+            assert plan.deps[f"b{i}"] == ["src"]
+        assert plan.deps["agg"] == ["b0", "b1", "b2", "b3", "b4"]
+
+    def test_var_reference_adds_dependency(self):
+        nodes = [
+            node("a", label="Summary"),
+            node("b", inline_prompt="Use {{Summary}}"),
+            node("c", "template", template_text="{{later}}"),
+            node("d", label="later"),
+        ]
+        plan = plan_pipeline(nodes, [], ["a", "b", "c", "d"], {})
+        assert plan.deps["b"] == ["a"]
+        # Sequential semantics: a later node is never visible, so no wait
+        assert plan.deps["c"] == []
+
+    def test_script_var_reference(self):
+        nodes = [node("a", label="facts"), node("b", "parse_list", script='result = {"output": context["vars"]["facts"]}')]
+        plan = plan_pipeline(nodes, [], ["a", "b"], {})
+        assert plan.deps["b"] == ["a"]
+
+    def test_batch_loop_claims_next_ai_prompt(self):
+        nodes = [
+            node("list", "parse_list"),
+            node("loop", "batch_loop"),
+            node("ai", inline_prompt="{{ctx}}"),
+            node("ctx", "template"),
+            node("out", "aggregate"),
+        ]
+        edges = [edge("list", "loop"), edge("loop", "ai"), edge("ai", "out")]
+        sorted_ids = ["list", "ctx", "loop", "ai", "out"]
+        plan = plan_pipeline(nodes, edges, sorted_ids, data_deps_from(edges))
+        assert plan.loop_targets == {"loop": "ai"}
+        assert "ai" not in plan.order
+        assert plan.deps["loop"] == ["list", "ctx"]
+        # Dependents of the claimed node wait for the loop that produces its output
+        assert plan.deps["out"] == ["loop"]
+
+    def test_deps_follow_topological_order_only(self):
+        nodes = [node("a"), node("b", input_from=["c"]), node("c")]
+        plan = plan_pipeline(nodes, [], ["a", "b", "c"], {"b": ["c"]})
+        assert plan.deps == {"a": [], "b": [], "c": []}
@@ -0,0 +1,118 @@
+"""Unit tests for the pure pricing engine in app.utils.pricing."""
+import pytest
+from app.utils.pricing import (
+    MarkupTable,
+    calculate_base_cost,
+    usd_to_credits,
+    price_usage,
+    price_usage_batch,
+    price_storage_day,
+)
+
+DEFAULT_TIERS = [
+    {"min_cost": 0.0, "max_cost": 0.001, "multiplier": 10.0},
+    {"min_cost": 0.001, "max_cost": 0.01, "multiplier": 7.0},
+    {"min_cost": 0.01, "max_cost": 0.10, "multiplier": 5.0},
+    {"min_cost": 0.10, "max_cost": 1.00, "multiplier": 3.0},
+    {"min_cost": 1.00, "max_cost": 999999.0, "multiplier": 2.0},
+]
+
+
+def linear_scan(tiers, cost):
+    """Reference implementation: the original apply_markup loop."""
+    for tier in sorted(tiers, key=lambda t: t["min_cost"]):
+        if tier["min_cost"] <= cost < tier["max_cost"]:
+            return tier["multiplier"]
+    return 2.0
+
+
+# ── MarkupTable ──
+
+class TestMarkupTable:
+    @pytest.mark.parametrize("cost,expected", [
+        (0.0, 10.0), (0.0005, 10.0), (0.001, 7.0), (0.05, 5.0),
+        (0.1, 3.0), (0.999, 3.0), (1.0, 2.0), (5000.0, 2.0),
+    ])
+    def test_default_tiers(self, cost, expected):
+        assert MarkupTable(DEFAULT_TIERS).multiplier_for(cost) == expected
+
+    def test_out_of_range_uses_fallback(self):
+        table = MarkupTable(DEFAULT_TIERS)
+        assert table.multiplier_for(-1.0) == 2.0
+        assert table.multiplier_for(1_000_000.0) == 2.0
+
+    def test_gaps_and_overlaps_match_linear_scan(self):
+        tiers = [
+            {"min_cost": 0.0, "max_cost": 0.5, "multiplier": 4.0},
+            {"min_cost": 0.2, "max_cost": 0.8, "multiplier": 6.0},
+            {"min_cost": 1.0, "max_cost": 2.0, "multiplier": 1.5},
+        ]
+        table = MarkupTable(tiers)
+        for cost in [0.0, 0.1, 0.2, 0.49, 0.5, 0.7, 0.8, 0.9, 1.0, 1.99, 2.0, 3.0]:
+            assert table.multiplier_for(cost) == linear_scan(tiers, cost), cost
+
+    def test_empty_table(self):
+        assert MarkupTable([]).apply(0.5) == (1.0, 2.0)
+
+
+# ── pricing ──
+
+class TestPricing:
+    def test_base_cost_and_credits(self):
+        assert calculate_base_cost("gpt-5.2", 1_000_000, 1_000_000) == pytest.approx(12.5)
+        assert calculate_base_cost("unknown", 1_000_000, 0) == pytest.approx(5.0)
+        assert usd_to_credits(1.0) == pytest.approx(50.0)
+
+    def test_price_usage(self):
+        priced = price_usage(MarkupTable(DEFAULT_TIERS), "gpt-4o", 10_000, 1_000)
+        assert priced.base_cost_usd == pytest.approx(0.035)
+        assert priced.markup_multiplier == 5.0
+        assert priced.final_cost_usd == pytest.approx(0.175)
+        assert priced.credits_used == pytest.approx(8.75)
+
+    def test_batch_matches_single(self):
+        table = MarkupTable(DEFAULT_TIERS)
+        records = [
+            {"model": model, "prompt_tokens": pt, "completion_tokens": ct}
+            for model in ["gpt-5.2", "gpt-4o-mini", "o1", "custom"]
+            for pt in [0, 37, 4_000, 250_000]
+            for ct in [0, 11, 3_000]
+        ]
+        batch = price_usage_batch(table, records)
+        assert batch == [
+            price_usage(table, r["model"], r["prompt_tokens"], r["completion_tokens"]) for r in records
+        ]
+
+    def test_cached_tokens_are_cheaper(self):
+        full = calculate_base_cost("gpt-5.2", 100_000, 1_000)
+        cached = calculate_base_cost("gpt-5.2", 100_000, 1_000, cached_tokens=80_000)
+        assert cached == pytest.approx(full - 0.08 * (2.50 - 0.25))
+        # Models without a cached rate bill cached tokens as input
+        assert calculate_base_cost("gpt-4", 1_000, 0, cached_tokens=1_000) == calculate_base_cost("gpt-4", 1_000, 0)
+
+    def test_batch_matches_single_with_cached_tokens(self):
+        table = MarkupTable(DEFAULT_TIERS)
+        records = [
+            {"model": model, "prompt_tokens": 50_000, "completion_tokens": 500, "cached_tokens": ct}
+            for model in ["gpt-5.2", "gpt-4o", "custom"]
+            for ct in [0, 1_024, 49_000]
+        ]
+        assert price_usage_batch(table, records) == [
+            price_usage(table, r["model"], r["prompt_tokens"], r["completion_tokens"], r["cached_tokens"])
+            for r in records
+        ]
+
+
+# ── storage ──
+
+class TestStoragePricing:
+    def test_price_storage_day(self):
+        charge = price_storage_day(10 * 1024 ** 3, cost_per_gb_month=0.3, days_in_month=30, multiplier=2.0)
+        assert charge.gb == pytest.approx(10)
+        assert charge.base_cost_usd == pytest.approx(0.1)
+        assert charge.final_cost_usd == pytest.approx(0.2)
+        assert charge.credits_used == pytest.approx(10)
+
+    def test_tiny_usage_is_not_billed(self):
+        assert price_storage_day(1024, 0.3, 30, 2.0) is None
+        assert price_storage_day(0, 0.3, 30, 2.0) is None
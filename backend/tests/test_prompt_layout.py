@@ -0,0 +1,41 @@
+"""Unit tests for app.utils.prompt_layout (cacheable prompt prefixes)."""
+import json
+from app.utils.prompt_layout import layout_messages, transcript_prefix, sources_system_message
+
+
+def serialized(messages):
+    return json.dumps(messages, ensure_ascii=False)
+
+
+class TestPromptLayout:
+    def test_transcript_prefix_is_stable(self):
+        a = layout_messages(transcript_prefix("T"), "first request", instructions="step 1")
+        b = layout_messages(transcript_prefix("T"), "second request", instructions="step 2")
+        prefix = serialized(transcript_prefix("T"))[:-1]
+        assert serialized(a).startswith(prefix)
+        assert serialized(b).startswith(prefix)
+
+    def test_instructions_follow_prefix_and_history(self):
+        history = [{"role": "user", "content": "q"}, {"role": "assistant", "content": "a"}]
+        messages = layout_messages(transcript_prefix("T"), "now", history=history, instructions="do X")
+        assert [m["role"] for m in messages] == ["user", "assistant", "user", "assistant", "system", "user"]
+        assert messages[-2]["content"] == "do X"
+        assert messages[-1]["content"] == "now"
+
+    def test_history_extends_previous_call(self):
+        first = layout_messages(transcript_prefix("T"), "q1")
+        second = layout_messages(
+            transcript_prefix("T"), "q2",
+            history=[{"role": "user", "content": "q1"}, {"role": "assistant", "content": "a1"}],
+        )
+        assert second[:len(first)] == first
+
+    def test_multimodal_request(self):
+        parts = [{"type": "text", "text": "look"}, {"type": "image_url", "image_url": {"url": "data:"}}]
+        assert layout_messages([], parts)[-1] == {"role": "user", "content": parts}
+
+    def test_sources_system_message(self):
+        assert sources_system_message("DOC").endswith("Исходные материалы проекта:\nDOC")
+
+    def test_sources_system_message_without_sources(self):
+        assert sources_system_message("") == "Ты — AI-ассистент для анализа документов. Отвечай на русском языке."
@@ -0,0 +1,125 @@
+"""Unit tests for the cluster-wide scheduler (app.services.scheduler) on an in-memory DB."""
+import asyncio
+from datetime import datetime, timezone, timedelta
+import pytest
+from fake_mongo import FakeDB
+from app.services import scheduler
+from app.services.scheduler import ScheduledJob, run_due_jobs
+
+NOW = datetime(2026, 10, 16, 0, 30, tzinfo=timezone.utc)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(scheduler, "db", fake)
+    monkeypatch.setattr(scheduler, "_jobs", {})
+    monkeypatch.setattr(scheduler, "_now", lambda: NOW)
+    run(scheduler.ensure_scheduler_indexes())
+    return fake
+
+
+def state(db, name):
+    return run(db.scheduled_jobs.find_one({"name": name}))
+
+
+def register(name, func, **kwargs):
+    scheduler.register_job(ScheduledJob(name, func, hour=0, run_if_new=True, **kwargs))
+
+
+class TestRunDueJobs:
+    def test_success_advances_slot_once(self, db):
+        calls = []
+
+        async def job():
+            calls.append(1)
+
+        register("a", job)
+        run(scheduler._seed_new_jobs(NOW))
+        assert run(run_due_jobs("p1")) == 1
+        assert run(run_due_jobs("p1")) == 0
+        assert calls == [1]
+        assert state(db, "a")["last_slot"] == "2026-10-16T00:00:00+00:00"
+        assert state(db, "a")["running_by"] is None
+
+    def test_failure_keeps_slot_and_backs_off(self, db, monkeypatch):
+        async def job():
+            raise RuntimeError("rate api down")
+
+        register("a", job)
+        run(scheduler._seed_new_jobs(NOW))
+        run(run_due_jobs("p1"))
+        s = state(db, "a")
+        assert s["last_status"] == "failed" and s["failures"] == 1
+        assert "last_slot" not in s
+        assert s["retry_at"] == (NOW + timedelta(seconds=scheduler.SCHEDULER_RETRY_BASE_SECONDS)).isoformat()
+        # Not retried before retry_at
+        assert run(run_due_jobs("p1")) == 0
+
+        later = NOW + timedelta(hours=1)
+        monkeypatch.setattr(scheduler, "_now", lambda: later)
+        run(run_due_jobs("p1"))
+        assert state(db, "a")["failures"] == 2
+        assert scheduler._retry_delay(2) == timedelta(seconds=2 * scheduler.SCHEDULER_RETRY_BASE_SECONDS)
+
+    def test_waits_for_dependency_and_gets_slot(self, db):
+        slots = []
+
+        async def rate():
+            pass
+
+        async def costs(slot):
+            slots.append(slot)
+
+        register("costs", costs, after=("rate",), takes_slot=True)
+        register("rate", rate)
+        run(scheduler._seed_new_jobs(NOW))
+        # "costs" comes first but waits; "rate" runs in the same pass
+        assert run(run_due_jobs("p1")) == 1
+        assert slots == []
+        assert run(run_due_jobs("p1")) == 1
+        assert slots == [datetime(2026, 10, 16, tzinfo=timezone.utc)]
+
+    def test_lost_lease_cancels_job(self, db, monkeypatch):
+        monkeypatch.setattr(scheduler, "SCHEDULER_LEASE_SECONDS", 0.03)
+        started = []
+
+        async def job():
+            started.append(1)
+            # Another process takes over the expired lease
+            await db.locks.update_one({"key": "scheduler:a"}, {"$set": {"owner": "p2"}})
+            await asyncio.sleep(5)
+
+        register("a", job)
+        run(scheduler._seed_new_jobs(NOW))
+        run(run_due_jobs("p1"))
+        s = state(db, "a")
+        assert started == [1]
+        assert s["last_status"] == "failed" and s["last_error"] == "lease lost"
+        assert "last_slot" not in s
+
+
+class TestRunJobNow:
+    def test_returns_state_on_success(self, db):
+        async def job():
+            pass
+
+        register("a", job)
+        run(scheduler._seed_new_jobs(NOW))
+        assert run(scheduler.run_job_now("a", "admin"))["last_status"] == "completed"
+
+    def test_failure_raised_and_recorded(self, db):
+        async def job():
+            raise RuntimeError("rate api down")
+
+        register("a", job)
+        run(scheduler._seed_new_jobs(NOW))
+        with pytest.raises(scheduler.JobFailed) as failed:
+            run(scheduler.run_job_now("a", "admin"))
+        assert failed.value.error == "rate api down"
+        s = state(db, "a")
+        assert s["last_status"] == "failed" and s["failures"] == 1
@@ -0,0 +1,18 @@
+"""Unit tests for app.utils.sse."""
+import json
+from app.utils.sse import sse_event, sse_comment
+
+
+class TestSseEvent:
+    def test_frame_format(self):
+        frame = sse_event("token", {"text": "Привет"})
+        assert frame == 'event: token\ndata: {"text": "Привет"}\n\n'
+
+    def test_newlines_stay_inside_json(self):
+        frame = sse_event("token", {"text": "a\nb"})
+        assert frame.count("\n\n") == 1
+        data = frame.split("data: ", 1)[1].strip()
+        assert json.loads(data) == {"text": "a\nb"}
+
+    def test_comment(self):
+        assert sse_comment("keepalive") == ": keepalive\n\n"
@@ -0,0 +1,47 @@
+"""Unit tests for app.utils.stats."""
+import pytest
+from app.utils.stats import percentile, summarize_calls
+
+
+class TestPercentile:
+    def test_single_value(self):
+        assert percentile([3.0], 50) == 3.0
+        assert percentile([3.0], 95) == 3.0
+
+    def test_median_odd(self):
+        assert percentile([5, 1, 3], 50) == 3
+
+    def test_median_even_interpolates(self):
+        assert percentile([1, 2, 3, 4], 50) == 2.5
+
+    def test_bounds(self):
+        values = [10, 20, 30, 40, 50]
+        assert percentile(values, 0) == 10
+        assert percentile(values, 100) == 50
+
+    def test_p95(self):
+        values = list(range(1, 101))
+        assert percentile(values, 95) == pytest.approx(95.05)
+
+    def test_empty_raises(self):
+        with pytest.raises(ValueError):
+            percentile([], 50)
+
+
+class TestSummarizeCalls:
+    RECORDS = [
+        {"model": "gpt-5.2", "reasoning_effort": "low", "latency_ms": 100, "ttft_ms": 40, "prompt_tokens": 10, "completion_tokens": 5},
+        {"model": "gpt-5.2", "reasoning_effort": "low", "latency_ms": 300, "ttft_ms": None, "prompt_tokens": 30, "completion_tokens": 15},
+        {"model": "gpt-5.2", "reasoning_effort": "high", "latency_ms": 900, "status": "error"},
+    ]
+
+    def test_groups_and_percentiles(self):
+        low, high = summarize_calls(self.RECORDS, ("model", "reasoning_effort"))
+        assert (low["reasoning_effort"], low["calls"], low["errors"]) == ("low", 2, 0)
+        assert low["latency_ms_p50"] == 200
+        assert low["ttft_ms_p50"] == 40
+        assert low["avg_prompt_tokens"] == 20
+        assert (high["calls"], high["errors"], high["ttft_ms_p95"]) == (1, 1, None)
+
+    def test_empty(self):
+        assert summarize_calls([], ("model",)) == []
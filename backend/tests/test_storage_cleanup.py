@@ -0,0 +1,39 @@
+"""Unit tests for bulk storage deletes (app.services.storage_cleanup) on an in-memory DB."""
+import asyncio
+import pytest
+from fake_mongo import FakeDB
+from app.services import storage_cleanup
+from app.services.storage_cleanup import delete_stored_objects
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FailingStorage:
+    def __init__(self, fail):
+        self.fail = set(fail)
+
+    async def delete_many(self, keys):
+        return {k: "AccessDenied" for k in keys if k in self.fail}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    run(fake.storage_delete_queue.create_index("key", unique=True))
+    monkeypatch.setattr(storage_cleanup, "db", fake)
+    monkeypatch.setattr(storage_cleanup, "storage_enabled", lambda: True)
+    return fake
+
+
+class TestDeleteStoredObjects:
+    def test_failures_queued_once_per_key(self, db, monkeypatch):
+        keys = [f"k{i}" for i in range(5)]
+        monkeypatch.setattr(storage_cleanup, "get_storage", lambda: FailingStorage(keys[:3]))
+        assert run(delete_stored_objects(keys + ["k0", ""], "test")) == 2
+        assert sorted(d["key"] for d in db.storage_delete_queue.docs) == ["k0", "k1", "k2"]
+        first_id = db.storage_delete_queue.docs[0]["id"]
+        run(delete_stored_objects(keys[:1], "test"))
+        assert len(db.storage_delete_queue.docs) == 3
+        assert db.storage_delete_queue.docs[0]["id"] == first_id
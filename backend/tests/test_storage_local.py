@@ -0,0 +1,78 @@
+"""Unit tests for app.services.storage with the local filesystem backend."""
+import os
+import asyncio
+import pytest
+from app.services.storage import LocalBackend, Storage, StorageError
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return Storage(LocalBackend(str(tmp_path)), concurrency=4)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestLocalStorage:
+    def test_put_get_delete(self, storage):
+        data = b"hello world"
+        assert run(storage.put("a/b/file.txt", data, "text/plain")) == "a/b/file.txt"
+        assert run(storage.get("a/b/file.txt")) == data
+        assert run(storage.size("a/b/file.txt")) == len(data)
+        run(storage.delete("a/b/file.txt"))
+        with pytest.raises(FileNotFoundError):
+            run(storage.get("a/b/file.txt"))
+        # Deleting a missing object is not an error
+        run(storage.delete("a/b/file.txt"))
+
+    def test_get_range(self, storage):
+        run(storage.put("r.bin", bytes(range(100))))
+        assert run(storage.get_range("r.bin", 10, 19)) == bytes(range(10, 20))
+        assert run(storage.get_range("r.bin", 95)) == bytes(range(95, 100))
+
+    def test_stream_in_chunks(self, storage):
+        data = bytes(range(256)) * 40
+
+        async def collect(**kw):
+            return [chunk async for chunk in storage.stream("s.bin", chunk_size=1000, **kw)]
+
+        run(storage.put("s.bin", data))
+        chunks = run(collect())
+        assert [len(c) for c in chunks] == [1000] * 10 + [240]
+        assert b"".join(chunks) == data
+        assert b"".join(run(collect(start=500, end=2599))) == data[500:2600]
+
+    def test_put_file(self, storage, tmp_path):
+        src = tmp_path / "src.bin"
+        src.write_bytes(b"x" * 5000)
+        run(storage.put_file("copied/src.bin", str(src)))
+        assert run(storage.get("copied/src.bin")) == b"x" * 5000
+
+    def test_concurrent_puts(self, storage):
+        async def put_all():
+            await asyncio.gather(*(storage.put(f"many/{i}", str(i).encode()) for i in range(50)))
+            return await asyncio.gather(*(storage.get(f"many/{i}") for i in range(50)))
+
+        assert run(put_all()) == [str(i).encode() for i in range(50)]
+
+    def test_key_cannot_escape_root(self, storage):
+        with pytest.raises(StorageError):
+            run(storage.put("../outside.txt", b"x"))
+
+    def test_delete_many_batches_and_reports_failures(self, storage, monkeypatch):
+        for i in range(5):
+            run(storage.put(f"bulk/{i}", b"x"))
+        calls = []
+        delete_batch = storage.backend.delete_batch
+
+        def counting(keys):
+            calls.append(len(keys))
+            return delete_batch(keys)
+
+        monkeypatch.setattr(storage.backend, "delete_batch", counting)
+        monkeypatch.setattr("app.services.storage.STORAGE_DELETE_BATCH", 2)
+        failed = run(storage.delete_many([f"bulk/{i}" for i in range(5)] + ["bulk/0", "../escape"]))
+        assert calls == [2, 2, 2]  # duplicates removed, 6 keys
+        assert list(failed) == ["../escape"]
+        assert not any(os.path.exists(storage.backend.path(f"bulk/{i}")) for i in range(5))
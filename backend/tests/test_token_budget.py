@@ -0,0 +1,50 @@
+"""Unit tests for app.services.token_budget (pre-dispatch prompt checks)."""
+import pytest
+from app.services import token_budget
+from app.services.token_budget import PromptTooLarge, cached_count, check_prompt, fit_texts, prompt_budget
+from app.utils.tokens import count_tokens
+
+
+class TestCheckPrompt:
+    def test_fits(self):
+        assert check_prompt("gpt-4o", [{"role": "user", "content": "привет"}]) > 0
+
+    def test_rejects_before_dispatch(self):
+        huge = [{"role": "user", "content": "слово " * 40_000}]
+        with pytest.raises(PromptTooLarge) as exc:
+            check_prompt("gpt-4", huge)
+        assert exc.value.limit == prompt_budget("gpt-4")
+        assert exc.value.tokens > exc.value.limit
+
+    def test_output_limit_replaces_default_reserve(self):
+        assert prompt_budget("gpt-4o", 1000) == prompt_budget("gpt-4o") + token_budget.GPT_OUTPUT_RESERVE_TOKENS - 1000
+        with pytest.raises(PromptTooLarge) as exc:
+            check_prompt("gpt-4", [{"role": "user", "content": "слово " * 40_000}], reserve=1000)
+        assert exc.value.limit == prompt_budget("gpt-4", 1000)
+
+
+class TestCachedCount:
+    def test_large_texts_cached_by_content(self):
+        text = "транскрипт " * 1000
+        token_budget._token_cache.clear()
+        assert cached_count(text) == count_tokens(text)
+        assert len(token_budget._token_cache) == 1
+        cached_count(str(text))
+        assert len(token_budget._token_cache) == 1
+
+    def test_short_texts_not_cached(self):
+        token_budget._token_cache.clear()
+        cached_count("коротко")
+        assert not token_budget._token_cache
+
+
+class TestFitTexts:
+    def test_unchanged_when_fitting(self):
+        texts = ["a", "b"]
+        assert fit_texts(texts, 1000) is texts
+
+    def test_truncates_largest(self):
+        small, large = "короткий документ", "длинный документ " * 3000
+        fitted = fit_texts([small, large], 1000)
+        assert fitted[0] == small
+        assert sum(count_tokens(t) for t in fitted) <= 1000
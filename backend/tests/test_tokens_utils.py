@@ -0,0 +1,62 @@
+"""Unit tests for app.utils.tokens (prompt token counting and budgeting)."""
+from app.utils.tokens import (
+    allocate, content_tokens, context_window, count_tokens, messages_tokens, truncate_tokens,
+    DEFAULT_CONTEXT_WINDOW, IMAGE_PART_TOKENS, TRUNCATION_MARK,
+)
+
+
+class TestCounting:
+    def test_count_grows_with_text(self):
+        assert count_tokens("") == 0
+        assert 0 < count_tokens("встреча " * 10) < count_tokens("встреча " * 100)
+
+    def test_multimodal_content(self):
+        parts = [{"type": "text", "text": "look"}, {"type": "image_url", "image_url": {"url": "data:"}}]
+        assert content_tokens(parts) == count_tokens("look") + IMAGE_PART_TOKENS
+
+    def test_large_file_part(self):
+        part = {"type": "file", "file": {"file_data": "data:application/pdf;base64," + "A" * 400_000}}
+        assert content_tokens([part]) > IMAGE_PART_TOKENS
+
+    def test_messages_overhead(self):
+        msgs = [{"role": "system", "content": "a"}, {"role": "user", "content": "b"}]
+        assert messages_tokens(msgs) > count_tokens("a") + count_tokens("b")
+
+    def test_custom_counter(self):
+        msgs = [{"role": "user", "content": "abc"}]
+        assert messages_tokens(msgs, count=lambda text, model: 100) == messages_tokens(msgs) - count_tokens("abc") + 100
+
+    def test_context_window(self):
+        assert context_window("gpt-4") == 8_192
+        assert context_window("gpt-5.2") == 272_000
+        assert context_window("unknown-model") == DEFAULT_CONTEXT_WINDOW
+
+
+class TestTruncate:
+    def test_fits_unchanged(self):
+        assert truncate_tokens("short text", 100) == "short text"
+
+    def test_cut_to_budget(self):
+        text = "слово " * 5000
+        cut = truncate_tokens(text, 200)
+        assert cut.endswith(TRUNCATION_MARK)
+        assert count_tokens(cut) <= 200
+        assert text.startswith(cut[:-len(TRUNCATION_MARK)])
+
+
+class TestAllocate:
+    def test_everything_fits(self):
+        assert allocate([10, 20, 30], 100) == [10, 20, 30]
+
+    def test_small_sections_keep_size(self):
+        assert allocate([10, 500, 1000], 310) == [10, 150, 150]
+
+    def test_equal_split(self):
+        assert allocate([500, 500], 300) == [150, 150]
+
+    def test_never_exceeds_budget(self):
+        sizes = [7, 130, 45, 900, 12, 300]
+        for budget in (0, 50, 333, 1000):
+            limits = allocate(sizes, budget)
+            assert sum(limits) <= budget
+            assert all(l <= s for l, s in zip(limits, sizes))
@@ -0,0 +1,69 @@
+"""Unit tests for map-reduce helpers in app.utils.transcript_chunks."""
+from app.utils.transcript_chunks import split_uncertain_section, split_transcript, merge_chunk_outputs
+
+
+# ── split_transcript ──
+
+class TestSplitTranscript:
+    def test_short_transcript_single_chunk(self):
+        text = "Speaker 1: Привет\n\nSpeaker 2: Здравствуйте"
+        assert split_transcript(text, 1000) == [text]
+
+    def test_splits_on_paragraph_boundaries(self):
+        paras = [f"Speaker {i % 2 + 1}: " + "слово " * 10 for i in range(6)]
+        text = "\n\n".join(p.strip() for p in paras)
+        chunks = split_transcript(text, 150)
+        assert len(chunks) > 1
+        assert all(len(c) <= 150 for c in chunks)
+        assert "\n\n".join(chunks) == text
+
+    def test_oversized_paragraph_keeps_speaker_label(self):
+        para = "Иван: " + " ".join(f"Предложение номер {i}." for i in range(20))
+        chunks = split_transcript(para, 100)
+        assert len(chunks) > 1
+        assert all(c.startswith("Иван: ") for c in chunks)
+        assert all(len(c) <= 100 for c in chunks)
+
+    def test_empty(self):
+        assert split_transcript("", 100) == []
+
+
+# ── split_uncertain_section ──
+
+class TestSplitUncertainSection:
+    def test_section_separated(self):
+        text = "Текст\n\n---\nСомнительные места:\n1. «кот» → «код» — пояснение"
+        main, section = split_uncertain_section(text)
+        assert main == "Текст"
+        assert section == ":\n1. «кот» → «код» — пояснение"
+
+    def test_section_without_colon(self):
+        text = "Текст\n\nСомнительные места\n1. «кот» → «код»"
+        assert split_uncertain_section(text) == ("Текст", "1. «кот» → «код»")
+
+    def test_no_uncertain_places(self):
+        text = "Текст\n\n---\nСомнительные места:\nНет сомнительных мест."
+        assert split_uncertain_section(text) == ("Текст", None)
+
+    def test_without_section(self):
+        assert split_uncertain_section("Просто текст") == ("Просто текст", None)
+
+
+# ── merge_chunk_outputs ──
+
+class TestMergeChunkOutputs:
+    def test_merges_text_and_sections(self):
+        outputs = [
+            "Часть 1\n\n---\nСомнительные места:\n1. «кот» → «код»",
+            "Часть 2\n\n---\nСомнительные места:\nНет сомнительных мест.",
+            "Часть 3\n\n---\nСомнительные места:\n1. «кот» → «код»\n2. «лес» → «вес»",
+        ]
+        merged = merge_chunk_outputs(outputs)
+        assert merged == (
+            "Часть 1\n\nЧасть 2\n\nЧасть 3"
+            "\n\n---\nСомнительные места:\n1. «кот» → «код»\n2. «лес» → «вес»"
+        )
+        assert split_uncertain_section(merged)[0] == "Часть 1\n\nЧасть 2\n\nЧасть 3"
+
+    def test_no_sections(self):
+        assert merge_chunk_outputs(["А", "Б"]) == "А\n\nБ"
@@ -0,0 +1,70 @@
+"""Unit tests for chunked transcript processing (app.services.transcript_processing) with a fake GPT call."""
+import asyncio
+import pytest
+from app.services import transcript_processing
+from app.services.gpt import GptResult
+from app.services.transcript_processing import process_transcript
+
+TRANSCRIPT = "\n\n".join(f"Speaker 1: реплика номер {i} " + "слово " * 10 for i in range(3))
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def chunked(monkeypatch):
+    monkeypatch.setattr(transcript_processing, "GPT_CHUNK_MAX_CHARS", 100)
+    monkeypatch.setattr(transcript_processing, "GPT_CHUNK_ATTEMPTS", 2)
+
+
+def fake_gpt(monkeypatch, failing=None, cache_hit=False):
+    calls = []
+
+    async def call(system_message, user_message, reasoning_effort, source):
+        calls.append(user_message)
+        if failing and failing in user_message:
+            raise RuntimeError("provider error")
+        return GptResult(
+            content=f"Обработано: {user_message[:20]}", model="gpt-5.2",
+            prompt_tokens=10, completion_tokens=5, total_tokens=15, cache_hit=cache_hit,
+        )
+
+    monkeypatch.setattr(transcript_processing, "call_gpt52_metered", call)
+    return calls
+
+
+def collecting():
+    metered = []
+
+    async def meter(result):
+        metered.append(result)
+    return metered, meter
+
+
+class TestProcessTranscript:
+    def test_every_chunk_metered_and_summed(self, chunked, monkeypatch):
+        fake_gpt(monkeypatch)
+        metered, meter = collecting()
+        result = run(process_transcript("Промпт", TRANSCRIPT, meter=meter))
+        assert len(metered) == 3
+        assert result.total_tokens == 45 and not result.cache_hit
+
+    def test_successful_chunks_metered_when_one_fails(self, chunked, monkeypatch):
+        calls = fake_gpt(monkeypatch, failing="номер 1")
+        metered, meter = collecting()
+        with pytest.raises(RuntimeError):
+            run(process_transcript("Промпт", TRANSCRIPT, meter=meter))
+        assert len(metered) == 2
+        # The failing chunk was retried, the others ran once
+        assert len(calls) == 4
+
+    def test_cache_hit_kept_when_all_chunks_hit(self, chunked, monkeypatch):
+        fake_gpt(monkeypatch, cache_hit=True)
+        assert run(process_transcript("Промпт", TRANSCRIPT)).cache_hit
+
+    def test_single_chunk_metered(self, monkeypatch):
+        fake_gpt(monkeypatch)
+        metered, meter = collecting()
+        run(process_transcript("Промпт", "Speaker 1: коротко", meter=meter))
+        assert len(metered) == 1
@@ -0,0 +1,79 @@
+"""Unit tests for chunked transcription helpers in app.utils.transcript_segments."""
+import pytest
+from app.utils.transcript_segments import plan_segments, reconcile_speakers, stitch_segments
+
+
+def _s(speaker, start, end, text):
+    return {"speaker": speaker, "start": start, "end": end, "text": text}
+
+
+# ── plan_segments ──
+
+class TestPlanSegments:
+    def test_short_recording_single_segment(self):
+        assert plan_segments(300, 600, 10) == [(0.0, 300.0)]
+
+    def test_overlapping_segments_cover_duration(self):
+        segs = plan_segments(1500, 600, 10)
+        assert segs == [(0.0, 600.0), (590.0, 1190.0), (1180.0, 1500.0)]
+
+    def test_exact_multiple(self):
+        assert plan_segments(600, 600, 10) == [(0.0, 600.0)]
+
+    def test_zero_duration(self):
+        assert plan_segments(0, 600, 10) == []
+
+    def test_overlap_must_be_shorter(self):
+        with pytest.raises(ValueError):
+            plan_segments(100, 10, 10)
+
+
+# ── reconcile_speakers ──
+
+class TestReconcileSpeakers:
+    def test_swapped_labels_are_matched(self):
+        prev = [_s(0, 590, 594, "a"), _s(1, 595, 600, "b")]
+        cur = [_s(1, 590, 594, "a"), _s(0, 595, 600, "b")]
+        mapping, nxt = reconcile_speakers(prev, cur, 2)
+        assert mapping == {1: 0, 0: 1}
+        assert nxt == 2
+
+    def test_new_speaker_gets_fresh_id(self):
+        prev = [_s(0, 590, 600, "a")]
+        cur = [_s(0, 590, 600, "a"), _s(1, 598, 600, "x")]
+        mapping, nxt = reconcile_speakers(prev, cur, 1)
+        assert mapping == {0: 0, 1: 1}
+        assert nxt == 2
+
+
+# ── stitch_segments ──
+
+class TestStitchSegments:
+    def test_empty(self):
+        assert stitch_segments([]) == []
+
+    def test_single_segment_passthrough(self):
+        seg = {"index": 0, "start": 0, "end": 10, "sentences": [_s(0, 0, 2, "Привет"), _s(1, 3, 5, "Здравствуйте")]}
+        assert stitch_segments([seg]) == [(0, "Привет"), (1, "Здравствуйте")]
+
+    def test_overlap_deduplicated_and_speakers_reconciled(self):
+        seg0 = {"index": 0, "start": 0, "end": 600, "sentences": [
+            _s(0, 100, 110, "one"),
+            _s(1, 591, 594, "two"),
+            _s(0, 596, 599, "three"),
+        ]}
+        # Deepgram numbered the speakers the other way round in segment 1
+        seg1 = {"index": 1, "start": 590, "end": 1190, "sentences": [
+            _s(0, 591, 594, "two"),
+            _s(1, 596, 599, "three"),
+            _s(0, 700, 710, "four"),
+            _s(2, 800, 805, "five"),
+        ]}
+        result = stitch_segments([seg1, seg0])
+        assert result == [
+            (0, "one"),
+            (1, "two"),
+            (0, "three"),
+            (1, "four"),
+            (2, "five"),
+        ]
@@ -1,5 +1,6 @@
 import React, { useState, useEffect, useRef, useCallback } from 'react';
 import { aiChatApi } from '../../lib/api';
+import { useCredits } from '../../contexts/CreditsContext';
 import { Button } from '../ui/button';
 import { ScrollArea } from '../ui/scroll-area';
 import {
@@ -147,9 +148,12 @@ export default function AiChatPanel({ open, onClose, pipelineId, onPipelineGener
   const [imageFile, setImageFile] = useState(null);
   const [imagePreview, setImagePreview] = useState(null);
   const [sending, setSending] = useState(false);
+  // Assistant reply received so far while it streams in (null when idle)
+  const [streamingText, setStreamingText] = useState(null);
   const [usageMap, setUsageMap] = useState({});
   const [loadingSessions, setLoadingSessions] = useState(false);
   const [view, setView] = useState('chat'); // 'chat' | 'sessions'
+  const { openCreditsModal } = useCredits();
   const messagesEndRef = useRef(null);
   const fileInputRef = useRef(null);
   const textareaRef = useRef(null);
@@ -278,9 +282,15 @@ export default function AiChatPanel({ open, onClose, pipelineId, onPipelineGener
     setSending(true);
     scrollToBottom();
 
+    setStreamingText('');
     try {
-      const res = await aiChatApi.sendMessage(sessionId, userContent, imageFile, pipelineContext || null);
-      const { user_message, assistant_message, pipeline_data, usage } = res.data;
+      const { user_message, assistant_message, pipeline_data, usage } = await aiChatApi.sendMessageStream(
+        sessionId, userContent, imageFile, pipelineContext || null,
+        (text) => {
+          setStreamingText((prev) => (prev || '') + text);
+          scrollToBottom();
+        },
+      );
 
       // Replace optimistic user msg and add assistant msg
       setMessages((prev) => {
@@ -299,13 +309,17 @@ export default function AiChatPanel({ open, onClose, pipelineId, onPipelineGener
         onPipelineGenerated(pipeline_data);
       }
     } catch (err) {
-      if (err.response?.status !== 402) {
+      // Streams use fetch, so the global axios 402 interceptor does not see them
+      if (err.response?.status === 402) {
+        openCreditsModal(err.response.data?.detail);
+      } else {
         toast.error(err.response?.data?.detail || 'Ошибка отправки сообщения');
       }
       // Remove optimistic message on error
       setMessages((prev) => prev.slice(0, -1));
     } finally {
       setSending(false);
+      setStreamingText(null);
     }
   };
 
@@ -454,10 +468,14 @@ export default function AiChatPanel({ open, onClose, pipelineId, onPipelineGener
                     <Bot className="w-3.5 h-3.5" />
                   </div>
                   <div className="bg-slate-100 rounded-xl rounded-tl-sm px-3.5 py-2.5">
-                    <div className="flex items-center gap-1.5">
-                      <Loader2 className="w-3.5 h-3.5 animate-spin text-cyan-600" />
-                      <span className="text-sm text-slate-500">Думаю...</span>
-                    </div>
+                    {streamingText ? (
+                      <p className="text-sm whitespace-pre-wrap" data-testid="chat-streaming-message">{streamingText}</p>
+                    ) : (
+                      <div className="flex items-center gap-1.5">
+                        <Loader2 className="w-3.5 h-3.5 animate-spin text-cyan-600" />
+                        <span className="text-sm text-slate-500">Думаю...</span>
+                      </div>
+                    )}
                   </div>
                 </div>
               )}
@@ -18,6 +18,7 @@ import Markdown from 'react-markdown';
 import { formatDistanceToNow } from 'date-fns';
 import { ru } from 'date-fns/locale';
 import { chatApi } from '../../lib/api';
+import { useCredits } from '../../contexts/CreditsContext';
 import { AttachmentsPanel } from './AttachmentsPanel';
 
 const DRAFT_KEY_PREFIX = 'voice_workspace_draft_';
@@ -39,7 +40,10 @@ export function AnalysisTab({
   const [savingChat, setSavingChat] = useState(false);
   const [draftSaved, setDraftSaved] = useState(false);
   const [selectedAttachmentIds, setSelectedAttachmentIds] = useState(new Set());
+  // Answer text received so far while an analysis streams in (null when idle)
+  const [streamingText, setStreamingText] = useState(null);
   const autosaveTimerRef = useRef(null);
+  const { openCreditsModal } = useCredits();
 
   const chatDraftKey = `${DRAFT_KEY_PREFIX}chat_${projectId}`;
 
@@ -105,22 +109,27 @@ export function AnalysisTab({
     }
 
     setAnalyzing(true);
+    setStreamingText('');
     try {
-      const response = await chatApi.analyze(projectId, {
+      const chat = await chatApi.analyzeStream(projectId, {
         prompt_id: selectedPrompt,
         additional_text: additionalText,
         reasoning_effort: selectedReasoningEffort,
         attachment_ids: selectedAttachmentIds.size > 0 ? [...selectedAttachmentIds] : undefined,
-      });
-      onChatHistoryUpdate([...chatHistory, response.data]);
+      }, (text) => setStreamingText((prev) => (prev || '') + text));
+      onChatHistoryUpdate([...chatHistory, chat]);
       setAdditionalText('');
       toast.success('Анализ завершен');
     } catch (error) {
-      if (error.response?.status !== 402) {
+      // Streams use fetch, so the global axios 402 interceptor does not see them
+      if (error.response?.status === 402) {
+        openCreditsModal(error.response.data?.detail);
+      } else {
         toast.error('Ошибка анализа');
       }
     } finally {
       setAnalyzing(false);
+      setStreamingText(null);
     }
   };
 
@@ -244,7 +253,7 @@ export function AnalysisTab({
           </CardTitle>
         </CardHeader>
         <CardContent>
-          {chatHistory.length === 0 ? (
+          {chatHistory.length === 0 && streamingText === null ? (
             <div className="text-center py-12 text-muted-foreground">
               <MessageSquare className="w-8 h-8 mx-auto mb-4" />
               <p>Пока нет результатов анализа</p>
@@ -314,6 +323,25 @@ export function AnalysisTab({
                     </CardContent>
                   </Card>
                 ))}
+                {streamingText !== null && (
+                  <Card className="bg-slate-50" data-testid="chat-response-streaming">
+                    <CardContent className="p-4">
+                      <div className="flex items-center justify-between mb-2">
+                        <Badge variant="outline">
+                          {prompts.find(p => p.id === selectedPrompt)?.name || 'Промпт'}
+                        </Badge>
+                        <Loader2 className="w-4 h-4 animate-spin text-muted-foreground" />
+                      </div>
+                      {streamingText ? (
+                        <div className="prose prose-sm max-w-none">
+                          <Markdown>{streamingText}</Markdown>
+                        </div>
+                      ) : (
+                        <p className="text-sm text-muted-foreground">Генерация ответа...</p>
+                      )}
+                    </CardContent>
+                  </Card>
+                )}
               </div>
             </ScrollArea>
           )}
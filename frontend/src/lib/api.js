@@ -3,6 +3,46 @@ import axios from 'axios';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// POST to an SSE endpoint. Calls onToken(text) for every `token` event and
+// resolves with the `done` payload. Errors are shaped like axios errors.
+const postEventStream = async (url, body, onToken) => {
+  const isForm = body instanceof FormData;
+  const headers = { Authorization: axios.defaults.headers.common['Authorization'] };
+  if (!isForm) headers['Content-Type'] = 'application/json';
+  const res = await fetch(url, { method: 'POST', headers, body: isForm ? body : JSON.stringify(body) });
+  if (!res.ok) {
+    const data = await res.json().catch(() => ({}));
+    throw Object.assign(new Error(data.detail || res.statusText), { response: { status: res.status, data } });
+  }
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      let event = 'message';
+      const dataLines = [];
+      frame.split('\n').forEach((line) => {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) dataLines.push(line.slice(6));
+      });
+      if (!dataLines.length) continue;
+      const data = JSON.parse(dataLines.join('\n'));
+      if (event === 'token') onToken?.(data.text);
+      else if (event === 'done') return data;
+      else if (event === 'error') {
+        throw Object.assign(new Error(data.detail), { response: { status: 500, data } });
+      }
+    }
+  }
+  throw new Error('Stream closed before completion');
+};
+
 // Projects
 export const projectsApi = {
   list: (params = {}) => axios.get(`${API}/projects`, { params }),
@@ -98,6 +138,8 @@ export const promptsApi = {
 // Chat/Analysis
 export const chatApi = {
   analyze: (projectId, data) => axios.post(`${API}/projects/${projectId}/analyze`, data),
+  analyzeStream: (projectId, data, onToken) =>
+    postEventStream(`${API}/projects/${projectId}/analyze/stream`, data, onToken),
   analyzeRaw: (projectId, data) => axios.post(`${API}/projects/${projectId}/analyze-raw`, data),
   saveFullAnalysis: (projectId, data) => axios.post(`${API}/projects/${projectId}/save-full-analysis`, data),
   history: (projectId) => axios.get(`${API}/projects/${projectId}/chat-history`),
@@ -182,6 +224,17 @@ export const aiChatApi = {
       timeout: 120000,
     });
   },
+  sendMessageStream: (sessionId, content, imageFile, pipelineContext, onToken) => {
+    const formData = new FormData();
+    formData.append('content', content || '');
+    if (imageFile) {
+      formData.append('image', imageFile);
+    }
+    if (pipelineContext) {
+      formData.append('pipeline_context', JSON.stringify(pipelineContext));
+    }
+    return postEventStream(`${API}/ai-chat/sessions/${sessionId}/message/stream`, formData, onToken);
+  },
 };
 
 // Attachments
@@ -246,6 +299,8 @@ export const docStreamsApi = {
   update: (projectId, streamId, data) => axios.put(`${API}/doc/projects/${projectId}/streams/${streamId}`, data),
   delete: (projectId, streamId) => axios.delete(`${API}/doc/projects/${projectId}/streams/${streamId}`),
   sendMessage: (projectId, streamId, content) => axios.post(`${API}/doc/projects/${projectId}/streams/${streamId}/messages`, { content }),
+  sendMessageStream: (projectId, streamId, content, onToken) =>
+    postEventStream(`${API}/doc/projects/${projectId}/streams/${streamId}/messages/stream`, { content }, onToken),
 };
 
 // Document Agent - Pins (Final Document)
@@ -261,6 +316,8 @@ export const docPinsApi = {
 export const docRunsApi = {
   list: (projectId) => axios.get(`${API}/doc/projects/${projectId}/runs`),
   run: (projectId, pipelineId) => axios.post(`${API}/doc/projects/${projectId}/run-pipeline`, { pipeline_id: pipelineId }),
+  get: (projectId, runId) => axios.get(`${API}/doc/projects/${projectId}/runs/${runId}`),
+  resume: (projectId, runId) => axios.post(`${API}/doc/projects/${projectId}/runs/${runId}/resume`),
   delete: (projectId, runId) => axios.delete(`${API}/doc/projects/${projectId}/runs/${runId}`),
 };
 
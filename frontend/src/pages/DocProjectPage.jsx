@@ -32,6 +32,10 @@ import { cn } from '../lib/utils';
 
 const fileTypeIcons = { pdf: FileType, image: Image, text: FileText, url: Globe, other: File };
 
+const RUN_POLL_INTERVAL_MS = 2000;
+// Stop waiting for a run whose status and progress have not changed for this long
+const RUN_STALL_TIMEOUT_MS = 15 * 60 * 1000;
+
 // ============ Materials Panel ============
 function MaterialsPanel({ attachments, uploading, onUpload, onAddUrl, onDelete }) {
   return (
@@ -173,6 +177,7 @@ export default function DocProjectPage() {
   const [selectedPipelineId, setSelectedPipelineId] = useState('');
   const [runs, setRuns] = useState([]);
   const [running, setRunning] = useState(false);
+  const [runProgress, setRunProgress] = useState(null);
 
   const loadProject = useCallback(async () => {
     try {
@@ -243,14 +248,40 @@ export default function DocProjectPage() {
     setRunning(true);
     try {
       const res = await docRunsApi.run(projectId, selectedPipelineId);
-      setRuns(prev => [res.data, ...prev]);
-      toast.success('Анализ завершён');
+      const run = await waitForRun(res.data.id);
+      setRuns(prev => [run, ...prev.filter(r => r.id !== run.id)]);
+      if (run.status === 'failed') toast.error(run.error || 'Ошибка выполнения');
+      else toast.success('Анализ завершён');
     } catch (err) {
-      if (err.response?.status !== 402) {
+      if (err.stalled) {
+        toast.error(err.message);
+      } else if (err.response?.status !== 402) {
         toast.error(err.response?.data?.detail || 'Ошибка выполнения');
       }
     } finally {
       setRunning(false);
+      setRunProgress(null);
+    }
+  };
+
+  // Runs execute in the background worker; poll until finished or stalled
+  const waitForRun = async (runId) => {
+    let lastState = null;
+    let changedAt = Date.now();
+    for (;;) {
+      const res = await docRunsApi.get(projectId, runId);
+      setRunProgress(res.data);
+      if (res.data.status === 'completed' || res.data.status === 'failed') return res.data;
+      const state = `${res.data.status}:${res.data.updated_at}:${res.data.nodes_finished}`;
+      if (state !== lastState) {
+        lastState = state;
+        changedAt = Date.now();
+      } else if (Date.now() - changedAt > RUN_STALL_TIMEOUT_MS) {
+        const err = new Error('Анализ не продвигается слишком долго. Обновите страницу позже, чтобы проверить результат');
+        err.stalled = true;
+        throw err;
+      }
+      await new Promise(resolve => setTimeout(resolve, RUN_POLL_INTERVAL_MS));
     }
   };
 
@@ -368,7 +399,11 @@ export default function DocProjectPage() {
                   <div className="border rounded-lg bg-indigo-50 p-6 text-center">
                     <Loader2 className="w-8 h-8 animate-spin text-indigo-500 mx-auto mb-3" />
                     <p className="text-sm font-medium text-indigo-700">Выполняется анализ...</p>
-                    <p className="text-xs text-indigo-500 mt-1">AI обрабатывает документы по выбранному сценарию</p>
+                    <p className="text-xs text-indigo-500 mt-1">
+                      {runProgress?.nodes_total
+                        ? `Выполнено шагов: ${runProgress.nodes_finished} из ${runProgress.nodes_total}`
+                        : 'AI обрабатывает документы по выбранному сценарию'}
+                    </p>
                   </div>
                 )}
 